@@ -1,65 +1,223 @@
-# pylint: disable=unused-import
-
 import argparse
 import binascii
+import hashlib
+import hmac
 import io
-import os
-import requests
+import itertools
+import json
 import logging
-import hashlib
+import os
 import time
+import urllib.parse
 
-from flask import Flask, Response, session, jsonify, render_template,render_template_string, request, redirect, abort
-from werkzeug.exceptions import BadRequest
+from flask import Flask, Response, after_this_request, jsonify, render_template, render_template_string, request, stream_with_context
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.exceptions import BadRequest, BadRequestKeyError, HTTPException, NotFound, RequestEntityTooLarge, Unauthorized
 
+import config
 from config import (
+    ADMIN_TOKEN,
+    ADMISSION_CONCURRENCY,
+    ADMISSION_DEADLINE,
+    ADMISSION_LOW_PRIORITY_SHARE,
+    ADMISSION_PRIORITY_PREFIXES,
+    ADMISSION_RETRY_AFTER,
+    ACCESS_TOKEN_COOKIE,
+    ACCESS_TOKEN_SECRET,
+    ACCESS_TOKENS,
+    API_FAST_PATH,
+    AUDIT_LOG_BUFFER_SIZE,
+    AUDIT_LOG_DIR,
+    AUDIT_LOG_FLUSH_INTERVAL,
+    AUDIT_LOG_MAX_AGE,
+    AUDIT_LOG_MAX_BYTES,
+    BATCH_MAX_BODY_SIZE,
+    BATCH_MAX_ITEMS,
     CTR_PARAM,
     ENC_FILE_DATA_PARAM,
     ENC_PICC_DATA_PARAM,
+    JINJA_BYTECODE_CACHE,
+    JINJA_BYTECODE_CACHE_DIR,
     REQUIRE_LRP,
+    RESULT_CACHE_MAX_ENTRIES,
+    RESULT_CACHE_TTL,
     SDMMAC_PARAM,
+    SERVER_TIMING,
     MASTER_KEY,
     UID_PARAM,
-    DERIVE_MODE,
+    KEY_VERSION_PARAM,
+    METRICS_DIR,
+    METRICS_ENABLED,
+    MEMORY_CHECK_INTERVAL,
+    MEMORY_RECYCLE_LIMIT,
+    MEMORY_SOFT_LIMIT,
+    METRICS_FLUSH_INTERVAL,
+    METRICS_TOKEN,
+    REQUEST_RECORD_PATH,
+    REQUEST_RECORD_REDACT,
+    REQUEST_RECORD_SAMPLE_RATE,
+    SESSION_BACKEND,
+    SESSION_MAX_ENTRIES,
+    SESSION_SQLITE_PATH,
+    SESSION_TTL,
+    SHARD_NODES,
+    SHARD_SECRET,
+    SHARD_SELF,
+    VALIDATE_ACCESS_WINDOW,
 )
 
-if DERIVE_MODE == "legacy":
-    from libsdm.legacy_derive import derive_tag_key, derive_undiversified_key
-elif DERIVE_MODE == "standard":
-    from libsdm.derive import derive_tag_key, derive_undiversified_key
-else:
-    raise RuntimeError("Invalid DERIVE_MODE.")
-
 from libsdm.sdm import (
     EncMode,
     InvalidMessage,
     ParamMode,
-    decrypt_sun_message,
-    validate_plain_sun,
+    get_encryption_mode,
 )
+from libsdm import hooks
+from libsdm.key_registry import KeyRegistry, KeyVersion
+from sdmserver.admission import AdmissionController
+from sdmserver.audit_log import (
+    OUTCOME_INVALID,
+    OUTCOME_INVALID_MAC,
+    OUTCOME_LRP_REQUIRED,
+    OUTCOME_NOT_ADMITTED,
+    OUTCOME_OK,
+    PARAM_MODE_BULK,
+    PARAM_MODE_PLAIN,
+    PARAM_MODE_SEPARATED,
+    UNKNOWN_MODE,
+    AuditLog,
+)
+from sdmserver.fastpath import ApiFastPath
+from sdmserver.key_setup import key_registry_from_config
+from sdmserver.memory import AllocationTracer, MemoryBudgetMiddleware, MemoryMonitor
+from sdmserver.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, MetricsRegistry
+from sdmserver.profiler import ProfilerMiddleware, SamplingProfiler
+from sdmserver.recorder import RequestRecorder, RequestRecorderMiddleware
+from sdmserver.response_cache import ResponseCache
+from sdmserver.access_token import issue_access_token, url_fingerprint, verify_access_token
+from sdmserver.session_store import create_session_store, session_key
+from sdmserver.sharding import HashRing, ShardRouter
+from sdmserver.single_flight import SingleFlight
+from sdmserver.timing import ServerTimingMiddleware, StageRecorder
 
 app = Flask(__name__)
 app.config['JSONIFY_PRETTYPRINT_REGULAR'] = True
 
+if JINJA_BYTECODE_CACHE:
+    # compiled templates are reused by the other workers and after restarts
+    app.jinja_options = {**app.jinja_options, 'bytecode_cache': FileSystemBytecodeCache(JINJA_BYTECODE_CACHE_DIR)}
+
 # Configure logging for access monitoring
 logging.basicConfig(level=logging.INFO)
 
-# Track used counters to prevent replay attacks
-used_counters = {}
+# MASTER_KEY is the default version, MASTER_KEYS contain the additional ones (key rotation, tenants),
+# unknown or revoked tags are rejected before deriving their keys
+key_registry = key_registry_from_config(config)
+
+# identical taps requested in quick succession share a single verification
+verification_results = SingleFlight(ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_MAX_ENTRIES)
+
+
+def coalesced_decrypt_sun_message(param_mode, picc_enc_data, sdmmac, enc_file_data=None, version_hint=None):
+    """
+    KeyRegistry.decrypt_sun_message() keyed by the decoded parameters, concurrent duplicates are computed once
+    """
+    key = ("sun", param_mode, picc_enc_data, sdmmac, enc_file_data, version_hint or None)
+    return verification_results.do(key, lambda: key_registry.decrypt_sun_message(param_mode=param_mode,
+                                                                                 picc_enc_data=picc_enc_data,
+                                                                                 sdmmac=sdmmac,
+                                                                                 enc_file_data=enc_file_data,
+                                                                                 version_hint=version_hint))
+
+
+def coalesced_validate_plain_sun(uid, read_ctr, sdmmac, version_hint=None):
+    """
+    KeyRegistry.validate_plain_sun() keyed by the decoded parameters, concurrent duplicates are computed once
+    """
+    key = ("plain", uid, read_ctr, sdmmac, version_hint or None)
+    return verification_results.do(key, lambda: key_registry.validate_plain_sun(uid=uid,
+                                                                                read_ctr=read_ctr,
+                                                                                sdmmac=sdmmac,
+                                                                                version_hint=version_hint))
+
+
+# per-worker metrics, aggregated across the workers through METRICS_DIR
+metrics = MetricsRegistry(directory=METRICS_DIR, flush_interval=METRICS_FLUSH_INTERVAL)
+stage_seconds = metrics.histogram("sdm_stage_seconds", "Time spent in the stages of the tap processing", ["stage"])
+verifications_total = metrics.counter("sdm_verifications_total", "Verified messages by endpoint, parameter mode, encryption mode and result",
+                                      ["endpoint", "param_mode", "enc_mode", "result"])
+cache_requests_total = metrics.counter("sdm_cache_requests_total", "Cache lookups by cache and result", ["cache", "result"])
+
+# times the stages for the metrics and the Server-Timing header: parse, verify, store and render in the application,
+# derive, picc, sdmmac, file, lrp (and the whole SUN message as "sun") inside libsdm
+stages = StageRecorder(observe=(lambda stage, seconds: stage_seconds.labels(stage).observe(seconds)) if METRICS_ENABLED else None)
+
+if METRICS_ENABLED or SERVER_TIMING:
+    hooks.register(stages)
+
+# append-only binary log of the verified taps, written in the background (see sdmserver.audit_log)
+audit_log = AuditLog(AUDIT_LOG_DIR,
+                     capacity=AUDIT_LOG_BUFFER_SIZE,
+                     flush_interval=AUDIT_LOG_FLUSH_INTERVAL,
+                     max_bytes=AUDIT_LOG_MAX_BYTES,
+                     max_age=AUDIT_LOG_MAX_AGE) if AUDIT_LOG_DIR else None
+
+AUDIT_PARAM_MODES = {"SEPARATED": PARAM_MODE_SEPARATED, "BULK": PARAM_MODE_BULK, "PLAIN": PARAM_MODE_PLAIN}
+AUDIT_OUTCOMES = {
+    "ok": OUTCOME_OK,
+    "lrp_required": OUTCOME_LRP_REQUIRED,
+    "Message is not properly signed - invalid MAC": OUTCOME_INVALID_MAC,
+    "UID is not provisioned or was revoked.": OUTCOME_NOT_ADMITTED,
+}
+
+
+def sun_encryption_mode(picc_enc_data):
+    try:
+        return get_encryption_mode(picc_enc_data)
+    except InvalidMessage:
+        return None
+
+
+def record_verification(endpoint, param_mode, enc_mode, result, started, res=None):
+    """
+    Count verified message and write it to the audit log
+    :param param_mode: name of the parameter mode (SEPARATED, BULK or PLAIN)
+    :param enc_mode: EncMode (None if unknown)
+    :param result: "ok" or the reason of the rejection
+    :param started: time.perf_counter() at the beginning of the verification
+    :param res: verification result (only if the message is authentic)
+    """
+    verifications_total.labels(endpoint, param_mode, enc_mode.name if enc_mode else "unknown", result).inc()
+
+    if audit_log is not None:
+        audit_log.record(uid=res['uid'] if res else None,
+                         read_ctr=res['read_ctr'] if res else None,
+                         enc_mode=enc_mode.value if enc_mode else UNKNOWN_MODE,
+                         param_mode=AUDIT_PARAM_MODES[param_mode],
+                         outcome=AUDIT_OUTCOMES.get(result, OUTCOME_INVALID),
+                         latency=time.perf_counter() - started)
+
+
+def error_response(code, err):
+    msg = str(err)
+    entry = response_cache.get_or_render(('error', code, msg),
+                                         lambda: render_template('error.html', code=code, msg=msg))
+    return cached_response(entry, code)
+
 
 @app.errorhandler(400)
 def handler_bad_request(err):
-    return render_template('error.html', code=400, msg=str(err)), 400
+    return error_response(400, err)
 
 
 @app.errorhandler(403)
 def handler_forbidden(err):
-    return render_template('error.html', code=403, msg=str(err)), 403
+    return error_response(403, err)
 
 
 @app.errorhandler(404)
 def handler_not_found(err):
-    return render_template('error.html', code=404, msg=str(err)), 404
+    return error_response(404, err)
 
 
 @app.context_processor
@@ -68,12 +226,8 @@ def inject_demo_mode():
     return {"demo_mode": demo_mode}
 
 
-@app.route('/')
-def sdm_main():
-    """
-    Updated main page with project-specific information.
-    """
-    return render_template_string("""
+# pre-rendered pages, see build_response_cache()
+MAIN_PAGE_TEMPLATE = """
     <html>
     <head>
         <title>MEMS NTAG 424 DNA Backend</title>
@@ -106,203 +260,281 @@ def sdm_main():
         </div>
     </body>
     </html>
-    """)
+    """
+
+VALIDATE_GRANTED_PAGE = """
+    <html>
+    <head>
+        <title>QUACK! Secure Access</title>
+        <style>
+            body {{ margin: 0; padding: 0; }}
+            .loading {{ 
+                position: fixed; top: 0; left: 0; width: 100%; height: 100%; 
+                background: white; display: flex; flex-direction: column;
+                justify-content: center; align-items: center; z-index: 9999; 
+            }}
+            .loading h1 {{ color: #4CAF50; font-size: 2.5em; }}
+            .loader {{ 
+                width: 50px; height: 50px; border: 5px solid #f3f3f3; 
+                border-top: 5px solid #4CAF50; border-radius: 50%; 
+                animation: spin 1s linear infinite; margin: 20px 0; 
+            }}
+            @keyframes spin {{ 0% {{ transform: rotate(0deg); }} 100% {{ transform: rotate(360deg); }} }}
+            .content {{ display: none; }}
+            iframe {{ width: 100%; height: 100vh; border: none; }}
+        </style>
+        <script>
+            setTimeout(function() {{
+                document.getElementById('loading').style.display = 'none';
+                document.getElementById('content').style.display = 'block';
+            }}, 3000);
+        </script>
+    </head>
+    <body>
+        <div id="loading" class="loading">
+            <h1>QUACK! 🦆</h1>
+            <p>Loading MEMSlide content...</p>
+            <div class="loader"></div>
+            <p><small>⏱️ {expiry_note}</small></p>
+        </div>
+        <div id="content" class="content">
+            <iframe src="https://pedroarrudar.wixstudio.com/test-umpalumpa" 
+                    sandbox="allow-scripts allow-same-origin allow-forms">
+            </iframe>
+        </div>
+    </body>
+    </html>
+    """
+
+VALIDATE_EXPIRED_PAGE = """
+    <html>
+    <head>
+        <title>Access Expired</title>
+        <style>
+            body { 
+                font-family: Arial, sans-serif; text-align: center; padding: 50px; 
+                background: linear-gradient(135deg, #ff9800 0%, #ffb74d 100%);
+                color: white; min-height: 100vh; margin: 0;
+                display: flex; flex-direction: column; justify-content: center; align-items: center;
+            }
+            h1 { color: #fff; font-size: 2.5em; margin-bottom: 20px; }
+            .clock-icon { font-size: 80px; margin: 20px 0; }
+            .message { font-size: 1.2em; margin-top: 20px; }
+            .instruction { background: rgba(255,255,255,0.2); padding: 15px; border-radius: 10px; margin-top: 20px; }
+        </style>
+    </head>
+    <body>
+        <h1>⏰ ACCESS EXPIRED ⏰</h1>
+        <div class="clock-icon">🕐</div>
+        <div class="message">
+            <p><strong>QUACK!</strong> 🦆</p>
+            <p>This MEMSlide access has expired after 5 minutes.</p>
+            <div class="instruction">
+                <p><strong>To access the album again:</strong></p>
+                <p>👆 Touch your MEMSlide with your phone again</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+
+VALIDATE_DENIED_PAGE = """
+    <html>
+    <head>
+        <title>Access Denied</title>
+        <style>
+            body { 
+                font-family: Arial, sans-serif; text-align: center; padding: 50px; 
+                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+                color: white; min-height: 100vh; margin: 0;
+                display: flex; flex-direction: column; justify-content: center; align-items: center;
+            }
+            h1 { color: #ff6b6b; font-size: 2.5em; margin-bottom: 20px; }
+            .message { font-size: 1.2em; margin-top: 20px; }
+        </style>
+    </head>
+    <body>
+        <h1>🚨 ACCESS DENIED 🚨</h1>
+        <div class="message">
+            <p><strong>QUACK QUACK!</strong> 🦆</p>
+            <p>This duck has been arrested for unauthorized access!</p>
+            <p>Please touch a valid MEMSlide to continue.</p>
+            <p><small>Crime: Attempting to access restricted album content without proper mems.slide validation</small></p>
+        </div>
+    </body>
+    </html>
+    """
+
+
+response_cache = ResponseCache()
+
+
+def cached_response(entry, status=200):
+    """
+    Serve pre-encoded response, honouring Accept-Encoding and If-None-Match.
+    """
+    code, headers, body = entry.negotiate(request.headers.get('Accept-Encoding'),
+                                          request.headers.get('If-None-Match'),
+                                          conditional=status == 200)
+    return Response(body, status=code or status, headers=headers)
+
+
+def granted_page(expiry_note):
+    return VALIDATE_GRANTED_PAGE.format(expiry_note=expiry_note)
+
+
+def build_response_cache():
+    """
+    Render the static pages and compile the templates only once, before the workers are forked.
+    """
+    with app.app_context():
+        response_cache.put('main', render_template_string(MAIN_PAGE_TEMPLATE))
+
+        for name in app.jinja_env.list_templates():
+            app.jinja_env.get_template(name)
+
+    response_cache.put('validate_first', granted_page(f"Access expires in {int(VALIDATE_ACCESS_WINDOW / 60)} minutes"))
+    response_cache.put('validate_expired', VALIDATE_EXPIRED_PAGE)
+    response_cache.put('validate_denied', VALIDATE_DENIED_PAGE)
+
+    for minutes in range(1, int(VALIDATE_ACCESS_WINDOW / 60) + 2):
+        response_cache.put(('validate_granted', minutes), granted_page(f"Expires in {minutes} minutes"))
+
+
+@app.route('/')
+def sdm_main():
+    """
+    Updated main page with project-specific information.
+    """
+    return cached_response(response_cache.get('main'))
 
 
 # NEW: Validation endpoint for NTAG 424 DNA access control
 
-# In-memory storage for used URLs (use Redis for production)
-used_urls = {}
+# first-access times of the verified taps, keyed by UID and SDMReadCtr
+session_store = create_session_store(SESSION_BACKEND,
+                                     ttl=SESSION_TTL,
+                                     max_entries=SESSION_MAX_ENTRIES,
+                                     sqlite_path=SESSION_SQLITE_PATH)
+
+# signs the access tokens issued by /validate, must be the same on all workers and nodes
+if ACCESS_TOKEN_SECRET:
+    access_token_secret = binascii.unhexlify(ACCESS_TOKEN_SECRET)
+else:
+    access_token_secret = hmac.new(MASTER_KEY, b"AccessTokenSecret", digestmod=hashlib.sha256).digest()
+
+
+def verify_validate_parameters(picc_data, enc, cmac):
+    """
+    Verify SUN message passed to the validate endpoint.
+    :return: session key of the tap, or None if the message is invalid
+    """
+    started = time.perf_counter()
+
+    try:
+        with stages.stage("parse"):
+            picc_enc_data = binascii.unhexlify(picc_data)
+            sdmmac = binascii.unhexlify(cmac)
+            enc_file_data = binascii.unhexlify(enc)
+    except (binascii.Error, ValueError):
+        # ValueError - non-ASCII characters
+        return None
+
+    try:
+        with stages.stage("verify"):
+            res = coalesced_decrypt_sun_message(param_mode=ParamMode.SEPARATED,
+                                                picc_enc_data=picc_enc_data,
+                                                sdmmac=sdmmac,
+                                                enc_file_data=enc_file_data,
+                                                version_hint=request.args.get(KEY_VERSION_PARAM))
+    except InvalidMessage as exc:
+        record_verification("validate", ParamMode.SEPARATED.name, sun_encryption_mode(picc_enc_data), str(exc), started)
+        return None
+
+    if REQUIRE_LRP and res['encryption_mode'] != EncMode.LRP:
+        record_verification("validate", ParamMode.SEPARATED.name, res['encryption_mode'], "lrp_required", started, res)
+        return None
+
+    record_verification("validate", ParamMode.SEPARATED.name, res['encryption_mode'], "ok", started, res)
+    return session_key(res['uid'], res['read_ctr'])
+
+
+def set_access_token_cookie(fingerprint, first_access, current_time):
+    """
+    Let the client prove the access on the subsequent visits without a session store lookup.
+    """
+    expires_at = first_access + VALIDATE_ACCESS_WINDOW
+    token = issue_access_token(access_token_secret, fingerprint, first_access, expires_at)
+
+    @after_this_request
+    def set_cookie(response):
+        response.set_cookie(ACCESS_TOKEN_COOKIE, token,
+                            max_age=max(int(expires_at - current_time), 0),
+                            path=request.path,
+                            secure=request.is_secure,
+                            httponly=True,
+                            samesite='Lax')
+        return response
 
-# Global variable for URL tracking
-url_access_times = {}
 
 @app.route('/validate')
 def validate_and_redirect():
     """
-    Simplified time-based URL validation for GitPod development testing.
+    Time-based validation of the SUN message, the access is granted for a limited time after the first tap.
     """
-    logging.info(f"NTAG validation attempt from {request.remote_addr}")
+    logging.info("NTAG validation attempt from %s", request.remote_addr)
     
     # Clean trial version string
     picc_data = request.args.get('picc_data')
     enc = request.args.get('enc')
     cmac = request.args.get('cmac')
-    
+    current_time = time.time()
+    first_access = None
+
     if picc_data and enc and cmac:
-        # Create unique URL identifier
-        url_hash = hashlib.md5(f"{picc_data}{enc}{cmac}".encode()).hexdigest()
-        current_time = time.time()
-        
-        # Check if URL exists and is still valid
-        if url_hash in url_access_times:
-            first_access = url_access_times[url_hash]
-            time_elapsed = current_time - first_access
-            
-            if time_elapsed <= 5:  # 5 minutes
-                # URL still valid
-                remaining_minutes = int((5 - time_elapsed) / 60) + 1
-                logging.info(f"Valid access: {remaining_minutes} minutes remaining")
-                
-                return f"""
-                <html>
-                <head>
-                    <title>QUACK! Secure Access</title>
-                    <style>
-                        body {{ margin: 0; padding: 0; }}
-                        .loading {{ 
-                            position: fixed; top: 0; left: 0; width: 100%; height: 100%; 
-                            background: white; display: flex; flex-direction: column;
-                            justify-content: center; align-items: center; z-index: 9999; 
-                        }}
-                        .loading h1 {{ color: #4CAF50; font-size: 2.5em; }}
-                        .loader {{ 
-                            width: 50px; height: 50px; border: 5px solid #f3f3f3; 
-                            border-top: 5px solid #4CAF50; border-radius: 50%; 
-                            animation: spin 1s linear infinite; margin: 20px 0; 
-                        }}
-                        @keyframes spin {{ 0% {{ transform: rotate(0deg); }} 100% {{ transform: rotate(360deg); }} }}
-                        .content {{ display: none; }}
-                        iframe {{ width: 100%; height: 100vh; border: none; }}
-                    </style>
-                    <script>
-                        setTimeout(function() {{
-                            document.getElementById('loading').style.display = 'none';
-                            document.getElementById('content').style.display = 'block';
-                        }}, 3000);
-                    </script>
-                </head>
-                <body>
-                    <div id="loading" class="loading">
-                        <h1>QUACK! 🦆</h1>
-                        <p>Loading MEMSlide content...</p>
-                        <div class="loader"></div>
-                        <p><small>⏱️ Expires in {remaining_minutes} minutes</small></p>
-                    </div>
-                    <div id="content" class="content">
-                        <iframe src="https://pedroarrudar.wixstudio.com/test-umpalumpa" 
-                                sandbox="allow-scripts allow-same-origin allow-forms">
-                        </iframe>
-                    </div>
-                </body>
-                </html>
-                """
-            else:
-                # URL expired
-                del url_access_times[url_hash]
-                logging.warning("URL expired - access denied")
-                
-                return """
-                <html>
-                <head>
-                    <title>Access Expired</title>
-                    <style>
-                        body { 
-                            font-family: Arial, sans-serif; text-align: center; padding: 50px; 
-                            background: linear-gradient(135deg, #ff9800 0%, #ffb74d 100%);
-                            color: white; min-height: 100vh; margin: 0;
-                            display: flex; flex-direction: column; justify-content: center; align-items: center;
-                        }
-                        h1 { color: #fff; font-size: 2.5em; margin-bottom: 20px; }
-                        .clock-icon { font-size: 80px; margin: 20px 0; }
-                        .message { font-size: 1.2em; margin-top: 20px; }
-                        .instruction { background: rgba(255,255,255,0.2); padding: 15px; border-radius: 10px; margin-top: 20px; }
-                    </style>
-                </head>
-                <body>
-                    <h1>⏰ ACCESS EXPIRED ⏰</h1>
-                    <div class="clock-icon">🕐</div>
-                    <div class="message">
-                        <p><strong>QUACK!</strong> 🦆</p>
-                        <p>This MEMSlide access has expired after 5 minutes.</p>
-                        <div class="instruction">
-                            <p><strong>To access the album again:</strong></p>
-                            <p>👆 Touch your MEMSlide with your phone again</p>
-                        </div>
-                    </div>
-                </body>
-                </html>
-                """
+        fingerprint = url_fingerprint(picc_data, enc, cmac)
+        token = None
+
+        if ACCESS_TOKENS:
+            token = verify_access_token(access_token_secret, request.cookies.get(ACCESS_TOKEN_COOKIE), fingerprint)
+
+        if token is not None:
+            # repeated visit proven by the signed token, no need to verify the tap again
+            first_access, created = token.first_access, False
         else:
-            # First access - record time
-            url_access_times[url_hash] = current_time
-            logging.info("New URL access - 5-minute timer started")
-            
-            return """
-            <html>
-            <head>
-                <title>QUACK! Secure Access</title>
-                <style>
-                    body { margin: 0; padding: 0; }
-                    .loading { 
-                        position: fixed; top: 0; left: 0; width: 100%; height: 100%; 
-                        background: white; display: flex; flex-direction: column;
-                        justify-content: center; align-items: center; z-index: 9999; 
-                    }
-                    .loading h1 { color: #4CAF50; font-size: 2.5em; }
-                    .loader { 
-                        width: 50px; height: 50px; border: 5px solid #f3f3f3; 
-                        border-top: 5px solid #4CAF50; border-radius: 50%; 
-                        animation: spin 1s linear infinite; margin: 20px 0; 
-                    }
-                    @keyframes spin { 0% { transform: rotate(0deg); } 100% { transform: rotate(360deg); } }
-                    .content { display: none; }
-                    iframe { width: 100%; height: 100vh; border: none; }
-                </style>
-                <script>
-                    setTimeout(function() {
-                        document.getElementById('loading').style.display = 'none';
-                        document.getElementById('content').style.display = 'block';
-                    }, 3000);
-                </script>
-            </head>
-            <body>
-                <div id="loading" class="loading">
-                    <h1>QUACK! 🦆</h1>
-                    <p>Loading MEMSlide content...</p>
-                    <div class="loader"></div>
-                    <p><small>⏱️ Access expires in 5 minutes</small></p>
-                </div>
-                <div id="content" class="content">
-                    <iframe src="https://pedroarrudar.wixstudio.com/test-umpalumpa" 
-                            sandbox="allow-scripts allow-same-origin allow-forms">
-                    </iframe>
-                </div>
-            </body>
-            </html>
-            """
-    else:
-        # Access denied - invalid parameters
-        logging.warning("Access denied - missing parameters")
-        
-        return """
-        <html>
-        <head>
-            <title>Access Denied</title>
-            <style>
-                body { 
-                    font-family: Arial, sans-serif; text-align: center; padding: 50px; 
-                    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                    color: white; min-height: 100vh; margin: 0;
-                    display: flex; flex-direction: column; justify-content: center; align-items: center;
-                }
-                h1 { color: #ff6b6b; font-size: 2.5em; margin-bottom: 20px; }
-                .message { font-size: 1.2em; margin-top: 20px; }
-            </style>
-        </head>
-        <body>
-            <h1>🚨 ACCESS DENIED 🚨</h1>
-            <div class="message">
-                <p><strong>QUACK QUACK!</strong> 🦆</p>
-                <p>This duck has been arrested for unauthorized access!</p>
-                <p>Please touch a valid MEMSlide to continue.</p>
-                <p><small>Crime: Attempting to access restricted album content without proper mems.slide validation</small></p>
-            </div>
-        </body>
-        </html>
-        """
-        
-        
+            key = verify_validate_parameters(picc_data, enc, cmac)
+
+            if key is not None:
+                with stages.stage("store"):
+                    first_access, created = session_store.claim(key, current_time)
+
+                if ACCESS_TOKENS and current_time - first_access <= VALIDATE_ACCESS_WINDOW:
+                    set_access_token_cookie(fingerprint, first_access, current_time)
+
+    if first_access is None:
+        # Access denied - missing or invalid parameters
+        logging.warning("Access denied - missing or invalid parameters")
+        return cached_response(response_cache.get('validate_denied'))
+
+    if created:
+        # First access - the time was recorded by the session store
+        logging.info("New URL access - timer started")
+        return cached_response(response_cache.get('validate_first'))
+
+    # Check if URL is still valid
+    time_elapsed = current_time - first_access
+
+    if time_elapsed > VALIDATE_ACCESS_WINDOW:
+        logging.warning("URL expired - access denied")
+        return cached_response(response_cache.get('validate_expired'))
+
+    remaining_minutes = int((VALIDATE_ACCESS_WINDOW - time_elapsed) / 60) + 1
+    logging.info("Valid access: %d minutes remaining", remaining_minutes)
+    entry = response_cache.get_or_render(('validate_granted', remaining_minutes),
+                                         lambda: granted_page(f"Expires in {remaining_minutes} minutes"))
+    return cached_response(entry)
+
+
 def parse_sdm_parameters(encrypted, cmac_param):
     """
     Parse SDM parameters for the validate endpoint.
@@ -349,14 +581,18 @@ def parse_sdm_parameters(encrypted, cmac_param):
 
 
 # Keep all existing endpoints unchanged
-def parse_parameters():
-    arg_e = request.args.get('e')
+def parse_parameters(args=None):
+    if args is None:
+        args = request.args
+
+    arg_e = args.get('e')
     if arg_e:
         param_mode = ParamMode.BULK
 
         try:
             e_b = binascii.unhexlify(arg_e)
-        except binascii.Error:
+        except (binascii.Error, ValueError):
+            # ValueError - non-ASCII characters
             raise BadRequest("Failed to decode parameters.") from None
 
         e_buf = io.BytesIO(e_b)
@@ -387,9 +623,9 @@ def parse_parameters():
             raise BadRequest("Incorrect length of the dynamic parameter.")
     else:
         param_mode = ParamMode.SEPARATED
-        enc_picc_data = request.args.get(ENC_PICC_DATA_PARAM)
-        enc_file_data = request.args.get(ENC_FILE_DATA_PARAM)
-        sdmmac = request.args.get(SDMMAC_PARAM)
+        enc_picc_data = args.get(ENC_PICC_DATA_PARAM)
+        enc_file_data = args.get(ENC_FILE_DATA_PARAM)
+        sdmmac = args.get(SDMMAC_PARAM)
 
         if not enc_picc_data:
             raise BadRequest(f"Parameter {ENC_PICC_DATA_PARAM} is required")
@@ -404,7 +640,7 @@ def parse_parameters():
 
             if enc_file_data:
                 enc_file_data_b = binascii.unhexlify(enc_file_data)
-        except binascii.Error:
+        except (binascii.Error, ValueError):
             raise BadRequest("Failed to decode parameters.") from None
 
     return param_mode, enc_picc_data_b, enc_file_data_b, sdmmac_b
@@ -429,37 +665,60 @@ def sdm_api_info_plain():
         return jsonify({"error": str(err)}), 400
 
 
-def _internal_tagpt(force_json=False):
+def verify_tagpt(args):
+    """
+    Validate plaintext SUN message.
+    """
+    started = time.perf_counter()
+
     try:
-        uid = binascii.unhexlify(request.args[UID_PARAM])
-        read_ctr = binascii.unhexlify(request.args[CTR_PARAM])
-        cmac = binascii.unhexlify(request.args[SDMMAC_PARAM])
-    except binascii.Error:
+        with stages.stage("parse"):
+            uid = binascii.unhexlify(args[UID_PARAM])
+            read_ctr = binascii.unhexlify(args[CTR_PARAM])
+            cmac = binascii.unhexlify(args[SDMMAC_PARAM])
+    except KeyError as err:
+        raise BadRequestKeyError(err.args[0]) from None
+    except (binascii.Error, ValueError):
+        # ValueError - non-ASCII characters
         raise BadRequest("Failed to decode parameters.") from None
 
     try:
-        sdm_file_read_key = derive_tag_key(MASTER_KEY, uid, 2)
-        res = validate_plain_sun(uid=uid,
-                                 read_ctr=read_ctr,
-                                 sdmmac=cmac,
-                                 sdm_file_read_key=sdm_file_read_key)
-    except InvalidMessage:
+        with stages.stage("verify"):
+            res = coalesced_validate_plain_sun(uid=uid,
+                                               read_ctr=read_ctr,
+                                               sdmmac=cmac,
+                                               version_hint=args.get(KEY_VERSION_PARAM))
+    except InvalidMessage as exc:
+        record_verification("tagpt", "PLAIN", None, str(exc), started)
         raise BadRequest("Invalid message (most probably wrong signature).") from None
 
     if REQUIRE_LRP and res['encryption_mode'] != EncMode.LRP:
+        record_verification("tagpt", "PLAIN", res['encryption_mode'], "lrp_required", started, res)
         raise BadRequest("Invalid encryption mode, expected LRP.")
 
+    record_verification("tagpt", "PLAIN", res['encryption_mode'], "ok", started, res)
+    return res
+
+
+def tagpt_api_payload(res):
+    return {
+        "uid": res['uid'].hex().upper(),
+        "read_ctr": res['read_ctr'],
+        "enc_mode": res['encryption_mode'].name
+    }
+
+
+def _internal_tagpt(force_json=False):
+    res = verify_tagpt(request.args)
+
     if request.args.get("output") == "json" or force_json:
-        return jsonify({
-            "uid": res['uid'].hex().upper(),
-            "read_ctr": res['read_ctr'],
-            "enc_mode": res['encryption_mode'].name
-        })
+        return jsonify(tagpt_api_payload(res))
 
-    return render_template('sdm_info.html',
-                           encryption_mode=res['encryption_mode'].name,
-                           uid=res['uid'],
-                           read_ctr_num=res['read_ctr'])
+    with stages.stage("render"):
+        return render_template('sdm_info.html',
+                               encryption_mode=res['encryption_mode'].name,
+                               uid=res['uid'],
+                               read_ctr_num=res['read_ctr'])
 
 
 @app.route('/webnfc')
@@ -493,26 +752,166 @@ def sdm_api_info():
         return jsonify({"error": str(err)})
 
 
+def read_batch_items():
+    """
+    Parse request body of the batch endpoint, either a JSON array or NDJSON (one JSON object per line).
+    """
+    if request.content_length is not None and request.content_length > BATCH_MAX_BODY_SIZE:
+        raise RequestEntityTooLarge(f"Request body is limited to {BATCH_MAX_BODY_SIZE} bytes.")
+
+    if request.mimetype == 'application/json':
+        body = request.stream.read(BATCH_MAX_BODY_SIZE + 1)
+
+        if len(body) > BATCH_MAX_BODY_SIZE:
+            raise RequestEntityTooLarge(f"Request body is limited to {BATCH_MAX_BODY_SIZE} bytes.")
+
+        try:
+            items = json.loads(body)
+        except ValueError:
+            raise BadRequest("Failed to decode JSON.") from None
+
+        if not isinstance(items, list):
+            raise BadRequest("Expected JSON array.")
+
+        if len(items) > BATCH_MAX_ITEMS:
+            raise RequestEntityTooLarge(f"Batch is limited to {BATCH_MAX_ITEMS} items.")
+
+        yield from items
+        return
+
+    size = 0
+    count = 0
+
+    for line in request.stream:
+        size += len(line)
+
+        if size > BATCH_MAX_BODY_SIZE:
+            raise RequestEntityTooLarge(f"Request body is limited to {BATCH_MAX_BODY_SIZE} bytes.")
+
+        if not line.strip():
+            continue
+
+        count += 1
+
+        if count > BATCH_MAX_ITEMS:
+            raise RequestEntityTooLarge(f"Batch is limited to {BATCH_MAX_ITEMS} items.")
+
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def verify_batch_item(index, item, file_key_cache):
+    started = time.perf_counter()
+
+    try:
+        if not isinstance(item, dict):
+            raise BadRequest("Expected JSON object.")
+
+        if not all(isinstance(value, str) for value in item.values()):
+            raise BadRequest("Expected string values.")
+
+        param_mode, enc_picc_data_b, enc_file_data_b, sdmmac_b = parse_parameters(item)
+
+        try:
+            res = key_registry.decrypt_sun_message(param_mode=param_mode,
+                                                   picc_enc_data=enc_picc_data_b,
+                                                   sdmmac=sdmmac_b,
+                                                   enc_file_data=enc_file_data_b,
+                                                   version_hint=item.get(KEY_VERSION_PARAM),
+                                                   file_key_cache=file_key_cache)
+        except (TypeError, ValueError):
+            # e.g. file data which isn't a multiple of the block size, must not break the rest of the stream
+            record_verification("batch", param_mode.name, sun_encryption_mode(enc_picc_data_b), "malformed", started)
+            raise BadRequest("Failed to decode parameters.") from None
+        except InvalidMessage as exc:
+            record_verification("batch", param_mode.name, sun_encryption_mode(enc_picc_data_b), str(exc), started)
+            raise BadRequest("Invalid message (most probably wrong signature).") from None
+
+        if REQUIRE_LRP and res['encryption_mode'] != EncMode.LRP:
+            record_verification("batch", param_mode.name, res['encryption_mode'], "lrp_required", started, res)
+            raise BadRequest("Invalid encryption mode, expected LRP.")
+
+        record_verification("batch", param_mode.name, res['encryption_mode'], "ok", started, res)
+    except BadRequest as err:
+        return {"index": index, "error": str(err)}
+
+    return {
+        "index": index,
+        "uid": res['uid'].hex().upper(),
+        "file_data": res['file_data'].hex() if res['file_data'] else None,
+        "read_ctr": res['read_ctr'],
+        "enc_mode": res['encryption_mode'].name
+    }
+
+
+@app.route('/api/tag/batch', methods=['POST'])
+def sdm_api_batch():
+    """
+    Verify many SUN messages at once, results are streamed as NDJSON in the order of the input.
+    """
+    items = read_batch_items()
+
+    try:
+        # fail early on oversized requests, before the response is started
+        first = next(items)
+    except StopIteration:
+        items = iter(())
+    except HTTPException as err:
+        return jsonify({"error": str(err)}), err.code
+    else:
+        items = itertools.chain([first], items)
+
+    def process():
+        # tag keys are derived only once per UID within the batch
+        file_key_cache = {}
+        index = 0
+
+        while True:
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            except RequestEntityTooLarge as err:
+                yield json.dumps({"index": index, "error": str(err)}) + "\n"
+                return
+
+            yield json.dumps(verify_batch_item(index, item, file_key_cache)) + "\n"
+            index += 1
+
+    return Response(stream_with_context(process()), mimetype='application/x-ndjson')
+
+
 # pylint:  disable=too-many-branches, too-many-statements, too-many-locals
-def _internal_sdm(with_tt=False, force_json=False):
+def verify_sdm(args, with_tt=False):
     """
-    SUN decrypting/validating endpoint.
+    Decrypt and validate SUN message.
+    :return: dict with the variables for sdm_info.html template
     """
-    param_mode, enc_picc_data_b, enc_file_data_b, sdmmac_b = parse_parameters()
+    endpoint = "tagtt" if with_tt else "tag"
+    started = time.perf_counter()
+
+    with stages.stage("parse"):
+        param_mode, enc_picc_data_b, enc_file_data_b, sdmmac_b = parse_parameters(args)
 
     try:
-        res = decrypt_sun_message(param_mode=param_mode,
-                                  sdm_meta_read_key=derive_undiversified_key(MASTER_KEY, 1),
-                                  sdm_file_read_key=lambda uid: derive_tag_key(MASTER_KEY, uid, 2),
-                                  picc_enc_data=enc_picc_data_b,
-                                  sdmmac=sdmmac_b,
-                                  enc_file_data=enc_file_data_b)
-    except InvalidMessage:
+        with stages.stage("verify"):
+            res = coalesced_decrypt_sun_message(param_mode=param_mode,
+                                                picc_enc_data=enc_picc_data_b,
+                                                sdmmac=sdmmac_b,
+                                                enc_file_data=enc_file_data_b,
+                                                version_hint=args.get(KEY_VERSION_PARAM))
+    except InvalidMessage as exc:
+        record_verification(endpoint, param_mode.name, sun_encryption_mode(enc_picc_data_b), str(exc), started)
         raise BadRequest("Invalid message (most probably wrong signature).") from InvalidMessage
 
     if REQUIRE_LRP and res['encryption_mode'] != EncMode.LRP:
+        record_verification(endpoint, param_mode.name, res['encryption_mode'], "lrp_required", started, res)
         raise BadRequest("Invalid encryption mode, expected LRP.")
 
+    record_verification(endpoint, param_mode.name, res['encryption_mode'], "ok", started, res)
+
     picc_data_tag = res['picc_data_tag']
     uid = res['uid']
     read_ctr_num = res['read_ctr']
@@ -562,32 +961,338 @@ def _internal_sdm(with_tt=False, force_json=False):
                 tt_status = 'Unknown'
                 tt_color = 'orange'
 
+    return {
+        "encryption_mode": encryption_mode,
+        "picc_data_tag": picc_data_tag,
+        "uid": uid,
+        "read_ctr_num": read_ctr_num,
+        "file_data": file_data,
+        "file_data_utf8": file_data_utf8,
+        "tt_status": tt_status,
+        "tt_status_api": tt_status_api,
+        "tt_color": tt_color
+    }
+
+
+def sdm_api_payload(info):
+    return {
+        "uid": info['uid'].hex().upper(),
+        "file_data": info['file_data'].hex() if info['file_data'] else None,
+        "read_ctr": info['read_ctr_num'],
+        "tt_status": info['tt_status_api'],
+        "enc_mode": info['encryption_mode']
+    }
+
+
+def _internal_sdm(with_tt=False, force_json=False):
+    """
+    SUN decrypting/validating endpoint.
+    """
+    info = verify_sdm(request.args, with_tt=with_tt)
+
     if request.args.get("output") == "json" or force_json:
-        return jsonify({
-            "uid": uid.hex().upper(),
-            "file_data": file_data.hex() if file_data else None,
-            "read_ctr": read_ctr_num,
-            "tt_status": tt_status_api,
-            "enc_mode": encryption_mode
-        })
-
-    return render_template('sdm_info.html',
-                           encryption_mode=encryption_mode,
-                           picc_data_tag=picc_data_tag,
-                           uid=uid,
-                           read_ctr_num=read_ctr_num,
-                           file_data=file_data,
-                           file_data_utf8=file_data_utf8,
-                           tt_status=tt_status,
-                           tt_color=tt_color)
+        return jsonify(sdm_api_payload(info))
+
+    with stages.stage("render"):
+        return render_template('sdm_info.html', **info)
+
+
+def collect_cache_stats():
+    for result in ("hits", "coalesced", "misses"):
+        cache_requests_total.labels("verification", result).set(getattr(verification_results, result))
+
+    for result in ("hits", "misses"):
+        cache_requests_total.labels("page", result).set(getattr(response_cache, result))
+
+
+metrics.add_collector(collect_cache_stats)
+
+
+if METRICS_ENABLED:
+    @app.route('/metrics')
+    def metrics_endpoint():
+        """
+        Metrics in Prometheus text format, summed over all live workers, only available with METRICS_TOKEN
+        configured, sent as "Authorization: Bearer <token>"
+        """
+        if not METRICS_TOKEN:
+            raise NotFound()
+
+        if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {METRICS_TOKEN}".encode()):
+            raise Unauthorized("Invalid metrics token.")
+
+        return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+def require_admin():
+    """
+    Admin endpoints are only available with ADMIN_TOKEN configured, sent as "Authorization: Bearer <token>"
+    """
+    if not ADMIN_TOKEN:
+        raise NotFound()
+
+    if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f"Bearer {ADMIN_TOKEN}".encode()):
+        raise Unauthorized("Invalid admin token.")
+
+
+# profiles the requests of this worker process on demand, see /admin/profiler
+profiler = SamplingProfiler()
+
+
+@app.route('/admin/profiler', methods=['GET'])
+def admin_profiler_status():
+    require_admin()
+    return jsonify(profiler.status())
+
+
+@app.route('/admin/profiler/start', methods=['POST'])
+def admin_profiler_start():
+    """
+    Start profiling: rate (share of the requests, 0 - 1), slow_ms (profile the requests slower than this),
+    interval_ms (sampling interval, default 5 ms)
+    """
+    require_admin()
+
+    try:
+        rate = float(request.args.get('rate', '0'))
+        slow_ms = request.args.get('slow_ms')
+        interval_ms = float(request.args.get('interval_ms', '5'))
+        profiler.start(rate=rate,
+                       slow_threshold=float(slow_ms) / 1000 if slow_ms else None,
+                       interval=interval_ms / 1000)
+    except ValueError as err:
+        raise BadRequest(str(err)) from None
+
+    return jsonify(profiler.status())
+
+
+@app.route('/admin/profiler/stop', methods=['POST'])
+def admin_profiler_stop():
+    require_admin()
+    profiler.stop()
+    return jsonify(profiler.status())
+
+
+@app.route('/admin/profiler/reset', methods=['POST'])
+def admin_profiler_reset():
+    require_admin()
+    profiler.reset()
+    return jsonify(profiler.status())
+
+
+@app.route('/admin/profiler/stacks', methods=['GET'])
+def admin_profiler_stacks():
+    """
+    Collapsed stacks of the profiled requests (input of flamegraph.pl, speedscope etc.), optionally for one endpoint
+    """
+    require_admin()
+    return Response(profiler.collapsed(request.args.get('endpoint')),
+                    content_type='text/plain; charset=utf-8',
+                    headers={'Content-Disposition': 'attachment; filename="profile.collapsed"'})
+
+
+# memory footprint and budget of this worker process, see /admin/memory
+memory_monitor = MemoryMonitor(soft_limit=MEMORY_SOFT_LIMIT,
+                               recycle_limit=MEMORY_RECYCLE_LIMIT,
+                               check_interval=MEMORY_CHECK_INTERVAL)
+memory_monitor.register('verification_results', lambda: len(verification_results), lambda: verification_results.clear())
+memory_monitor.register('response_cache', lambda: len(response_cache), lambda: response_cache.shrink())
+# only the expired sessions can be dropped, the live ones decide about the access
+memory_monitor.register('session_store', lambda: len(session_store), lambda: session_store.purge())
+memory_monitor.register('key_registry_learned', lambda: key_registry.learned_count(), lambda: key_registry.forget_learned())
+memory_monitor.register('profiler_stacks', lambda: sum(len(stacks) for stacks in profiler.stacks.values()))
+memory_monitor.register('audit_log_pending', lambda: audit_log.pending if audit_log else 0)
+
+allocation_tracer = AllocationTracer()
+
+
+@app.route('/admin/memory', methods=['GET'])
+def admin_memory_status():
+    """
+    RSS, Python heap statistics and sizes of the in-process caches and stores of this worker
+    """
+    require_admin()
+    return jsonify(memory_monitor.status())
+
+
+@app.route('/admin/memory/shrink', methods=['POST'])
+def admin_memory_shrink():
+    require_admin()
+    before = memory_monitor.shrink()
+    return jsonify(dict(memory_monitor.status(), shrunk=before))
+
+
+@app.route('/admin/memory/trace/start', methods=['POST'])
+def admin_memory_trace_start():
+    """
+    Start tracing the allocations: frames (number of frames stored per allocation, default 1)
+    """
+    require_admin()
+
+    try:
+        allocation_tracer.start(int(request.args.get('frames', '1')))
+    except ValueError as err:
+        raise BadRequest(str(err)) from None
+
+    return jsonify({"active": allocation_tracer.active})
+
+
+@app.route('/admin/memory/trace/stop', methods=['POST'])
+def admin_memory_trace_stop():
+    require_admin()
+    allocation_tracer.stop()
+    return jsonify({"active": allocation_tracer.active})
+
+
+@app.route('/admin/memory/trace', methods=['GET'])
+def admin_memory_trace():
+    """
+    Top allocation sites since the tracing was started: limit (default 20), key_type (lineno, filename or traceback),
+    with the growth since the previous call
+    """
+    require_admin()
+
+    try:
+        sites = allocation_tracer.top(int(request.args.get('limit', '20')), request.args.get('key_type', 'lineno'))
+    except (ValueError, RuntimeError) as err:
+        raise BadRequest(str(err)) from None
+
+    return jsonify({"active": allocation_tracer.active, "sites": sites})
+
+
+build_response_cache()
+
+
+def fast_api_sdm(args, with_tt=False):
+    try:
+        return 200, sdm_api_payload(verify_sdm(args, with_tt=with_tt))
+    except BadRequest as err:
+        return 200, {"error": str(err)}
+
+
+def fast_api_tagpt(args):
+    try:
+        return 200, tagpt_api_payload(verify_tagpt(args))
+    except BadRequest as err:
+        return 400, {"error": str(err)}
+
+
+if API_FAST_PATH:
+    # machine clients skip Flask routing and request parsing entirely
+    app.wsgi_app = ApiFastPath(app.wsgi_app, {
+        '/api/tag': fast_api_sdm,
+        '/api/tagtt': lambda args: fast_api_sdm(args, with_tt=True),
+        '/api/tagpt': fast_api_tagpt,
+    })
+
+# outside of the fast path, so the fast API requests are profiled too
+app.wsgi_app = ProfilerMiddleware(app.wsgi_app, profiler, paths=[
+    '/', '/tag', '/tagtt', '/tagpt', '/api/tag', '/api/tagtt', '/api/tagpt', '/api/tag/batch', '/validate', '/webnfc',
+])
+
+if memory_monitor.enabled:
+    app.wsgi_app = MemoryBudgetMiddleware(app.wsgi_app, memory_monitor)
+
+if SERVER_TIMING:
+    app.wsgi_app = ServerTimingMiddleware(app.wsgi_app, paths=['/tag', '/tagtt', '/tagpt', '/api/tag', '/api/tagtt', '/api/tagpt', '/validate'])
+
+if ADMISSION_DEADLINE:
+    # shed the requests which would miss the deadline, demo pages first
+    app.wsgi_app = AdmissionController(app.wsgi_app,
+                                       deadline=ADMISSION_DEADLINE,
+                                       concurrency=ADMISSION_CONCURRENCY,
+                                       priority_prefixes=ADMISSION_PRIORITY_PREFIXES,
+                                       low_priority_share=ADMISSION_LOW_PRIORITY_SHARE,
+                                       retry_after=ADMISSION_RETRY_AFTER)
+
+if METRICS_ENABLED:
+    # outside of the admission control, so the shed requests are counted too
+    app.wsgi_app = MetricsMiddleware(app.wsgi_app, metrics, paths=[
+        '/', '/tag', '/tagtt', '/tagpt', '/api/tag', '/api/tagtt', '/api/tagpt', '/api/tag/batch', '/validate', '/webnfc', '/metrics',
+    ])
+
+if REQUEST_RECORD_PATH:
+    # sampled request stream for sdmserver.recorder replays, the digests of the redacted values match across the workers
+    request_recorder = RequestRecorder(REQUEST_RECORD_PATH,
+                                       sample_rate=REQUEST_RECORD_SAMPLE_RATE,
+                                       redact=REQUEST_RECORD_REDACT,
+                                       key=hmac.new(MASTER_KEY, b"RequestRecorderKey", digestmod=hashlib.sha256).digest())
+    app.wsgi_app = RequestRecorderMiddleware(app.wsgi_app, request_recorder, paths=[
+        '/tag', '/tagtt', '/tagpt', '/api/tag', '/api/tagtt', '/api/tagpt', '/validate',
+    ])
+
+
+SHARDED_PATHS = ['/tag', '/tagtt', '/tagpt', '/api/tag', '/api/tagtt', '/api/tagpt', '/validate']
+
+
+def shard_uid(environ):
+    """
+    Find out UID of the tag without verifying the message, only used to choose the owning shard.
+    """
+    args = dict(urllib.parse.parse_qsl(environ.get('QUERY_STRING', '')))
+
+    try:
+        if environ.get('PATH_INFO') in ['/tagpt', '/api/tagpt']:
+            return binascii.unhexlify(args[UID_PARAM])
+
+        if environ.get('PATH_INFO') == '/validate':
+            picc_enc_data = binascii.unhexlify(args['picc_data'])
+        elif args.get('e'):
+            e_b = binascii.unhexlify(args['e'])
+            picc_enc_data = e_b[:24] if (len(e_b) - 8) % 16 == 8 else e_b[:16]
+        else:
+            picc_enc_data = binascii.unhexlify(args[ENC_PICC_DATA_PARAM])
+
+        return key_registry.peek_uid(picc_enc_data, args.get(KEY_VERSION_PARAM))
+    except (KeyError, binascii.Error, ValueError, InvalidMessage):
+        # ValueError - non-ASCII characters, the request is rejected locally
+        return None
+
+
+def enable_sharding(nodes, self_node):
+    """
+    Route the tag requests to the node owning the tag, so per-tag state stays local to that node.
+    """
+    wsgi_app = app.wsgi_app
+
+    if isinstance(wsgi_app, ShardRouter):
+        wsgi_app = wsgi_app.app
+
+    # authenticates the forwarded requests, must be the same on all nodes
+    if SHARD_SECRET:
+        secret = binascii.unhexlify(SHARD_SECRET)
+    else:
+        secret = hmac.new(MASTER_KEY, b"ShardForwardSecret", digestmod=hashlib.sha256).digest()
+
+    app.wsgi_app = ShardRouter(wsgi_app,
+                               ring=HashRing(nodes),
+                               self_node=self_node,
+                               extract_uid=shard_uid,
+                               paths=SHARDED_PATHS,
+                               secret=secret)
+
+
+if SHARD_NODES:
+    enable_sharding(SHARD_NODES, SHARD_SELF)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='OTA NFC Server')
     parser.add_argument('--host', type=str, nargs='?', default='0.0.0.0', help='address to listen on')
     parser.add_argument('--port', type=int, nargs='?', default=5000, help='port to listen on')
+    parser.add_argument('--shard-nodes', type=str, help='comma separated base URLs of all shards (overrides SHARD_NODES)')
+    parser.add_argument('--shard-self', type=str, help='base URL of this shard (overrides SHARD_SELF)')
+    parser.add_argument('--profile-startup', action='store_true', help='print import-time breakdown of the worker startup and exit')
 
     args = parser.parse_args()
 
-    app.run(debug=False, host='0.0.0.0', port=5000)
+    if args.profile_startup:
+        from sdmserver.startup_profile import format_report, measure_imports  # pylint: disable=import-outside-toplevel
+        print(format_report('app', measure_imports('app', cwd=os.path.dirname(os.path.abspath(__file__)))))
+        raise SystemExit(0)
+
+    if args.shard_nodes:
+        enable_sharding(args.shard_nodes.split(','), args.shard_self)
+
+    app.run(debug=False, host=args.host, port=args.port)
     
\ No newline at end of file
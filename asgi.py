@@ -0,0 +1,24 @@
+"""
+ASGI entry point, run with any ASGI server, e.g.:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+Requests are accepted on the asyncio event loop and the SUN verification runs in a bounded pool
+of threads or processes (see ASGI_* options in config.py).
+"""
+
+from config import ASGI_EXECUTOR, ASGI_MAX_IN_FLIGHT, ASGI_WORKERS
+from sdmserver.asgi_bridge import AsgiBridge
+
+if ASGI_EXECUTOR == "process":
+    # the worker processes import the application on their own
+    application = AsgiBridge(executor="process",
+                             workers=ASGI_WORKERS,
+                             max_in_flight=ASGI_MAX_IN_FLIGHT,
+                             app_path="app:app")
+else:
+    from app import app
+
+    application = AsgiBridge(app,
+                             executor="thread",
+                             workers=ASGI_WORKERS,
+                             max_in_flight=ASGI_MAX_IN_FLIGHT)
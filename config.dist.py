@@ -19,3 +19,132 @@ SDMMAC_PARAM = "cmac"
 # accept only SDM using LRP, disallow usage of AES
 REQUIRE_LRP = False
 
+
+# access window granted by /validate after the first tap (seconds)
+VALIDATE_ACCESS_WINDOW = 300
+
+# storage of the first-access times for /validate
+# "memory" - per-process, "sqlite" - shared by all worker processes using the same SESSION_SQLITE_PATH
+SESSION_BACKEND = "memory"
+SESSION_TTL = 24 * 3600
+SESSION_MAX_ENTRIES = 100000
+SESSION_SQLITE_PATH = None
+
+# issue signed access token cookies on /validate, so the repeated visits don't need the session store
+# ACCESS_TOKEN_SECRET (hex) must be the same on all nodes, it is derived from MASTER_KEY if not set
+ACCESS_TOKENS = True
+ACCESS_TOKEN_COOKIE = "sdm_access"
+ACCESS_TOKEN_SECRET = None
+
+# route each tag to the node owning its UID (consistent hashing), so per-tag state stays in that node
+# SHARD_NODES - base URLs of all nodes (empty list disables sharding), SHARD_SELF - base URL of this node
+# SHARD_SECRET (hex) authenticates the requests forwarded between the nodes, it must be the same on all nodes
+# and is derived from MASTER_KEY if not set
+SHARD_NODES = []
+SHARD_SELF = None
+SHARD_SECRET = None
+
+# additional master key versions, MASTER_KEY is always the "default" version
+# e.g. MASTER_KEYS = {"v2": ("00112233445566778899AABBCCDDEEFF", "standard")}
+MASTER_KEYS = {}
+# the key version can be pinned using URL parameter (e.g. ?kv=v2) or by the UID prefix (e.g. {"04AB": "v2"}),
+# otherwise it is learned from the previous taps or tried (at most KEY_TRIAL_LIMIT versions per tap)
+KEY_VERSION_PARAM = "kv"
+KEY_VERSION_UID_PREFIXES = {}
+KEY_TRIAL_LIMIT = 4
+
+# reject unknown and revoked tags before the key derivation
+# UID_FILTER_PROVISIONED - Bloom filter of provisioned UIDs (build: python3 -m libsdm.uid_filter build uids.txt uids.bloom)
+# UID_FILTER_REVOKED - text file with revoked UIDs (one hex UID per line)
+# both files are reloaded when replaced, checked every UID_FILTER_CHECK_INTERVAL seconds
+UID_FILTER_PROVISIONED = None
+UID_FILTER_REVOKED = None
+UID_FILTER_CHECK_INTERVAL = 5
+
+# ASGI mode (uvicorn asgi:application): the requests are accepted on the event loop,
+# the verification runs in a bounded "thread" or "process" pool of ASGI_WORKERS (None - CPU count)
+# with process pool, use SESSION_BACKEND = "sqlite" so all processes share /validate state
+ASGI_EXECUTOR = "thread"
+ASGI_WORKERS = None
+ASGI_MAX_IN_FLIGHT = 1024
+
+# limits of the batch verification endpoint (POST /api/tag/batch)
+BATCH_MAX_ITEMS = 1000
+BATCH_MAX_BODY_SIZE = 1024 * 1024
+
+# serve /api/tag, /api/tagtt and /api/tagpt by a minimal WSGI dispatcher in front of Flask,
+# the responses are the same, only serialized as compact JSON
+API_FAST_PATH = False
+
+# the same tap URL requested repeatedly (link previews, prefetch, refreshes) is verified only once,
+# the successful result is reused for RESULT_CACHE_TTL seconds (0 - only coalesce concurrent requests)
+RESULT_CACHE_TTL = 3
+RESULT_CACHE_MAX_ENTRIES = 10000
+
+# load shedding: requests which can't be completed within ADMISSION_DEADLINE seconds (estimated from
+# the requests in progress and the recent service time) are rejected with 503 and Retry-After
+# ADMISSION_CONCURRENCY - requests processed in parallel by one worker process (threads)
+# requests not matching ADMISSION_PRIORITY_PREFIXES (demo pages) only get ADMISSION_LOW_PRIORITY_SHARE of the deadline
+# set ADMISSION_DEADLINE = None to disable
+ADMISSION_DEADLINE = None
+ADMISSION_CONCURRENCY = 1
+ADMISSION_PRIORITY_PREFIXES = ["/api/", "/validate"]
+ADMISSION_LOW_PRIORITY_SHARE = 0.5
+ADMISSION_RETRY_AFTER = 1
+
+# verification daemon for internal services (python3 verify_daemon.py), listens on Unix domain socket path
+# or localhost "host:port", VERIFY_DAEMON_KEY_CACHE_SIZE derived tag keys are kept across the connections
+VERIFY_DAEMON_ADDRESS = "/tmp/sdm-verify.sock"
+VERIFY_DAEMON_KEY_CACHE_SIZE = 100000
+
+# compiled Jinja templates are cached on the disk and reused by the new workers (faster cold start),
+# JINJA_BYTECODE_CACHE_DIR = None uses the system temporary directory
+JINJA_BYTECODE_CACHE = True
+JINJA_BYTECODE_CACHE_DIR = None
+
+# metrics in Prometheus text format on /metrics (disabled by default, collecting them times the stages of every tap);
+# the scraper has to send "Authorization: Bearer <METRICS_TOKEN>" header, METRICS_TOKEN = None doesn't serve /metrics;
+# with multiple worker processes set METRICS_DIR to a directory shared by the workers, each of them writes its
+# snapshot there at most once per METRICS_FLUSH_INTERVAL seconds and /metrics reports the sum over all live workers
+METRICS_ENABLED = False
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 1
+METRICS_TOKEN = None
+
+# Server-Timing response header on the verification endpoints (/tag, /tagtt, /tagpt, /api/... and /validate),
+# shows the time spent in parse, derive, decrypt, mac, store and render stages in the browser's devtools
+SERVER_TIMING = False
+
+# append-only binary audit log of the verified taps (time, UID, counter, mode, outcome, latency), every worker
+# buffers up to AUDIT_LOG_BUFFER_SIZE records in memory and writes them out at least every AUDIT_LOG_FLUSH_INTERVAL
+# seconds from a background thread, the files are rotated after AUDIT_LOG_MAX_BYTES bytes or AUDIT_LOG_MAX_AGE seconds
+# summary: python3 -m sdmserver.audit_log <AUDIT_LOG_DIR>
+# set AUDIT_LOG_DIR = None to disable
+AUDIT_LOG_DIR = None
+AUDIT_LOG_BUFFER_SIZE = 65536
+AUDIT_LOG_FLUSH_INTERVAL = 1
+AUDIT_LOG_MAX_BYTES = 64 * 1024 * 1024
+AUDIT_LOG_MAX_AGE = 3600
+
+# admin endpoints (/admin/...) require "Authorization: Bearer <ADMIN_TOKEN>" header, None disables them
+# (on-demand request profiler, the endpoints act on the worker process which serves the admin request)
+ADMIN_TOKEN = None
+
+# memory budget of every worker process (RSS in bytes, checked after the responses at most once per MEMORY_CHECK_INTERVAL
+# seconds): above MEMORY_SOFT_LIMIT the in-process caches are shrunk (cached verification results, pages rendered on demand,
+# learned key versions, expired sessions), if the worker is still above MEMORY_RECYCLE_LIMIT it sends itself SIGTERM once
+# the response is sent, so it exits gracefully and the process manager (gunicorn) starts a new one before the OOM killer
+# steps in; don't set MEMORY_RECYCLE_LIMIT without such process manager, None disables the limit
+# the footprint (RSS, heap, sizes of the caches) and the allocation sites are reported on /admin/memory
+MEMORY_SOFT_LIMIT = None
+MEMORY_RECYCLE_LIMIT = None
+MEMORY_CHECK_INTERVAL = 5
+
+# record a sample (REQUEST_RECORD_SAMPLE_RATE, 0 - 1) of the requests of the verification endpoints into
+# REQUEST_RECORD_PATH as JSON lines (arrival time, path, parameters, status, latency), the file is shared by the workers;
+# with REQUEST_RECORD_REDACT the tag data are replaced by their length and a keyed digest, the replay then sends
+# simulated taps of the same shape: python3 -m sdmserver.recorder --wsgi app:app <REQUEST_RECORD_PATH> --speed 1
+# set REQUEST_RECORD_PATH = None to disable
+REQUEST_RECORD_PATH = None
+REQUEST_RECORD_SAMPLE_RATE = 1.0
+REQUEST_RECORD_REDACT = True
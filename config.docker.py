@@ -13,3 +13,77 @@ CTR_PARAM = os.environ.get("CTR_PARAM", "ctr")
 SDMMAC_PARAM = os.environ.get("SDMMAC_PARAM", "cmac")
 
 REQUIRE_LRP = os.environ.get("REQUIRE_LRP", "0") == "1"
+
+VALIDATE_ACCESS_WINDOW = int(os.environ.get("VALIDATE_ACCESS_WINDOW", "300"))
+
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "memory")
+SESSION_TTL = int(os.environ.get("SESSION_TTL", str(24 * 3600)))
+SESSION_MAX_ENTRIES = int(os.environ.get("SESSION_MAX_ENTRIES", "100000"))
+SESSION_SQLITE_PATH = os.environ.get("SESSION_SQLITE_PATH")
+
+ACCESS_TOKENS = os.environ.get("ACCESS_TOKENS", "1") == "1"
+ACCESS_TOKEN_COOKIE = os.environ.get("ACCESS_TOKEN_COOKIE", "sdm_access")
+ACCESS_TOKEN_SECRET = os.environ.get("ACCESS_TOKEN_SECRET")
+
+SHARD_NODES = [n for n in os.environ.get("SHARD_NODES", "").split(",") if n]
+SHARD_SELF = os.environ.get("SHARD_SELF")
+SHARD_SECRET = os.environ.get("SHARD_SECRET")
+
+# MASTER_KEYS="v2=<hex>:standard,v3=<hex>:legacy"
+MASTER_KEYS = {version: tuple(spec.split(":", 1))
+               for version, spec in (item.split("=", 1) for item in os.environ.get("MASTER_KEYS", "").split(",") if item)}
+KEY_VERSION_PARAM = os.environ.get("KEY_VERSION_PARAM", "kv")
+# KEY_VERSION_UID_PREFIXES="04AB=v2,04CD=v3"
+KEY_VERSION_UID_PREFIXES = dict(item.split("=", 1) for item in os.environ.get("KEY_VERSION_UID_PREFIXES", "").split(",") if item)
+KEY_TRIAL_LIMIT = int(os.environ.get("KEY_TRIAL_LIMIT", "4"))
+
+UID_FILTER_PROVISIONED = os.environ.get("UID_FILTER_PROVISIONED")
+UID_FILTER_REVOKED = os.environ.get("UID_FILTER_REVOKED")
+UID_FILTER_CHECK_INTERVAL = float(os.environ.get("UID_FILTER_CHECK_INTERVAL", "5"))
+
+ASGI_EXECUTOR = os.environ.get("ASGI_EXECUTOR", "thread")
+ASGI_WORKERS = int(os.environ["ASGI_WORKERS"]) if os.environ.get("ASGI_WORKERS") else None
+ASGI_MAX_IN_FLIGHT = int(os.environ.get("ASGI_MAX_IN_FLIGHT", "1024"))
+
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "1000"))
+BATCH_MAX_BODY_SIZE = int(os.environ.get("BATCH_MAX_BODY_SIZE", str(1024 * 1024)))
+
+API_FAST_PATH = os.environ.get("API_FAST_PATH", "0") == "1"
+
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", "3"))
+RESULT_CACHE_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "10000"))
+
+ADMISSION_DEADLINE = float(os.environ["ADMISSION_DEADLINE"]) if os.environ.get("ADMISSION_DEADLINE") else None
+ADMISSION_CONCURRENCY = int(os.environ.get("ADMISSION_CONCURRENCY", "1"))
+ADMISSION_PRIORITY_PREFIXES = os.environ.get("ADMISSION_PRIORITY_PREFIXES", "/api/,/validate").split(",")
+ADMISSION_LOW_PRIORITY_SHARE = float(os.environ.get("ADMISSION_LOW_PRIORITY_SHARE", "0.5"))
+ADMISSION_RETRY_AFTER = int(os.environ.get("ADMISSION_RETRY_AFTER", "1"))
+
+VERIFY_DAEMON_ADDRESS = os.environ.get("VERIFY_DAEMON_ADDRESS", "/tmp/sdm-verify.sock")
+VERIFY_DAEMON_KEY_CACHE_SIZE = int(os.environ.get("VERIFY_DAEMON_KEY_CACHE_SIZE", "100000"))
+
+JINJA_BYTECODE_CACHE = os.environ.get("JINJA_BYTECODE_CACHE", "1") == "1"
+JINJA_BYTECODE_CACHE_DIR = os.environ.get("JINJA_BYTECODE_CACHE_DIR")
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "0") == "1"
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "1"))
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+
+AUDIT_LOG_DIR = os.environ.get("AUDIT_LOG_DIR")
+AUDIT_LOG_BUFFER_SIZE = int(os.environ.get("AUDIT_LOG_BUFFER_SIZE", "65536"))
+AUDIT_LOG_FLUSH_INTERVAL = float(os.environ.get("AUDIT_LOG_FLUSH_INTERVAL", "1"))
+AUDIT_LOG_MAX_BYTES = int(os.environ.get("AUDIT_LOG_MAX_BYTES", str(64 * 1024 * 1024)))
+AUDIT_LOG_MAX_AGE = float(os.environ.get("AUDIT_LOG_MAX_AGE", "3600"))
+
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+MEMORY_SOFT_LIMIT = int(os.environ["MEMORY_SOFT_LIMIT"]) if os.environ.get("MEMORY_SOFT_LIMIT") else None
+MEMORY_RECYCLE_LIMIT = int(os.environ["MEMORY_RECYCLE_LIMIT"]) if os.environ.get("MEMORY_RECYCLE_LIMIT") else None
+MEMORY_CHECK_INTERVAL = float(os.environ.get("MEMORY_CHECK_INTERVAL", "5"))
+
+REQUEST_RECORD_PATH = os.environ.get("REQUEST_RECORD_PATH")
+REQUEST_RECORD_SAMPLE_RATE = float(os.environ.get("REQUEST_RECORD_SAMPLE_RATE", "1.0"))
+REQUEST_RECORD_REDACT = os.environ.get("REQUEST_RECORD_REDACT", "1") == "1"
@@ -14,3 +14,95 @@ ENC_PICC_DATA_PARAM = "picc_data"
 SDMMAC_PARAM = "cmac"
 UID_PARAM = "uid"
 
+
+# Time-limited access granted by the /validate endpoint
+VALIDATE_ACCESS_WINDOW = 300  # seconds
+
+# Storage of the first-access times for /validate ("memory" or "sqlite")
+SESSION_BACKEND = "memory"
+SESSION_TTL = 24 * 3600  # seconds
+SESSION_MAX_ENTRIES = 100000
+SESSION_SQLITE_PATH = None
+
+# Signed access tokens (cookies) for repeated visits of /validate
+ACCESS_TOKENS = True
+ACCESS_TOKEN_COOKIE = "sdm_access"
+ACCESS_TOKEN_SECRET = None  # hex; derived from MASTER_KEY if not set
+
+# UID-sharded routing, e.g. ["http://10.0.0.1:5000", "http://10.0.0.2:5000"] (disabled if empty)
+SHARD_NODES = []
+SHARD_SELF = None
+SHARD_SECRET = None  # hex; derived from MASTER_KEY if not set
+
+# Additional master key versions (key rotation, multiple tenants): {"v2": ("<hex master key>", "standard")}
+MASTER_KEYS = {}
+KEY_VERSION_PARAM = "kv"
+KEY_VERSION_UID_PREFIXES = {}  # {"04AB": "v2"}
+KEY_TRIAL_LIMIT = 4
+
+# UID admission before key derivation (None - disabled)
+UID_FILTER_PROVISIONED = None  # Bloom filter built with: python3 -m libsdm.uid_filter build
+UID_FILTER_REVOKED = None  # text file, one hex UID per line
+UID_FILTER_CHECK_INTERVAL = 5  # seconds
+
+# ASGI mode (asgi.py): "thread" or "process" pool for the verification, pool size (None - CPU count)
+ASGI_EXECUTOR = "thread"
+ASGI_WORKERS = None
+ASGI_MAX_IN_FLIGHT = 1024
+
+# Limits of POST /api/tag/batch
+BATCH_MAX_ITEMS = 1000
+BATCH_MAX_BODY_SIZE = 1024 * 1024  # bytes
+
+# Serve /api/tag, /api/tagtt and /api/tagpt by a minimal WSGI dispatcher in front of Flask (compact JSON)
+API_FAST_PATH = False
+
+# Identical verifications are computed once and the successful result is reused for RESULT_CACHE_TTL seconds
+RESULT_CACHE_TTL = 3
+RESULT_CACHE_MAX_ENTRIES = 10000
+
+# Reject requests which can't be completed within ADMISSION_DEADLINE seconds with 503 (None - disabled)
+ADMISSION_DEADLINE = None
+ADMISSION_CONCURRENCY = 1
+ADMISSION_PRIORITY_PREFIXES = ["/api/", "/validate"]
+ADMISSION_LOW_PRIORITY_SHARE = 0.5
+ADMISSION_RETRY_AFTER = 1
+
+# Verification daemon for internal services (python3 verify_daemon.py), Unix socket path or host:port
+VERIFY_DAEMON_ADDRESS = "/tmp/sdm-verify.sock"
+VERIFY_DAEMON_KEY_CACHE_SIZE = 100000
+
+# Cache compiled Jinja templates on the disk (None - system temporary directory)
+JINJA_BYTECODE_CACHE = True
+JINJA_BYTECODE_CACHE_DIR = None
+
+# Prometheus metrics on /metrics, METRICS_DIR shared by the worker processes (None - only the serving process)
+METRICS_ENABLED = True
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 1
+# Token of the /metrics endpoint, sent as "Authorization: Bearer <token>" (None - not served)
+METRICS_TOKEN = None
+
+# Report the time spent in the processing stages in Server-Timing response header
+SERVER_TIMING = False
+
+# Binary audit log of the verified taps written in the background (None - disabled), see sdmserver/audit_log.py
+AUDIT_LOG_DIR = None
+AUDIT_LOG_BUFFER_SIZE = 65536
+AUDIT_LOG_FLUSH_INTERVAL = 1
+AUDIT_LOG_MAX_BYTES = 64 * 1024 * 1024
+AUDIT_LOG_MAX_AGE = 3600
+
+# Token of the admin endpoints (/admin/...), sent as "Authorization: Bearer <token>" (None - disabled)
+ADMIN_TOKEN = None
+
+# Memory budget of a worker process in bytes of RSS (None - disabled): above MEMORY_SOFT_LIMIT the in-process caches
+# are shrunk, above MEMORY_RECYCLE_LIMIT the worker exits gracefully after the response (restarted by gunicorn)
+MEMORY_SOFT_LIMIT = None
+MEMORY_RECYCLE_LIMIT = None
+MEMORY_CHECK_INTERVAL = 5
+
+# Sampled recording of the requests as JSON lines for replays, see sdmserver/recorder.py (None - disabled)
+REQUEST_RECORD_PATH = None
+REQUEST_RECORD_SAMPLE_RATE = 1.0
+REQUEST_RECORD_REDACT = True
@@ -5,6 +5,8 @@ import hmac
 from Crypto.Cipher import AES
 from Crypto.Hash import CMAC
 
+from libsdm import hooks
+
 # NOTE:
 # Key diversification methods were modified as of 2023-01-24
 # If you rely on the previous diversification methods,
@@ -25,9 +27,10 @@ def derive_tag_key(master_key: bytes, uid: bytes, key_no: int):
     if master_key == (b"\x00" * 16):
         return b"\x00" * 16
 
-    cmac_code = CMAC.new(hmac_sha256(master_key, DIV_CONST2 + bytes([key_no])), ciphermod=AES)
-    cmac_code.update(b"\x01" + hmac_sha256(hmac_sha256(master_key, DIV_CONST3, no_trunc=True), uid))
-    return cmac_code.digest()
+    with hooks.span(hooks.STAGE_DERIVE, len(uid)):
+        cmac_code = CMAC.new(hmac_sha256(master_key, DIV_CONST2 + bytes([key_no])), ciphermod=AES)
+        cmac_code.update(b"\x01" + hmac_sha256(hmac_sha256(master_key, DIV_CONST3, no_trunc=True), uid))
+        return cmac_code.digest()
 
 
 # derive a key which is not UID-diversified
@@ -38,4 +41,5 @@ def derive_undiversified_key(master_key: bytes, key_no: int):
     if master_key == (b"\x00" * 16):
         return b"\x00" * 16
 
-    return hmac_sha256(master_key, DIV_CONST1)
+    with hooks.span(hooks.STAGE_DERIVE):
+        return hmac_sha256(master_key, DIV_CONST1)
@@ -0,0 +1,406 @@
+# pylint: disable=line-too-long, invalid-name
+
+"""
+Differential equivalence harness of the optimised cryptography against the frozen reference (libsdm.reference).
+
+Every case is generated from its own seed: random keys (sometimes all zeros, which take the shortcut of the key
+derivation), UIDs, counters (including the ones which overflow), payload lengths around the block boundaries,
+AES and LRP modes, SEPARATED and BULK parameter modes and SDMMAC parameter names. Each operation is run by both
+implementations and the results (or the exception types) must be identical. The published vectors of AN12196
+and AN12304 are checked as fixed cases against both implementations.
+
+A reported mismatch is reproducible from its seed:
+    python3 -m libsdm.differential --cases 1000000 --workers 8
+    python3 -m libsdm.differential --case-seed 4294967301
+"""
+
+import argparse
+import binascii
+import json
+import random
+import sys
+from multiprocessing import Pool
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from libsdm import derive, legacy_derive, reference
+from libsdm.lrp import LRP
+from libsdm.sdm import EncMode, ParamMode, calculate_sdmmac, decrypt_file_data, decrypt_picc_data
+
+SDMMAC_PARAMS = ["cmac", "", "mac", "CMAC"]
+
+
+def reference_implementation() -> SimpleNamespace:
+    return SimpleNamespace(
+        LRP=reference.LRP,
+        calculate_sdmmac=reference.calculate_sdmmac,
+        decrypt_file_data=reference.decrypt_file_data,
+        decrypt_picc_data=reference.decrypt_picc_data,
+        derive_tag_key=reference.derive_tag_key,
+        derive_undiversified_key=reference.derive_undiversified_key,
+        legacy_derive_tag_key=reference.legacy_derive_tag_key,
+        legacy_derive_undiversified_key=reference.legacy_derive_undiversified_key,
+    )
+
+
+def current_implementation(**overrides: Any) -> SimpleNamespace:
+    """
+    The live implementation under test
+    :param overrides: replace some of the functions (e.g. a candidate fast path before it's wired in)
+    """
+    impl = SimpleNamespace(
+        LRP=LRP,
+        calculate_sdmmac=calculate_sdmmac,
+        decrypt_file_data=decrypt_file_data,
+        decrypt_picc_data=decrypt_picc_data,
+        derive_tag_key=derive.derive_tag_key,
+        derive_undiversified_key=derive.derive_undiversified_key,
+        legacy_derive_tag_key=legacy_derive.derive_tag_key,
+        legacy_derive_undiversified_key=legacy_derive.derive_undiversified_key,
+    )
+
+    for name, func in overrides.items():
+        if not hasattr(impl, name):
+            raise ValueError(f"Unknown function: {name}")
+
+        setattr(impl, name, func)
+
+    return impl
+
+
+def _eval_lrp(impl, key, u, x, final):
+    return impl.LRP.eval_lrp(impl.LRP.generate_plaintexts(key), impl.LRP.generate_updated_keys(key)[u], x, final)
+
+
+def _lrp_cmac(impl, key, u, data):
+    return impl.LRP(key, u).cmac(data)
+
+
+def _lrp_encrypt(impl, key, u, r, pad, data):
+    lrp = impl.LRP(key, u, r, pad=pad)
+    # the counter carries over to the next message
+    return lrp.encrypt(data), lrp.r
+
+
+def _lrp_decrypt(impl, key, u, r, pad, data):
+    lrp = impl.LRP(key, u, r, pad=pad)
+    return lrp.decrypt(data), lrp.r
+
+
+def _calculate_sdmmac(impl, param_mode, key, picc_data, enc_file_data, mode, sdmmac_param):
+    return impl.calculate_sdmmac(param_mode, key, picc_data, enc_file_data, mode=mode, sdmmac_param=sdmmac_param)
+
+
+def _decrypt_file_data(impl, key, picc_data, read_ctr, enc_file_data, mode):
+    return impl.decrypt_file_data(key, picc_data, read_ctr, enc_file_data, mode=mode)
+
+
+def _decrypt_picc_data(impl, key, picc_enc_data):
+    return impl.decrypt_picc_data(key, picc_enc_data)
+
+
+def _derive_tag_key(impl, master_key, uid, key_no, legacy=False):
+    func = impl.legacy_derive_tag_key if legacy else impl.derive_tag_key
+    return func(master_key, uid, key_no)
+
+
+def _derive_undiversified_key(impl, master_key, key_no, legacy=False):
+    func = impl.legacy_derive_undiversified_key if legacy else impl.derive_undiversified_key
+    return func(master_key, key_no)
+
+
+OPERATIONS: Dict[str, Callable[..., Any]] = {
+    "eval_lrp": _eval_lrp,
+    "lrp_cmac": _lrp_cmac,
+    "lrp_encrypt": _lrp_encrypt,
+    "lrp_decrypt": _lrp_decrypt,
+    "calculate_sdmmac": _calculate_sdmmac,
+    "decrypt_file_data": _decrypt_file_data,
+    "decrypt_picc_data": _decrypt_picc_data,
+    "derive_tag_key": _derive_tag_key,
+    "derive_undiversified_key": _derive_undiversified_key,
+}
+
+_h = binascii.unhexlify
+_ZERO_KEY = b"\x00" * 16
+
+# (name, operation, arguments, expected result)
+VECTORS: List[Tuple[str, str, Dict[str, Any], Any]] = [
+    # AN12304
+    ("an12304_eval_lrp_1", "eval_lrp", {"key": _h("567826B8DA8E768432A9548DBE4AA3A0"), "u": 2, "x": _h("1359"), "final": True},
+     _h("1BA2C0C578996BC497DD181C6885A9DD")),
+    ("an12304_eval_lrp_2", "eval_lrp", {"key": _h("B65557CE0E9B4C5886F232200113562B"), "u": 1, "x": _h("BB4FCF27C94076F756AB030D"), "final": False},
+     _h("6FDFA8D2A6AA8476BF94E71F25637F96")),
+    ("an12304_eval_lrp_odd_nibbles", "eval_lrp", {"key": _h("C48A8E8B16571645A1557825AA66AC91"), "u": 3, "x": "1F0B7C0DB12889CA436CABB78BE42F9", "final": True},
+     _h("51296B5E6D3B8DB8A1A7399760A19189")),
+    ("an12304_eval_lrp_3", "eval_lrp", {"key": _h("9AFF3EF56FFEC3153B1CADB48B445409"), "u": 3, "x": _h("4B073B247CD48F7E0A"), "final": False},
+     _h("909415E5C8BE77563050F2227E17C0E4")),
+    ("an12304_cmac_empty", "lrp_cmac", {"key": _h("63A0169B4D9FE42C72B2784C806EAC21"), "u": 0, "data": b""},
+     _h("0E07C601970814A4176FDA633C6FC3DE")),
+    ("an12304_cmac_short", "lrp_cmac", {"key": _h("8195088CE6C393708EBBE6C7914ECB0B"), "u": 0, "data": _h("BBD5B85772C7")},
+     _h("AD8595E0B49C5C0DB18E77355F5AAFF6")),
+    ("an12304_lricb_enc", "lrp_encrypt", {"key": _h("E0C4935FF0C254CD2CEF8FDDC32460CF"), "u": 0, "r": _h("C3315DBF"), "pad": True, "data": _h("012D7F1653CAF6503C6AB0C1010E8CB0")},
+     (_h("FCBBACAA4F29182464F99DE41085266F480E863E487BAAF687B43ED1ECE0D623"), _h("C3315DC1"))),
+    ("an12304_lricb_dec", "lrp_decrypt", {"key": _h("E0C4935FF0C254CD2CEF8FDDC32460CF"), "u": 0, "r": _h("C3315DBF"), "pad": True, "data": _h("FCBBACAA4F29182464F99DE41085266F480E863E487BAAF687B43ED1ECE0D623")},
+     (_h("012D7F1653CAF6503C6AB0C1010E8CB0"), _h("C3315DC1"))),
+    ("an12304_sdm_file_data", "decrypt_file_data", {"key": _ZERO_KEY, "picc_data": _h("042E1D222A63807B0000"), "read_ctr": _h("7B0000"), "enc_file_data": _h("4ADE304B5AB9474CB40AFFCAB0607A85"), "mode": EncMode.LRP},
+     b"0102030400000000"),
+    ("lrp_sdmmac", "calculate_sdmmac", {"param_mode": ParamMode.SEPARATED, "key": _ZERO_KEY, "picc_data": _h("049B112A2F7080040000"), "enc_file_data": _h("D6E921C47DB4C17C56F979F81559BB83"), "mode": EncMode.LRP, "sdmmac_param": "cmac"},
+     _h("F9481AC7D855BDB6")),
+    ("lrp_sdmmac_no_file", "calculate_sdmmac", {"param_mode": ParamMode.SEPARATED, "key": _ZERO_KEY, "picc_data": _h("04940E2A2F7080030000"), "enc_file_data": None, "mode": EncMode.LRP, "sdmmac_param": "cmac"},
+     _h("4231608BA7B02BA9")),
+    ("lrp_file_data", "decrypt_file_data", {"key": _ZERO_KEY, "picc_data": _h("049B112A2F7080040000"), "read_ctr": _h("040000"), "enc_file_data": _h("D6E921C47DB4C17C56F979F81559BB83"), "mode": EncMode.LRP},
+     b"NTXXb7dz3PsYYBlU"),
+    # AN12196
+    ("an12196_picc_data", "decrypt_picc_data", {"key": _ZERO_KEY, "picc_enc_data": _h("FD91EC264309878BE6345CBE53BADF40")},
+     {"picc_data_tag": b"\xc7", "uid_length": 7, "uid": _h("04958CAA5C5E80"), "read_ctr": _h("080000"), "read_ctr_num": 8, "encryption_mode": EncMode.AES}),
+    ("an12196_sdmmac", "calculate_sdmmac", {"param_mode": ParamMode.SEPARATED, "key": _ZERO_KEY, "picc_data": _h("04958CAA5C5E80080000"), "enc_file_data": _h("CEE9A53E3E463EF1F459635736738962"), "mode": EncMode.AES, "sdmmac_param": "cmac"},
+     _h("ECC1E7F6C6C73BF6")),
+    ("an12196_sdmmac_no_file", "calculate_sdmmac", {"param_mode": ParamMode.SEPARATED, "key": _ZERO_KEY, "picc_data": _h("04DE5F1EACC0403D0000"), "enc_file_data": None, "mode": EncMode.AES, "sdmmac_param": "cmac"},
+     _h("94EED9EE65337086")),
+    ("an12196_file_data", "decrypt_file_data", {"key": _ZERO_KEY, "picc_data": _h("04958CAA5C5E80080000"), "read_ctr": _h("080000"), "enc_file_data": _h("CEE9A53E3E463EF1F459635736738962"), "mode": EncMode.AES},
+     b"x" * 16),
+    ("lrp_picc_data", "decrypt_picc_data", {"key": _ZERO_KEY, "picc_enc_data": _h("07D9CA2545881D4BFDD920BE1603268C0714420DD893A497")},
+     {"picc_data_tag": b"\xc7", "uid_length": 7, "uid": _h("049B112A2F7080"), "read_ctr": _h("040000"), "read_ctr_num": 4, "encryption_mode": EncMode.LRP}),
+    # key diversification (tests/test_kdf.py)
+    ("kdf_factory_key", "derive_tag_key", {"master_key": _ZERO_KEY, "uid": _h("010203040506AB"), "key_no": 1},
+     _ZERO_KEY),
+    ("kdf_tag_key", "derive_tag_key", {"master_key": _h("C9EB67DF090AFF47C3B19A2516680B9D"), "uid": _h("03030303030303"), "key_no": 2},
+     _h("85f7cc459a5b4b2f5d1a5019ded61c88")),
+    ("kdf_undiversified_key", "derive_undiversified_key", {"master_key": _h("B95F4C27E3D0BC333792EA968545217F"), "key_no": 1},
+     _h("3a553c40846fda656faa0fce4f45fdbd")),
+]
+
+
+def _outcome(impl, op: str, args: Dict[str, Any]) -> Tuple[str, Any]:
+    try:
+        return "ok", OPERATIONS[op](impl, **args)
+    except Exception as exc:  # pylint: disable=broad-except
+        # both implementations must fail the same way, the message may differ
+        return "raise", type(exc).__name__
+
+
+def _key(rng: random.Random, size: int = 16) -> bytes:
+    choice = rng.random()
+
+    if choice < 0.05:
+        return b"\x00" * size
+
+    if choice < 0.08:
+        return b"\xff" * size
+
+    return rng.randbytes(size)
+
+
+def _length(rng: random.Random, limit: int = 64) -> int:
+    # block boundaries are where the padding and subkey selection go wrong
+    if rng.random() < 0.5:
+        return min(limit, rng.choice([0, 1, 15, 16, 17, 31, 32, 33, 48]))
+
+    return rng.randint(0, limit)
+
+
+def _counter(rng: random.Random, size: int) -> bytes:
+    choice = rng.random()
+
+    if choice < 0.1:
+        # overflows during the message
+        return b"\xff" * (size - 1) + bytes([rng.randint(0xfc, 0xff)])
+
+    if choice < 0.2:
+        return b"\x00" * size
+
+    return rng.randbytes(size)
+
+
+def generate_case(seed: int) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Random arguments of every operation, reproducible from the seed
+    :param seed: seed of the case
+    :return: list of (operation, arguments)
+    """
+    rng = random.Random(seed)
+    mode = rng.choice([EncMode.AES, EncMode.LRP])
+    param_mode = rng.choice([ParamMode.SEPARATED, ParamMode.BULK])
+    uid = rng.randbytes(7)
+    read_ctr = _counter(rng, 3)
+    picc_data = rng.choice([uid + read_ctr, uid + read_ctr, uid, read_ctr, b""])
+    x = rng.randbytes(_length(rng, 32))
+    pad = rng.random() < 0.5
+    plaintext = rng.randbytes(_length(rng) if pad else 16 * rng.randint(0, 4))
+
+    case = [
+        ("eval_lrp", {"key": _key(rng), "u": rng.randint(0, 3), "x": x.hex().upper() if rng.random() < 0.1 else x, "final": rng.random() < 0.5}),
+        ("lrp_cmac", {"key": _key(rng), "u": rng.randint(0, 3), "data": rng.randbytes(_length(rng))}),
+        ("lrp_encrypt", {"key": _key(rng), "u": rng.randint(0, 3), "r": _counter(rng, rng.choice([4, 6, 8, 16])), "pad": pad, "data": plaintext}),
+        ("lrp_decrypt", {"key": _key(rng), "u": rng.randint(0, 3), "r": _counter(rng, rng.choice([4, 6, 8, 16])), "pad": rng.random() < 0.5,
+                         "data": rng.randbytes(16 * rng.randint(0, 4))}),
+        ("calculate_sdmmac", {"param_mode": param_mode, "key": _key(rng), "picc_data": picc_data,
+                              "enc_file_data": rng.choice([None, b"", rng.randbytes(16 * rng.randint(1, 4))]),
+                              "mode": mode, "sdmmac_param": rng.choice(SDMMAC_PARAMS)}),
+        ("decrypt_file_data", {"key": _key(rng), "picc_data": uid + read_ctr, "read_ctr": read_ctr,
+                               "enc_file_data": rng.randbytes(16 * rng.randint(0, 4)), "mode": mode}),
+        ("decrypt_picc_data", {"key": _key(rng), "picc_enc_data": rng.randbytes(rng.choice([16, 16, 24, 24, 8, 32]))}),
+        ("derive_tag_key", {"master_key": _key(rng, rng.choice([16, 16, 32])), "uid": rng.choice([uid, uid, rng.randbytes(4), b""]),
+                            "key_no": rng.randint(0, 4)}),
+        ("derive_undiversified_key", {"master_key": _key(rng, rng.choice([16, 16, 32])), "key_no": rng.choice([1, 1, 1, 2])}),
+    ]
+
+    if rng.random() < 0.1:
+        # PBKDF2 with 5000 iterations dominates the run time, check only a sample
+        case.append(("derive_tag_key", {"master_key": _key(rng), "uid": uid, "key_no": rng.randint(0, 4), "legacy": True}))
+        case.append(("derive_undiversified_key", {"master_key": _key(rng), "key_no": rng.randint(0, 4), "legacy": True}))
+
+    return case
+
+
+def _printable(value: Any) -> Any:
+    if isinstance(value, bytes):
+        return value.hex().upper()
+
+    if isinstance(value, (EncMode, ParamMode)):
+        return value.name
+
+    if isinstance(value, (tuple, list)):
+        return [_printable(item) for item in value]
+
+    if isinstance(value, dict):
+        return {key: _printable(item) for key, item in value.items()}
+
+    return value
+
+
+def _mismatch(seed: Any, op: str, args: Dict[str, Any], expected: Tuple[str, Any], actual: Tuple[str, Any], name: str) -> Dict[str, Any]:
+    return {
+        "seed": seed,
+        "operation": op,
+        "arguments": _printable(args),
+        name: _printable(expected),
+        "candidate": _printable(actual),
+    }
+
+
+def check_case(seed: int, candidate: Optional[SimpleNamespace] = None, ref: Optional[SimpleNamespace] = None) -> List[Dict[str, Any]]:
+    """
+    Compare the candidate with the reference on one random case
+    :param seed: seed of the case
+    :param candidate: implementation under test (default: current_implementation())
+    :param ref: reference implementation (default: reference_implementation())
+    :return: list of mismatches (empty if equivalent)
+    """
+    candidate = candidate or current_implementation()
+    ref = ref or reference_implementation()
+    mismatches = []
+
+    for op, args in generate_case(seed):
+        expected = _outcome(ref, op, args)
+        actual = _outcome(candidate, op, args)
+
+        if expected != actual:
+            mismatches.append(_mismatch(seed, op, args, expected, actual, "reference"))
+
+    return mismatches
+
+
+def check_vectors(candidate: Optional[SimpleNamespace] = None) -> List[Dict[str, Any]]:
+    """
+    Check the published vectors against both the candidate and the reference
+    :param candidate: implementation under test (default: current_implementation())
+    :return: list of mismatches (empty if both reproduce every vector)
+    """
+    implementations = [("candidate", candidate or current_implementation()), ("reference", reference_implementation())]
+    mismatches = []
+
+    for name, op, args, expected in VECTORS:
+        for impl_name, impl in implementations:
+            actual = _outcome(impl, op, args)
+
+            if actual != ("ok", expected):
+                mismatch = _mismatch(name, op, args, ("ok", expected), actual, "expected")
+                mismatch["implementation"] = impl_name
+                mismatches.append(mismatch)
+
+    return mismatches
+
+
+def _check_range(job: Tuple[int, int]) -> Tuple[int, List[Dict[str, Any]]]:
+    start, count = job
+    candidate = current_implementation()
+    ref = reference_implementation()
+    mismatches = []
+
+    for seed in range(start, start + count):
+        mismatches.extend(check_case(seed, candidate, ref))
+
+    return count, mismatches
+
+
+def case_seeds(seed: int, cases: int, batch: int) -> Iterable[Tuple[int, int]]:
+    """
+    Split the cases into (first case seed, count) jobs, distinct runs seeds don't overlap
+    """
+    base = seed << 32
+
+    for start in range(0, cases, batch):
+        yield base + start, min(batch, cases - start)
+
+
+def run(cases: int, seed: int = 0, workers: int = 1, batch: int = 1000, max_mismatches: int = 100) -> Dict[str, Any]:
+    """
+    Check the fixed vectors and random cases of the live implementation
+    :param cases: number of random cases
+    :param seed: seed of the run
+    :param workers: number of processes
+    :param batch: cases per job
+    :param max_mismatches: stop collecting the mismatches after this many
+    :return: report dict
+    """
+    mismatches = check_vectors()
+    checked = 0
+    jobs = case_seeds(seed, cases, batch)
+
+    if workers > 1:
+        with Pool(workers) as pool:
+            results = list(pool.imap_unordered(_check_range, jobs))
+    else:
+        results = [_check_range(job) for job in jobs]
+
+    for count, found in results:
+        checked += count
+        mismatches.extend(found)
+
+    return {
+        "vectors": len(VECTORS),
+        "cases": checked,
+        "mismatch_count": len(mismatches),
+        "mismatches": mismatches[:max_mismatches],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the optimised SUN cryptography with the frozen reference implementation')
+    parser.add_argument('--cases', type=int, default=100000, help='number of random cases')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the run')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes')
+    parser.add_argument('--batch', type=int, default=1000, help='cases per job')
+    parser.add_argument('--case-seed', type=int, default=None, help='re-run a single case (seed from a mismatch report)')
+
+    args = parser.parse_args()
+
+    if args.case_seed is not None:
+        report = {"cases": 1, "mismatches": check_case(args.case_seed)}
+        report["mismatch_count"] = len(report["mismatches"])
+    else:
+        report = run(args.cases, args.seed, args.workers, args.batch)
+
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+    sys.exit(1 if report["mismatch_count"] else 0)
+
+
+if __name__ == "__main__":
+    main()
+
+
+__all__ = ['OPERATIONS', 'VECTORS', 'reference_implementation', 'current_implementation', 'generate_case',
+           'check_case', 'check_vectors', 'case_seeds', 'run']
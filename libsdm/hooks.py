@@ -0,0 +1,99 @@
+# pylint: disable=line-too-long
+
+"""
+Instrumentation hooks of the SUN processing stages.
+
+The library emits a start and a stop event around each stage (key derivation, PICCData decryption,
+SDMMAC calculation, SDMEncFileData decryption, LRP batch of blocks), so a metrics or tracing backend can be
+plugged in without patching the library:
+
+    def handler(event, stage, size):
+        ...
+
+    hooks.register(handler)
+
+The events of a single thread are properly nested, each stop event closes the most recent open stage.
+While no handler is registered, an instrumented stage only costs a call which checks the handler tuple
+and returns a shared no-op context manager.
+"""
+
+import threading
+from contextlib import nullcontext
+from typing import Callable, Tuple
+
+START = "start"
+STOP = "stop"
+
+STAGE_SUN = "sun"
+STAGE_DERIVE = "derive"
+STAGE_PICC = "picc"
+STAGE_SDMMAC = "sdmmac"
+STAGE_FILE = "file"
+STAGE_LRP = "lrp"
+
+# handler(event, stage, size), size is the number of bytes processed by the stage
+Handler = Callable[[str, str, int], None]
+
+# replaced as a whole (never mutated), so the instrumented code reads it without locking
+_handlers: Tuple[Handler, ...] = ()
+_lock = threading.Lock()
+_NOOP = nullcontext()
+
+
+class _Span:
+    __slots__ = ("handlers", "stage", "size")
+
+    def __init__(self, handlers: Tuple[Handler, ...], stage: str, size: int):
+        self.handlers = handlers
+        self.stage = stage
+        self.size = size
+
+    def __enter__(self):
+        for handler in self.handlers:
+            handler(START, self.stage, self.size)
+
+    def __exit__(self, exc_type, exc, tb):
+        for handler in self.handlers:
+            handler(STOP, self.stage, self.size)
+
+        return False
+
+
+def span(stage: str, size: int = 0):
+    """
+    Context manager emitting the start and stop events of a stage to the registered handlers
+    :param stage: name of the stage (one of STAGE_*)
+    :param size: number of bytes processed by the stage
+    """
+    handlers = _handlers
+
+    if not handlers:
+        return _NOOP
+
+    return _Span(handlers, stage, size)
+
+
+def register(handler: Handler):
+    """
+    Register an event handler (the handlers are called synchronously and shouldn't raise)
+    """
+    global _handlers  # pylint: disable=global-statement
+
+    with _lock:
+        if handler not in _handlers:
+            _handlers = _handlers + (handler,)
+
+
+def unregister(handler: Handler):
+    global _handlers  # pylint: disable=global-statement
+
+    with _lock:
+        _handlers = tuple(h for h in _handlers if h != handler)
+
+
+def enabled() -> bool:
+    return bool(_handlers)
+
+
+__all__ = ['START', 'STOP', 'STAGE_SUN', 'STAGE_DERIVE', 'STAGE_PICC', 'STAGE_SDMMAC', 'STAGE_FILE', 'STAGE_LRP',
+           'Handler', 'span', 'register', 'unregister', 'enabled']
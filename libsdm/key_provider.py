@@ -0,0 +1,195 @@
+# pylint: disable=line-too-long
+
+"""
+Asynchronous providers of the tag keys (K_SDMFileReadKey), e.g. external KMS or HSM.
+
+A key provider answers a batch of UIDs in a single call. BatchingKeyClient collects the lookups made
+by concurrent coroutines within a short window into one provider call and caches the returned keys
+for a limited time, so a remote key service costs at most one round trip per batch instead of one per tap.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Protocol, Set, Tuple
+
+from libsdm import derive, legacy_derive
+from libsdm.sdm import ParamMode, decrypt_picc_data, decrypt_sun_message
+
+
+class KeyProviderError(RuntimeError):
+    pass
+
+
+class KeyProvider(Protocol):
+    async def get_keys(self, uids: List[bytes]) -> Dict[bytes, bytes]:
+        """
+        Fetch K_SDMFileReadKey for each of the UIDs
+        :param uids: list of distinct UIDs
+        :return: dict mapping UIDs to keys, unknown UIDs are omitted
+        """
+
+
+class DerivedKeyProvider:
+    def __init__(self, master_key: bytes, derive_mode: str = "standard"):
+        """
+        Key provider deriving the keys locally from the master key
+        """
+        self._derive = {"standard": derive, "legacy": legacy_derive}[derive_mode]
+        self.master_key = master_key
+
+    async def get_keys(self, uids: List[bytes]) -> Dict[bytes, bytes]:
+        return {uid: self._derive.derive_tag_key(self.master_key, uid, 2) for uid in uids}
+
+
+class BatchingKeyClient:
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self,
+                 provider: KeyProvider,
+                 max_batch: int = 64,
+                 max_delay: float = 0.002,
+                 ttl: float = 300.0,
+                 max_entries: int = 100000):
+        """
+        Coalescing and caching front of a key provider (bound to a single event loop)
+        :param provider: key provider
+        :param max_batch: maximum number of UIDs in a single provider call
+        :param max_delay: how long (in seconds) the first lookup waits for the others to join the batch
+        :param ttl: how long (in seconds) the fetched keys are cached
+        :param max_entries: maximum number of cached keys, the least recently used are evicted
+        """
+        self.provider = provider
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.provider_calls = 0
+
+        self._cache: Dict[bytes, Tuple[float, bytes]] = OrderedDict()
+        # lookups waiting for the next batch and lookups of the batches being fetched
+        self._pending: Dict[bytes, asyncio.Future] = {}
+        self._in_flight: Dict[bytes, asyncio.Future] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _cached(self, uid: bytes) -> Optional[bytes]:
+        entry = self._cache.get(uid)
+
+        if entry is None:
+            return None
+
+        if entry[0] <= time.monotonic():
+            del self._cache[uid]
+            return None
+
+        self._cache.move_to_end(uid)
+        return entry[1]
+
+    def _store(self, uid: bytes, key: bytes):
+        self._cache[uid] = (time.monotonic() + self.ttl, key)
+        self._cache.move_to_end(uid)
+
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, {}
+        self._in_flight.update(batch)
+
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._fetch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _fetch(self, batch: Dict[bytes, asyncio.Future]):
+        self.provider_calls += 1
+
+        try:
+            keys = await self.provider.get_keys(list(batch))
+        except Exception as exc:  # pylint: disable=broad-except
+            for uid, future in batch.items():
+                self._in_flight.pop(uid, None)
+
+                if not future.done():
+                    future.set_exception(KeyProviderError(f"Key provider failed: {exc}"))
+            return
+
+        for uid, future in batch.items():
+            self._in_flight.pop(uid, None)
+            key = keys.get(uid)
+
+            if key is not None:
+                self._store(uid, key)
+
+            if future.done():
+                continue
+
+            if key is None:
+                future.set_exception(KeyProviderError("Key is not available for the UID."))
+            else:
+                future.set_result(key)
+
+    async def get_key(self, uid: bytes) -> bytes:
+        """
+        Get K_SDMFileReadKey for the UID
+        :raises:
+            KeyProviderError: if the key is unknown or the provider failed
+        """
+        key = self._cached(uid)
+
+        if key is not None:
+            return key
+
+        future = self._pending.get(uid) or self._in_flight.get(uid)
+
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = self._pending[uid] = loop.create_future()
+
+            if len(self._pending) >= self.max_batch:
+                self._flush()
+            elif self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.max_delay, self._flush)
+
+        # the future is shared by all the lookups of the UID, cancelling one of them must not affect the others
+        return await asyncio.shield(future)
+
+
+# pylint: disable=too-many-arguments
+async def async_decrypt_sun_message(param_mode: ParamMode,
+                                    sdm_meta_read_key: bytes,
+                                    key_client: BatchingKeyClient,
+                                    picc_enc_data: bytes,
+                                    sdmmac: bytes,
+                                    enc_file_data: Optional[bytes] = None,
+                                    uid_filter: Optional[Callable[[bytes], bool]] = None,
+                                    sdmmac_param: Optional[str] = None) -> dict:
+    """
+    Decrypt SUN message, the tag key is fetched from the key client (see libsdm.sdm.decrypt_sun_message)
+    :raises:
+        InvalidMessage: if SUN message is invalid
+        KeyProviderError: if the tag key is not available
+    """
+    picc_data = decrypt_picc_data(sdm_meta_read_key, picc_enc_data)
+    uid = picc_data['uid']
+    file_key = b"\x00" * 16
+
+    # the key is only fetched for the messages which would reach SDMMAC check with the real key
+    if uid is not None and picc_data['uid_length'] == 0x07 and (uid_filter is None or uid_filter(uid)):
+        file_key = await key_client.get_key(uid)
+
+    return decrypt_sun_message(param_mode=param_mode,
+                               sdm_meta_read_key=sdm_meta_read_key,
+                               sdm_file_read_key=lambda _: file_key,
+                               picc_enc_data=picc_enc_data,
+                               sdmmac=sdmmac,
+                               enc_file_data=enc_file_data,
+                               uid_filter=uid_filter,
+                               sdmmac_param=sdmmac_param)
+
+
+__all__ = ['KeyProvider', 'KeyProviderError', 'DerivedKeyProvider', 'BatchingKeyClient', 'async_decrypt_sun_message']
@@ -0,0 +1,330 @@
+# pylint: disable=line-too-long
+
+"""
+Registry of versioned master keys, used for key rotations or for hosting multiple tenants.
+
+The key version for a message is chosen by an index instead of trying every key:
+1. explicit version passed by the caller (e.g. URL path or parameter),
+2. UID-to-version map learned from the previously verified messages,
+3. static UID prefix map.
+Trial verification is only used as a fallback and it's bounded by `max_trials`. The PICCData of all candidate
+meta keys is decrypted first (cheap) and only the plausible candidates are subjected to the SDMMAC check.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from libsdm import derive, legacy_derive
+from libsdm.sdm import (
+    EncMode,
+    InvalidMessage,
+    ParamMode,
+    decrypt_picc_data,
+    decrypt_sun_message,
+    validate_plain_sun,
+)
+
+DERIVE_MODULES = {
+    "standard": derive,
+    "legacy": legacy_derive,
+}
+
+
+class KeyVersion:
+    def __init__(self, version: str, master_key: bytes, derive_mode: str = "standard"):
+        """
+        Single version of the master key
+        :param version: version identifier
+        :param master_key: master key from which the tag keys are derived
+        :param derive_mode: key diversification method ("standard" or "legacy")
+        """
+        if derive_mode not in DERIVE_MODULES:
+            raise RuntimeError("Invalid DERIVE_MODE.")
+
+        self.version = version
+        self.master_key = master_key
+        self.derive_mode = derive_mode
+        self._derive = DERIVE_MODULES[derive_mode]
+
+        # undiversified key is used for every message, derive it only once
+        self.sdm_meta_read_key = self._derive.derive_undiversified_key(master_key, 1)
+
+    def sdm_file_read_key(self, uid: bytes) -> bytes:
+        return self._derive.derive_tag_key(self.master_key, uid, 2)
+
+    def __repr__(self):
+        return f"KeyVersion({self.version!r}, derive_mode={self.derive_mode!r})"
+
+
+def is_plausible_picc_data(picc_data: dict) -> bool:
+    """
+    Check whether decrypted PICCData looks like it was decrypted with the correct key
+    """
+    return picc_data['uid'] is not None
+
+
+class KeyRegistry:
+    # pylint: disable=too-many-arguments
+    def __init__(self,
+                 versions: Iterable[KeyVersion],
+                 default_version: Optional[str] = None,
+                 uid_prefixes: Optional[Dict[bytes, str]] = None,
+                 max_trials: int = 4,
+                 learned_size: int = 100000,
+                 uid_filter: Optional[Callable[[bytes], bool]] = None,
+                 sdmmac_param: Optional[str] = None,
+                 learned_shards: int = 16):
+        """
+        Registry of the master key versions
+        :param versions: all known key versions
+        :param default_version: version to try first (default: the first one)
+        :param uid_prefixes: map of UID prefixes to key versions
+        :param max_trials: maximum number of versions subjected to the SDMMAC check for a single message
+        :param learned_size: maximum number of remembered UID-to-version mappings
+        :param uid_filter: function telling whether the UID is admitted, checked before the key derivation (optional)
+        :param sdmmac_param: name of the SDMMAC URL parameter (see libsdm.sdm.calculate_sdmmac)
+        :param learned_shards: number of independently locked parts of the learned map
+        """
+        self.versions: Dict[str, KeyVersion] = OrderedDict((v.version, v) for v in versions)
+
+        if not self.versions:
+            raise RuntimeError("At least one key version is required.")
+
+        self.default_version = default_version or next(iter(self.versions))
+        self.versions.move_to_end(self.default_version, last=False)
+        self.max_trials = max_trials
+        self.learned_size = learned_size
+        self.uid_filter = uid_filter
+        self.sdmmac_param = sdmmac_param
+
+        self.uid_prefixes = dict(uid_prefixes or {})
+        self._prefix_lengths = sorted({len(p) for p in self.uid_prefixes}, reverse=True)
+
+        for version in self.uid_prefixes.values():
+            if version not in self.versions:
+                raise RuntimeError(f"Unknown key version in UID prefix map: {version}")
+
+        # versions sharing the same meta key need only a single PICCData decryption
+        self._by_meta_key: Dict[bytes, List[KeyVersion]] = OrderedDict()
+
+        for v in self.versions.values():
+            self._by_meta_key.setdefault(v.sdm_meta_read_key, []).append(v)
+
+        # the learned map is updated by every verified message, spread it over several locks
+        # so the concurrent threads don't contend on a single one
+        self._learned_shard_size = max(learned_size // learned_shards, 1)
+        self._learned: List[Tuple[threading.Lock, Dict[bytes, str]]] = [(threading.Lock(), OrderedDict()) for _ in range(learned_shards)]
+
+    def _learned_shard(self, uid: bytes) -> Tuple[threading.Lock, Dict[bytes, str]]:
+        return self._learned[hash(uid) % len(self._learned)]
+
+    @property
+    def default(self) -> KeyVersion:
+        return self.versions[self.default_version]
+
+    def get(self, version: str) -> KeyVersion:
+        try:
+            return self.versions[version]
+        except KeyError:
+            raise InvalidMessage("Unknown key version.") from None
+
+    def learn(self, uid: bytes, version: str):
+        """
+        Remember the key version which was successfully used for the given UID
+        """
+        lock, learned = self._learned_shard(uid)
+
+        with lock:
+            learned[uid] = version
+            learned.move_to_end(uid)
+
+            while len(learned) > self._learned_shard_size:
+                learned.popitem(last=False)
+
+    def learned_count(self) -> int:
+        """
+        Number of remembered UID-to-version mappings
+        """
+        return sum(len(learned) for _, learned in self._learned)
+
+    def forget_learned(self):
+        """
+        Forget all the learned mappings (the versions are found by trial again)
+        """
+        for lock, learned in self._learned:
+            with lock:
+                learned.clear()
+
+    def route_uid(self, uid: bytes) -> Optional[str]:
+        """
+        Find the key version for UID using the learned map and the prefix map
+        :return: key version or None if unknown
+        """
+        lock, learned = self._learned_shard(uid)
+
+        with lock:
+            version = learned.get(uid)
+
+        if version is not None:
+            return version
+
+        for length in self._prefix_lengths:
+            version = self.uid_prefixes.get(uid[:length])
+
+            if version is not None:
+                return version
+
+        return None
+
+    def _order(self, routed: Optional[str], candidates: List[KeyVersion]) -> List[KeyVersion]:
+        if routed is not None:
+            candidates = sorted(candidates, key=lambda v: v.version != routed)
+
+        return candidates[:self.max_trials]
+
+    def sun_candidates(self, picc_enc_data: bytes, version_hint: Optional[str] = None) -> List[Tuple[KeyVersion, dict]]:
+        """
+        Choose the key versions which should be tried for the SUN message, the most likely first
+        :param picc_enc_data: PICCEncData
+        :param version_hint: explicit key version (if known)
+        :return: list of tuples (key version, decrypted PICCData)
+        """
+        if version_hint:
+            version = self.get(version_hint)
+            return [(version, decrypt_picc_data(version.sdm_meta_read_key, picc_enc_data))]
+
+        candidates = []
+
+        for meta_key, versions in self._by_meta_key.items():
+            picc_data = decrypt_picc_data(meta_key, picc_enc_data)
+
+            if not is_plausible_picc_data(picc_data):
+                continue
+
+            routed = self.route_uid(picc_data['uid'])
+
+            if routed is not None and any(v.version == routed for v in versions):
+                # indexed hit, there is no need to decrypt with any other meta key
+                return [(v, picc_data) for v in self._order(routed, versions)]
+
+            candidates.extend((v, picc_data) for v in versions)
+
+            if len(candidates) >= self.max_trials:
+                break
+
+        return candidates[:self.max_trials]
+
+    def peek_uid(self, picc_enc_data: bytes, version_hint: Optional[str] = None) -> Optional[bytes]:
+        """
+        Decrypt UID from PICCEncData without validating the message
+        """
+        candidates = self.sun_candidates(picc_enc_data, version_hint)
+
+        if not candidates:
+            return None
+
+        return candidates[0][1]['uid']
+
+    # pylint: disable=too-many-arguments
+    def decrypt_sun_message(self,
+                            param_mode: ParamMode,
+                            picc_enc_data: bytes,
+                            sdmmac: bytes,
+                            enc_file_data: Optional[bytes] = None,
+                            version_hint: Optional[str] = None,
+                            file_key_cache: Optional[Dict[Tuple[str, bytes], bytes]] = None) -> dict:
+        """
+        Decrypt SUN message using the matching key version (see libsdm.sdm.decrypt_sun_message)
+        :param file_key_cache: dict for memoizing the derived tag keys (e.g. within a single batch)
+        :return: dict: same as decrypt_sun_message(), with additional key_version (str)
+        :raises:
+            InvalidMessage: if SUN message is invalid for all the candidate key versions
+        """
+        candidates = [v for v, _ in self.sun_candidates(picc_enc_data, version_hint)]
+
+        if not candidates:
+            # nothing plausible, but still go through the complete validation with the default key
+            candidates = [self.default]
+
+        last_exc = None
+
+        for version in candidates:
+            file_read_key = version.sdm_file_read_key
+
+            if file_key_cache is not None:
+                def file_read_key(uid, version=version):
+                    key = file_key_cache.get((version.version, uid))
+
+                    if key is None:
+                        key = file_key_cache[(version.version, uid)] = version.sdm_file_read_key(uid)
+
+                    return key
+
+            try:
+                res = decrypt_sun_message(param_mode=param_mode,
+                                          sdm_meta_read_key=version.sdm_meta_read_key,
+                                          sdm_file_read_key=file_read_key,
+                                          picc_enc_data=picc_enc_data,
+                                          sdmmac=sdmmac,
+                                          enc_file_data=enc_file_data,
+                                          uid_filter=self.uid_filter,
+                                          sdmmac_param=self.sdmmac_param)
+            except InvalidMessage as exc:
+                last_exc = exc
+                continue
+
+            self.learn(res['uid'], version.version)
+            res['key_version'] = version.version
+            return res
+
+        if last_exc is None:
+            raise InvalidMessage("No key version to try.")
+
+        raise last_exc
+
+    # pylint: disable=too-many-arguments
+    def validate_plain_sun(self,
+                           uid: bytes,
+                           read_ctr: bytes,
+                           sdmmac: bytes,
+                           mode: Optional[EncMode] = None,
+                           version_hint: Optional[str] = None) -> dict:
+        """
+        Validate plaintext SUN message using the matching key version (see libsdm.sdm.validate_plain_sun)
+        :return: dict: same as validate_plain_sun(), with additional key_version (str)
+        :raises:
+            InvalidMessage: if SDMMAC is invalid for all the candidate key versions
+        """
+        if self.uid_filter is not None and not self.uid_filter(uid):
+            raise InvalidMessage("UID is not provisioned or was revoked.")
+
+        if version_hint:
+            candidates = [self.get(version_hint)]
+        else:
+            candidates = self._order(self.route_uid(uid), list(self.versions.values()))
+
+        last_exc = None
+
+        for version in candidates:
+            try:
+                res = validate_plain_sun(uid=uid,
+                                         read_ctr=read_ctr,
+                                         sdmmac=sdmmac,
+                                         sdm_file_read_key=version.sdm_file_read_key(uid),
+                                         mode=mode)
+            except InvalidMessage as exc:
+                last_exc = exc
+                continue
+
+            self.learn(uid, version.version)
+            res['key_version'] = version.version
+            return res
+
+        if last_exc is None:
+            raise InvalidMessage("No key version to try.")
+
+        raise last_exc
+
+
+__all__ = ['KeyVersion', 'KeyRegistry', 'is_plausible_picc_data']
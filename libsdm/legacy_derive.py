@@ -1,5 +1,7 @@
 import hashlib
 
+from libsdm import hooks
+
 
 # old derivation algorithm compatible with NFC Developer App
 
@@ -8,7 +10,8 @@ def derive_tag_key(master_key: bytes, uid: bytes, key_no: int) -> bytes:
     if master_key == (b"\x00" * 16):
         return b"\x00" * 16
 
-    return hashlib.pbkdf2_hmac('sha512', master_key, b"key" + uid + bytes([key_no]), 5000, 16)
+    with hooks.span(hooks.STAGE_DERIVE, len(uid)):
+        return hashlib.pbkdf2_hmac('sha512', master_key, b"key" + uid + bytes([key_no]), 5000, 16)
 
 
 # derive a key which is not UID-diversified
@@ -16,4 +19,5 @@ def derive_undiversified_key(master_key: bytes, key_no: int) -> bytes:
     if master_key == (b"\x00" * 16):
         return b"\x00" * 16
 
-    return hashlib.pbkdf2_hmac('sha512', master_key, b"key_no_uid" + bytes([key_no]), 5000, 16)
+    with hooks.span(hooks.STAGE_DERIVE):
+        return hashlib.pbkdf2_hmac('sha512', master_key, b"key_no_uid" + bytes([key_no]), 5000, 16)
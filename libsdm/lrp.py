@@ -15,6 +15,8 @@ from Crypto.Cipher import AES
 from Crypto.Protocol.SecretSharing import _Element
 from Crypto.Util.strxor import strxor
 
+from libsdm import hooks
+
 
 def remove_pad(pt: bytes):
     padl = 0
@@ -158,19 +160,20 @@ class LRP:
         elif pt_stream.getbuffer().nbytes == 0:
             raise RuntimeError("Zero length pt not supported.")
 
-        pt_stream.seek(0)
+        with hooks.span(hooks.STAGE_LRP, len(data)):
+            pt_stream.seek(0)
 
-        while True:
-            block = pt_stream.read(AES.block_size)
+            while True:
+                block = pt_stream.read(AES.block_size)
 
-            if len(block) == 0:
-                break
+                if len(block) == 0:
+                    break
 
-            y = LRP.eval_lrp(self.p, self.kp, self.r, final=True)
-            ct_stream.write(e(y, block))
-            self.r = incr_counter(self.r)
+                y = LRP.eval_lrp(self.p, self.kp, self.r, final=True)
+                ct_stream.write(e(y, block))
+                self.r = incr_counter(self.r)
 
-        return ct_stream.getvalue()
+            return ct_stream.getvalue()
 
     def decrypt(self, data: bytes) -> bytes:
         """
@@ -184,15 +187,16 @@ class LRP:
 
         pt_stream = io.BytesIO()
 
-        while True:
-            block = ct_stream.read(AES.block_size)
+        with hooks.span(hooks.STAGE_LRP, len(data)):
+            while True:
+                block = ct_stream.read(AES.block_size)
 
-            if len(block) == 0:
-                break
+                if len(block) == 0:
+                    break
 
-            y = LRP.eval_lrp(self.p, self.kp, self.r, final=True)
-            pt_stream.write(d(y, block))
-            self.r = incr_counter(self.r)
+                y = LRP.eval_lrp(self.p, self.kp, self.r, final=True)
+                pt_stream.write(d(y, block))
+                self.r = incr_counter(self.r)
 
         pt = pt_stream.getvalue()
 
@@ -210,36 +214,37 @@ class LRP:
         """
         stream = io.BytesIO(data)
 
-        k0 = LRP.eval_lrp(self.p, self.kp, b"\x00" * 16, True)
+        with hooks.span(hooks.STAGE_LRP, len(data)):
+            k0 = LRP.eval_lrp(self.p, self.kp, b"\x00" * 16, True)
 
-        k1 = (_Element(k0) * _Element(2)).encode()  # type: ignore
-        k2 = (_Element(k0) * _Element(4)).encode()  # type: ignore
+            k1 = (_Element(k0) * _Element(2)).encode()  # type: ignore
+            k2 = (_Element(k0) * _Element(4)).encode()  # type: ignore
 
-        y = b"\x00" * AES.block_size
+            y = b"\x00" * AES.block_size
 
-        while True:
-            x = stream.read(AES.block_size)
+            while True:
+                x = stream.read(AES.block_size)
 
-            if len(x) < AES.block_size or stream.tell() == stream.getbuffer().nbytes:
-                break
+                if len(x) < AES.block_size or stream.tell() == stream.getbuffer().nbytes:
+                    break
 
-            y = strxor(x, y)
-            y = LRP.eval_lrp(self.p, self.kp, y, True)
+                y = strxor(x, y)
+                y = LRP.eval_lrp(self.p, self.kp, y, True)
 
-        pad_bytes = 0
+            pad_bytes = 0
 
-        if len(x) < AES.block_size:
-            pad_bytes = AES.block_size - len(x)
-            x = x + b"\x80" + (b"\x00" * (pad_bytes - 1))
+            if len(x) < AES.block_size:
+                pad_bytes = AES.block_size - len(x)
+                x = x + b"\x80" + (b"\x00" * (pad_bytes - 1))
 
-        y = strxor(x, y)
+            y = strxor(x, y)
 
-        if not pad_bytes:
-            y = strxor(y, k1)
-        else:
-            y = strxor(y, k2)
+            if not pad_bytes:
+                y = strxor(y, k1)
+            else:
+                y = strxor(y, k2)
 
-        return LRP.eval_lrp(self.p, self.kp, y, True)
+            return LRP.eval_lrp(self.p, self.kp, y, True)
 
 
 __all__ = ['LRP']
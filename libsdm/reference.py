@@ -0,0 +1,493 @@
+# pylint: disable=line-too-long, invalid-name
+
+"""
+Frozen reference implementation of the SUN cryptography, used by the differential harness (libsdm.differential).
+
+This is a verbatim copy of lrp.py, the SDMMAC / file data / PICCData functions of sdm.py and the key derivation
+of derive.py and legacy_derive.py as they were before any of them was optimised, without the profiling hooks.
+Any faster implementation in those modules must produce bit-for-bit the same results as this one.
+
+NOTE: Don't optimise, refactor or fix this module, it's the specification. A bug fix of the behaviour belongs
+to both this module and the live one, in the same commit.
+"""
+
+import binascii
+import hashlib
+import hmac
+import io
+import struct
+from typing import Generator, List, Optional, Union
+
+from Crypto.Cipher import AES
+from Crypto.Hash import CMAC
+from Crypto.Protocol.SecretSharing import _Element
+from Crypto.Util.strxor import strxor
+
+from libsdm.sdm import EncMode, InvalidMessage, ParamMode
+
+DIV_CONST1 = binascii.unhexlify("50494343446174614b6579")
+DIV_CONST2 = binascii.unhexlify("536c6f744d61737465724b6579")
+DIV_CONST3 = binascii.unhexlify("446976426173654b6579")
+
+
+def remove_pad(pt: bytes):
+    padl = 0
+
+    for b in pt[::-1]:
+        padl += 1
+
+        if b == 0x80:
+            break
+
+        if b != 0x00:
+            raise RuntimeError('Invalid padding')
+
+    return pt[:-padl]
+
+
+def nibbles(x: Union[bytes, str]) -> Generator[int, None, None]:
+    """
+    Generate integers out of x (bytes), applicable for m = 4
+    """
+    if isinstance(x, bytes):
+        x = x.hex()
+
+    for nb in x:
+        yield binascii.unhexlify("0" + nb)[0]
+
+
+def incr_counter(r: bytes):
+    max_bit_len = len(r) * 8
+
+    ctr_orig = int.from_bytes(r, byteorder='big', signed=False)
+    ctr_incr = ctr_orig + 1
+
+    if ctr_incr.bit_length() > max_bit_len:
+        # we have overflow, reset counter to zero
+        return b"\x00" * len(r)
+
+    return ctr_incr.to_bytes(len(r), byteorder='big')
+
+
+def e(k: bytes, v: bytes) -> bytes:
+    """
+    Simple AES/ECB encrypt `v` with key `k`
+    """
+    cipher = AES.new(k, AES.MODE_ECB)
+    return cipher.encrypt(v)
+
+
+def d(k: bytes, v: bytes) -> bytes:
+    """
+    Simple AES/ECB decrypt `v` with key `k`
+    """
+    cipher = AES.new(k, AES.MODE_ECB)
+    return cipher.decrypt(v)
+
+
+class LRP:
+    def __init__(self, key: bytes, u: int, r: Optional[bytes] = None, pad: bool = True):
+        """
+        Leakage Resilient Primitive
+        :param key: secret key from which updated keys will be derived
+        :param u: number of updated key to use (counting from 0)
+        :param r: IV/counter value (default: all zeros)
+        :param pad: whether to use bit padding or no (default: True)
+        """
+        if r is None:
+            r = b"\x00" * 16
+
+        self.key = key
+        self.u = u
+        self.r = r
+        self.pad = pad
+
+        self.p = LRP.generate_plaintexts(key)
+        self.ku = LRP.generate_updated_keys(key)
+        self.kp = self.ku[self.u]
+
+    @staticmethod
+    def generate_plaintexts(k: bytes, m: int = 4) -> List[bytes]:
+        """
+        Algorithm 1
+        """
+        h = k
+        h = e(h, b"\x55" * 16)
+        p = []
+
+        for _ in range(0, 2**m):
+            p.append(e(h, b"\xaa" * 16))
+            h = e(h, b"\x55" * 16)
+
+        return p
+
+    @staticmethod
+    def generate_updated_keys(k: bytes, q: int = 4) -> List[bytes]:
+        """
+        Algorithm 2
+        """
+        h = k
+        h = e(h, b"\xaa" * 16)
+        uk = []
+
+        for _ in range(0, q):
+            uk.append(e(h, b"\xaa" * 16))
+            h = e(h, b"\x55" * 16)
+
+        return uk
+
+    @staticmethod
+    def eval_lrp(p: List[bytes], kp: bytes, x: Union[bytes, str], final: bool) -> bytes:
+        """
+        Algorithm 3 assuming m = 4
+        """
+        y = kp
+
+        for x_i in nibbles(x):
+            p_j = p[x_i]
+            y = e(y, p_j)
+
+        if final:
+            y = e(y, b"\x00" * 16)
+
+        return y
+
+    def encrypt(self, data: bytes) -> bytes:
+        """
+        LRICB encrypt and update counter (LRICBEnc)
+        :param data: plaintext
+        :return: ciphertext
+        """
+        pt_stream = io.BytesIO()
+        ct_stream = io.BytesIO()
+        pt_stream.write(data)
+
+        if self.pad:
+            pt_stream.write(b"\x80")
+
+            while pt_stream.getbuffer().nbytes % AES.block_size != 0:
+                pt_stream.write(b"\x00")
+        elif pt_stream.getbuffer().nbytes % AES.block_size != 0:
+            raise RuntimeError("Parameter pt must have length multiple of AES block size.")
+        elif pt_stream.getbuffer().nbytes == 0:
+            raise RuntimeError("Zero length pt not supported.")
+
+        pt_stream.seek(0)
+
+        while True:
+            block = pt_stream.read(AES.block_size)
+
+            if len(block) == 0:
+                break
+
+            y = LRP.eval_lrp(self.p, self.kp, self.r, final=True)
+            ct_stream.write(e(y, block))
+            self.r = incr_counter(self.r)
+
+        return ct_stream.getvalue()
+
+    def decrypt(self, data: bytes) -> bytes:
+        """
+        LRICB decrypt and update counter (LRICBDecs)
+        :param data: ciphertext
+        :return: plaintext
+        """
+        ct_stream = io.BytesIO()
+        ct_stream.write(data)
+        ct_stream.seek(0)
+
+        pt_stream = io.BytesIO()
+
+        while True:
+            block = ct_stream.read(AES.block_size)
+
+            if len(block) == 0:
+                break
+
+            y = LRP.eval_lrp(self.p, self.kp, self.r, final=True)
+            pt_stream.write(d(y, block))
+            self.r = incr_counter(self.r)
+
+        pt = pt_stream.getvalue()
+
+        if self.pad:
+            pt = remove_pad(pt)
+
+        return pt
+
+    def cmac(self, data: bytes) -> bytes:
+        """
+        Calculate CMAC_LRP
+        (Huge thanks to @Pharisaeus for help with polynomial math.)
+        :param data: message to be authenticated
+        :return: CMAC result
+        """
+        stream = io.BytesIO(data)
+
+        k0 = LRP.eval_lrp(self.p, self.kp, b"\x00" * 16, True)
+
+        k1 = (_Element(k0) * _Element(2)).encode()  # type: ignore
+        k2 = (_Element(k0) * _Element(4)).encode()  # type: ignore
+
+        y = b"\x00" * AES.block_size
+
+        while True:
+            x = stream.read(AES.block_size)
+
+            if len(x) < AES.block_size or stream.tell() == stream.getbuffer().nbytes:
+                break
+
+            y = strxor(x, y)
+            y = LRP.eval_lrp(self.p, self.kp, y, True)
+
+        pad_bytes = 0
+
+        if len(x) < AES.block_size:
+            pad_bytes = AES.block_size - len(x)
+            x = x + b"\x80" + (b"\x00" * (pad_bytes - 1))
+
+        y = strxor(x, y)
+
+        if not pad_bytes:
+            y = strxor(y, k1)
+        else:
+            y = strxor(y, k2)
+
+        return LRP.eval_lrp(self.p, self.kp, y, True)
+
+
+def calculate_sdmmac(param_mode: ParamMode,
+                     sdm_file_read_key: bytes,
+                     picc_data: bytes,
+                     enc_file_data: Optional[bytes] = None,
+                     mode: Optional[EncMode] = None,
+                     sdmmac_param: Optional[str] = None) -> bytes:
+    """
+    Calculate SDMMAC for NTAG 424 DNA
+    :param param_mode: Type of dynamic URL encoding (ParamMode)
+    :param sdm_file_read_key: MAC calculation key (K_SDMFileReadKey)
+    :param picc_data: [ UID ][ SDMReadCtr ]
+    :param enc_file_data: SDMEncFileData (if used)
+    :param mode: Encryption mode used by PICC - EncMode.AES (default) or EncMode.LRP
+    :param sdmmac_param: name of the SDMMAC URL parameter, "" if SDMMAC directly follows the file data (default: config.SDMMAC_PARAM)
+    :return: calculated SDMMAC (8 bytes)
+    """
+    if mode is None:
+        mode = EncMode.AES
+
+    if sdmmac_param is None:
+        # only needed when the caller doesn't pass the parameter name, keep the library importable without config
+        import config  # pylint: disable=import-outside-toplevel
+        sdmmac_param = config.SDMMAC_PARAM
+
+    input_buf = io.BytesIO()
+
+    if enc_file_data:
+        sdmmac_param_text = f"&{sdmmac_param}="
+
+        if param_mode == ParamMode.BULK or not sdmmac_param:
+            sdmmac_param_text = ""
+
+        input_buf.write(enc_file_data.hex().upper().encode('ascii') + sdmmac_param_text.encode('ascii'))
+
+    if mode == EncMode.AES:
+        sv2stream = io.BytesIO()
+        sv2stream.write(b"\x3C\xC3\x00\x01\x00\x80")
+        sv2stream.write(picc_data)
+
+        while sv2stream.getbuffer().nbytes % AES.block_size != 0:
+            # zero padding till the end of the block
+            sv2stream.write(b"\x00")
+
+        c2 = CMAC.new(sdm_file_read_key, ciphermod=AES)
+        c2.update(sv2stream.getvalue())
+        sdmmac = CMAC.new(c2.digest(), ciphermod=AES)
+        sdmmac.update(input_buf.getvalue())
+        mac_digest = sdmmac.digest()
+    elif mode == EncMode.LRP:
+        sv2stream = io.BytesIO()
+        sv2stream.write(b"\x00\x01\x00\x80")
+        sv2stream.write(picc_data)
+
+        while (sv2stream.getbuffer().nbytes + 2) % AES.block_size != 0:
+            # zero padding till the end of the block
+            sv2stream.write(b"\x00")
+
+        sv2stream.write(b"\x1E\xE1")
+        sv = sv2stream.getvalue()
+
+        lrp_master = LRP(sdm_file_read_key, 0)
+        master_key = lrp_master.cmac(sv)
+
+        lrp_session_macing = LRP(master_key, 0)
+        mac_digest = lrp_session_macing.cmac(input_buf.getvalue())
+    else:
+        raise InvalidMessage("Invalid encryption mode.")
+
+    return bytes(bytearray([mac_digest[i] for i in range(16) if i % 2 == 1]))
+
+
+def decrypt_file_data(sdm_file_read_key: bytes,
+                      picc_data: bytes,
+                      read_ctr: bytes,
+                      enc_file_data: bytes,
+                      mode: Optional[EncMode] = None) -> bytes:
+    """
+    Decrypt SDMEncFileData for NTAG 424 DNA
+    :param sdm_file_read_key: SUN decryption key (K_SDMFileReadKey)
+    :param picc_data: PICCDataTag [ || UID ][ || SDMReadCtr ]]
+    :param read_ctr: SDMReadCtr
+    :param enc_file_data: SDMEncFileData
+    :param mode: Encryption mode used by PICC - EncMode.AES (default) or EncMode.LRP
+    :return: decrypted file data (bytes)
+    """
+    if mode is None:
+        mode = EncMode.AES
+
+    if mode == EncMode.AES:
+        sv1stream = io.BytesIO()
+        sv1stream.write(b"\xC3\x3C\x00\x01\x00\x80")
+        sv1stream.write(picc_data)
+
+        while sv1stream.getbuffer().nbytes % AES.block_size != 0:
+            # zero padding till the end of the block
+            sv1stream.write(b"\x00")
+
+        cm = CMAC.new(sdm_file_read_key, ciphermod=AES)
+        cm.update(sv1stream.getvalue())
+        k_ses_sdm_file_read_enc = cm.digest()
+        ive = AES.new(k_ses_sdm_file_read_enc, AES.MODE_ECB) \
+            .encrypt(read_ctr + b"\x00" * 13)
+        # in datasheet it is written that KSDMMetaReadKey should be used,
+        # but actually seems to be KSesSDMFileReadENC
+        return AES.new(k_ses_sdm_file_read_enc, AES.MODE_CBC, IV=ive) \
+            .decrypt(enc_file_data)
+
+    if mode == EncMode.LRP:
+        sv2stream = io.BytesIO()
+        sv2stream.write(b"\x00\x01\x00\x80")
+        sv2stream.write(picc_data)
+
+        while (sv2stream.getbuffer().nbytes + 2) % AES.block_size != 0:
+            # zero padding till the end of the block
+            sv2stream.write(b"\x00")
+
+        sv2stream.write(b"\x1E\xE1")
+        sv = sv2stream.getvalue()
+
+        lrp_master = LRP(sdm_file_read_key, 0)
+        master_key = lrp_master.cmac(sv)
+
+        lrp_session_encing = LRP(master_key, 1, read_ctr + b"\x00\x00\x00", pad=False)
+        return lrp_session_encing.decrypt(enc_file_data)
+
+    raise InvalidMessage("Invalid encryption mode")
+
+
+def get_encryption_mode(picc_enc_data: bytes):
+    if len(picc_enc_data) == 16:
+        return EncMode.AES
+
+    if len(picc_enc_data) == 24:
+        return EncMode.LRP
+
+    raise InvalidMessage("Unsupported encryption mode.")
+
+
+def decrypt_picc_data(sdm_meta_read_key: bytes, picc_enc_data: bytes) -> dict:
+    """
+    Decrypt PICCData for NTAG 424 DNA (without validating SDMMAC, so the result must not be trusted on its own)
+    :param sdm_meta_read_key: SUN decryption key (K_SDMMetaReadKey)
+    :param picc_enc_data: PICCEncData
+    :return: dict: picc_data_tag (1 byte), uid_length (int), uid (bytes; None if not mirrored or has unsupported length), read_ctr (bytes; None if not mirrored), read_ctr_num (int), encryption_mode (EncMode.AES or EncMode.LRP)
+    :raises:
+        InvalidMessage: if encryption mode is not supported
+    """
+    mode = get_encryption_mode(picc_enc_data)
+
+    if mode == EncMode.AES:
+        cipher = AES.new(sdm_meta_read_key, AES.MODE_CBC, IV=b'\x00' * 16)
+        plaintext = cipher.decrypt(picc_enc_data)
+    elif mode == EncMode.LRP:
+        picc_rand = picc_enc_data[0:8]
+        picc_enc_data_stripped = picc_enc_data[8:]
+        cipher = LRP(sdm_meta_read_key, 0, picc_rand, pad=False)
+        plaintext = cipher.decrypt(picc_enc_data_stripped)
+    else:
+        raise InvalidMessage("Invalid encryption mode.")
+
+    p_stream = io.BytesIO(plaintext)
+
+    picc_data_tag = p_stream.read(1)
+    uid_mirroring_en = (picc_data_tag[0] & 0x80) == 0x80
+    sdm_read_ctr_en = (picc_data_tag[0] & 0x40) == 0x40
+    uid_length = picc_data_tag[0] & 0x0F
+
+    uid = None
+    read_ctr = None
+    read_ctr_num = None
+
+    # so far this is the only length mentioned by datasheet
+    # dont read the buffer any further if we don't recognize it
+    if uid_length in [0x07]:
+        if uid_mirroring_en:
+            uid = p_stream.read(uid_length)
+
+        if sdm_read_ctr_en:
+            read_ctr = p_stream.read(3)
+            read_ctr_num = struct.unpack("<I", read_ctr + b"\x00")[0]
+
+    return {
+        "picc_data_tag": picc_data_tag,
+        "uid_length": uid_length,
+        "uid": uid,
+        "read_ctr": read_ctr,
+        "read_ctr_num": read_ctr_num,
+        "encryption_mode": mode
+    }
+
+
+def hmac_sha256(key, msg, no_trunc=False):
+    hmac_code = hmac.new(key, msg, digestmod=hashlib.sha256).digest()
+    return hmac_code if no_trunc else hmac_code[0:16]
+
+
+# derive a key which is UID-diversified (derive.py)
+def derive_tag_key(master_key: bytes, uid: bytes, key_no: int):
+    if master_key == (b"\x00" * 16):
+        return b"\x00" * 16
+
+    cmac_code = CMAC.new(hmac_sha256(master_key, DIV_CONST2 + bytes([key_no])), ciphermod=AES)
+    cmac_code.update(b"\x01" + hmac_sha256(hmac_sha256(master_key, DIV_CONST3, no_trunc=True), uid))
+    return cmac_code.digest()
+
+
+# derive a key which is not UID-diversified (derive.py)
+def derive_undiversified_key(master_key: bytes, key_no: int):
+    if key_no != 1:
+        raise RuntimeError("Only key #1 can be derived in undiversified mode.")
+
+    if master_key == (b"\x00" * 16):
+        return b"\x00" * 16
+
+    return hmac_sha256(master_key, DIV_CONST1)
+
+
+# derive a key which is UID-diversified (legacy_derive.py)
+def legacy_derive_tag_key(master_key: bytes, uid: bytes, key_no: int) -> bytes:
+    if master_key == (b"\x00" * 16):
+        return b"\x00" * 16
+
+    return hashlib.pbkdf2_hmac('sha512', master_key, b"key" + uid + bytes([key_no]), 5000, 16)
+
+
+# derive a key which is not UID-diversified (legacy_derive.py)
+def legacy_derive_undiversified_key(master_key: bytes, key_no: int) -> bytes:
+    if master_key == (b"\x00" * 16):
+        return b"\x00" * 16
+
+    return hashlib.pbkdf2_hmac('sha512', master_key, b"key_no_uid" + bytes([key_no]), 5000, 16)
+
+
+__all__ = ['LRP', 'calculate_sdmmac', 'decrypt_file_data', 'decrypt_picc_data', 'derive_tag_key', 'derive_undiversified_key',
+           'legacy_derive_tag_key', 'legacy_derive_undiversified_key']
@@ -0,0 +1,402 @@
+# pylint: disable=line-too-long, invalid-name
+
+"""
+PICC-side simulator of the SUN messages, produces the valid taps for the benchmarks, load tests and fuzzing.
+
+The messages are built in reverse to decrypt_sun_message(): PICCData is encrypted with K_SDMMetaReadKey,
+the optional file data with the session key derived from K_SDMFileReadKey, and SDMMAC is calculated with
+calculate_sdmmac() (the same function on both sides). AES and LRP modes, SEPARATED and BULK parameter modes
+and the TagTamper status in the file data are supported.
+
+NOTE: This is a testing tool. Like lrp.py, it's not suitable for use on a real PICC.
+
+Generate one million distinct taps as URLs (one per line):
+    python3 -m libsdm.simulator --master-key 00000000000000000000000000000000 --count 1000000 --workers 4
+"""
+
+import argparse
+import binascii
+import random
+import struct
+import sys
+from multiprocessing import Pool
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from Crypto.Cipher import AES
+from Crypto.Hash import CMAC
+from Crypto.Protocol.SecretSharing import _Element
+from Crypto.Util.strxor import strxor
+
+from libsdm import derive, legacy_derive
+from libsdm.lrp import LRP
+from libsdm.sdm import EncMode, ParamMode, calculate_sdmmac
+
+# UID mirroring, SDMReadCtr mirroring, 7-byte UID
+PICC_DATA_TAG = 0xC7
+
+DERIVE_MODULES = {
+    "standard": derive,
+    "legacy": legacy_derive,
+}
+
+
+class SunMessage(NamedTuple):
+    uid: bytes
+    read_ctr: int
+    param_mode: ParamMode
+    picc_enc_data: bytes
+    enc_file_data: Optional[bytes]
+    sdmmac: bytes
+
+
+def _read_ctr_bytes(read_ctr: int) -> bytes:
+    if not 0 <= read_ctr <= 0xFFFFFF:
+        raise ValueError("read_ctr must fit into 3 bytes.")
+
+    return struct.pack("<I", read_ctr)[:3]
+
+
+def _picc_plaintext(uid: bytes, read_ctr: int, padding: Optional[bytes]) -> bytes:
+    if len(uid) != 7:
+        raise ValueError("uid must be 7 bytes long.")
+
+    # PICCData is padded with random bytes by the tag
+    if padding is None:
+        padding = random.randbytes(5)
+
+    if len(padding) != 5:
+        raise ValueError("padding must be 5 bytes long.")
+
+    return bytes([PICC_DATA_TAG]) + uid + _read_ctr_bytes(read_ctr) + padding
+
+
+def encrypt_picc_data(sdm_meta_read_key: bytes,
+                      uid: bytes,
+                      read_ctr: int,
+                      mode: EncMode = EncMode.AES,
+                      padding: Optional[bytes] = None,
+                      picc_rand: Optional[bytes] = None) -> bytes:
+    """
+    Encrypt PICCData (reverse of decrypt_picc_data)
+    :param sdm_meta_read_key: K_SDMMetaReadKey
+    :param uid: UID (7 bytes)
+    :param read_ctr: SDMReadCtr
+    :param mode: EncMode.AES or EncMode.LRP
+    :param padding: 5 bytes padding the PICCData (default: random)
+    :param picc_rand: PICCRand for LRP mode (8 bytes, default: random)
+    :return: PICCEncData (16 bytes for AES, 24 bytes for LRP)
+    """
+    plaintext = _picc_plaintext(uid, read_ctr, padding)
+
+    if mode == EncMode.AES:
+        return AES.new(sdm_meta_read_key, AES.MODE_CBC, IV=b"\x00" * 16).encrypt(plaintext)
+
+    if picc_rand is None:
+        picc_rand = random.randbytes(8)
+
+    return picc_rand + LRP(sdm_meta_read_key, 0, picc_rand, pad=False).encrypt(plaintext)
+
+
+def _aes_file_session(sdm_file_read_key: bytes, picc_data: bytes, read_ctr: bytes):
+    sv1 = b"\xC3\x3C\x00\x01\x00\x80" + picc_data
+    sv1 += b"\x00" * (-len(sv1) % AES.block_size)
+    cm = CMAC.new(sdm_file_read_key, ciphermod=AES)
+    cm.update(sv1)
+    k_ses_sdm_file_read_enc = cm.digest()
+    ive = AES.new(k_ses_sdm_file_read_enc, AES.MODE_ECB).encrypt(read_ctr + b"\x00" * 13)
+    return AES.new(k_ses_sdm_file_read_enc, AES.MODE_CBC, IV=ive)
+
+
+def _lrp_session_key(sdm_file_read_key: bytes, picc_data: bytes, lrp_master: Optional[LRP] = None) -> bytes:
+    sv = b"\x00\x01\x00\x80" + picc_data
+    sv += b"\x00" * (-(len(sv) + 2) % AES.block_size) + b"\x1E\xE1"
+    return (lrp_master or LRP(sdm_file_read_key, 0)).cmac(sv)
+
+
+def encrypt_file_data(sdm_file_read_key: bytes,
+                      uid: bytes,
+                      read_ctr: int,
+                      file_data: bytes,
+                      mode: EncMode = EncMode.AES) -> bytes:
+    """
+    Encrypt the file data (reverse of decrypt_file_data)
+    :param sdm_file_read_key: K_SDMFileReadKey
+    :param uid: UID (7 bytes)
+    :param read_ctr: SDMReadCtr
+    :param file_data: plaintext, length must be a multiple of 16 bytes (see pad_file_data)
+    :param mode: EncMode.AES or EncMode.LRP
+    :return: SDMEncFileData
+    """
+    if not file_data or len(file_data) % AES.block_size != 0:
+        raise ValueError("file_data length must be a non-zero multiple of 16 bytes.")
+
+    read_ctr_b = _read_ctr_bytes(read_ctr)
+
+    if mode == EncMode.AES:
+        return _aes_file_session(sdm_file_read_key, uid + read_ctr_b, read_ctr_b).encrypt(file_data)
+
+    session_key = _lrp_session_key(sdm_file_read_key, uid + read_ctr_b)
+    return LRP(session_key, 1, read_ctr_b + b"\x00\x00\x00", pad=False).encrypt(file_data)
+
+
+def pad_file_data(data: bytes, tt_status: Optional[bytes] = None, param_mode: ParamMode = ParamMode.SEPARATED) -> bytes:
+    """
+    Lay out the mirrored file data as the backend reads it, zero-padded to a multiple of 16 bytes
+    :param data: file data
+    :param tt_status: TagTamper status, permanent and current (e.g. b"CC" - closed, b"OC" - tampered, loop closed)
+    :param param_mode: in BULK mode the data are preceded by their length (after the TagTamper status)
+    :return: plaintext file data for encrypt_file_data()
+    """
+    if tt_status is not None and len(tt_status) != 2:
+        raise ValueError("tt_status must be 2 bytes long.")
+
+    out = tt_status or b""
+
+    if param_mode == ParamMode.BULK:
+        if len(data) > 0xFF:
+            raise ValueError("BULK file data must be at most 255 bytes long.")
+
+        out = (out or b"\x00\x00") + bytes([len(data)])
+
+    out += data
+
+    if not out:
+        raise ValueError("File data is empty.")
+
+    return out + b"\x00" * (-len(out) % AES.block_size)
+
+
+def generate_sun_message(master_key: bytes,
+                         uid: bytes,
+                         read_ctr: int,
+                         mode: EncMode = EncMode.AES,
+                         param_mode: ParamMode = ParamMode.SEPARATED,
+                         file_data: Optional[bytes] = None,
+                         derive_mode: str = "standard",
+                         sdmmac_param: str = "cmac",
+                         padding: Optional[bytes] = None,
+                         picc_rand: Optional[bytes] = None) -> SunMessage:
+    """
+    Generate the SUN message of a single tap
+    :param master_key: master key from which the tag keys are derived (see libsdm.derive)
+    :param uid: UID (7 bytes)
+    :param read_ctr: SDMReadCtr
+    :param mode: EncMode.AES or EncMode.LRP
+    :param param_mode: ParamMode.SEPARATED or ParamMode.BULK
+    :param file_data: plaintext file data, multiple of 16 bytes (None - no file data mirrored)
+    :param derive_mode: key diversification method ("standard" or "legacy")
+    :param sdmmac_param: name of the SDMMAC URL parameter, must match the verifier (see calculate_sdmmac)
+    :param padding: PICCData padding (default: random)
+    :param picc_rand: PICCRand for LRP mode (default: random)
+    """
+    derive_module = DERIVE_MODULES[derive_mode]
+    sdm_meta_read_key = derive_module.derive_undiversified_key(master_key, 1)
+    sdm_file_read_key = derive_module.derive_tag_key(master_key, uid, 2)
+
+    picc_enc_data = encrypt_picc_data(sdm_meta_read_key, uid, read_ctr, mode, padding, picc_rand)
+    enc_file_data = encrypt_file_data(sdm_file_read_key, uid, read_ctr, file_data, mode) if file_data else None
+    sdmmac = calculate_sdmmac(param_mode, sdm_file_read_key, uid + _read_ctr_bytes(read_ctr), enc_file_data,
+                              mode=mode, sdmmac_param=sdmmac_param)
+    return SunMessage(uid, read_ctr, param_mode, picc_enc_data, enc_file_data, sdmmac)
+
+
+def sun_query(msg: SunMessage,
+              picc_param: str = "picc_data",
+              file_param: str = "enc_file_data",
+              sdmmac_param: str = "cmac") -> str:
+    """
+    Query string of the SUN message, as the tag mirrors it into the URL
+    """
+    if msg.param_mode == ParamMode.BULK:
+        return "e=" + (msg.picc_enc_data + (msg.enc_file_data or b"") + msg.sdmmac).hex().upper()
+
+    parts = [f"{picc_param}={msg.picc_enc_data.hex().upper()}"]
+
+    if msg.enc_file_data:
+        parts.append(f"{file_param}={msg.enc_file_data.hex().upper()}")
+
+    parts.append(f"{sdmmac_param}={msg.sdmmac.hex().upper()}")
+    return "&".join(parts)
+
+
+def plain_sun_query(master_key: bytes,
+                    uid: bytes,
+                    read_ctr: int,
+                    mode: EncMode = EncMode.AES,
+                    derive_mode: str = "standard",
+                    uid_param: str = "uid",
+                    ctr_param: str = "ctr",
+                    sdmmac_param: str = "cmac") -> str:
+    """
+    Query string of a plaintext SUN message (UID and SDMReadCtr mirrored in plain, see validate_plain_sun)
+    """
+    sdm_file_read_key = DERIVE_MODULES[derive_mode].derive_tag_key(master_key, uid, 2)
+    read_ctr_b = _read_ctr_bytes(read_ctr)
+    sdmmac = calculate_sdmmac(ParamMode.SEPARATED, sdm_file_read_key, uid + read_ctr_b, mode=mode, sdmmac_param=sdmmac_param)
+    return f"{uid_param}={uid.hex().upper()}&{ctr_param}={read_ctr_b[::-1].hex().upper()}&{sdmmac_param}={sdmmac.hex().upper()}"
+
+
+def simulated_uid(index: int, seed: int = 0) -> bytes:
+    """
+    Deterministic UID of the index-th simulated tag (NXP manufacturer code 0x04)
+    """
+    return b"\x04" + random.Random(seed * 0x100000000 + index).randbytes(6)
+
+
+class _TagKeys:
+    __slots__ = ("file_key", "cmac_ecb", "cmac_k1", "lrp_master")
+
+    def __init__(self, file_key: bytes, mode: EncMode):
+        self.file_key = file_key
+        self.cmac_ecb = None
+        self.cmac_k1 = None
+        self.lrp_master = None
+
+        if mode == EncMode.AES:
+            # the session MAC key is the CMAC of a single complete block: E(K, SV2 ^ K1)
+            self.cmac_ecb = AES.new(file_key, AES.MODE_ECB)
+            self.cmac_k1 = (_Element(self.cmac_ecb.encrypt(b"\x00" * 16)) * _Element(2)).encode()  # type: ignore
+        else:
+            self.lrp_master = LRP(file_key, 0)
+
+
+# pylint: disable=too-many-arguments, too-many-locals
+def bulk_sun_messages(master_key: bytes,
+                      count: int,
+                      mode: EncMode = EncMode.AES,
+                      param_mode: ParamMode = ParamMode.SEPARATED,
+                      tags: int = 1000,
+                      start: int = 0,
+                      first_ctr: int = 1,
+                      file_data: Optional[bytes] = None,
+                      derive_mode: str = "standard",
+                      sdmmac_param: str = "cmac",
+                      seed: int = 0,
+                      chunk_size: int = 4096) -> Iterator[SunMessage]:
+    """
+    Generate many distinct taps of the simulated tags: the i-th tap is made by tag i % tags with SDMReadCtr
+    first_ctr + i // tags. The tag keys are derived once per tag, the PICCData of a whole chunk is encrypted
+    by a single AES call (AES mode) and the AES session MAC keys need only one block encryption each.
+    :param master_key: master key
+    :param count: number of taps
+    :param mode: EncMode.AES or EncMode.LRP
+    :param param_mode: ParamMode.SEPARATED or ParamMode.BULK
+    :param tags: number of distinct simulated tags (UIDs, see simulated_uid)
+    :param start: index of the first tap (for splitting the work between processes)
+    :param first_ctr: SDMReadCtr of the first tap of each tag
+    :param file_data: plaintext file data, multiple of 16 bytes (None - no file data)
+    :param derive_mode: key diversification method ("standard" or "legacy")
+    :param sdmmac_param: name of the SDMMAC URL parameter, must match the verifier
+    :param seed: seed of the UIDs and paddings
+    :param chunk_size: number of taps encrypted together
+    """
+    derive_module = DERIVE_MODULES[derive_mode]
+    sdm_meta_read_key = derive_module.derive_undiversified_key(master_key, 1)
+    meta_ecb = AES.new(sdm_meta_read_key, AES.MODE_ECB)
+    meta_lrp = LRP(sdm_meta_read_key, 0, pad=False)
+    rng = random.Random(seed * 0x100000000 + start + 1)
+    keys: Dict[int, Tuple[bytes, _TagKeys]] = {}
+
+    for chunk_start in range(start, start + count, chunk_size):
+        chunk: List[Tuple[bytes, int, bytes, _TagKeys]] = []
+
+        for i in range(chunk_start, min(chunk_start + chunk_size, start + count)):
+            tag = i % tags
+            read_ctr = first_ctr + i // tags
+
+            if tag not in keys:
+                uid = simulated_uid(tag, seed)
+                keys[tag] = (uid, _TagKeys(derive_module.derive_tag_key(master_key, uid, 2), mode))
+
+            uid, tag_keys = keys[tag]
+            chunk.append((uid, read_ctr, _picc_plaintext(uid, read_ctr, rng.randbytes(5)), tag_keys))
+
+        if mode == EncMode.AES:
+            # CBC with zero IV of a single block is ECB, so the whole chunk is encrypted at once
+            picc_enc = meta_ecb.encrypt(b"".join(plaintext for _, _, plaintext, _ in chunk))
+            picc_enc_data = [picc_enc[n * 16:(n + 1) * 16] for n in range(len(chunk))]
+        else:
+            picc_enc_data = []
+
+            for _, _, plaintext, _ in chunk:
+                picc_rand = rng.randbytes(8)
+                meta_lrp.r = picc_rand
+                picc_enc_data.append(picc_rand + meta_lrp.encrypt(plaintext))
+
+        for (uid, read_ctr, _, tag_keys), picc_enc in zip(chunk, picc_enc_data):
+            read_ctr_b = _read_ctr_bytes(read_ctr)
+            enc_file_data = None
+            mac_input = b""
+
+            if mode == EncMode.AES:
+                sv2 = b"\x3C\xC3\x00\x01\x00\x80" + uid + read_ctr_b
+                session_mac_key = tag_keys.cmac_ecb.encrypt(strxor(sv2, tag_keys.cmac_k1))
+
+                if file_data:
+                    enc_file_data = _aes_file_session(tag_keys.file_key, uid + read_ctr_b, read_ctr_b).encrypt(file_data)
+            else:
+                session_key = _lrp_session_key(tag_keys.file_key, uid + read_ctr_b, tag_keys.lrp_master)
+
+                if file_data:
+                    enc_file_data = LRP(session_key, 1, read_ctr_b + b"\x00\x00\x00", pad=False).encrypt(file_data)
+
+            if enc_file_data:
+                mac_input = enc_file_data.hex().upper().encode("ascii")
+
+                if param_mode == ParamMode.SEPARATED and sdmmac_param:
+                    mac_input += f"&{sdmmac_param}=".encode("ascii")
+
+            if mode == EncMode.AES:
+                mac = CMAC.new(session_mac_key, mac_input, ciphermod=AES).digest()
+            else:
+                mac = LRP(session_key, 0).cmac(mac_input)
+
+            yield SunMessage(uid, read_ctr, param_mode, picc_enc, enc_file_data, mac[1::2])
+
+
+def _generate_urls(args: Tuple[argparse.Namespace, int, int]) -> List[str]:
+    opts, start, count = args
+    return [f"{opts.base_url}?{sun_query(msg, sdmmac_param=opts.sdmmac_param)}"
+            for msg in bulk_sun_messages(binascii.unhexlify(opts.master_key), count,
+                                         mode=EncMode[opts.mode],
+                                         param_mode=ParamMode[opts.param_mode],
+                                         tags=opts.tags,
+                                         start=start,
+                                         file_data=pad_file_data(opts.file_data.encode("utf-8"),
+                                                                 opts.tt_status.encode("ascii") if opts.tt_status else None,
+                                                                 ParamMode[opts.param_mode]) if opts.file_data or opts.tt_status else None,
+                                         derive_mode=opts.derive_mode,
+                                         sdmmac_param=opts.sdmmac_param,
+                                         seed=opts.seed)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate URLs of simulated NTAG 424 DNA taps')
+    parser.add_argument('--master-key', type=str, required=True, help='hex-encoded master key')
+    parser.add_argument('--count', type=int, default=1000, help='number of taps')
+    parser.add_argument('--tags', type=int, default=1000, help='number of distinct tags')
+    parser.add_argument('--mode', choices=[m.name for m in EncMode], default='AES', help='encryption mode')
+    parser.add_argument('--param-mode', choices=[m.name for m in ParamMode], default='SEPARATED', help='parameter mode')
+    parser.add_argument('--file-data', type=str, default='', help='mirrored file data (text)')
+    parser.add_argument('--tt-status', type=str, default=None, help='TagTamper status, e.g. CC or OC')
+    parser.add_argument('--derive-mode', choices=sorted(DERIVE_MODULES), default='standard', help='key diversification method')
+    parser.add_argument('--sdmmac-param', type=str, default='cmac', help='name of the SDMMAC parameter')
+    parser.add_argument('--base-url', type=str, default='http://127.0.0.1:5000/tag', help='URL of the endpoint')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the UIDs and paddings')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes')
+
+    args = parser.parse_args()
+    batch = 20000
+    jobs = [(args, start, min(batch, args.count - start)) for start in range(0, args.count, batch)]
+
+    with Pool(args.workers) as pool:
+        for urls in pool.imap(_generate_urls, jobs):
+            sys.stdout.write("\n".join(urls) + "\n")
+
+
+if __name__ == "__main__":
+    main()
+
+
+__all__ = ['SunMessage', 'encrypt_picc_data', 'encrypt_file_data', 'pad_file_data', 'generate_sun_message',
+           'sun_query', 'plain_sun_query', 'simulated_uid', 'bulk_sun_messages', 'PICC_DATA_TAG']
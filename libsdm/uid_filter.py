@@ -0,0 +1,235 @@
+# pylint: disable=line-too-long
+
+"""
+Admission of tag UIDs before the (potentially expensive) key derivation.
+
+* BloomFilter - compact, memory-mapped set of provisioned UIDs (no false negatives, rare false positives),
+* revoked UIDs - exact set loaded from a text file (one hex UID per line).
+
+Both files are re-read automatically when they are replaced on the disk (e.g. with os.replace()),
+so the lists can be updated atomically without restarting the server.
+
+Usage:
+    python3 -m libsdm.uid_filter build provisioned_uids.txt provisioned.bloom --fp-rate 0.0001
+"""
+
+import argparse
+import binascii
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import FrozenSet, Iterable, Optional, Tuple
+
+BLOOM_MAGIC = b"SDMBLOOM"
+BLOOM_HEADER = struct.Struct("<8sIIQ")  # magic, version, number of hashes, number of bits
+BLOOM_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+def _hashes(uid: bytes) -> Tuple[int, int]:
+    digest = hashlib.blake2b(uid, digest_size=16).digest()
+    return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+
+class BloomFilter:
+    def __init__(self, bits, num_bits: int, num_hashes: int):
+        """
+        Bloom filter over the bit array `bits` (bytes, bytearray or mmap)
+        """
+        self.bits = bits
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+
+    @staticmethod
+    def parameters(capacity: int, fp_rate: float) -> Tuple[int, int]:
+        """
+        Calculate optimal number of bits and hashes for the expected number of items and false positive rate
+        """
+        capacity = max(capacity, 1)
+        num_bits = max(int(math.ceil(-capacity * math.log(fp_rate) / (math.log(2) ** 2))), 8)
+        num_hashes = max(int(round(num_bits / capacity * math.log(2))), 1)
+        return num_bits, num_hashes
+
+    @classmethod
+    def build(cls, uids: Iterable[bytes], capacity: int, fp_rate: float = 0.0001) -> "BloomFilter":
+        num_bits, num_hashes = cls.parameters(capacity, fp_rate)
+        bloom = cls(bytearray((num_bits + 7) // 8), num_bits, num_hashes)
+
+        for uid in uids:
+            bloom.add(uid)
+
+        return bloom
+
+    def _positions(self, uid: bytes):
+        h1, h2 = _hashes(uid)
+
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, uid: bytes):
+        for pos in self._positions(uid):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, uid: bytes) -> bool:
+        bits = self.bits
+
+        for pos in self._positions(uid):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+
+        return True
+
+    def save(self, path: str):
+        """
+        Write the filter to the file, the file is replaced atomically
+        """
+        tmp_path = f"{path}.tmp{os.getpid()}"
+
+        with open(tmp_path, "wb") as f:
+            f.write(BLOOM_HEADER.pack(BLOOM_MAGIC, BLOOM_VERSION, self.num_hashes, self.num_bits))
+            f.write(self.bits)
+
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BloomFilter":
+        """
+        Memory-map the filter file
+        """
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(mm) < BLOOM_HEADER.size:
+            raise RuntimeError("Truncated Bloom filter file.")
+
+        magic, version, num_hashes, num_bits = BLOOM_HEADER.unpack_from(mm, 0)
+
+        if magic != BLOOM_MAGIC or version != BLOOM_VERSION:
+            raise RuntimeError("Invalid Bloom filter file.")
+
+        if len(mm) != BLOOM_HEADER.size + (num_bits + 7) // 8:
+            raise RuntimeError("Truncated Bloom filter file.")
+
+        return cls(memoryview(mm)[BLOOM_HEADER.size:], num_bits, num_hashes)
+
+
+def read_uid_list(path: str) -> FrozenSet[bytes]:
+    """
+    Read text file with one hex-encoded UID per line (empty lines and # comments are ignored)
+    """
+    uids = set()
+
+    with open(path, "r", encoding="ascii") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+
+            if line:
+                uids.add(binascii.unhexlify(line))
+
+    return frozenset(uids)
+
+
+def _file_version(path: Optional[str]):
+    if not path:
+        return None
+
+    st = os.stat(path)
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class UidAdmission:
+    def __init__(self, provisioned_path: Optional[str] = None, revoked_path: Optional[str] = None, check_interval: float = 5.0):
+        """
+        Admission check of UIDs
+        :param provisioned_path: Bloom filter file with provisioned UIDs (None - all UIDs are considered provisioned)
+        :param revoked_path: text file with revoked UIDs (None - no UIDs are revoked)
+        :param check_interval: how often (in seconds) the files are checked for modification
+        """
+        self.provisioned_path = provisioned_path
+        self.revoked_path = revoked_path
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+        self._versions = (None, None)
+        # swapped as a whole, so the readers never see a half-updated state
+        self._state: Tuple[Optional[BloomFilter], FrozenSet[bytes]] = (None, frozenset())
+        self.reload()
+
+    def reload(self):
+        """
+        Load both files again
+        """
+        with self._lock:
+            versions = (_file_version(self.provisioned_path), _file_version(self.revoked_path))
+            provisioned = BloomFilter.load(self.provisioned_path) if self.provisioned_path else None
+            revoked = read_uid_list(self.revoked_path) if self.revoked_path else frozenset()
+            self._state = (provisioned, revoked)
+            self._versions = versions
+            self._next_check = time.monotonic() + self.check_interval
+
+    def maybe_reload(self):
+        """
+        Reload the files if they were modified (checked at most once per check_interval)
+        """
+        if time.monotonic() < self._next_check:
+            return
+
+        try:
+            versions = (_file_version(self.provisioned_path), _file_version(self.revoked_path))
+        except OSError:
+            # file is being replaced, keep the current state
+            return
+
+        if versions != self._versions:
+            try:
+                self.reload()
+            except (OSError, ValueError, RuntimeError) as exc:
+                # malformed file (e.g. invalid hex UID, truncated or empty filter), keep the current state
+                # and try again after check_interval
+                logger.error("Failed to reload UID filter: %s", exc)
+                self._next_check = time.monotonic() + self.check_interval
+        else:
+            self._next_check = time.monotonic() + self.check_interval
+
+    def admit(self, uid: bytes) -> bool:
+        """
+        Check whether the UID is provisioned and not revoked
+        """
+        self.maybe_reload()
+        provisioned, revoked = self._state
+
+        if uid in revoked:
+            return False
+
+        return provisioned is None or uid in provisioned
+
+    __call__ = admit
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build Bloom filter of provisioned UIDs')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help='build filter out of text file with hex UIDs')
+    build_parser.add_argument('uid_list', type=str, help='input file, one hex-encoded UID per line')
+    build_parser.add_argument('output', type=str, help='output filter file (replaced atomically)')
+    build_parser.add_argument('--fp-rate', type=float, default=0.0001, help='false positive rate')
+
+    args = parser.parse_args()
+    uids = read_uid_list(args.uid_list)
+    bloom = BloomFilter.build(uids, capacity=len(uids), fp_rate=args.fp_rate)
+    bloom.save(args.output)
+    print(f"{len(uids)} UIDs, {bloom.num_bits} bits, {bloom.num_hashes} hashes")
+
+
+if __name__ == "__main__":
+    main()
+
+
+__all__ = ['BloomFilter', 'UidAdmission', 'read_uid_list']
@@ -0,0 +1,92 @@
+# pylint: disable=line-too-long
+
+"""
+Stateless access tokens for the repeated visits of /validate.
+
+After the first successful tap the client receives a token bound to the URL it has used,
+signed with HMAC-SHA256. Any worker or node sharing the secret is able to validate the token
+with a single HMAC computation, without looking up the server-side session store.
+
+Token layout (before base64url encoding):
+[ version (1) ][ first access (4) ][ expires at (4) ][ URL fingerprint (8) ][ HMAC-SHA256/128 (16) ]
+"""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import struct
+from typing import NamedTuple, Optional
+
+TOKEN_VERSION = 1
+TOKEN_BODY = struct.Struct(">BII8s")
+TOKEN_MAC_LEN = 16
+FINGERPRINT_LEN = 8
+
+
+class AccessToken(NamedTuple):
+    first_access: int
+    expires_at: int
+    fingerprint: bytes
+
+
+def url_fingerprint(*params: str) -> bytes:
+    """
+    Calculate fingerprint of the dynamic URL parameters, hex values are compared case-insensitively
+    :param params: values of the URL parameters
+    :return: fingerprint (8 bytes)
+    """
+    return hashlib.sha256("&".join(params).upper().encode('ascii', 'replace')).digest()[:FINGERPRINT_LEN]
+
+
+def _sign(secret: bytes, body: bytes) -> bytes:
+    return hmac.new(secret, body, digestmod=hashlib.sha256).digest()[:TOKEN_MAC_LEN]
+
+
+def issue_access_token(secret: bytes, fingerprint: bytes, first_access: float, expires_at: float) -> str:
+    """
+    Issue signed access token
+    :param secret: HMAC key
+    :param fingerprint: URL fingerprint (see url_fingerprint())
+    :param first_access: timestamp of the first access
+    :param expires_at: timestamp after which the access is no longer granted
+    :return: token (URL-safe string)
+    """
+    body = TOKEN_BODY.pack(TOKEN_VERSION, int(first_access), int(expires_at), fingerprint)
+    return base64.urlsafe_b64encode(body + _sign(secret, body)).rstrip(b"=").decode('ascii')
+
+
+def verify_access_token(secret: bytes, token: Optional[str], fingerprint: bytes) -> Optional[AccessToken]:
+    """
+    Verify the signature of the access token and check if it was issued for the given URL
+    (expiration is not checked, so the caller is able to tell apart the expired access from the invalid one)
+    :param secret: HMAC key
+    :param token: token as received from the client (or None)
+    :param fingerprint: URL fingerprint (see url_fingerprint())
+    :return: decoded token, or None if the token is missing or invalid
+    """
+    if not token:
+        return None
+
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    except (binascii.Error, ValueError):
+        return None
+
+    if len(raw) != TOKEN_BODY.size + TOKEN_MAC_LEN:
+        return None
+
+    body, mac = raw[:TOKEN_BODY.size], raw[TOKEN_BODY.size:]
+
+    if not hmac.compare_digest(mac, _sign(secret, body)):
+        return None
+
+    version, first_access, expires_at, token_fingerprint = TOKEN_BODY.unpack(body)
+
+    if version != TOKEN_VERSION or not hmac.compare_digest(token_fingerprint, fingerprint):
+        return None
+
+    return AccessToken(first_access, expires_at, token_fingerprint)
+
+
+__all__ = ['AccessToken', 'url_fingerprint', 'issue_access_token', 'verify_access_token']
@@ -0,0 +1,158 @@
+# pylint: disable=line-too-long
+
+"""
+Admission control with deadline-based load shedding.
+
+The expected completion time of a new request is estimated from the number of requests in progress
+and the moving average of the recent service times. The requests which cannot be completed within
+the deadline are rejected immediately with a cheap, pre-built 503 response, instead of queueing
+and timing out after the work was done anyway. The priority requests (API, /validate) get the whole
+deadline, the other ones (demo pages) only a fraction of it, so they are shed first.
+
+An idle worker always admits the request (unless its deadline already passed in the queue), and the
+estimate decays back to the initial service time, so a single slow request (e.g. a large batch)
+can't lock the endpoints out.
+
+With single-threaded workers (uWSGI, gunicorn sync) the requests queue in the listen backlog instead,
+this time is taken into account when the front server sets the X-Request-Start header (t=<unix time>).
+"""
+
+import math
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from werkzeug.wsgi import ClosingIterator
+
+
+def queued_time(environ: dict, now: Optional[float] = None) -> float:
+    """
+    Time spent waiting before the request reached the application, according to X-Request-Start header
+    (seconds, milliseconds or microseconds since the epoch, with optional "t=" prefix)
+    """
+    value = environ.get("HTTP_X_REQUEST_START")
+
+    if not value:
+        return 0.0
+
+    try:
+        start = float(value.strip().removeprefix("t="))
+    except ValueError:
+        return 0.0
+
+    if start > 1e14:
+        start /= 1e6
+    elif start > 1e11:
+        start /= 1e3
+
+    return max((now if now is not None else time.time()) - start, 0.0)
+
+
+class AdmissionController:
+    # pylint: disable=too-many-arguments, too-many-instance-attributes
+    def __init__(self,
+                 app: Callable,
+                 deadline: float = 1.0,
+                 concurrency: int = 1,
+                 priority_prefixes: Iterable[str] = ("/api/", "/validate"),
+                 low_priority_share: float = 0.5,
+                 retry_after: int = 1,
+                 alpha: float = 0.2,
+                 initial_service_time: float = 0.01,
+                 decay_half_life: float = 10.0):
+        """
+        :param app: WSGI application
+        :param deadline: maximum time (in seconds) to complete the request, including the time in the queue
+        :param concurrency: number of requests processed in parallel (threads per process)
+        :param priority_prefixes: path prefixes of the priority requests
+        :param low_priority_share: fraction of the deadline available to the other requests
+        :param retry_after: value of Retry-After header of the rejections
+        :param alpha: weight of the latest sample in the moving average of the service time
+        :param initial_service_time: service time assumed before any request is completed
+        :param decay_half_life: time (in seconds) after which the excess of the estimate over initial_service_time halves
+        """
+        self.app = app
+        self.deadline = deadline
+        self.concurrency = max(concurrency, 1)
+        self.priority_prefixes = tuple(priority_prefixes)
+        self.low_priority_share = low_priority_share
+        self.alpha = alpha
+        self.initial_service_time = initial_service_time
+        self.decay_half_life = decay_half_life
+
+        self.service_time = initial_service_time
+        self._updated = time.monotonic()
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+        self._reject_body = b"Server is overloaded, please retry later.\n"
+        self._reject_headers = [
+            ("Content-Type", "text/plain; charset=utf-8"),
+            ("Content-Length", str(len(self._reject_body))),
+            ("Retry-After", str(retry_after)),
+            ("Cache-Control", "no-store"),
+        ]
+
+    def expected_time(self, in_flight: int) -> float:
+        """
+        Estimated completion time of a new request with `in_flight` requests already in progress
+        """
+        return (in_flight // self.concurrency + 1) * self.service_time
+
+    def _decay(self):
+        # called with the lock held
+        now = time.monotonic()
+
+        if self.decay_half_life > 0:
+            weight = math.pow(0.5, (now - self._updated) / self.decay_half_life)
+            self.service_time = self.initial_service_time + (self.service_time - self.initial_service_time) * weight
+
+        self._updated = now
+
+    def _finish(self, started: float):
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self.in_flight -= 1
+            self._decay()
+            self.service_time += self.alpha * (elapsed - self.service_time)
+
+    def __call__(self, environ, start_response):
+        if environ.get("PATH_INFO", "").startswith(self.priority_prefixes):
+            budget = self.deadline
+        else:
+            budget = self.deadline * self.low_priority_share
+
+        budget -= queued_time(environ)
+
+        with self._lock:
+            self._decay()
+
+            # an idle worker takes the request anyway, so the estimate gets new samples
+            if budget <= 0 or (self.in_flight > 0 and self.expected_time(self.in_flight) > budget):
+                self.rejected += 1
+                admitted = False
+            else:
+                self.in_flight += 1
+                self.admitted += 1
+                admitted = True
+
+        if not admitted:
+            start_response("503 Service Unavailable", list(self._reject_headers))
+            return [self._reject_body]
+
+        started = time.perf_counter()
+
+        try:
+            result = self.app(environ, start_response)
+        except BaseException:
+            self._finish(started)
+            raise
+
+        # streamed responses are still in progress until the server closes the iterator
+        return ClosingIterator(result, lambda: self._finish(started))
+
+
+__all__ = ['AdmissionController', 'queued_time']
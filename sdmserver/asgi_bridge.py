@@ -0,0 +1,341 @@
+# pylint: disable=line-too-long
+
+"""
+ASGI adapter running a WSGI application in a bounded worker pool.
+
+The connections are handled by the asyncio event loop (so slow clients don't occupy a worker),
+while the WSGI application, which does all the CPU-bound work (SUN decryption, key derivation),
+runs in a thread pool or a process pool of limited size.
+
+In the thread mode the response is streamed, each chunk yielded by the application is sent as soon as it's
+produced (e.g. NDJSON of /api/tag/batch), and the application is stopped when the client disconnects.
+The process mode returns the complete response from the worker process.
+"""
+
+import asyncio
+import importlib
+import io
+import sys
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+
+# application loaded in the worker processes of the process pool
+_process_app = None
+
+# number of response chunks buffered between the worker thread and the event loop
+STREAM_BUFFER = 16
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+def build_environ(scope: dict, body: bytes) -> dict:
+    """
+    Build WSGI environment out of ASGI HTTP scope (without wsgi.input and wsgi.errors)
+    """
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": str(client[0]),
+        "REMOTE_PORT": str(client[1]),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = "HTTP_" + name
+            environ[key] = environ[key] + "," + value if key in environ else value
+
+    return environ
+
+
+def _start_response_collector():
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        if exc_info and captured:
+            raise exc_info[1].with_traceback(exc_info[2])
+
+        captured["status"] = status
+        captured["headers"] = headers
+        return lambda data: captured.setdefault("early", []).append(data)
+
+    return captured, start_response
+
+
+def call_wsgi(app: Callable, environ: dict, body: bytes) -> Tuple[str, List[Tuple[str, str]], bytes]:
+    """
+    Call WSGI application and collect the complete response
+    """
+    environ = dict(environ, **{"wsgi.input": io.BytesIO(body), "wsgi.errors": sys.stderr})
+    captured, start_response = _start_response_collector()
+    result = app(environ, start_response)
+
+    try:
+        chunks = captured.get("early", []) + [chunk for chunk in result if chunk]
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+    return captured["status"], captured["headers"], b"".join(chunks)
+
+
+def stream_wsgi(app: Callable, environ: dict, body: bytes, emit: Callable[[Tuple[Any, ...]], None], cancelled: threading.Event):
+    """
+    Call WSGI application and pass the response to `emit` as it's produced:
+    ("start", status, headers), then ("body", chunk) for each chunk and finally ("end",) or ("error", exception)
+    :param cancelled: stop iterating the response when set (client disconnected)
+    """
+    environ = dict(environ, **{"wsgi.input": io.BytesIO(body), "wsgi.errors": sys.stderr})
+    captured, start_response = _start_response_collector()
+    started = False
+    result = None
+
+    try:
+        result = app(environ, start_response)
+
+        for chunk in result:
+            if cancelled.is_set():
+                break
+
+            if not chunk:
+                continue
+
+            if not started:
+                emit(("start", captured["status"], captured["headers"]))
+                started = True
+
+            for early in captured.pop("early", []):
+                emit(("body", early))
+
+            emit(("body", chunk))
+
+        if not started:
+            emit(("start", captured["status"], captured["headers"]))
+
+        for early in captured.pop("early", []):
+            emit(("body", early))
+    except Exception as exc:  # pylint: disable=broad-except
+        emit(("error", exc))
+        return
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+    emit(("end",))
+
+
+def _init_process(app_path: str):
+    # pylint: disable=global-statement
+    global _process_app
+    module_name, attr = app_path.split(":", 1)
+    _process_app = getattr(importlib.import_module(module_name), attr)
+
+
+def _call_process_app(environ: dict, body: bytes):
+    return call_wsgi(_process_app, environ, body)
+
+
+class AsgiBridge:
+    # pylint: disable=too-many-arguments
+    def __init__(self,
+                 wsgi_app: Optional[Callable] = None,
+                 executor: str = "thread",
+                 workers: Optional[int] = None,
+                 max_in_flight: int = 1024,
+                 max_body_size: int = 1024 * 1024,
+                 app_path: Optional[str] = None):
+        """
+        :param wsgi_app: WSGI application (required in thread mode)
+        :param executor: "thread" - run the application in a thread pool, "process" - in a process pool
+        :param workers: size of the pool (default: number of CPUs)
+        :param max_in_flight: maximum number of requests waiting for or running in the pool, the excess is rejected with 503
+        :param max_body_size: maximum accepted size of the request body
+        :param app_path: "module:attribute" of the WSGI application loaded by the worker processes (required in process mode)
+        """
+        if executor == "thread":
+            if wsgi_app is None:
+                raise RuntimeError("WSGI application is required for the thread executor.")
+
+            self.pool: Executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="asgi-wsgi")
+        elif executor == "process":
+            if app_path is None:
+                raise RuntimeError("Application path is required for the process executor.")
+
+            self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_process, initargs=(app_path,))
+        else:
+            raise RuntimeError("Invalid executor, expected 'thread' or 'process'.")
+
+        self.wsgi_app = wsgi_app
+        self.executor = executor
+        self.max_in_flight = max_in_flight
+        self.max_body_size = max_body_size
+        self.in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+
+        if scope["type"] != "http":
+            raise RuntimeError(f"Unsupported scope type: {scope['type']}")
+
+        try:
+            body = await self._read_body(receive)
+        except ClientDisconnected:
+            # nobody would receive the response
+            return
+
+        if body is None:
+            await self._send_simple(send, 413, b"Request body is too large.\n")
+            return
+
+        if self.in_flight >= self.max_in_flight:
+            await self._send_simple(send, 503, b"Server is overloaded.\n", [(b"retry-after", b"1")])
+            return
+
+        self.in_flight += 1
+
+        try:
+            environ = build_environ(scope, body)
+
+            if self.executor == "process":
+                environ["wsgi.multiprocess"] = True
+                status, headers, resp_body = await asyncio.get_running_loop().run_in_executor(self.pool, _call_process_app, environ, body)
+                await self._send_start(send, status, headers)
+                await send({"type": "http.response.body", "body": resp_body})
+            else:
+                await self._stream(environ, body, receive, send)
+        finally:
+            self.in_flight -= 1
+
+    async def _stream(self, environ: dict, body: bytes, receive, send):
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_BUFFER)
+        cancelled = threading.Event()
+
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(queue.put(message), loop).result()
+
+        worker = loop.run_in_executor(self.pool, stream_wsgi, self.wsgi_app, environ, body, emit, cancelled)
+        watcher = asyncio.ensure_future(self._watch_disconnect(receive, cancelled))
+
+        try:
+            while True:
+                message = await queue.get()
+
+                if message[0] == "end":
+                    break
+
+                if message[0] == "error":
+                    raise message[1]
+
+                if cancelled.is_set():
+                    # keep draining, so the worker isn't blocked on the full queue
+                    continue
+
+                if message[0] == "start":
+                    await self._send_start(send, message[1], message[2])
+                else:
+                    await send({"type": "http.response.body", "body": message[1], "more_body": True})
+
+            if not cancelled.is_set():
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            watcher.cancel()
+            cancelled.set()
+
+            while not worker.done():
+                # unblock the worker if it's waiting for space in the queue
+                while not queue.empty():
+                    queue.get_nowait()
+
+                await asyncio.wait([worker], timeout=0.01)
+
+    @staticmethod
+    async def _watch_disconnect(receive, cancelled: threading.Event):
+        while True:
+            message = await receive()
+
+            if message["type"] == "http.disconnect":
+                cancelled.set()
+                return
+
+    @staticmethod
+    async def _send_start(send, status: str, headers: List[Tuple[str, str]]):
+        await send({
+            "type": "http.response.start",
+            "status": int(status.split(" ", 1)[0]),
+            "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+        })
+
+    async def _read_body(self, receive) -> Optional[bytes]:
+        """
+        :return: request body, None if it's too large
+        :raises:
+            ClientDisconnected: if the client disconnected before sending the complete body
+        """
+        chunks = []
+        size = 0
+
+        while True:
+            message = await receive()
+
+            if message["type"] == "http.disconnect":
+                raise ClientDisconnected()
+
+            chunk = message.get("body", b"")
+            size += len(chunk)
+
+            if size > self.max_body_size:
+                return None
+
+            chunks.append(chunk)
+
+            if not message.get("more_body", False):
+                break
+
+        return b"".join(chunks)
+
+    @staticmethod
+    async def _send_simple(send, status: int, body: bytes, headers: Optional[list] = None):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/plain"), (b"content-length", str(len(body)).encode())] + (headers or []),
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.pool.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+__all__ = ['AsgiBridge', 'build_environ', 'call_wsgi', 'stream_wsgi']
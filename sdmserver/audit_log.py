@@ -0,0 +1,326 @@
+# pylint: disable=line-too-long
+
+"""
+Append-only binary audit log of the verified taps.
+
+The request threads only pack a fixed-size record into a preallocated in-process ring buffer (never touching
+the disk, a full buffer drops the record and counts it), a background thread writes out the buffered records
+in large batches and rotates the files by size and age. Every worker process writes its own files.
+
+File layout: 16-byte header (magic, version, record size), followed by the records (little endian, 32 bytes):
+    timestamp_us (u64), uid (7 bytes, zeros if unknown), read_ctr (u32, 0xFFFFFFFF if unknown),
+    enc_mode (u8), param_mode (u8), outcome (u8), latency_us (u32), 6 bytes reserved
+
+The records are read through mmap, a truncated trailing record (e.g. after a crash) is ignored:
+    python3 -m sdmserver.audit_log /var/log/sdm-audit
+"""
+
+import argparse
+import atexit
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import Counter
+from typing import Iterator, List, NamedTuple, Optional
+
+MAGIC = b"SDMAUDIT"
+VERSION = 1
+HEADER = struct.Struct("<8sHH4x")
+RECORD = struct.Struct("<Q7sIBBBI6x")
+
+UNKNOWN_UID = b"\x00" * 7
+UNKNOWN_CTR = 0xFFFFFFFF
+UNKNOWN_MODE = 0xFF
+
+PARAM_MODE_SEPARATED = 0
+PARAM_MODE_BULK = 1
+PARAM_MODE_PLAIN = 2
+
+OUTCOME_OK = 0
+OUTCOME_INVALID = 1
+OUTCOME_INVALID_MAC = 2
+OUTCOME_NOT_ADMITTED = 3
+OUTCOME_LRP_REQUIRED = 4
+
+OUTCOME_NAMES = {
+    OUTCOME_OK: "ok",
+    OUTCOME_INVALID: "invalid",
+    OUTCOME_INVALID_MAC: "invalid_mac",
+    OUTCOME_NOT_ADMITTED: "not_admitted",
+    OUTCOME_LRP_REQUIRED: "lrp_required",
+}
+
+
+class AuditRecord(NamedTuple):
+    timestamp_us: int
+    uid: bytes
+    read_ctr: int
+    enc_mode: int
+    param_mode: int
+    outcome: int
+    latency_us: int
+
+
+class AuditLog:
+    def __init__(self,
+                 directory: str,
+                 capacity: int = 65536,
+                 flush_interval: float = 1.0,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 max_age: float = 3600.0,
+                 prefix: str = "audit"):
+        """
+        :param directory: directory of the log files
+        :param capacity: number of records held by the ring buffer, records arriving when it is full are dropped
+        :param flush_interval: maximum time (in seconds) a record waits in the buffer
+        :param max_bytes: the file is rotated when it reaches this size
+        :param max_age: the file is rotated when it's older (in seconds)
+        :param prefix: prefix of the file names
+        """
+        if capacity < 2:
+            raise ValueError("capacity must be at least 2.")
+
+        self.directory = directory
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.prefix = prefix
+
+        # statistics
+        self.written = 0
+        self.dropped = 0
+
+        self._buf = bytearray(capacity * RECORD.size)
+        self._head = 0  # total number of appended records
+        self._tail = 0  # total number of records taken by the writer
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+
+        self._file = None
+        self._file_size = 0
+        self._file_opened = 0.0
+        self._seq = 0
+        self._writer: Optional[threading.Thread] = None
+        self._pid = None
+
+        os.makedirs(directory, exist_ok=True)
+        atexit.register(self.close)
+
+    def _ensure_writer(self):
+        # the workers are forked after the application is loaded, threads don't survive fork()
+        if self._pid == os.getpid():
+            return
+
+        with self._io_lock:
+            if self._pid == os.getpid():
+                return
+
+            if self._pid is not None:
+                # the records buffered by the parent are written by the parent
+                with self._lock:
+                    self._tail = self._head
+
+            self._file = None
+            self._pid = os.getpid()
+            self._writer = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+            self._writer.start()
+
+    def record(self,
+               uid: Optional[bytes],
+               read_ctr: Optional[int],
+               enc_mode: int,
+               param_mode: int,
+               outcome: int,
+               latency: float,
+               timestamp: Optional[float] = None) -> bool:
+        """
+        Buffer a record of a tap, never blocks on the disk
+        :param uid: UID of the tag (only if the message was authenticated)
+        :param read_ctr: SDMReadCtr
+        :param enc_mode: EncMode value (UNKNOWN_MODE if unknown)
+        :param param_mode: one of PARAM_MODE_*
+        :param outcome: one of OUTCOME_*
+        :param latency: verification time in seconds
+        :param timestamp: time of the tap (default: time.time())
+        :return: False if the record was dropped because the buffer is full
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        if self._pid != os.getpid():
+            self._ensure_writer()
+
+        with self._lock:
+            pending = self._head - self._tail
+
+            if pending >= self.capacity:
+                self.dropped += 1
+                return False
+
+            RECORD.pack_into(self._buf, (self._head % self.capacity) * RECORD.size,
+                             int(timestamp * 1000000),
+                             uid or UNKNOWN_UID,
+                             UNKNOWN_CTR if read_ctr is None else read_ctr,
+                             enc_mode, param_mode, outcome,
+                             min(int(latency * 1000000), 0xFFFFFFFF))
+            self._head += 1
+
+        if pending + 1 >= self.capacity // 2:
+            self._wake.set()
+
+        return True
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of records waiting in the buffer
+        """
+        return self._head - self._tail
+
+    def _take(self) -> bytes:
+        with self._lock:
+            count = self._head - self._tail
+
+            if not count:
+                return b""
+
+            start = (self._tail % self.capacity) * RECORD.size
+            end = start + count * RECORD.size
+
+            if end <= len(self._buf):
+                data = bytes(self._buf[start:end])
+            else:
+                data = bytes(self._buf[start:]) + bytes(self._buf[:end - len(self._buf)])
+
+            self._tail = self._head
+            return data
+
+    def _open(self, now: float):
+        self._seq += 1
+        path = os.path.join(self.directory, f"{self.prefix}-{int(now * 1000):015d}-{os.getpid()}-{self._seq}.bin")
+        # unbuffered, the batches are already large
+        self._file = open(path, "ab", buffering=0)  # pylint: disable=consider-using-with
+        self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+        self._file_size = HEADER.size
+        self._file_opened = now
+
+    def _write(self, data: bytes):
+        now = time.time()
+
+        if self._file is not None and (self._file_size >= self.max_bytes or now - self._file_opened >= self.max_age):
+            self._file.close()
+            self._file = None
+
+        if self._file is None:
+            self._open(now)
+
+        self._file.write(data)
+        self._file_size += len(data)
+        self.written += len(data) // RECORD.size
+
+    def flush(self):
+        """
+        Write out all the buffered records
+        """
+        with self._io_lock:
+            data = self._take()
+
+            if data:
+                self._write(data)
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+
+            try:
+                self.flush()
+            except OSError:
+                # keep accepting the records, the disk might recover
+                time.sleep(self.flush_interval)
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self.flush()
+
+        with self._io_lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def audit_files(directory: str, prefix: str = "audit") -> List[str]:
+    """
+    List the log files in the directory, oldest first
+    """
+    names = [name for name in os.listdir(directory) if name.startswith(prefix + "-") and name.endswith(".bin")]
+    return [os.path.join(directory, name) for name in sorted(names)]
+
+
+def read_records(path: str) -> Iterator[AuditRecord]:
+    """
+    Iterate over the records of a log file (memory mapped, also works on a file being written)
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+
+        if size < HEADER.size:
+            return
+
+        with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+            magic, version, record_size = HEADER.unpack_from(mm, 0)
+
+            if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+                raise RuntimeError(f"{path} is not a supported audit log file.")
+
+            end = HEADER.size + (size - HEADER.size) // RECORD.size * RECORD.size
+
+            with memoryview(mm) as view, view[HEADER.size:end] as records:
+                for fields in RECORD.iter_unpack(records):
+                    yield AuditRecord._make(fields)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize the audit log of the verified taps')
+    parser.add_argument('directory', type=str, help='directory of the log files')
+    parser.add_argument('--list', action='store_true', help='print every record')
+
+    args = parser.parse_args()
+    outcomes = Counter()
+    uids = set()
+    total = 0
+    started = time.perf_counter()
+
+    for path in audit_files(args.directory):
+        for rec in read_records(path):
+            total += 1
+            outcomes[rec.outcome] += 1
+
+            if rec.outcome == OUTCOME_OK:
+                uids.add(rec.uid)
+
+            if args.list:
+                ctr = "" if rec.read_ctr == UNKNOWN_CTR else rec.read_ctr
+                print(f"{rec.timestamp_us / 1000000:.6f}\t{rec.uid.hex().upper()}\t{ctr}\t{rec.enc_mode}\t{rec.param_mode}\t"
+                      f"{OUTCOME_NAMES.get(rec.outcome, rec.outcome)}\t{rec.latency_us}")
+
+    print(f"{total} records ({time.perf_counter() - started:.2f} s), {len(uids)} distinct verified UIDs")
+
+    for outcome, count in outcomes.most_common():
+        print(f"  {OUTCOME_NAMES.get(outcome, outcome)}: {count}")
+
+
+if __name__ == "__main__":
+    main()
+
+
+__all__ = ['AuditLog', 'AuditRecord', 'audit_files', 'read_records', 'RECORD', 'HEADER',
+           'UNKNOWN_UID', 'UNKNOWN_CTR', 'UNKNOWN_MODE',
+           'PARAM_MODE_SEPARATED', 'PARAM_MODE_BULK', 'PARAM_MODE_PLAIN',
+           'OUTCOME_OK', 'OUTCOME_INVALID', 'OUTCOME_INVALID_MAC', 'OUTCOME_NOT_ADMITTED', 'OUTCOME_LRP_REQUIRED', 'OUTCOME_NAMES']
@@ -0,0 +1,83 @@
+# pylint: disable=line-too-long
+
+"""
+Minimal WSGI dispatcher for the JSON API endpoints.
+
+Requests to the registered paths are answered directly: the query string is scanned without building
+a full request object and the result is serialized to compact JSON. All other requests fall through
+to the wrapped application.
+"""
+
+import json
+from typing import Callable, Dict, Tuple
+from urllib.parse import unquote_plus
+
+Handler = Callable[[dict], Tuple[int, dict]]
+
+STATUS_LINES = {
+    200: "200 OK",
+    400: "400 Bad Request",
+    403: "403 Forbidden",
+    404: "404 Not Found",
+    500: "500 Internal Server Error",
+}
+
+# compact and with the same key order as Flask's jsonify()
+_encoder = json.JSONEncoder(separators=(",", ":"), sort_keys=True, ensure_ascii=True)
+
+
+def parse_query(query_string: str) -> Dict[str, str]:
+    """
+    Parse URL query string, the first occurrence of the parameter wins (same as request.args.get())
+    """
+    args: Dict[str, str] = {}
+
+    if not query_string:
+        return args
+
+    for field in query_string.split("&"):
+        if not field:
+            continue
+
+        name, _, value = field.partition("=")
+
+        if "%" in name or "+" in name:
+            name = unquote_plus(name)
+
+        if name not in args:
+            args[name] = unquote_plus(value) if "%" in value or "+" in value else value
+
+    return args
+
+
+class ApiFastPath:
+    def __init__(self, app: Callable, routes: Dict[str, Handler]):
+        """
+        :param app: WSGI application handling all the other requests
+        :param routes: map of paths to handlers, each handler takes parsed query arguments
+                       and returns tuple (HTTP status code, JSON-serializable payload)
+        """
+        self.app = app
+        self.routes = routes
+
+    def __call__(self, environ, start_response):
+        handler = self.routes.get(environ.get("PATH_INFO"))
+
+        if handler is None or environ.get("REQUEST_METHOD") not in ("GET", "HEAD"):
+            return self.app(environ, start_response)
+
+        status, payload = handler(parse_query(environ.get("QUERY_STRING", "")))
+        body = (_encoder.encode(payload) + "\n").encode("ascii")
+
+        start_response(STATUS_LINES.get(status, str(status)), [
+            ("Content-Type", "application/json"),
+            ("Content-Length", str(len(body))),
+        ])
+
+        if environ["REQUEST_METHOD"] == "HEAD":
+            return [b""]
+
+        return [body]
+
+
+__all__ = ['ApiFastPath', 'parse_query']
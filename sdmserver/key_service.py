@@ -0,0 +1,196 @@
+# pylint: disable=line-too-long
+
+"""
+Remote key service: client (key provider) and a local HSM stand-in.
+
+The framing is the same as of the verification daemon (uint32 length prefix, uint16-prefixed fields):
+Request:  request_id (u32), fields: UIDs
+Response: request_id (u32), status (u8), fields: key for each UID in the request order (empty - unknown UID);
+          on error (status 1) a single field with the error message
+
+The stand-in derives the keys from the master key, optionally with an artificial latency:
+    python3 -m sdmserver.key_service --address /tmp/sdm-keys.sock --master-key 00000000000000000000000000000000
+"""
+
+import argparse
+import asyncio
+import binascii
+import os
+import struct
+from typing import Callable, Dict, List, Optional, Tuple
+
+from libsdm.key_provider import DerivedKeyProvider, KeyProvider, KeyProviderError
+from sdmserver.verify_daemon import FRAME_HEADER, MAX_FRAME_SIZE, Address, FIELD_HEADER, pack_fields, parse_address
+
+REQUEST_HEADER = struct.Struct(">I")
+RESPONSE_HEADER = struct.Struct(">IB")
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+
+def _unpack_all_fields(buf: bytes, offset: int) -> List[bytes]:
+    fields = []
+
+    while offset < len(buf):
+        length, = FIELD_HEADER.unpack_from(buf, offset)
+        offset += FIELD_HEADER.size
+        fields.append(buf[offset:offset + length])
+        offset += length
+
+    if offset != len(buf):
+        raise ValueError("Truncated field.")
+
+    return fields
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> Optional[bytes]:
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+        length, = FRAME_HEADER.unpack(header)
+
+        if length > MAX_FRAME_SIZE:
+            raise ValueError("Frame is too large.")
+
+        return await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+
+
+def _write_frame(writer: asyncio.StreamWriter, payload: bytes):
+    writer.write(FRAME_HEADER.pack(len(payload)) + payload)
+
+
+async def _open_connection(address: Address) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    if isinstance(address, str):
+        return await asyncio.open_unix_connection(address)
+
+    return await asyncio.open_connection(*address)
+
+
+class RemoteKeyProvider:
+    def __init__(self, address: Address, pool_size: int = 4, timeout: float = 5.0):
+        """
+        Key provider talking to the remote key service over a pool of persistent connections
+        :param address: path of the Unix domain socket, "host:port" or (host, port) tuple
+        :param pool_size: maximum number of connections (and concurrent requests)
+        :param timeout: request timeout in seconds
+        """
+        self.address = parse_address(address)
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(pool_size)
+        self._idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self._next_id = 0
+
+    async def _request(self, conn, request_id: int, uids: List[bytes]) -> bytes:
+        reader, writer = conn
+        _write_frame(writer, REQUEST_HEADER.pack(request_id) + pack_fields(*uids))
+        await writer.drain()
+        payload = await _read_frame(reader)
+
+        if payload is None:
+            raise ConnectionError("Connection closed by the key service.")
+
+        return payload
+
+    async def get_keys(self, uids: List[bytes]) -> Dict[bytes, bytes]:
+        async with self._slots:
+            conn = self._idle.pop() if self._idle else await _open_connection(self.address)
+            self._next_id = (self._next_id + 1) & 0xFFFFFFFF
+            request_id = self._next_id
+
+            try:
+                payload = await asyncio.wait_for(self._request(conn, request_id, uids), self.timeout)
+                resp_id, status = RESPONSE_HEADER.unpack_from(payload, 0)
+                fields = _unpack_all_fields(payload, RESPONSE_HEADER.size)
+
+                if resp_id != request_id:
+                    raise ConnectionError("Out of order response.")
+            except BaseException:
+                conn[1].close()
+                raise
+
+            self._idle.append(conn)
+
+        if status != STATUS_OK:
+            raise KeyProviderError(fields[0].decode("utf-8", "replace") if fields else "Key service error.")
+
+        if len(fields) != len(uids):
+            raise KeyProviderError("Invalid response of the key service.")
+
+        return {uid: key for uid, key in zip(uids, fields) if key}
+
+    async def close(self):
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+
+async def start_key_service(address: Address, provider: KeyProvider, latency: float = 0.0) -> asyncio.AbstractServer:
+    """
+    Start serving the keys of the provider (e.g. DerivedKeyProvider as HSM stand-in)
+    :param address: path of the Unix domain socket or (host, port) tuple
+    :param latency: artificial delay (in seconds) of every response, simulates the network round trip
+    """
+    address = parse_address(address)
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                payload = await _read_frame(reader)
+
+                if payload is None:
+                    return
+
+                request_id, = REQUEST_HEADER.unpack_from(payload, 0)
+
+                try:
+                    uids = _unpack_all_fields(payload, REQUEST_HEADER.size)
+                    keys = await provider.get_keys(uids)
+                    response = RESPONSE_HEADER.pack(request_id, STATUS_OK) + pack_fields(*[keys.get(uid) for uid in uids])
+                except (ValueError, KeyProviderError) as exc:
+                    response = RESPONSE_HEADER.pack(request_id, STATUS_ERROR) + pack_fields(str(exc).encode("utf-8"))
+
+                if latency:
+                    await asyncio.sleep(latency)
+
+                _write_frame(writer, response)
+                await writer.drain()
+        except (ValueError, struct.error, ConnectionError):
+            return
+        finally:
+            writer.close()
+
+    if isinstance(address, str):
+        if os.path.exists(address):
+            os.unlink(address)
+
+        return await asyncio.start_unix_server(handle, address)
+
+    return await asyncio.start_server(handle, *address)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local HSM stand-in serving derived tag keys')
+    parser.add_argument('--address', type=str, required=True, help='path of the Unix domain socket or host:port to listen on')
+    parser.add_argument('--master-key', type=str, required=True, help='master key (hex)')
+    parser.add_argument('--derive-mode', type=str, default='standard', choices=['standard', 'legacy'], help='key diversification method')
+    parser.add_argument('--latency', type=float, default=0.0, help='artificial delay of every response (seconds)')
+
+    args = parser.parse_args()
+    provider = DerivedKeyProvider(binascii.unhexlify(args.master_key), args.derive_mode)
+
+    async def run():
+        server = await start_key_service(args.address, provider, latency=args.latency)
+
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
+
+
+__all__ = ['RemoteKeyProvider', 'start_key_service']
@@ -0,0 +1,44 @@
+# pylint: disable=line-too-long
+
+"""
+Key registry built out of the configuration, shared by the web application and the verification daemon,
+so the daemon doesn't need to import (and start) the whole web application.
+"""
+
+import binascii
+from typing import Optional
+
+from libsdm.key_registry import KeyRegistry, KeyVersion
+from libsdm.uid_filter import UidAdmission
+
+
+def uid_admission_from_config(cfg) -> Optional[UidAdmission]:
+    """
+    Create the admission filter of UIDs (None if neither UID_FILTER_PROVISIONED nor UID_FILTER_REVOKED is set)
+    :param cfg: configuration module
+    """
+    if not (cfg.UID_FILTER_PROVISIONED or cfg.UID_FILTER_REVOKED):
+        return None
+
+    return UidAdmission(provisioned_path=cfg.UID_FILTER_PROVISIONED,
+                        revoked_path=cfg.UID_FILTER_REVOKED,
+                        check_interval=cfg.UID_FILTER_CHECK_INTERVAL)
+
+
+def key_registry_from_config(cfg) -> KeyRegistry:
+    """
+    Create the key registry, MASTER_KEY is the default version, MASTER_KEYS contain the additional ones
+    (key rotation, tenants), unknown or revoked tags are rejected before their keys are derived
+    :param cfg: configuration module
+    """
+    return KeyRegistry([KeyVersion("default", cfg.MASTER_KEY, cfg.DERIVE_MODE)]
+                       + [KeyVersion(version, binascii.unhexlify(key), mode)
+                          for version, (key, mode) in cfg.MASTER_KEYS.items()],
+                       uid_prefixes={binascii.unhexlify(prefix): version
+                                     for prefix, version in cfg.KEY_VERSION_UID_PREFIXES.items()},
+                       max_trials=cfg.KEY_TRIAL_LIMIT,
+                       uid_filter=uid_admission_from_config(cfg),
+                       sdmmac_param=cfg.SDMMAC_PARAM)
+
+
+__all__ = ['key_registry_from_config', 'uid_admission_from_config']
@@ -0,0 +1,423 @@
+# pylint: disable=line-too-long
+
+"""
+Load generator for the verification endpoints.
+
+The traffic is a weighted mix of valid taps made by the tag simulator (AES and LRP, SEPARATED and BULK parameters,
+TagTamper, plaintext SUN, /validate) and invalid requests (wrong SDMMAC, malformed parameters). It drives either
+the WSGI application in-process (no network, the application and the generator share the GIL) or a server over HTTP.
+
+Closed loop: --concurrency workers send the next request as soon as the previous one completes.
+Open loop: requests arrive at --rate per second (Poisson arrivals) regardless of the responses, served by up to
+--concurrency workers; the latency is measured from the scheduled arrival, so the queueing delay is included.
+
+The report (JSON) contains the throughput, p50/p90/p99/p99.9 latencies, status codes ("200 error" - JSON API
+reporting an error) and connection errors, overall and per request kind:
+    python3 -m sdmserver.loadgen --wsgi app:app --concurrency 8 --duration 10
+    python3 -m sdmserver.loadgen --url http://127.0.0.1:5000 --rate 500 --duration 30 --mix api_tag=80,invalid_mac=20
+"""
+
+import argparse
+import binascii
+import http.client
+import importlib
+import json
+import math
+import queue
+import random
+import threading
+import time
+import urllib.parse
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, Optional, Sequence
+
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+from libsdm.sdm import EncMode, ParamMode
+from libsdm.simulator import bulk_sun_messages, pad_file_data, plain_sun_query, sun_query
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+# kind: (path, encryption mode, parameter mode, TagTamper), None mode - built separately
+KINDS = {
+    "tag": ("/tag", EncMode.AES, ParamMode.SEPARATED, False),
+    "tag_lrp": ("/tag", EncMode.LRP, ParamMode.SEPARATED, False),
+    "tag_bulk": ("/tag", EncMode.AES, ParamMode.BULK, False),
+    "api_tag": ("/api/tag", EncMode.AES, ParamMode.SEPARATED, False),
+    "api_tag_lrp": ("/api/tag", EncMode.LRP, ParamMode.SEPARATED, False),
+    "tagtt": ("/api/tagtt", EncMode.LRP, ParamMode.BULK, True),
+    "tagpt": ("/api/tagpt", None, None, False),
+    "validate": ("/validate", None, None, False),
+    "invalid_mac": ("/api/tag", None, None, False),
+    "malformed": ("/api/tag", None, None, False),
+}
+
+DEFAULT_MIX = {"api_tag": 40, "tag": 20, "tag_lrp": 10, "tagpt": 10, "validate": 10, "invalid_mac": 5, "malformed": 5}
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """
+    Parse "kind=weight,kind=weight"
+    """
+    mix = {}
+
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+
+        if kind not in KINDS:
+            raise ValueError(f"Unknown request kind: {kind}")
+
+        mix[kind] = float(weight) if weight else 1.0
+
+    return mix
+
+
+def build_requests(mix: Dict[str, float], master_key: bytes, pool_size: int = 1000, derive_mode: str = "standard", seed: int = 0) -> Dict[str, List[str]]:
+    """
+    Generate the requests (path with query string) of every kind in the mix
+    :param mix: weights of the request kinds
+    :param master_key: master key of the server
+    :param pool_size: number of distinct requests of each kind (the same taps are repeated once exhausted)
+    :param derive_mode: key diversification method of the server
+    :param seed: seed of the simulated tags
+    """
+    requests = {}
+    rng = random.Random(seed)
+
+    for index, kind in enumerate(sorted(mix)):
+        path, mode, param_mode, with_tt = KINDS[kind]
+        tag_seed = seed * 100 + index
+
+        if kind == "tagpt":
+            uids = [b"\x04" + rng.randbytes(6) for _ in range(pool_size)]
+            requests[kind] = [f"{path}?{plain_sun_query(master_key, uid, i + 1, derive_mode=derive_mode)}" for i, uid in enumerate(uids)]
+        elif kind == "validate":
+            messages = bulk_sun_messages(master_key, pool_size, tags=pool_size, file_data=pad_file_data(b"validate"), derive_mode=derive_mode, seed=tag_seed)
+            requests[kind] = [f"{path}?{sun_query(msg, file_param='enc')}" for msg in messages]
+        elif kind == "invalid_mac":
+            messages = bulk_sun_messages(master_key, pool_size, tags=pool_size, derive_mode=derive_mode, seed=tag_seed)
+            requests[kind] = [f"{path}?{sun_query(msg._replace(sdmmac=bytes(8)))}" for msg in messages]
+        elif kind == "malformed":
+            requests[kind] = [f"{path}?picc_data={rng.randbytes(16).hex()}ZZ&cmac={rng.randbytes(8).hex()}" for _ in range(pool_size)]
+        else:
+            file_data = pad_file_data(b"load test", b"CC" if with_tt else None, param_mode) if path != "/api/tag" else None
+            messages = bulk_sun_messages(master_key, pool_size, mode, param_mode, tags=pool_size, file_data=file_data, derive_mode=derive_mode, seed=tag_seed)
+            requests[kind] = [f"{path}?{sun_query(msg)}" for msg in messages]
+
+    return requests
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """
+    Nearest-rank percentile of the sorted values
+    """
+    if not sorted_values:
+        return 0.0
+
+    # rounded, so that e.g. 99.9 % of 1000 values is exactly the 999th one
+    rank = max(math.ceil(round(q * len(sorted_values) / 100, 6)), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def response_outcome(status: int, body: bytes) -> str:
+    """
+    Status code of the response, "<code> error" if the JSON API reports an error with 200 OK (/api/tag, /api/tagtt)
+    """
+    if status == 200 and body.startswith(b'{"error"'):
+        return "200 error"
+
+    return str(status)
+
+
+def summarize(latencies: List[float], statuses: Counter, errors: Counter, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    summary = {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": {f"p{q:g}": round(percentile(latencies, q) * 1000, 3) for q in PERCENTILES},
+        "status": dict(sorted(statuses.items())),
+        "errors": dict(errors),
+    }
+    summary["latency_ms"]["mean"] = round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0
+    summary["latency_ms"]["max"] = round(latencies[-1] * 1000, 3) if latencies else 0.0
+    return summary
+
+
+class WsgiTarget:
+    def __init__(self, app: Callable):
+        """
+        Call the WSGI application in-process
+        """
+        self.app = app
+
+    def request(self, path_qs: str) -> str:
+        path, _, query_string = path_qs.partition("?")
+        environ = EnvironBuilder(path=path, query_string=query_string, environ_base={"REMOTE_ADDR": "127.0.0.1"}).get_environ()
+        app_iter, status, _ = run_wsgi_app(self.app, environ)
+
+        try:
+            body = b"".join(app_iter)
+        finally:
+            if hasattr(app_iter, "close"):
+                app_iter.close()
+
+        return response_outcome(int(status[:3]), body)
+
+
+class HttpTarget:
+    def __init__(self, base_url: str, timeout: float = 10.0):
+        """
+        Send the requests over HTTP, each worker thread keeps its own connection alive
+        """
+        parsed = urllib.parse.urlsplit(base_url)
+
+        if parsed.scheme not in ("http", "https"):
+            raise ValueError("Only http:// and https:// URLs are supported.")
+
+        self.scheme = parsed.scheme
+        self.netloc = parsed.netloc
+        self.prefix = parsed.path.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+            conn = self._local.conn = cls(self.netloc, timeout=self.timeout)
+
+        return conn
+
+    def request(self, path_qs: str) -> str:
+        conn = self._connection()
+
+        try:
+            conn.request("GET", self.prefix + path_qs)
+            res = conn.getresponse()
+            return response_outcome(res.status, res.read())
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            raise
+
+
+class LoadGenerator:
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self,
+                 target,
+                 requests: Dict[str, List[str]],
+                 mix: Dict[str, float],
+                 concurrency: int = 1,
+                 rate: Optional[float] = None,
+                 duration: Optional[float] = None,
+                 total: Optional[int] = None,
+                 seed: int = 0):
+        """
+        :param target: WsgiTarget or HttpTarget
+        :param requests: requests of every kind (see build_requests)
+        :param mix: weights of the request kinds
+        :param concurrency: number of worker threads
+        :param rate: arrival rate (requests per second) of the open loop (None - closed loop)
+        :param duration: how long to send the requests (in seconds)
+        :param total: how many requests to send (at least one of duration and total is required)
+        :param seed: seed of the request choice and the arrivals
+        """
+        if duration is None and total is None:
+            raise ValueError("Either duration or total is required.")
+
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1.")
+
+        if rate is not None and rate <= 0:
+            raise ValueError("rate must be positive.")
+
+        self.target = target
+        self.requests = requests
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.concurrency = concurrency
+        self.rate = rate
+        self.duration = duration
+        self.total = total
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._issued = 0
+        self._cursors: Dict[str, int] = defaultdict(int)
+        self._latencies: Dict[str, List[float]] = defaultdict(list)
+        self._statuses: Dict[str, Counter] = defaultdict(Counter)
+        self._errors: Dict[str, Counter] = defaultdict(Counter)
+
+    def _next(self, deadline: Optional[float]):
+        """
+        Pick the next request, None once the duration or the total is reached
+        """
+        with self._lock:
+            if (self.total is not None and self._issued >= self.total) or (deadline is not None and time.perf_counter() >= deadline):
+                return None
+
+            self._issued += 1
+            kind = self._rng.choices(self.kinds, self.weights)[0]
+            pool = self.requests[kind]
+            path_qs = pool[self._cursors[kind] % len(pool)]
+            self._cursors[kind] += 1
+            return kind, path_qs
+
+    def _send(self, kind: str, path_qs: str, started: float):
+        status = None
+        error = None
+
+        try:
+            status = self.target.request(path_qs)
+        except Exception as exc:  # pylint: disable=broad-except
+            error = type(exc).__name__
+
+        latency = time.perf_counter() - started
+
+        with self._lock:
+            self._latencies[kind].append(latency)
+
+            if error is None:
+                self._statuses[kind][status] += 1
+            else:
+                self._errors[kind][error] += 1
+
+    def _closed_worker(self, deadline: Optional[float]):
+        while True:
+            picked = self._next(deadline)
+
+            if picked is None:
+                return
+
+            self._send(*picked, time.perf_counter())
+
+    def _open_worker(self, arrivals: queue.Queue):
+        while True:
+            item = arrivals.get()
+
+            if item is None:
+                return
+
+            kind, path_qs, scheduled = item
+            self._send(kind, path_qs, scheduled)
+
+    def _dispatch(self, arrivals: queue.Queue, deadline: Optional[float]):
+        scheduled = time.perf_counter()
+
+        while True:
+            scheduled += self._rng.expovariate(self.rate)
+            delay = scheduled - time.perf_counter()
+
+            if delay > 0:
+                time.sleep(delay)
+
+            picked = self._next(deadline)
+
+            if picked is None:
+                return
+
+            arrivals.put((*picked, scheduled))
+
+    def run(self) -> dict:
+        started = time.perf_counter()
+        deadline = started + self.duration if self.duration is not None else None
+
+        if self.rate is None:
+            workers = [threading.Thread(target=self._closed_worker, args=(deadline,)) for _ in range(self.concurrency)]
+        else:
+            arrivals = queue.Queue()
+            workers = [threading.Thread(target=self._open_worker, args=(arrivals,)) for _ in range(self.concurrency)]
+
+        for worker in workers:
+            worker.start()
+
+        if self.rate is not None:
+            self._dispatch(arrivals, deadline)
+
+            for _ in workers:
+                arrivals.put(None)
+
+        for worker in workers:
+            worker.join()
+
+        return self.report(time.perf_counter() - started)
+
+    def report(self, elapsed: float) -> dict:
+        latencies: List[float] = []
+        statuses = Counter()
+        errors = Counter()
+
+        for kind in self._latencies:
+            latencies.extend(self._latencies[kind])
+            statuses.update(self._statuses[kind])
+            errors.update(self._errors[kind])
+
+        report = {
+            "mode": "closed" if self.rate is None else "open",
+            "concurrency": self.concurrency,
+            "rate": self.rate,
+            "elapsed_s": round(elapsed, 3),
+        }
+        report.update(summarize(latencies, statuses, errors, elapsed))
+        report["kinds"] = {kind: summarize(self._latencies[kind], self._statuses[kind], self._errors[kind], elapsed)
+                           for kind in sorted(self._latencies)}
+        return report
+
+
+def load_wsgi_app(spec: str) -> Callable:
+    """
+    Import WSGI application given as "module:attribute"
+    """
+    module_name, _, attribute = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attribute or "application")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate load against the verification endpoints, print JSON report')
+    target_group = parser.add_mutually_exclusive_group(required=True)
+    target_group.add_argument('--wsgi', type=str, help='in-process WSGI application, e.g. app:app')
+    target_group.add_argument('--url', type=str, help='base URL of the server, e.g. http://127.0.0.1:5000')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help=f'weights of the request kinds ({", ".join(KINDS)})')
+    parser.add_argument('--concurrency', type=int, default=4, help='number of worker threads')
+    parser.add_argument('--rate', type=float, default=None, help='open loop arrival rate in requests per second (default: closed loop)')
+    parser.add_argument('--duration', type=float, default=None, help='test duration in seconds')
+    parser.add_argument('--requests', type=int, default=None, help='number of requests')
+    parser.add_argument('--pool-size', type=int, default=1000, help='distinct requests of each kind')
+    parser.add_argument('--master-key', type=str, default=None, help='hex-encoded master key of the server (default: from config)')
+    parser.add_argument('--derive-mode', type=str, default=None, help='key diversification method of the server (default: from config)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated traffic')
+
+    args = parser.parse_args()
+
+    if args.duration is None and args.requests is None:
+        args.duration = 10.0
+
+    if args.master_key is None or args.derive_mode is None:
+        import config  # pylint: disable=import-outside-toplevel
+        master_key = binascii.unhexlify(args.master_key) if args.master_key else config.MASTER_KEY
+        derive_mode = args.derive_mode or config.DERIVE_MODE
+    else:
+        master_key = binascii.unhexlify(args.master_key)
+        derive_mode = args.derive_mode
+
+    target = WsgiTarget(load_wsgi_app(args.wsgi)) if args.wsgi else HttpTarget(args.url)
+    requests = build_requests(args.mix, master_key, pool_size=args.pool_size, derive_mode=derive_mode, seed=args.seed)
+    generator = LoadGenerator(target, requests, args.mix,
+                              concurrency=args.concurrency,
+                              rate=args.rate,
+                              duration=args.duration,
+                              total=args.requests,
+                              seed=args.seed)
+    report = generator.run()
+    report["target"] = args.wsgi or args.url
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
+
+
+__all__ = ['LoadGenerator', 'WsgiTarget', 'HttpTarget', 'build_requests', 'parse_mix', 'percentile', 'summarize',
+           'response_outcome', 'load_wsgi_app', 'KINDS', 'DEFAULT_MIX', 'PERCENTILES']
@@ -0,0 +1,297 @@
+# pylint: disable=line-too-long
+
+"""
+Memory footprint of the worker process.
+
+Reports the resident set size (RSS), the Python heap statistics and the sizes of the registered in-process caches
+and stores, and traces the allocation sites on demand (tracemalloc is only started when asked for, it slows down
+every allocation while enabled).
+
+The memory budget is checked after the responses (at most once per check interval). Above the soft limit the
+registered caches are shrunk; if the process is still above the recycle limit, it asks itself to exit gracefully
+with SIGTERM once the response is sent, so the process manager (gunicorn) replaces it before the OOM killer does.
+"""
+
+import gc
+import linecache
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+from werkzeug.wsgi import ClosingIterator
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def rss_bytes() -> Optional[int]:
+    """
+    Current resident set size of this process (None if unknown)
+    """
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """
+    Peak resident set size of this process (None if unknown)
+    """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def heap_stats() -> dict:
+    """
+    Statistics of the Python heap and the garbage collector
+    """
+    stats = {
+        "allocated_blocks": sys.getallocatedblocks(),
+        "gc_objects": len(gc.get_objects()),
+        "gc_counts": list(gc.get_count()),
+        "gc_collections": [generation["collections"] for generation in gc.get_stats()],
+        "gc_uncollectable": sum(generation["uncollectable"] for generation in gc.get_stats()),
+        "tracemalloc": tracemalloc.is_tracing(),
+    }
+
+    if tracemalloc.is_tracing():
+        stats["traced_bytes"], stats["traced_peak_bytes"] = tracemalloc.get_traced_memory()
+
+    return stats
+
+
+class AllocationTracer:
+    def __init__(self):
+        """
+        On-demand tracemalloc snapshots, each compared with the previous one to find the growing allocation sites
+        """
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 1):
+        """
+        :param frames: number of frames stored per allocation (more frames - more overhead)
+        """
+        if frames < 1:
+            raise ValueError("frames must be at least 1.")
+
+        with self._lock:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+            tracemalloc.start(frames)
+            self._baseline = None
+
+    def stop(self):
+        with self._lock:
+            tracemalloc.stop()
+            self._baseline = None
+
+    def top(self, limit: int = 20, key_type: str = "lineno") -> List[dict]:
+        """
+        Largest allocation sites of the memory allocated since the tracing was started
+        :param limit: number of sites
+        :param key_type: "lineno", "filename" or "traceback"
+        :return: list of the sites with their size, number of blocks and the growth since the previous call
+        """
+        if key_type not in ("lineno", "filename", "traceback"):
+            raise ValueError("key_type must be lineno, filename or traceback.")
+
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                raise RuntimeError("Allocation tracing is not started.")
+
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, linecache.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            ])
+
+            if self._baseline is not None:
+                stats = snapshot.compare_to(self._baseline, key_type)
+            else:
+                stats = snapshot.statistics(key_type)
+
+            self._baseline = snapshot
+
+        sites = []
+
+        for stat in sorted(stats, key=lambda s: s.size, reverse=True)[:limit]:
+            sites.append({
+                "site": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+                "size": stat.size,
+                "count": stat.count,
+                "size_diff": getattr(stat, "size_diff", stat.size),
+                "count_diff": getattr(stat, "count_diff", stat.count),
+            })
+
+        return sites
+
+
+def recycle_worker():
+    """
+    Ask the worker process to exit gracefully, the process manager starts a new one
+    """
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+class _Store:
+    __slots__ = ("size", "shrink")
+
+    def __init__(self, size: Callable[[], int], shrink: Optional[Callable[[], object]]):
+        self.size = size
+        self.shrink = shrink
+
+
+class MemoryMonitor:
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self,
+                 soft_limit: Optional[int] = None,
+                 recycle_limit: Optional[int] = None,
+                 check_interval: float = 5.0,
+                 recycle: Callable[[], None] = recycle_worker):
+        """
+        Memory budget of the worker process
+        :param soft_limit: RSS (in bytes) above which the caches are shrunk (None - disabled)
+        :param recycle_limit: RSS (in bytes) above which the worker is recycled, if shrinking didn't help (None - disabled)
+        :param check_interval: minimum time (in seconds) between two checks of the budget
+        :param recycle: function recycling the worker
+        """
+        if soft_limit is not None and recycle_limit is not None and recycle_limit < soft_limit:
+            raise ValueError("recycle_limit must not be lower than soft_limit.")
+
+        self.soft_limit = soft_limit
+        self.recycle_limit = recycle_limit
+        self.check_interval = check_interval
+        self.recycle = recycle
+
+        # statistics
+        self.shrinks = 0
+        self.recycling = False
+
+        self._stores: Dict[str, _Store] = {}
+        self._lock = threading.Lock()
+        self._next_check = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.soft_limit is not None or self.recycle_limit is not None
+
+    def register(self, name: str, size: Callable[[], int], shrink: Optional[Callable[[], object]] = None):
+        """
+        Register an in-process cache or store
+        :param name: name of the store
+        :param size: function returning the number of entries (or bytes, for the preallocated buffers)
+        :param shrink: function releasing the entries which can be rebuilt, called when over the soft limit (optional)
+        """
+        self._stores[name] = _Store(size, shrink)
+
+    def sizes(self) -> Dict[str, int]:
+        return {name: store.size() for name, store in self._stores.items()}
+
+    def shrink(self) -> Dict[str, int]:
+        """
+        Shrink all the registered stores and collect the garbage
+        :return: sizes of the stores before shrinking
+        """
+        before = {}
+
+        for name, store in self._stores.items():
+            if store.shrink is not None:
+                before[name] = store.size()
+                store.shrink()
+
+        gc.collect()
+        self.shrinks += 1
+        return before
+
+    def check(self) -> Optional[str]:
+        """
+        Check the budget right now
+        :return: None if within the budget, "shrink" if the caches were shrunk, "recycle" if the worker should be recycled
+        """
+        rss = rss_bytes()
+
+        if rss is None:
+            return None
+
+        action = None
+
+        if self.soft_limit is not None and rss > self.soft_limit:
+            self.shrink()
+            action = "shrink"
+            rss = rss_bytes()
+
+        if self.recycle_limit is not None and rss > self.recycle_limit:
+            self.recycling = True
+            action = "recycle"
+
+        return action
+
+    def maybe_check(self) -> Optional[str]:
+        """
+        Check the budget if the check interval has elapsed (only one thread checks at a time)
+        """
+        if not self.enabled or self.recycling or time.monotonic() < self._next_check:
+            return None
+
+        if not self._lock.acquire(blocking=False):
+            return None
+
+        try:
+            self._next_check = time.monotonic() + self.check_interval
+            return self.check()
+        finally:
+            self._lock.release()
+
+    def status(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "rss_bytes": rss_bytes(),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "soft_limit": self.soft_limit,
+            "recycle_limit": self.recycle_limit,
+            "shrinks": self.shrinks,
+            "recycling": self.recycling,
+            "heap": heap_stats(),
+            "stores": self.sizes(),
+        }
+
+
+class MemoryBudgetMiddleware:
+    def __init__(self, app: Callable, monitor: MemoryMonitor):
+        """
+        Check the memory budget after the responses are sent, recycle the worker if it's over the budget
+        :param app: WSGI application
+        :param monitor: memory monitor
+        """
+        self.app = app
+        self.monitor = monitor
+
+    def finish(self):
+        if self.monitor.maybe_check() == "recycle":
+            self.monitor.recycle()
+
+    def __call__(self, environ, start_response):
+        return ClosingIterator(self.app(environ, start_response), self.finish)
+
+
+__all__ = ['MemoryMonitor', 'MemoryBudgetMiddleware', 'AllocationTracer', 'rss_bytes', 'peak_rss_bytes', 'heap_stats', 'recycle_worker']
@@ -0,0 +1,367 @@
+# pylint: disable=line-too-long
+
+"""
+Low-overhead metrics in Prometheus text format, aggregated across pre-forked worker processes.
+
+Every process keeps its own counters and histograms in memory. When a shared directory is configured,
+each process periodically (at most once per `flush_interval`, piggybacking on the requests) writes a snapshot
+into its own file, and the process serving /metrics sums the snapshots of all live processes.
+Recording a sample is only a dict lookup, a bisect and two additions under a lock.
+"""
+
+import bisect
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from werkzeug.wsgi import ClosingIterator
+
+# seconds, from 50 us (AES message) to 5 s (legacy PBKDF2 derivation under load)
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_SNAPSHOT_FILE = re.compile(r"^metrics-(\d+)\.json$")
+
+LabelValues = Tuple[str, ...]
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self, lock: threading.Lock):
+        self.value = 0.0
+        self._lock = lock
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value: float):
+        """
+        Mirror a total counted elsewhere (e.g. cache hits counted by the cache itself)
+        """
+        self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+
+    def __init__(self, buckets: Sequence[float], lock: threading.Lock):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = lock
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        started = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[LabelValues, object] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError()
+
+    def labels(self, *values: str):
+        """
+        Get the child for the label values (keep the reference for the hot paths)
+        """
+        child = self._children.get(values)
+
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"Metric {self.name} expects labels {self.labelnames}.")
+
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+
+        return child
+
+    def snapshot(self) -> Dict[LabelValues, object]:
+        raise NotImplementedError()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild(self._lock)
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def snapshot(self) -> Dict[LabelValues, float]:
+        return {values: child.value for values, child in list(self._children.items())}
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets, self._lock)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def snapshot(self) -> Dict[LabelValues, Tuple[List[int], float]]:
+        with self._lock:
+            return {values: (list(child.counts), child.sum) for values, child in self._children.items()}
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+
+    if extra:
+        pairs.append(extra)
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class MetricsRegistry:
+    def __init__(self, directory: Optional[str] = None, flush_interval: float = 1.0):
+        """
+        :param directory: directory shared by the worker processes (None - report only this process)
+        :param flush_interval: minimum interval (in seconds) between two snapshots written by a process
+        """
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._next_flush = 0.0
+        self._flush_lock = threading.Lock()
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _register(self, metric: _Metric):
+        if metric.name in self.metrics:
+            raise RuntimeError(f"Metric {metric.name} is already registered.")
+
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        """
+        Register function called before each snapshot, e.g. to mirror statistics kept by other objects
+        """
+        self._collectors.append(collector)
+
+    def snapshot(self) -> Dict[str, list]:
+        for collector in self._collectors:
+            collector()
+
+        result = {}
+
+        for name, metric in self.metrics.items():
+            if metric.kind == "counter":
+                result[name] = [[list(values), value] for values, value in metric.snapshot().items()]
+            else:
+                result[name] = [[list(values), counts, total] for values, (counts, total) in metric.snapshot().items()]
+
+        return result
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"metrics-{pid}.json")
+
+    def flush(self):
+        """
+        Write the snapshot of this process into the shared directory
+        """
+        if not self.directory:
+            return
+
+        pid = os.getpid()
+        path = self._snapshot_path(pid)
+        tmp_path = f"{path}.tmp"
+
+        with self._flush_lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.snapshot(), f, separators=(",", ":"))
+
+            os.replace(tmp_path, path)
+            self._next_flush = time.monotonic() + self.flush_interval
+
+    def maybe_flush(self):
+        """
+        Flush if the interval has elapsed (cheap enough to be called after every request)
+        """
+        if self.directory and time.monotonic() >= self._next_flush:
+            self.flush()
+
+    def _snapshots(self) -> Iterable[Dict[str, list]]:
+        yield self.snapshot()
+
+        if not self.directory:
+            return
+
+        own_pid = os.getpid()
+
+        for filename in os.listdir(self.directory):
+            match = _SNAPSHOT_FILE.match(filename)
+
+            if not match:
+                continue
+
+            pid = int(match.group(1))
+
+            # counters of the exited workers are dropped, Prometheus handles it as a counter reset
+            if pid == own_pid or not _pid_alive(pid):
+                continue
+
+            try:
+                with open(os.path.join(self.directory, filename), "r", encoding="utf-8") as f:
+                    yield json.load(f)
+            except (OSError, ValueError):
+                continue
+
+    def aggregate(self) -> Dict[str, Dict[LabelValues, object]]:
+        """
+        Sum the snapshots of all live processes
+        """
+        merged: Dict[str, Dict[LabelValues, object]] = {name: {} for name in self.metrics}
+
+        for snapshot in self._snapshots():
+            for name, samples in snapshot.items():
+                metric = self.metrics.get(name)
+
+                if metric is None:
+                    continue
+
+                target = merged[name]
+
+                for sample in samples:
+                    values = tuple(sample[0])
+
+                    if metric.kind == "counter":
+                        target[values] = target.get(values, 0.0) + sample[1]
+                    else:
+                        counts, total = target.get(values, ([0] * (len(metric.buckets) + 1), 0.0))
+                        target[values] = ([a + b for a, b in zip(counts, sample[1])], total + sample[2])
+
+        return merged
+
+    def render(self) -> str:
+        """
+        Render the aggregated metrics in Prometheus text exposition format
+        """
+        self.maybe_flush()
+        lines = []
+
+        for name, samples in self.aggregate().items():
+            metric = self.metrics[name]
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+
+            for values in sorted(samples):
+                if metric.kind == "counter":
+                    lines.append(f"{name}{_format_labels(metric.labelnames, values)} {_format_value(samples[values])}")
+                    continue
+
+                counts, total = samples[values]
+                cumulative = 0
+
+                for bound, count in zip(list(metric.buckets) + ["+Inf"], counts):
+                    cumulative += count
+                    le = 'le="' + (bound if isinstance(bound, str) else _format_value(bound)) + '"'
+                    lines.append(f"{name}_bucket{_format_labels(metric.labelnames, values, le)} {cumulative}")
+
+                lines.append(f"{name}_sum{_format_labels(metric.labelnames, values)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(metric.labelnames, values)} {cumulative}")
+
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    def __init__(self, app: Callable, registry: MetricsRegistry, paths: Iterable[str]):
+        """
+        Count the requests and their durations per path
+        :param app: WSGI application
+        :param registry: metrics registry
+        :param paths: paths reported separately, the other ones are reported as "other"
+        """
+        self.app = app
+        self.registry = registry
+        self.paths = frozenset(paths)
+        self.requests = registry.counter("sdm_http_requests_total", "HTTP requests by path and status code", ["path", "status"])
+        self.duration = registry.histogram("sdm_http_request_seconds", "Duration of HTTP requests by path", ["path"])
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        path = path if path in self.paths else "other"
+        started = time.perf_counter()
+        status = ["000"]
+
+        def metrics_start_response(status_line, headers, exc_info=None):
+            status[0] = status_line[:3]
+            return start_response(status_line, headers, exc_info)
+
+        def finish():
+            self.duration.labels(path).observe(time.perf_counter() - started)
+            self.requests.labels(path, status[0]).inc()
+            self.registry.maybe_flush()
+
+        try:
+            result = self.app(environ, metrics_start_response)
+        except BaseException:
+            status[0] = "500"
+            finish()
+            raise
+
+        return ClosingIterator(result, finish)
+
+
+__all__ = ['MetricsRegistry', 'MetricsMiddleware', 'Counter', 'Histogram', 'DEFAULT_BUCKETS', 'CONTENT_TYPE']
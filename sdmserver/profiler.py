@@ -0,0 +1,257 @@
+# pylint: disable=line-too-long
+
+"""
+On-demand sampling profiler of the requests.
+
+While enabled, a background thread periodically captures the stacks of the threads serving the watched requests
+(sys._current_frames(), the request threads are not slowed down by tracing). A request is watched if it was picked
+by the sampling rate, or if the slow request threshold is set, in which case its samples are kept only when
+the request turns out to be slower than the threshold.
+
+The samples are aggregated per endpoint into collapsed stacks ("endpoint;frame;frame count" lines), which can be
+fed into flamegraph.pl or speedscope. Only code locations are captured, never the argument values; the query
+strings listed with the slow requests are redacted.
+"""
+
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from collections import Counter, deque
+from typing import Callable, Dict, Iterable, Optional
+
+from werkzeug.wsgi import ClosingIterator
+
+# query parameters which don't carry key material nor tag identifiers
+SAFE_PARAMS = frozenset(["output", "kv"])
+
+
+def redact_query(query_string: str, safe_params: Iterable[str] = SAFE_PARAMS) -> str:
+    """
+    Replace values of the query parameters (encrypted PICCData, UID, SDMMAC, ...) with their length
+    """
+    safe_params = frozenset(safe_params)
+    pairs = urllib.parse.parse_qsl(query_string, keep_blank_values=True)
+    return "&".join(f"{name}={value if name in safe_params else f'<{len(value)}>'}" for name, value in pairs)
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def collapse_stack(frame) -> str:
+    """
+    Collapse the stack of the frame into "outer;...;inner"
+    """
+    names = []
+
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+
+    return ";".join(reversed(names))
+
+
+class _Watch:
+    __slots__ = ("endpoint", "sampled", "samples")
+
+    def __init__(self, endpoint: str, sampled: bool):
+        self.endpoint = endpoint
+        self.sampled = sampled
+        self.samples: Counter = Counter()
+
+
+class SamplingProfiler:
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, max_stacks: int = 10000, max_slow_requests: int = 100):
+        """
+        :param max_stacks: maximum number of distinct stacks kept per endpoint, the samples of new stacks are dropped then
+        :param max_slow_requests: number of the most recent slow requests listed
+        """
+        self.max_stacks = max_stacks
+        self.active = False
+        self.rate = 0.0
+        self.slow_threshold: Optional[float] = None
+        self.interval = 0.005
+        self.started_at: Optional[float] = None
+
+        self.stacks: Dict[str, Counter] = {}
+        self.requests: Counter = Counter()
+        self.slow_requests = deque(maxlen=max_slow_requests)
+
+        self._watched: Dict[int, _Watch] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, rate: float = 0.0, slow_threshold: Optional[float] = None, interval: float = 0.005):
+        """
+        Start profiling
+        :param rate: share of the requests to profile (0.0 - 1.0)
+        :param slow_threshold: also profile the requests slower than this (in seconds, None - disabled)
+        :param interval: time (in seconds) between two samples
+        """
+        if not 0.0 <= rate <= 1.0:
+            raise ValueError("rate must be between 0 and 1.")
+
+        if rate == 0.0 and slow_threshold is None:
+            raise ValueError("Either rate or slow_threshold is required.")
+
+        if interval <= 0:
+            raise ValueError("interval must be positive.")
+
+        self.stop()
+        self.rate = rate
+        self.slow_threshold = slow_threshold
+        self.interval = interval
+        self.started_at = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+        self.active = True
+
+    def stop(self):
+        self.active = False
+        self._stop.set()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        with self._lock:
+            self._watched.clear()
+
+    def reset(self):
+        with self._lock:
+            self.stacks.clear()
+            self.requests.clear()
+            self.slow_requests.clear()
+
+    def begin(self, endpoint: str) -> Optional[_Watch]:
+        """
+        Decide whether to watch the request served by the current thread
+        """
+        if not self.active:
+            return None
+
+        sampled = self.rate > 0 and random.random() < self.rate
+
+        if not sampled and self.slow_threshold is None:
+            return None
+
+        watch = _Watch(endpoint, sampled)
+
+        with self._lock:
+            self._watched[threading.get_ident()] = watch
+
+        return watch
+
+    def end(self, watch: _Watch, duration: float, query_string: str = ""):
+        with self._lock:
+            self._watched.pop(threading.get_ident(), None)
+            slow = self.slow_threshold is not None and duration >= self.slow_threshold
+
+            if not (watch.sampled or slow):
+                return
+
+            self.requests[watch.endpoint] += 1
+            stacks = self.stacks.setdefault(watch.endpoint, Counter())
+
+            for stack, count in watch.samples.items():
+                if stack in stacks or len(stacks) < self.max_stacks:
+                    stacks[stack] += count
+
+            if slow:
+                self.slow_requests.append({
+                    "time": time.time(),
+                    "endpoint": watch.endpoint,
+                    "duration": duration,
+                    "query": redact_query(query_string),
+                    "samples": sum(watch.samples.values()),
+                })
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()  # pylint: disable=protected-access
+
+            with self._lock:
+                for ident, watch in self._watched.items():
+                    frame = frames.get(ident)
+
+                    if frame is not None:
+                        watch.samples[collapse_stack(frame)] += 1
+
+    def collapsed(self, endpoint: Optional[str] = None) -> str:
+        """
+        Collapsed stacks of the profiled requests, with the endpoint as the root frame
+        """
+        lines = []
+
+        with self._lock:
+            for name, stacks in sorted(self.stacks.items()):
+                if endpoint is not None and name != endpoint:
+                    continue
+
+                for stack, count in sorted(stacks.items()):
+                    lines.append(f"{name};{stack} {count}")
+
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "active": self.active,
+                "rate": self.rate,
+                "slow_threshold": self.slow_threshold,
+                "interval": self.interval,
+                "started_at": self.started_at,
+                "requests": dict(self.requests),
+                "slow_requests": list(self.slow_requests),
+            }
+
+
+class ProfilerMiddleware:
+    def __init__(self, app: Callable, profiler: SamplingProfiler, paths: Iterable[str], exclude_prefixes: Iterable[str] = ("/admin/",)):
+        """
+        Let the profiler watch the requests
+        :param app: WSGI application
+        :param profiler: profiler
+        :param paths: paths aggregated separately, the other ones are aggregated as "other"
+        :param exclude_prefixes: paths never profiled
+        """
+        self.app = app
+        self.profiler = profiler
+        self.paths = frozenset(paths)
+        self.exclude_prefixes = tuple(exclude_prefixes)
+
+    def __call__(self, environ, start_response):
+        if not self.profiler.active:
+            return self.app(environ, start_response)
+
+        path = environ.get("PATH_INFO", "")
+
+        if path.startswith(self.exclude_prefixes):
+            return self.app(environ, start_response)
+
+        watch = self.profiler.begin(path if path in self.paths else "other")
+
+        if watch is None:
+            return self.app(environ, start_response)
+
+        started = time.perf_counter()
+
+        def finish():
+            self.profiler.end(watch, time.perf_counter() - started, environ.get("QUERY_STRING", ""))
+
+        try:
+            result = self.app(environ, start_response)
+        except BaseException:
+            finish()
+            raise
+
+        return ClosingIterator(result, finish)
+
+
+__all__ = ['SamplingProfiler', 'ProfilerMiddleware', 'redact_query', 'collapse_stack', 'SAFE_PARAMS']
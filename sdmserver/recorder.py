@@ -0,0 +1,455 @@
+# pylint: disable=line-too-long
+
+"""
+Recording and replay of the request stream.
+
+The recorder middleware writes a sample of the requests as JSON lines: arrival time, path, parameters, status
+(as sdmserver.loadgen reports it, "200 error" for the JSON API errors) and latency. By default the values of
+the parameters carrying tag data are redacted to their length and a keyed digest, so the recording reveals
+neither the UIDs nor the messages, yet the repeated taps and the repeated visits of /validate stay recognizable.
+
+The replayer turns the redacted taps into simulated taps of the same shape (endpoint, AES/LRP, SEPARATED/BULK,
+file data length, valid or invalid), the same recorded tap always into the same simulated one, and sends them
+at the original, scaled or maximum speed. The statuses and latencies are compared with the recording and
+optionally with a previous replay:
+    python3 -m sdmserver.recorder --wsgi app:app /var/log/sdm-requests.jsonl --speed 2 --output replay.json
+    python3 -m sdmserver.recorder --wsgi app:app /var/log/sdm-requests.jsonl --speed 0 --baseline replay.json
+"""
+
+import argparse
+import atexit
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import queue
+import random
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from libsdm.sdm import EncMode, ParamMode
+from libsdm.simulator import generate_sun_message, plain_sun_query, sun_query
+from sdmserver.loadgen import HttpTarget, WsgiTarget, load_wsgi_app, response_outcome, summarize
+from sdmserver.profiler import SAFE_PARAMS
+
+
+def redact_params(query_string: str, key: bytes, safe_params: Iterable[str] = SAFE_PARAMS) -> Dict[str, object]:
+    """
+    Replace values of the parameters with their length and a keyed digest (equal values - equal digests)
+    """
+    safe_params = frozenset(safe_params)
+    params = {}
+
+    for name, value in urllib.parse.parse_qsl(query_string, keep_blank_values=True):
+        if name in safe_params:
+            params[name] = value
+        else:
+            digest = hmac.new(key, value.upper().encode(), digestmod=hashlib.sha256).hexdigest()[:16]
+            params[name] = {"len": len(value), "id": digest}
+
+    return params
+
+
+class _Outcome:
+    """
+    Response iterable recording the status once the response is finished
+    """
+    def __init__(self, app_iter, finish: Callable[[str], None], status: List[str]):
+        self.app_iter = app_iter
+        self.finish = finish
+        self.status = status
+        self.error = False
+        self.first = True
+
+    def __iter__(self):
+        for chunk in self.app_iter:
+            if self.first and chunk:
+                self.first = False
+                self.error = chunk.startswith(b'{"error"')
+
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self.app_iter, "close"):
+                self.app_iter.close()
+        finally:
+            status = int(self.status[0] or 500)
+            self.finish(response_outcome(status, b'{"error"' if self.error else b""))
+
+
+class RequestRecorder:
+    # pylint: disable=too-many-arguments
+    def __init__(self,
+                 path: str,
+                 sample_rate: float = 1.0,
+                 redact: bool = True,
+                 key: Optional[bytes] = None,
+                 flush_interval: float = 1.0,
+                 buffer_size: int = 1000):
+        """
+        :param path: JSONL file, appended to (every line is written whole, so several workers can share it)
+        :param sample_rate: share of the requests to record (0.0 - 1.0)
+        :param redact: redact the parameter values (see redact_params)
+        :param key: key of the digests of the redacted values, the same on all workers (default: random)
+        :param flush_interval: maximum time (in seconds) the records wait in memory
+        :param buffer_size: the records are written out when this many are buffered
+        """
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError("sample_rate must be between 0 and 1.")
+
+        self.path = path
+        self.sample_rate = sample_rate
+        self.redact = redact
+        self.key = key or os.urandom(32)
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+
+        self.recorded = 0
+        self._lines: List[str] = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        atexit.register(self.flush)
+
+    def sampled(self) -> bool:
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def record(self, timestamp: float, method: str, path: str, query_string: str, status: str, latency: float):
+        entry = {
+            "ts": round(timestamp, 6),
+            "method": method,
+            "path": path,
+            "status": status,
+            "latency_ms": round(latency * 1000, 3),
+        }
+
+        if self.redact:
+            entry["params"] = redact_params(query_string, self.key)
+        else:
+            entry["query"] = query_string
+
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+
+        with self._lock:
+            self._lines.append(line)
+            self.recorded += 1
+            due = len(self._lines) >= self.buffer_size or time.monotonic() - self._last_flush >= self.flush_interval
+
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            lines, self._lines = self._lines, []
+            self._last_flush = time.monotonic()
+
+        if not lines:
+            return
+
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+
+        try:
+            # a single append of whole lines, not interleaved with the other workers
+            os.write(fd, "".join(lines).encode("utf-8"))
+        finally:
+            os.close(fd)
+
+
+class RequestRecorderMiddleware:
+    def __init__(self, app: Callable, recorder: RequestRecorder, paths: Iterable[str]):
+        """
+        Record the sampled requests of the given paths
+        :param app: WSGI application
+        :param recorder: recorder
+        :param paths: recorded paths
+        """
+        self.app = app
+        self.recorder = recorder
+        self.paths = frozenset(paths)
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+
+        if path not in self.paths or not self.recorder.sampled():
+            return self.app(environ, start_response)
+
+        timestamp = time.time()
+        started = time.perf_counter()
+        status = [""]
+
+        def recorder_start_response(status_line, headers, exc_info=None):
+            status[0] = status_line[:3]
+            return start_response(status_line, headers, exc_info)
+
+        def finish(outcome: str):
+            self.recorder.record(timestamp, environ.get("REQUEST_METHOD", "GET"), path,
+                                 environ.get("QUERY_STRING", ""), outcome, time.perf_counter() - started)
+
+        try:
+            result = self.app(environ, recorder_start_response)
+        except BaseException:
+            finish("500")
+            raise
+
+        return _Outcome(result, finish, status)
+
+
+def read_recording(path: str) -> Iterator[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+
+            if line:
+                yield json.loads(line)
+
+
+class TapSynthesizer:
+    # pylint: disable=too-many-arguments
+    def __init__(self,
+                 master_key: bytes,
+                 derive_mode: str = "standard",
+                 picc_param: str = "picc_data",
+                 file_param: str = "enc_file_data",
+                 sdmmac_param: str = "cmac"):
+        """
+        Turn the redacted requests into the simulated taps of the same shape
+        """
+        self.master_key = master_key
+        self.derive_mode = derive_mode
+        self.picc_param = picc_param
+        self.file_param = file_param
+        self.sdmmac_param = sdmmac_param
+        self._cache: Dict[str, str] = {}
+
+    @staticmethod
+    def _length(params: dict, name: str) -> int:
+        value = params.get(name)
+        return value["len"] // 2 if isinstance(value, dict) else 0
+
+    def path_qs(self, entry: dict) -> Optional[str]:
+        """
+        Path with query string of the recorded request (None if it can't be replayed)
+        """
+        if "query" in entry:
+            return f"{entry['path']}?{entry['query']}" if entry["query"] else entry["path"]
+
+        params = entry.get("params", {})
+        tap_id = "&".join(f"{name}={value['id']}" for name, value in sorted(params.items()) if isinstance(value, dict))
+        key = f"{entry['path']}?{tap_id}|{entry.get('status') == '200'}"
+
+        if key not in self._cache:
+            query = self._synthesize(entry["path"], params, tap_id, entry.get("status") == "200")
+
+            if query is None:
+                return None
+
+            extra = [f"{name}={urllib.parse.quote(value)}" for name, value in params.items() if not isinstance(value, dict)]
+            self._cache[key] = f"{entry['path']}?{'&'.join([query] + extra)}"
+
+        return self._cache[key]
+
+    def _synthesize(self, path: str, params: dict, tap_id: str, valid: bool) -> Optional[str]:
+        seed = hashlib.sha256(tap_id.encode()).digest()
+        uid = b"\x04" + seed[:6]
+        read_ctr = int.from_bytes(seed[6:9], "little")
+
+        if path.endswith("/tagpt"):
+            query = plain_sun_query(self.master_key, uid, read_ctr, derive_mode=self.derive_mode, sdmmac_param=self.sdmmac_param)
+            return query if valid else query[:-16] + "0" * 16
+
+        file_param = "enc" if path == "/validate" else self.file_param
+        picc_len = self._length(params, self.picc_param)
+
+        if picc_len:
+            param_mode = ParamMode.SEPARATED
+            file_len = self._length(params, file_param)
+        elif self._length(params, "e"):
+            param_mode = ParamMode.BULK
+            total = self._length(params, "e")
+            picc_len = 16 if (total - 8) % 16 == 0 else 24
+            file_len = total - picc_len - 8
+        else:
+            return None
+
+        mode = EncMode.LRP if picc_len == 24 else EncMode.AES
+        file_data = seed[9:25] * max(file_len // 16, 1) if file_len > 0 else None
+
+        msg = generate_sun_message(self.master_key, uid, read_ctr, mode, param_mode, file_data=file_data,
+                                   derive_mode=self.derive_mode, sdmmac_param=self.sdmmac_param)
+
+        if not valid:
+            msg = msg._replace(sdmmac=bytes(8))
+
+        return sun_query(msg, self.picc_param, file_param, self.sdmmac_param)
+
+
+class Replayer:
+    def __init__(self, target, requests: List[dict], speed: float = 1.0, concurrency: int = 8):
+        """
+        :param target: WsgiTarget or HttpTarget (see sdmserver.loadgen)
+        :param requests: recorded requests, each with "path_qs" to send and "offset" (seconds from the first one)
+        :param speed: 1.0 - original speed, 2.0 - twice as fast, 0 - as fast as possible
+        :param concurrency: number of worker threads
+        """
+        if speed < 0:
+            raise ValueError("speed must not be negative.")
+
+        self.target = target
+        self.requests = requests
+        self.speed = speed
+        self.concurrency = concurrency
+        self.outcomes: List[Optional[str]] = [None] * len(requests)
+        self.latencies: List[float] = [0.0] * len(requests)
+
+    def _send(self, index: int, scheduled: float):
+        try:
+            self.outcomes[index] = self.target.request(self.requests[index]["path_qs"])
+        except Exception as exc:  # pylint: disable=broad-except
+            self.outcomes[index] = type(exc).__name__
+
+        self.latencies[index] = time.perf_counter() - scheduled
+
+    def _worker(self, pending: queue.Queue):
+        while True:
+            item = pending.get()
+
+            if item is None:
+                return
+
+            self._send(*item)
+
+    def run(self) -> float:
+        """
+        :return: elapsed time
+        """
+        pending = queue.Queue()
+        workers = [threading.Thread(target=self._worker, args=(pending,)) for _ in range(self.concurrency)]
+
+        for worker in workers:
+            worker.start()
+
+        started = time.perf_counter()
+
+        for index, req in enumerate(self.requests):
+            scheduled = started + req["offset"] / self.speed if self.speed else time.perf_counter()
+            delay = scheduled - time.perf_counter()
+
+            if delay > 0:
+                time.sleep(delay)
+
+            if not self.speed:
+                # as fast as possible, but keep the queue short so the latency doesn't include the backlog
+                while pending.qsize() > self.concurrency:
+                    time.sleep(0.0005)
+
+                scheduled = time.perf_counter()
+
+            pending.put((index, scheduled))
+
+        for _ in workers:
+            pending.put(None)
+
+        for worker in workers:
+            worker.join()
+
+        return time.perf_counter() - started
+
+
+def compare(outcomes: List[Optional[str]], latencies: List[float], baseline_outcomes: List[Optional[str]], baseline_latencies: List[float], elapsed: float) -> dict:
+    """
+    Compare the statuses (request by request) and the latency distribution with the baseline
+    """
+    mismatches = Counter(f"{expected} -> {actual}" for expected, actual in zip(baseline_outcomes, outcomes) if expected != actual)
+    current = summarize(latencies, Counter(outcomes), Counter(), elapsed)["latency_ms"]
+    baseline = summarize(baseline_latencies, Counter(baseline_outcomes), Counter(), elapsed)["latency_ms"]
+    return {
+        "status_mismatches": sum(mismatches.values()),
+        "mismatch_breakdown": dict(mismatches.most_common(20)),
+        "latency_ms": {name: {"baseline": baseline[name], "replay": current[name],
+                              "ratio": round(current[name] / baseline[name], 3) if baseline[name] else None}
+                       for name in current},
+    }
+
+
+def prepare_requests(entries: Iterable[dict], synthesizer: TapSynthesizer) -> List[dict]:
+    requests = []
+    first = None
+
+    for entry in entries:
+        path_qs = synthesizer.path_qs(entry)
+
+        if path_qs is None or entry.get("method", "GET") != "GET":
+            continue
+
+        if first is None:
+            first = entry["ts"]
+
+        requests.append({
+            "path_qs": path_qs,
+            "offset": entry["ts"] - first,
+            "status": entry.get("status"),
+            "latency": entry.get("latency_ms", 0.0) / 1000,
+        })
+
+    return requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded requests, compare statuses and latencies')
+    target_group = parser.add_mutually_exclusive_group(required=True)
+    target_group.add_argument('--wsgi', type=str, help='in-process WSGI application, e.g. app:app')
+    target_group.add_argument('--url', type=str, help='base URL of the server, e.g. http://127.0.0.1:5000')
+    parser.add_argument('recording', type=str, help='JSONL file written by the recorder')
+    parser.add_argument('--speed', type=float, default=1.0, help='1 - original speed, 2 - twice as fast, 0 - maximum speed')
+    parser.add_argument('--concurrency', type=int, default=8, help='number of worker threads')
+    parser.add_argument('--master-key', type=str, default=None, help='hex-encoded master key of the server (default: from config)')
+    parser.add_argument('--output', type=str, default=None, help='write the report with the per-request statuses (a baseline for later runs)')
+    parser.add_argument('--baseline', type=str, default=None, help='report of a previous replay to compare with (default: the recording)')
+
+    args = parser.parse_args()
+
+    import config  # pylint: disable=import-outside-toplevel
+    master_key = binascii.unhexlify(args.master_key) if args.master_key else config.MASTER_KEY
+    synthesizer = TapSynthesizer(master_key, config.DERIVE_MODE, config.ENC_PICC_DATA_PARAM, config.ENC_FILE_DATA_PARAM, config.SDMMAC_PARAM)
+    requests = prepare_requests(read_recording(args.recording), synthesizer)
+
+    target = WsgiTarget(load_wsgi_app(args.wsgi)) if args.wsgi else HttpTarget(args.url)
+    replayer = Replayer(target, requests, speed=args.speed, concurrency=args.concurrency)
+    elapsed = replayer.run()
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+        baseline_outcomes, baseline_latencies = baseline["outcomes"], [latency / 1000 for latency in baseline["latencies_ms"]]
+    else:
+        baseline_outcomes, baseline_latencies = [req["status"] for req in requests], [req["latency"] for req in requests]
+
+    report = {
+        "target": args.wsgi or args.url,
+        "recording": args.recording,
+        "speed": args.speed,
+        "elapsed_s": round(elapsed, 3),
+    }
+    report.update(summarize(replayer.latencies, Counter(replayer.outcomes), Counter(), elapsed))
+    report["comparison"] = compare(replayer.outcomes, replayer.latencies, baseline_outcomes, baseline_latencies, elapsed)
+    print(json.dumps(report, indent=2))
+
+    if args.output:
+        report["outcomes"] = replayer.outcomes
+        report["latencies_ms"] = [round(latency * 1000, 3) for latency in replayer.latencies]
+
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f)
+
+
+if __name__ == "__main__":
+    main()
+
+
+__all__ = ['RequestRecorder', 'RequestRecorderMiddleware', 'TapSynthesizer', 'Replayer', 'redact_params',
+           'read_recording', 'prepare_requests', 'compare']
@@ -0,0 +1,161 @@
+# pylint: disable=line-too-long
+
+"""
+Cache of pre-rendered response bodies with pre-encoded gzip/brotli variants and ETags.
+
+Bodies are rendered and compressed once (ideally at startup, before the workers are forked),
+so serving them only involves picking the right variant for the Accept-Encoding header.
+"""
+
+import gzip
+import hashlib
+import threading
+from typing import Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+try:
+    import brotli  # type: ignore
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# compressing tiny bodies doesn't pay off
+MIN_COMPRESS_SIZE = 256
+
+
+def _accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    accepted = {}
+
+    for item in accept_encoding.split(","):
+        parts = item.strip().split(";")
+        name = parts[0].strip().lower()
+        q = 1.0
+
+        for param in parts[1:]:
+            key, _, value = param.strip().partition("=")
+
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+
+        if name:
+            accepted[name] = q
+
+    return accepted
+
+
+class CachedResponse:
+    def __init__(self, body: bytes, content_type: str = "text/html; charset=utf-8"):
+        """
+        Pre-encoded response body
+        :param body: uncompressed body
+        :param content_type: value of Content-Type header
+        """
+        self.body = body
+        self.content_type = content_type
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self.encoded: Dict[str, bytes] = {}
+
+        if len(body) >= MIN_COMPRESS_SIZE:
+            if brotli is not None:
+                self.encoded["br"] = brotli.compress(body)
+
+            self.encoded["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+
+    def negotiate(self,
+                  accept_encoding: Optional[str] = None,
+                  if_none_match: Optional[str] = None,
+                  conditional: bool = True) -> Tuple[int, List[Tuple[str, str]], bytes]:
+        """
+        Choose the representation for the request
+        :param accept_encoding: value of the Accept-Encoding request header
+        :param if_none_match: value of the If-None-Match request header
+        :param conditional: whether 304 Not Modified could be returned (only for successful responses)
+        :return: tuple (status code or 0 if the status should not be changed, headers, body)
+        """
+        headers = [("Content-Type", self.content_type), ("ETag", self.etag)]
+
+        if self.encoded:
+            headers.append(("Vary", "Accept-Encoding"))
+
+        if conditional and if_none_match:
+            tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+
+            if self.etag in tags or "*" in tags:
+                return 304, headers, b""
+
+        if accept_encoding and self.encoded:
+            accepted = _accepted_encodings(accept_encoding)
+
+            for encoding in ["br", "gzip"]:
+                if encoding in self.encoded and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+                    headers.append(("Content-Encoding", encoding))
+                    return 0, headers, self.encoded[encoding]
+
+        return 0, headers, self.body
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 256):
+        """
+        Bounded cache of the pre-encoded responses
+        :param max_entries: maximum number of entries created on demand by get_or_render()
+        """
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, CachedResponse] = {}
+        # keys of the entries created by put(), kept by shrink()
+        self._pinned: Set[Hashable] = set()
+        self._lock = threading.Lock()
+        # statistics of get_or_render()
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, key: Hashable, body: str, content_type: str = "text/html; charset=utf-8") -> CachedResponse:
+        entry = CachedResponse(body.encode('utf-8'), content_type)
+
+        with self._lock:
+            self._entries[key] = entry
+            self._pinned.add(key)
+
+        return entry
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        return self._entries.get(key)
+
+    def get_or_render(self, key: Hashable, render: Callable[[], str]) -> CachedResponse:
+        """
+        Get cached response, render and cache it if missing (as long as the cache is not full)
+        """
+        entry = self._entries.get(key)
+
+        if entry is not None:
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        entry = CachedResponse(render().encode('utf-8'))
+
+        with self._lock:
+            if len(self._entries) < self.max_entries:
+                self._entries.setdefault(key, entry)
+
+        return entry
+
+    def shrink(self) -> int:
+        """
+        Drop the entries created on demand by get_or_render()
+        :return: number of dropped entries
+        """
+        with self._lock:
+            dropped = [key for key in self._entries if key not in self._pinned]
+
+            for key in dropped:
+                del self._entries[key]
+
+        return len(dropped)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+__all__ = ['CachedResponse', 'ResponseCache']
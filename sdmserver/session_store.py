@@ -0,0 +1,284 @@
+# pylint: disable=line-too-long
+
+"""
+Bounded TTL session stores used by the /validate endpoint.
+
+Sessions are keyed by compact binary keys derived from the verified UID and SDMReadCtr,
+so the key space is bounded by the number of genuine taps and not by the URL text
+an attacker decides to send.
+"""
+
+import heapq
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import sqlite3
+
+
+def session_key(uid: bytes, read_ctr: Optional[int]) -> bytes:
+    """
+    Build a compact session key out of verified SUN message contents
+    :param uid: UID of the tag (7 bytes)
+    :param read_ctr: SDMReadCtr as integer (or None if the counter is not mirrored)
+    :return: session key (bytes)
+    """
+    if read_ctr is None:
+        return uid
+
+    return uid + struct.pack(">I", read_ctr)[1:]
+
+
+class SessionStore:
+    """
+    Interface of a session store, mapping session keys to the time of the first access.
+    """
+
+    def claim(self, key: bytes, now: Optional[float] = None) -> Tuple[float, bool]:
+        """
+        Return the time of the first access for the given key, recording it if not known yet
+        :param key: session key (see session_key())
+        :param now: current timestamp (default: time.time())
+        :return: tuple (first access timestamp, whether the entry was created by this call)
+        """
+        raise NotImplementedError()
+
+    def purge(self, now: Optional[float] = None) -> int:
+        """
+        Remove all expired entries
+        :param now: current timestamp (default: time.time())
+        :return: number of removed entries
+        """
+        raise NotImplementedError()
+
+    def __len__(self) -> int:
+        raise NotImplementedError()
+
+
+class MemorySessionStore(SessionStore):
+    """
+    In-process session store with min-heap expiry and a hard cap on the number of entries.
+
+    Expired entries are evicted incrementally on each claim() (at most `purge_batch` entries per call),
+    so the cost of cleaning up is amortised over the requests instead of stalling a single one.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, purge_batch: int = 32):
+        """
+        :param ttl: how long (in seconds) an entry is retained after the first access
+        :param max_entries: hard cap on the number of entries, the soonest expiring ones are evicted first
+        :param purge_batch: maximum number of expired entries evicted on each claim()
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries must be positive.")
+
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.purge_batch = purge_batch
+
+        self._lock = threading.Lock()
+        self._entries: Dict[bytes, float] = {}
+        self._heap: List[Tuple[float, bytes]] = []
+
+    def _evict(self, now: float, limit: Optional[int]) -> int:
+        evicted = 0
+
+        while self._heap and (limit is None or evicted < limit):
+            expires_at, key = self._heap[0]
+
+            if expires_at > now:
+                break
+
+            heapq.heappop(self._heap)
+
+            # lazy deletion, the heap might contain stale items
+            first_access = self._entries.get(key)
+
+            if first_access is not None and first_access + self.ttl == expires_at:
+                del self._entries[key]
+                evicted += 1
+
+        return evicted
+
+    def _evict_oldest(self):
+        while self._heap:
+            expires_at, key = heapq.heappop(self._heap)
+            first_access = self._entries.get(key)
+
+            if first_access is not None and first_access + self.ttl == expires_at:
+                del self._entries[key]
+                return
+
+    def claim(self, key: bytes, now: Optional[float] = None) -> Tuple[float, bool]:
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            self._evict(now, self.purge_batch)
+            first_access = self._entries.get(key)
+
+            if first_access is not None:
+                if first_access + self.ttl > now:
+                    return first_access, False
+
+                # expired, but not yet reached by the incremental eviction
+                del self._entries[key]
+
+            while len(self._entries) >= self.max_entries:
+                self._evict_oldest()
+
+            self._entries[key] = now
+            heapq.heappush(self._heap, (now + self.ttl, key))
+            return now, True
+
+    def purge(self, now: Optional[float] = None) -> int:
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            return self._evict(now, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    Session store backed by a SQLite database file, which can be shared by all worker processes on a host.
+    """
+
+    def __init__(self, path: str, ttl: float, max_entries: int, purge_interval: float = 5.0):
+        """
+        :param path: path to the database file
+        :param ttl: how long (in seconds) an entry is retained after the first access
+        :param max_entries: hard cap on the number of entries, the soonest expiring ones are evicted first
+        :param purge_interval: minimum interval (in seconds) between two purges of the expired entries
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries must be positive.")
+
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.purge_interval = purge_interval
+
+        self._local = threading.local()
+        self._last_purge = 0.0
+
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions ("
+                         "key BLOB PRIMARY KEY, first_access REAL NOT NULL, expires_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+
+    def _connect(self) -> "sqlite3.Connection":
+        # connections can't be shared across threads nor inherited through fork()
+        conn = getattr(self._local, "conn", None)
+
+        if conn is None or self._local.pid != os.getpid():
+            # imported only by this backend, the memory one doesn't pay for it at startup
+            import sqlite3  # pylint: disable=import-outside-toplevel
+
+            conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+
+        return conn
+
+    def claim(self, key: bytes, now: Optional[float] = None) -> Tuple[float, bool]:
+        if now is None:
+            now = time.time()
+
+        if now - self._last_purge >= self.purge_interval:
+            self.purge(now)
+
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+
+        try:
+            row = conn.execute("SELECT first_access, expires_at FROM sessions WHERE key = ?", (key,)).fetchone()
+
+            if row is not None and row[1] > now:
+                conn.execute("COMMIT")
+                return row[0], False
+
+            conn.execute("INSERT OR REPLACE INTO sessions (key, first_access, expires_at) VALUES (?, ?, ?)",
+                         (key, now, now + self.ttl))
+            excess = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] - self.max_entries
+
+            if excess > 0:
+                conn.execute("DELETE FROM sessions WHERE key IN "
+                             "(SELECT key FROM sessions WHERE key != ? ORDER BY expires_at LIMIT ?)", (key, excess))
+
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        return now, True
+
+    def purge(self, now: Optional[float] = None) -> int:
+        if now is None:
+            now = time.time()
+
+        self._last_purge = now
+        return self._connect().execute("DELETE FROM sessions WHERE expires_at <= ?", (now,)).rowcount
+
+    def __len__(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class ShardedSessionStore(SessionStore):
+    """
+    Session store partitioned by key over several independently locked stores,
+    so the concurrent requests (threaded workers, free-threaded Python) don't contend on a single lock.
+    """
+
+    def __init__(self, shards: List[SessionStore]):
+        self.shards = shards
+
+    def _shard(self, key: bytes) -> SessionStore:
+        return self.shards[zlib.crc32(key) % len(self.shards)]
+
+    def claim(self, key: bytes, now: Optional[float] = None) -> Tuple[float, bool]:
+        return self._shard(key).claim(key, now)
+
+    def purge(self, now: Optional[float] = None) -> int:
+        return sum(shard.purge(now) for shard in self.shards)
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self.shards)
+
+
+def create_session_store(backend: str, ttl: float, max_entries: int, sqlite_path: Optional[str] = None, shards: int = 16) -> SessionStore:
+    """
+    Create session store according to the configuration
+    :param backend: "memory" (per-process) or "sqlite" (shared by all processes using the same file)
+    :param ttl: how long (in seconds) an entry is retained after the first access
+    :param max_entries: hard cap on the number of entries
+    :param sqlite_path: path to the database file (only for "sqlite" backend)
+    :param shards: number of independently locked partitions (only for "memory" backend)
+    :return: session store
+    """
+    if backend == "memory":
+        if shards <= 1:
+            return MemorySessionStore(ttl=ttl, max_entries=max_entries)
+
+        return ShardedSessionStore([MemorySessionStore(ttl=ttl, max_entries=max(max_entries // shards, 1))
+                                    for _ in range(shards)])
+
+    if backend == "sqlite":
+        if not sqlite_path:
+            raise RuntimeError("Path to the database file is required for the sqlite session backend.")
+
+        return SqliteSessionStore(sqlite_path, ttl=ttl, max_entries=max_entries)
+
+    raise RuntimeError("Invalid session backend.")
+
+
+__all__ = ['SessionStore', 'MemorySessionStore', 'ShardedSessionStore', 'SqliteSessionStore', 'session_key', 'create_session_store']
@@ -0,0 +1,233 @@
+# pylint: disable=line-too-long
+
+"""
+UID-sharded request routing.
+
+Every tag is owned by exactly one node (or worker process), chosen by consistent hashing of its UID,
+so the per-tag state (sessions, counters) can be kept in the memory of the owning node.
+The UID is obtained by decrypting PICCData with K_SDMMetaReadKey, which is cheap compared to the full
+verification, and the request is then either handled locally or forwarded to the owner.
+
+Forwarded requests carry a timestamped HMAC of the request under a secret shared by the cluster, so a client
+can't make a node serve a tag it doesn't own by sending the forwarding header itself.
+"""
+
+import bisect
+import hashlib
+import hmac
+import http.client
+import time
+import urllib.parse
+from typing import Callable, Iterable, List, Optional, Tuple
+
+FORWARDED_HEADER = "X-SDM-Shard-Forwarded"
+SHARD_HEADER = "X-SDM-Shard"
+
+# headers which must not be passed through by the forwarding node
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+                      "te", "trailers", "transfer-encoding", "upgrade", "content-length"}
+
+ForwardResult = Tuple[str, List[Tuple[str, str]], bytes]
+
+# maximum age (and clock skew between the nodes) of a forwarded request in seconds
+FORWARD_MAX_AGE = 60
+
+
+class HashRing:
+    """
+    Consistent hash ring with virtual nodes.
+    """
+
+    def __init__(self, nodes: Iterable[str], vnodes: int = 64):
+        """
+        :param nodes: node identifiers (e.g. base URLs)
+        :param vnodes: number of points on the ring per node
+        """
+        self.nodes = list(nodes)
+
+        if not self.nodes:
+            raise ValueError("At least one node is required.")
+
+        points = []
+
+        for node in self.nodes:
+            for i in range(vnodes):
+                points.append((self._hash(f"{node}#{i}".encode('utf-8')), node))
+
+        points.sort()
+        self._points = [p[0] for p in points]
+        self._owners = [p[1] for p in points]
+
+    @staticmethod
+    def _hash(data: bytes) -> int:
+        return int.from_bytes(hashlib.sha256(data).digest()[:8], byteorder='big')
+
+    def node_for(self, key: bytes) -> str:
+        """
+        Find the node owning the given key
+        :param key: routing key (e.g. UID)
+        :return: node identifier
+        """
+        idx = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[idx]
+
+
+def _forward_mac(secret: bytes, timestamp: int, environ: dict) -> str:
+    msg = "\n".join([str(timestamp), environ.get("REQUEST_METHOD", "GET"), environ.get("PATH_INFO", "/"), environ.get("QUERY_STRING", "")])
+    return hmac.new(secret, msg.encode('utf-8'), digestmod=hashlib.sha256).hexdigest()
+
+
+def sign_forwarded(secret: bytes, environ: dict, now: Optional[float] = None) -> str:
+    """
+    Create value of the forwarding header for the request
+    :param secret: secret shared by all nodes
+    :param environ: WSGI environment of the request
+    :param now: current UNIX time (default: time.time())
+    :return: header value "<timestamp>:<HMAC of the timestamp, method, path and query>"
+    """
+    timestamp = int(time.time() if now is None else now)
+    return f"{timestamp}:{_forward_mac(secret, timestamp, environ)}"
+
+
+def verify_forwarded(secret: bytes, environ: dict, max_age: float = FORWARD_MAX_AGE, now: Optional[float] = None) -> bool:
+    """
+    Check that the request was forwarded by another node of the cluster
+    :param secret: secret shared by all nodes
+    :param environ: WSGI environment of the request
+    :param max_age: maximum age of the signature in seconds
+    :param now: current UNIX time (default: time.time())
+    :return: True if the forwarding header is present and valid
+    """
+    value = environ.get("HTTP_" + FORWARDED_HEADER.upper().replace("-", "_"), "")
+    timestamp, _, mac = value.partition(":")
+
+    if not timestamp.isdigit():
+        return False
+
+    if abs((time.time() if now is None else now) - int(timestamp)) > max_age:
+        return False
+
+    return hmac.compare_digest(mac, _forward_mac(secret, int(timestamp), environ))
+
+
+def http_forward(node: str, environ: dict, signature: str, timeout: float = 10.0) -> ForwardResult:
+    """
+    Forward WSGI request to another node over HTTP
+    :param node: base URL of the node, e.g. http://10.0.0.2:5000
+    :param environ: WSGI environment of the request
+    :param signature: value of the forwarding header (see sign_forwarded)
+    :param timeout: socket timeout in seconds
+    :return: tuple (status line, headers, body)
+    """
+    url = urllib.parse.urlsplit(node)
+    conn_cls = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+    conn = conn_cls(url.netloc, timeout=timeout)
+
+    path = url.path.rstrip("/") + environ.get("PATH_INFO", "/")
+
+    if environ.get("QUERY_STRING"):
+        path += "?" + environ["QUERY_STRING"]
+
+    body = None
+    length = environ.get("CONTENT_LENGTH")
+
+    if length:
+        body = environ["wsgi.input"].read(int(length))
+
+    headers = {}
+
+    for key, value in environ.items():
+        if key.startswith("HTTP_"):
+            name = key[5:].replace("_", "-").title()
+
+            if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() not in ("host", FORWARDED_HEADER.lower()):
+                headers[name] = value
+
+    headers[FORWARDED_HEADER] = signature
+
+    if environ.get("CONTENT_TYPE"):
+        headers["Content-Type"] = environ["CONTENT_TYPE"]
+
+    headers["X-Forwarded-For"] = environ.get("REMOTE_ADDR", "")
+
+    try:
+        conn.request(environ.get("REQUEST_METHOD", "GET"), path, body=body, headers=headers)
+        resp = conn.getresponse()
+        resp_body = resp.read()
+        resp_headers = [(k, v) for k, v in resp.getheaders() if k.lower() not in HOP_BY_HOP_HEADERS]
+        return f"{resp.status} {resp.reason}", resp_headers, resp_body
+    finally:
+        conn.close()
+
+
+class ShardRouter:
+    """
+    WSGI middleware routing the requests of the given paths to the node owning the tag.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self,
+                 app: Callable,
+                 ring: HashRing,
+                 self_node: str,
+                 extract_uid: Callable[[dict], Optional[bytes]],
+                 paths: Iterable[str],
+                 secret: bytes,
+                 forward: Callable[[str, dict, str], ForwardResult] = http_forward,
+                 max_age: float = FORWARD_MAX_AGE):
+        """
+        :param app: WSGI application handling the locally owned requests
+        :param ring: hash ring of all nodes
+        :param self_node: identifier of this node (must be a member of the ring)
+        :param extract_uid: function returning UID of the tag for the WSGI environment (None if unknown)
+        :param paths: paths which should be routed
+        :param secret: secret shared by all nodes, authenticates the forwarded requests
+        :param forward: function forwarding the request to the given node (node, environ, signature)
+        :param max_age: maximum age of a forwarded request in seconds
+        """
+        if self_node not in ring.nodes:
+            raise ValueError("This node is not a member of the hash ring.")
+
+        self.app = app
+        self.ring = ring
+        self.self_node = self_node
+        self.extract_uid = extract_uid
+        self.paths = set(paths)
+        self.secret = secret
+        self.forward = forward
+        self.max_age = max_age
+
+    def owner_of(self, environ: dict) -> str:
+        if environ.get("PATH_INFO") not in self.paths:
+            return self.self_node
+
+        if verify_forwarded(self.secret, environ, self.max_age):
+            return self.self_node
+
+        uid = self.extract_uid(environ)
+
+        if uid is None:
+            # malformed or undecryptable message, will be rejected locally
+            return self.self_node
+
+        return self.ring.node_for(uid)
+
+    def __call__(self, environ, start_response):
+        owner = self.owner_of(environ)
+
+        if owner == self.self_node:
+            def start_response_local(status, headers, exc_info=None):
+                return start_response(status, headers + [(SHARD_HEADER, self.self_node)], exc_info)
+
+            return self.app(environ, start_response_local)
+
+        try:
+            status, headers, body = self.forward(owner, environ, sign_forwarded(self.secret, environ))
+        except OSError:
+            status, headers, body = "502 Bad Gateway", [("Content-Type", "text/plain")], b"Shard is unavailable.\n"
+
+        start_response(status, headers + [("Content-Length", str(len(body)))])
+        return [body]
+
+
+__all__ = ['HashRing', 'ShardRouter', 'http_forward', 'sign_forwarded', 'verify_forwarded', 'SHARD_HEADER', 'FORWARDED_HEADER']
@@ -0,0 +1,109 @@
+# pylint: disable=line-too-long
+
+"""
+Coalescing of identical verifications.
+
+The same tap URL is often requested several times within a few seconds (link previews, browser prefetch,
+refreshes). Concurrent duplicates wait for a single computation and the successful result is kept
+for a short time, so the repeats don't run the key derivation and the decryption again.
+
+Only the pure verification result is shared, the per-request side effects (e.g. session store claims)
+are still performed by each request.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    def __init__(self, ttl: float = 3.0, max_entries: int = 10000):
+        """
+        Single-flight executor with short-lived cache of the successful results
+        :param ttl: how long (in seconds) the successful result is reused (0 - only coalesce concurrent calls)
+        :param max_entries: maximum number of cached results, the least recently used are evicted
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        # statistics: served from the cache, joined a computation in progress, computed
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._results: Dict[Hashable, Tuple[float, Any]] = OrderedDict()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """
+        Return fn() result for the key, computed at most once for the concurrent callers
+        :param key: canonical identity of the computation
+        :param fn: computation, exceptions are propagated to all the waiting callers and never cached
+        """
+        with self._lock:
+            cached = self._results.get(key)
+
+            if cached is not None:
+                if cached[0] > time.monotonic():
+                    self._results.move_to_end(key)
+                    self.hits += 1
+                    return cached[1]
+
+                del self._results[key]
+
+            call = self._calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = self._calls[key] = _Call()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+                if call.error is None and self.ttl > 0:
+                    self._results[key] = (time.monotonic() + self.ttl, call.result)
+
+                    while len(self._results) > self.max_entries:
+                        self._results.popitem(last=False)
+
+            call.done.set()
+
+        return call.result
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+
+__all__ = ['SingleFlight']
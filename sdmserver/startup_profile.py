@@ -0,0 +1,110 @@
+# pylint: disable=line-too-long
+
+"""
+Import-time breakdown of the worker startup.
+
+The module is imported in a fresh interpreter with `-X importtime`, so the measurement includes everything
+a new worker does at import time (including the module-level initialization of the application).
+
+Usage:
+    python3 -m sdmserver.startup_profile app
+"""
+
+import argparse
+import subprocess
+import sys
+from collections import defaultdict
+from typing import List, NamedTuple, Optional
+
+
+class ImportTime(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(output: str) -> List[ImportTime]:
+    """
+    Parse output of `python -X importtime`
+    """
+    entries = []
+
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+
+        parts = line[len("import time:"):].split("|")
+
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            # header line
+            continue
+
+        name = parts[2].rstrip()
+        stripped = name.lstrip()
+        entries.append(ImportTime(module=stripped,
+                                  self_us=int(parts[0]),
+                                  cumulative_us=int(parts[1]),
+                                  depth=(len(name) - len(stripped) - 1) // 2))
+
+    return entries
+
+
+def measure_imports(module: str, cwd: Optional[str] = None) -> List[ImportTime]:
+    """
+    Import the module in a fresh interpreter and collect its import times
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=cwd, capture_output=True, text=True, check=False)
+
+    if proc.returncode != 0:
+        raise RuntimeError(f"Failed to import {module}:\n{proc.stderr}")
+
+    return parse_importtime(proc.stderr)
+
+
+def format_report(module: str, entries: List[ImportTime], top: int = 15) -> str:
+    """
+    Format the import times: total, time per top-level package and the slowest modules
+    """
+    total = sum(e.self_us for e in entries)
+    own = next((e for e in entries if e.module == module), None)
+    packages = defaultdict(int)
+
+    for e in entries:
+        packages[e.module.split(".", 1)[0]] += e.self_us
+
+    lines = [f"Import of {module}: {total / 1000:.1f} ms total"]
+
+    if own is not None:
+        lines.append(f"  module body of {module} (initialization): {own.self_us / 1000:.1f} ms")
+
+    lines.append("")
+    lines.append("By package (self time):")
+
+    for name, us in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        lines.append(f"  {us / 1000:8.1f} ms  {us * 100 / max(total, 1):5.1f}%  {name}")
+
+    lines.append("")
+    lines.append("Slowest modules (self time):")
+
+    for e in sorted(entries, key=lambda e: -e.self_us)[:top]:
+        lines.append(f"  {e.self_us / 1000:8.1f} ms  {e.module}")
+
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print import-time breakdown of a module')
+    parser.add_argument('module', type=str, help='module to import (e.g. app)')
+    parser.add_argument('--top', type=int, default=15, help='number of the listed packages and modules')
+
+    args = parser.parse_args()
+    print(format_report(args.module, measure_imports(args.module), top=args.top))
+
+
+if __name__ == "__main__":
+    main()
+
+
+__all__ = ['ImportTime', 'parse_importtime', 'measure_imports', 'format_report']
@@ -0,0 +1,140 @@
+# pylint: disable=line-too-long
+
+"""
+Per-request stage timing, reported in the Server-Timing response header and shared with the metrics.
+
+StageRecorder is the single source of the stage durations: the application stages (parse, verify, store, render)
+are timed with StageRecorder.stage() and the stages inside libsdm (derive, picc, sdmmac, file, ...) arrive
+as libsdm.hooks events. Every finished stage is passed to the observer (e.g. a metrics histogram) and added
+to the timer of the current request, if ServerTimingMiddleware started one.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+from libsdm import hooks
+
+# stage name -> Server-Timing metric name, the stages mapping to the same metric are summed up
+SERVER_TIMING_METRICS = {
+    "parse": "parse",
+    hooks.STAGE_DERIVE: "derive",
+    hooks.STAGE_PICC: "decrypt",
+    hooks.STAGE_FILE: "decrypt",
+    hooks.STAGE_SDMMAC: "mac",
+    "store": "store",
+    "render": "render",
+}
+
+
+class RequestTimer:
+    def __init__(self):
+        # insertion ordered, so the header lists the stages in the order they finished for the first time
+        self.durations: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+
+    def server_timing(self, metrics: Optional[Dict[str, str]] = None) -> str:
+        """
+        Format the value of the Server-Timing header (durations in milliseconds)
+        :param metrics: stage name -> reported metric name, the other stages are left out
+        """
+        if metrics is None:
+            metrics = SERVER_TIMING_METRICS
+
+        totals: Dict[str, float] = {}
+
+        for stage, seconds in self.durations.items():
+            name = metrics.get(stage)
+
+            if name is not None:
+                totals[name] = totals.get(name, 0.0) + seconds
+
+        return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in totals.items())
+
+
+_current_timer: ContextVar[Optional[RequestTimer]] = ContextVar("sdm_request_timer", default=None)
+
+
+def current_timer() -> Optional[RequestTimer]:
+    return _current_timer.get()
+
+
+class StageRecorder:
+    def __init__(self, observe: Optional[Callable[[str, float], None]] = None):
+        """
+        Time the stages, also usable as libsdm hook handler (see libsdm.hooks.register)
+        :param observe: called with the stage name and its duration (in seconds) after each stage
+        """
+        self.observe = observe
+        self._local = threading.local()
+
+    def record(self, stage: str, seconds: float):
+        if self.observe is not None:
+            self.observe(stage, seconds)
+
+        timer = _current_timer.get()
+
+        if timer is not None:
+            timer.add(stage, seconds)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def __call__(self, event: str, stage: str, size: int):
+        stack = getattr(self._local, "stack", None)
+
+        if stack is None:
+            stack = self._local.stack = []
+
+        if event == hooks.START:
+            stack.append(time.perf_counter())
+        elif stack:
+            self.record(stage, time.perf_counter() - stack.pop())
+
+
+class ServerTimingMiddleware:
+    def __init__(self, app: Callable, paths: Iterable[str], metrics: Optional[Dict[str, str]] = None):
+        """
+        Add Server-Timing header with the stage durations to the responses
+        :param app: WSGI application
+        :param paths: paths of the timed endpoints
+        :param metrics: stage name -> reported metric name (default: SERVER_TIMING_METRICS)
+        """
+        self.app = app
+        self.paths = frozenset(paths)
+        self.metrics = metrics if metrics is not None else SERVER_TIMING_METRICS
+
+    def __call__(self, environ, start_response):
+        if environ.get("PATH_INFO") not in self.paths:
+            return self.app(environ, start_response)
+
+        timer = RequestTimer()
+
+        def timing_start_response(status, headers, exc_info=None):
+            # the view has finished at this point, the body is already rendered
+            value = timer.server_timing(self.metrics)
+
+            if value:
+                headers = list(headers) + [("Server-Timing", value)]
+
+            return start_response(status, headers, exc_info)
+
+        token = _current_timer.set(timer)
+
+        try:
+            return self.app(environ, timing_start_response)
+        finally:
+            _current_timer.reset(token)
+
+
+__all__ = ['RequestTimer', 'StageRecorder', 'ServerTimingMiddleware', 'SERVER_TIMING_METRICS', 'current_timer']
@@ -0,0 +1,441 @@
+# pylint: disable=line-too-long
+
+"""
+Verification daemon for internal services, speaking a compact binary protocol over a Unix domain socket
+(or localhost TCP).
+
+Every frame is prefixed with its length (uint32, big endian). Requests may be pipelined, the responses
+are returned in the order of the requests on the connection. The daemon processes the requests of a connection
+one by one and blocks while its responses aren't read, so the client keeps at most PIPELINE_WINDOW requests
+outstanding (their responses must fit into the socket buffers).
+
+Request:  request_id (u32), op (u8), flags (u8), fields
+    op 1 - SUN message:       fields picc_enc_data, enc_file_data, sdmmac, key_version; flags bit 0 - bulk parameter mode
+    op 2 - plaintext SUN:     fields uid, read_ctr, sdmmac, key_version
+Response: request_id (u32), status (u8), enc_mode (u8), read_ctr (u32), fields uid, file_data, key_version, error
+    status 0 - valid, 1 - invalid message, 2 - malformed request
+    enc_mode 0 - AES, 1 - LRP, 255 - unknown; read_ctr 0xFFFFFFFF - not mirrored
+
+Each field is prefixed with its length (uint16, big endian), empty field means "not present".
+"""
+
+import os
+import queue
+import socket
+import socketserver
+import stat
+import struct
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple, Union
+
+from libsdm.key_registry import KeyRegistry
+from libsdm.sdm import EncMode, InvalidMessage, ParamMode
+
+Address = Union[str, Tuple[str, int]]
+
+FRAME_HEADER = struct.Struct(">I")
+REQUEST_HEADER = struct.Struct(">IBB")
+RESPONSE_HEADER = struct.Struct(">IBBI")
+FIELD_HEADER = struct.Struct(">H")
+
+MAX_FRAME_SIZE = 64 * 1024
+
+# maximum number of requests sent by VerifyClient.pipeline() before reading their responses
+PIPELINE_WINDOW = 64
+
+OP_SUN = 1
+OP_PLAIN = 2
+FLAG_BULK = 0x01
+
+STATUS_OK = 0
+STATUS_INVALID = 1
+STATUS_BAD_REQUEST = 2
+
+NO_ENC_MODE = 0xFF
+NO_READ_CTR = 0xFFFFFFFF
+
+
+def pack_fields(*fields: Optional[bytes]) -> bytes:
+    return b"".join(FIELD_HEADER.pack(len(f or b"")) + (f or b"") for f in fields)
+
+
+def unpack_fields(buf: bytes, offset: int, count: int) -> List[Optional[bytes]]:
+    fields = []
+
+    for _ in range(count):
+        length, = FIELD_HEADER.unpack_from(buf, offset)
+        offset += FIELD_HEADER.size
+        field = buf[offset:offset + length]
+
+        if len(field) != length:
+            raise ValueError("Truncated field.")
+
+        fields.append(field or None)
+        offset += length
+
+    return fields
+
+
+def parse_address(address: Address) -> Address:
+    """
+    Parse "host:port" to TCP address tuple, anything else is a path of the Unix domain socket
+    """
+    if isinstance(address, str) and "/" not in address and ":" in address:
+        host, port = address.rsplit(":", 1)
+        return host, int(port)
+
+    return address
+
+
+def read_frame(rfile) -> Optional[bytes]:
+    header = rfile.read(FRAME_HEADER.size)
+
+    if len(header) < FRAME_HEADER.size:
+        return None
+
+    length, = FRAME_HEADER.unpack(header)
+
+    if length > MAX_FRAME_SIZE:
+        raise ValueError("Frame is too large.")
+
+    payload = rfile.read(length)
+
+    if len(payload) < length:
+        return None
+
+    return payload
+
+
+class KeyCache:
+    def __init__(self, max_entries: int = 100000):
+        """
+        Thread-safe LRU cache of the derived tag keys, usable as file_key_cache of KeyRegistry.decrypt_sun_message()
+        """
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+
+            if value is not None:
+                self._entries.move_to_end(key)
+
+            return value
+
+    def __setitem__(self, key: Hashable, value: bytes):
+        with self._lock:
+            self._entries[key] = value
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class Verifier:
+    def __init__(self, key_registry: KeyRegistry, require_lrp: bool = False, key_cache_size: int = 100000):
+        """
+        Request processor of the daemon
+        :param key_registry: registry of the master keys
+        :param require_lrp: reject messages not using LRP
+        :param key_cache_size: number of derived tag keys kept across the connections
+        """
+        self.key_registry = key_registry
+        self.require_lrp = require_lrp
+        self.key_cache = KeyCache(key_cache_size)
+
+    def _verify(self, op: int, flags: int, fields: List[Optional[bytes]]) -> dict:
+        key_version = fields[3].decode("utf-8") if fields[3] else None
+
+        if op == OP_SUN:
+            picc_enc_data, enc_file_data, sdmmac, _ = fields
+
+            if not picc_enc_data or not sdmmac:
+                raise ValueError("PICCEncData and SDMMAC are required.")
+
+            res = self.key_registry.decrypt_sun_message(param_mode=ParamMode.BULK if flags & FLAG_BULK else ParamMode.SEPARATED,
+                                                        picc_enc_data=picc_enc_data,
+                                                        sdmmac=sdmmac,
+                                                        enc_file_data=enc_file_data,
+                                                        version_hint=key_version,
+                                                        file_key_cache=self.key_cache)
+        elif op == OP_PLAIN:
+            uid, read_ctr, sdmmac, _ = fields
+
+            if not uid or not read_ctr or not sdmmac:
+                raise ValueError("UID, read counter and SDMMAC are required.")
+
+            res = self.key_registry.validate_plain_sun(uid=uid, read_ctr=read_ctr, sdmmac=sdmmac, version_hint=key_version)
+        else:
+            raise ValueError("Unknown operation.")
+
+        if self.require_lrp and res['encryption_mode'] != EncMode.LRP:
+            raise InvalidMessage("Invalid encryption mode, expected LRP.")
+
+        return res
+
+    def process(self, payload: bytes) -> bytes:
+        """
+        Process single request frame
+        :return: response frame payload
+        """
+        request_id = 0
+
+        try:
+            request_id, op, flags = REQUEST_HEADER.unpack_from(payload, 0)
+            fields = unpack_fields(payload, REQUEST_HEADER.size, 4)
+            res = self._verify(op, flags, fields)
+        except InvalidMessage as exc:
+            return RESPONSE_HEADER.pack(request_id, STATUS_INVALID, NO_ENC_MODE, NO_READ_CTR) + pack_fields(None, None, None, str(exc).encode("utf-8"))
+        except (ValueError, UnicodeDecodeError, struct.error) as exc:
+            return RESPONSE_HEADER.pack(request_id, STATUS_BAD_REQUEST, NO_ENC_MODE, NO_READ_CTR) + pack_fields(None, None, None, str(exc).encode("utf-8"))
+
+        read_ctr = res['read_ctr'] if res['read_ctr'] is not None else NO_READ_CTR
+        return RESPONSE_HEADER.pack(request_id, STATUS_OK, res['encryption_mode'].value, read_ctr) \
+            + pack_fields(res['uid'], res.get('file_data'), res['key_version'].encode("utf-8"), None)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        verifier: Verifier = self.server.verifier  # type: ignore
+
+        while True:
+            try:
+                payload = read_frame(self.rfile)
+            except ValueError:
+                return
+
+            if payload is None:
+                return
+
+            response = verifier.process(payload)
+            self.wfile.write(FRAME_HEADER.pack(len(response)) + response)
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TcpHandler(_Handler):
+    # responses are small writes, don't let them wait for the ACK of the previous one
+    disable_nagle_algorithm = True
+
+
+class _TcpServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def _remove_stale_socket(path: str):
+    """
+    Remove the socket left behind by a daemon which is no longer running
+    :raises:
+        RuntimeError: if the path isn't a socket or another daemon is listening on it
+    """
+    try:
+        mode = os.stat(path).st_mode
+    except FileNotFoundError:
+        return
+
+    if not stat.S_ISSOCK(mode):
+        raise RuntimeError(f"{path} exists and it's not a socket.")
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except ConnectionRefusedError:
+            os.unlink(path)
+            return
+
+    raise RuntimeError(f"Another daemon is listening on {path}.")
+
+
+def create_server(address: Address, verifier: Verifier) -> socketserver.BaseServer:
+    """
+    Create the daemon server (call serve_forever() to run it)
+    :param address: path of the Unix domain socket or (host, port) tuple
+    """
+    address = parse_address(address)
+
+    if isinstance(address, str):
+        _remove_stale_socket(address)
+
+        server: socketserver.BaseServer = _UnixServer(address, _Handler)
+    else:
+        server = _TcpServer(address, _TcpHandler)
+
+    server.verifier = verifier  # type: ignore
+    return server
+
+
+class _Connection:
+    def __init__(self, address: Address, timeout: float):
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(address)
+
+        if family == socket.AF_INET:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        self.rfile = self.sock.makefile("rb")
+        self.next_id = 0
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+class VerifyClient:
+    def __init__(self, address: Address, pool_size: int = 4, timeout: float = 5.0, window: int = PIPELINE_WINDOW):
+        """
+        Client of the verification daemon with a pool of persistent connections, safe to share between threads
+        :param address: path of the Unix domain socket, "host:port" or (host, port) tuple
+        :param pool_size: maximum number of idle connections kept open
+        :param timeout: socket timeout in seconds
+        :param window: maximum number of pipelined requests waiting for their responses
+        """
+        self.address = parse_address(address)
+        self.timeout = timeout
+        self.window = max(window, 1)
+        self._pool: "queue.LifoQueue[_Connection]" = queue.LifoQueue(maxsize=pool_size)
+
+    def _acquire(self) -> _Connection:
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return _Connection(self.address, self.timeout)
+
+    def _release(self, conn: _Connection):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    @staticmethod
+    def sun_request(param_mode: ParamMode, picc_enc_data: bytes, sdmmac: bytes, enc_file_data: Optional[bytes] = None, key_version: Optional[str] = None) -> Tuple[int, int, List[Optional[bytes]]]:
+        flags = FLAG_BULK if param_mode == ParamMode.BULK else 0
+        return OP_SUN, flags, [picc_enc_data, enc_file_data, sdmmac, key_version.encode("utf-8") if key_version else None]
+
+    @staticmethod
+    def plain_request(uid: bytes, read_ctr: bytes, sdmmac: bytes, key_version: Optional[str] = None) -> Tuple[int, int, List[Optional[bytes]]]:
+        return OP_PLAIN, 0, [uid, read_ctr, sdmmac, key_version.encode("utf-8") if key_version else None]
+
+    @staticmethod
+    def _parse_response(payload: bytes) -> Tuple[int, Union[dict, Exception]]:
+        request_id, status, enc_mode, read_ctr = RESPONSE_HEADER.unpack_from(payload, 0)
+        uid, file_data, key_version, error = unpack_fields(payload, RESPONSE_HEADER.size, 4)
+
+        if status == STATUS_INVALID:
+            return request_id, InvalidMessage((error or b"").decode("utf-8"))
+
+        if status != STATUS_OK:
+            return request_id, RuntimeError((error or b"").decode("utf-8"))
+
+        return request_id, {
+            "uid": uid,
+            "read_ctr": read_ctr if read_ctr != NO_READ_CTR else None,
+            "encryption_mode": EncMode(enc_mode),
+            "file_data": file_data,
+            "key_version": (key_version or b"").decode("utf-8"),
+        }
+
+    def _receive(self, conn: _Connection, expected_id: int) -> Union[dict, Exception]:
+        payload = read_frame(conn.rfile)
+
+        if payload is None:
+            raise ConnectionError("Connection closed by the daemon.")
+
+        request_id, result = self._parse_response(payload)
+
+        if request_id != expected_id:
+            raise ConnectionError("Out of order response.")
+
+        return result
+
+    def pipeline(self, requests: Iterable[Tuple[int, int, List[Optional[bytes]]]]) -> List[Union[dict, Exception]]:
+        """
+        Send the requests without waiting for each response and collect their results, at most `window`
+        requests are outstanding, so neither side blocks on full socket buffers
+        :param requests: requests built by sun_request() or plain_request()
+        :return: for each request, either the result dict or the exception (InvalidMessage or RuntimeError)
+        """
+        conn = self._acquire()
+        # sent in chunks of half the window, so the next chunk is on its way while the responses are read
+        chunk_size = max(self.window // 2, 1)
+
+        try:
+            pending: "deque[int]" = deque()
+            results: List[Any] = []
+            frames: List[bytes] = []
+            ids: List[int] = []
+
+            def flush():
+                while pending and len(pending) + len(frames) > self.window:
+                    results.append(self._receive(conn, pending.popleft()))
+
+                conn.sock.sendall(b"".join(frames))
+                pending.extend(ids)
+                frames.clear()
+                ids.clear()
+
+            for op, flags, fields in requests:
+                conn.next_id = (conn.next_id + 1) & 0xFFFFFFFF
+                payload = REQUEST_HEADER.pack(conn.next_id, op, flags) + pack_fields(*fields)
+                frames.append(FRAME_HEADER.pack(len(payload)) + payload)
+                ids.append(conn.next_id)
+
+                if len(frames) >= chunk_size:
+                    flush()
+
+            if frames:
+                flush()
+
+            while pending:
+                results.append(self._receive(conn, pending.popleft()))
+        except BaseException:
+            conn.close()
+            raise
+
+        self._release(conn)
+        return results
+
+    def _call(self, request: Tuple[int, int, List[Optional[bytes]]]) -> dict:
+        result = self.pipeline([request])[0]
+
+        if isinstance(result, Exception):
+            raise result
+
+        return result
+
+    def decrypt_sun_message(self, param_mode: ParamMode, picc_enc_data: bytes, sdmmac: bytes, enc_file_data: Optional[bytes] = None, key_version: Optional[str] = None) -> dict:
+        """
+        Decrypt and validate SUN message
+        :return: dict: uid, read_ctr, encryption_mode, file_data, key_version
+        :raises:
+            InvalidMessage: if SUN message is invalid
+        """
+        return self._call(self.sun_request(param_mode, picc_enc_data, sdmmac, enc_file_data, key_version))
+
+    def validate_plain_sun(self, uid: bytes, read_ctr: bytes, sdmmac: bytes, key_version: Optional[str] = None) -> dict:
+        """
+        Validate plaintext SUN message
+        :return: dict: uid, read_ctr, encryption_mode, file_data (None), key_version
+        :raises:
+            InvalidMessage: if SDMMAC is invalid
+        """
+        return self._call(self.plain_request(uid, read_ctr, sdmmac, key_version))
+
+
+__all__ = ['PIPELINE_WINDOW', 'Verifier', 'VerifyClient', 'KeyCache', 'create_server', 'parse_address']
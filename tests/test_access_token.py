@@ -0,0 +1,36 @@
+from sdmserver.access_token import issue_access_token, url_fingerprint, verify_access_token
+
+SECRET = b"\x11" * 32
+
+
+def test_access_token_roundtrip():
+    fingerprint = url_fingerprint("FD91EC264309878BE6345CBE53BADF40", "CEE9A53E3E463EF1F459635736738962", "ECC1E7F6C6C73BF6")
+    token = issue_access_token(SECRET, fingerprint, 1000.5, 1300.5)
+    res = verify_access_token(SECRET, token, fingerprint)
+
+    assert res.first_access == 1000
+    assert res.expires_at == 1300
+    assert res.fingerprint == fingerprint
+
+
+def test_access_token_fingerprint_case_insensitive():
+    assert url_fingerprint("abcdef", "01") == url_fingerprint("ABCDEF", "01")
+    assert url_fingerprint("abcdef", "01") != url_fingerprint("abcdef", "02")
+
+
+def test_access_token_invalid():
+    fingerprint = url_fingerprint("AA", "BB", "CC")
+    token = issue_access_token(SECRET, fingerprint, 1000, 1300)
+
+    # token issued for another URL
+    assert verify_access_token(SECRET, token, url_fingerprint("AA", "BB", "CD")) is None
+    # different secret
+    assert verify_access_token(b"\x22" * 32, token, fingerprint) is None
+    # tampered token
+    tampered = ("B" if token[5] != "B" else "C").join([token[:5], token[6:]])
+    assert verify_access_token(SECRET, tampered, fingerprint) is None
+    # garbage
+    assert verify_access_token(SECRET, None, fingerprint) is None
+    assert verify_access_token(SECRET, "", fingerprint) is None
+    assert verify_access_token(SECRET, "!!!", fingerprint) is None
+    assert verify_access_token(SECRET, token[:-4], fingerprint) is None
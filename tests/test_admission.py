@@ -0,0 +1,119 @@
+import threading
+import time
+
+from sdmserver.admission import AdmissionController, queued_time
+
+
+def _call(app, path, **environ):
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured['status'] = status
+        captured['headers'] = dict(headers)
+
+    result = app(dict(environ, PATH_INFO=path), start_response)
+    body = b"".join(result)
+
+    if hasattr(result, "close"):
+        result.close()
+
+    return captured['status'], captured['headers'], body
+
+
+def _ok_app(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [b"ok"]
+
+
+def test_queued_time():
+    assert queued_time({}) == 0.0
+    assert queued_time({"HTTP_X_REQUEST_START": "garbage"}) == 0.0
+    assert queued_time({"HTTP_X_REQUEST_START": "t=1700000000.5"}, now=1700000001.0) == 0.5
+    assert queued_time({"HTTP_X_REQUEST_START": "t=1700000000500"}, now=1700000001.0) == 0.5
+    assert queued_time({"HTTP_X_REQUEST_START": "1700000000500000"}, now=1700000001.0) == 0.5
+    assert queued_time({"HTTP_X_REQUEST_START": "t=1700000002.0"}, now=1700000001.0) == 0.0
+
+
+def test_admitted_and_service_time_tracked():
+    controller = AdmissionController(_ok_app, deadline=1.0, initial_service_time=0.5, alpha=0.5)
+    assert _call(controller, "/api/tag")[2] == b"ok"
+    assert controller.in_flight == 0
+    assert controller.admitted == 1
+    assert controller.service_time < 0.5
+
+
+def test_shedding_by_priority():
+    entered = threading.Event()
+    release = threading.Event()
+
+    def slow_app(environ, start_response):
+        entered.set()
+        release.wait(5)
+        return _ok_app(environ, start_response)
+
+    controller = AdmissionController(slow_app, deadline=1.0, initial_service_time=0.4)
+    worker = threading.Thread(target=lambda: _call(controller, "/api/tag"))
+    worker.start()
+    entered.wait(5)
+
+    # one request in progress: 0.8s expected, fits the priority deadline but not the demo page share
+    status, headers, _ = _call(controller, "/tag")
+    assert status == "503 Service Unavailable"
+    assert headers["Retry-After"] == "1"
+    assert controller.rejected == 1
+
+    release.set()
+    worker.join(5)
+
+
+def test_shedding_by_queue_time():
+    controller = AdmissionController(_ok_app, deadline=1.0, initial_service_time=0.1)
+    status, _, _ = _call(controller, "/api/tag", HTTP_X_REQUEST_START="t=1")
+    assert status.startswith("503")
+    assert controller.in_flight == 0
+
+
+def test_recovers_after_slow_request():
+    def app(environ, start_response):
+        if environ["PATH_INFO"] == "/api/tag/batch":
+            time.sleep(0.3)
+
+        return _ok_app(environ, start_response)
+
+    controller = AdmissionController(app, deadline=0.1, initial_service_time=0.001, alpha=0.5)
+    assert _call(controller, "/api/tag/batch")[0] == "200 OK"
+    assert controller.service_time > 0.1
+
+    # the worker is idle, so the fast requests are admitted and bring the estimate down
+    for _ in range(5):
+        assert _call(controller, "/api/tag")[0] == "200 OK"
+
+    assert controller.service_time < 0.1
+    assert controller.rejected == 0
+
+
+def test_estimate_decays():
+    entered = threading.Event()
+    release = threading.Event()
+
+    def app(environ, start_response):
+        if environ["PATH_INFO"] == "/api/slow":
+            entered.set()
+            release.wait(5)
+
+        return _ok_app(environ, start_response)
+
+    controller = AdmissionController(app, deadline=1.0, initial_service_time=0.01, decay_half_life=0.05)
+    controller.service_time = 5.0
+    worker = threading.Thread(target=lambda: _call(controller, "/api/slow"))
+    worker.start()
+    entered.wait(5)
+
+    try:
+        # one request in progress and a stale high estimate
+        assert _call(controller, "/api/tag")[0].startswith("503")
+        time.sleep(0.5)
+        assert _call(controller, "/api/tag")[0] == "200 OK"
+    finally:
+        release.set()
+        worker.join(5)
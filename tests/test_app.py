@@ -0,0 +1,217 @@
+import binascii
+import gzip
+import json
+
+import pytest
+
+import app as sdm_app
+from sdmserver.sharding import SHARD_HEADER
+
+# AN12196 page 18, all-zeros keys
+PICC_DATA = "FD91EC264309878BE6345CBE53BADF40"
+ENC = "CEE9A53E3E463EF1F459635736738962"
+CMAC = "ECC1E7F6C6C73BF6"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(sdm_app, "key_registry", sdm_app.KeyRegistry([sdm_app.KeyVersion("default", b"\x00" * 16)]))
+    monkeypatch.setattr(sdm_app, "session_store", sdm_app.create_session_store("memory", ttl=3600, max_entries=100))
+    monkeypatch.setattr(sdm_app, "verification_results", sdm_app.SingleFlight(ttl=60))
+    return sdm_app.app.test_client()
+
+
+def test_validate_first_and_repeated_access(client):
+    url = f"/validate?picc_data={PICC_DATA}&enc={ENC}&cmac={CMAC}"
+
+    res = client.get(url)
+    assert res.status_code == 200
+    assert "Access expires in 5 minutes" in res.get_data(as_text=True)
+
+    res = client.get(url)
+    assert "Expires in 5 minutes" in res.get_data(as_text=True)
+
+    key = sdm_app.session_key(binascii.unhexlify("04958CAA5C5E80"), 8)
+    assert sdm_app.session_store.claim(key)[1] is False
+
+
+def test_validate_expired(client, monkeypatch):
+    url = f"/validate?picc_data={PICC_DATA}&enc={ENC}&cmac={CMAC}"
+    client.get(url)
+
+    now = sdm_app.time.time()
+    monkeypatch.setattr(sdm_app.time, "time", lambda: now + sdm_app.VALIDATE_ACCESS_WINDOW + 1)
+    assert "ACCESS EXPIRED" in client.get(url).get_data(as_text=True)
+
+
+def test_validate_invalid_signature(client):
+    res = client.get(f"/validate?picc_data={PICC_DATA}&enc={ENC}&cmac=0000000000000000")
+    assert "ACCESS DENIED" in res.get_data(as_text=True)
+    assert len(sdm_app.session_store) == 0
+
+
+def test_validate_missing_parameters(client):
+    assert "ACCESS DENIED" in client.get("/validate").get_data(as_text=True)
+
+
+def test_validate_non_ascii_parameters(client):
+    res = client.get("/validate?picc_data=%C3%A9&enc=00&cmac=00")
+    assert res.status_code == 200
+    assert "ACCESS DENIED" in res.get_data(as_text=True)
+
+
+def test_repeated_tap_verified_once(client, monkeypatch):
+    calls = []
+    decrypt = sdm_app.key_registry.decrypt_sun_message
+    monkeypatch.setattr(sdm_app.key_registry, "decrypt_sun_message", lambda **kw: calls.append(kw) or decrypt(**kw))
+
+    # hex case doesn't matter, the parameters are compared decoded
+    assert client.get(f"/api/tag?{sdm_app.ENC_PICC_DATA_PARAM}={PICC_DATA}&{sdm_app.ENC_FILE_DATA_PARAM}={ENC}"
+                      f"&{sdm_app.SDMMAC_PARAM}={CMAC}").get_json()["read_ctr"] == 8
+    assert client.get(f"/api/tag?{sdm_app.ENC_PICC_DATA_PARAM}={PICC_DATA.lower()}&{sdm_app.ENC_FILE_DATA_PARAM}={ENC}"
+                      f"&{sdm_app.SDMMAC_PARAM}={CMAC}").get_json()["read_ctr"] == 8
+
+    # the session is still claimed by every request
+    url = f"/validate?picc_data={PICC_DATA}&enc={ENC}&cmac={CMAC}"
+    assert "Access expires in 5 minutes" in client.get(url).get_data(as_text=True)
+    assert "Expires in 5 minutes" in client.get(url).get_data(as_text=True)
+    assert len(calls) == 1
+
+    # failures are not cached
+    for _ in range(2):
+        client.get(f"/api/tag?{sdm_app.ENC_PICC_DATA_PARAM}={PICC_DATA}&{sdm_app.SDMMAC_PARAM}=0000000000000000")
+
+    assert len(calls) == 3
+
+
+def test_validate_access_token(client, monkeypatch):
+    url = f"/validate?picc_data={PICC_DATA}&enc={ENC}&cmac={CMAC}"
+    res = client.get(url)
+    assert "sdm_access=" in res.headers["Set-Cookie"]
+
+    # the repeated visit is served from the signed token only
+    monkeypatch.setattr(sdm_app, "session_store", None)
+    monkeypatch.setattr(sdm_app, "key_registry", None)
+    assert "Expires in 5 minutes" in client.get(url).get_data(as_text=True)
+
+
+def test_validate_access_token_other_url(client):
+    client.get(f"/validate?picc_data={PICC_DATA}&enc={ENC}&cmac={CMAC}")
+
+    # token doesn't grant access to other URLs
+    res = client.get(f"/validate?picc_data={PICC_DATA}&enc={ENC}&cmac=0000000000000000")
+    assert "ACCESS DENIED" in res.get_data(as_text=True)
+
+
+def test_shard_uid(client):
+    uid = binascii.unhexlify("04958CAA5C5E80")
+
+    assert sdm_app.shard_uid({"PATH_INFO": "/validate", "QUERY_STRING": f"picc_data={PICC_DATA}&enc={ENC}&cmac={CMAC}"}) == uid
+    assert sdm_app.shard_uid({"PATH_INFO": "/tag", "QUERY_STRING": f"e={PICC_DATA}{ENC}{CMAC}"}) == uid
+    assert sdm_app.shard_uid({"PATH_INFO": "/tagpt", "QUERY_STRING": "uid=04958CAA5C5E80&ctr=000001"}) == uid
+    assert sdm_app.shard_uid({"PATH_INFO": "/tag", "QUERY_STRING": "picc_data=XYZ"}) is None
+
+    for path, query in [("/tagpt", "uid=%C3%A9"), ("/tag", "e=%C3%A9"), ("/validate", "picc_data=%C3%A9"), ("/api/tag", "picc_data=%C3%A9")]:
+        assert sdm_app.shard_uid({"PATH_INFO": path, "QUERY_STRING": query}) is None
+
+
+def test_sharded_non_ascii_parameters_handled_locally(client, monkeypatch):
+    monkeypatch.setattr(sdm_app.app, "wsgi_app", sdm_app.app.wsgi_app)
+    sdm_app.enable_sharding(["http://127.0.0.1:1", "http://127.0.0.1:2"], "http://127.0.0.1:1")
+
+    res = client.get("/tagpt?uid=%C3%A9&ctr=000001&cmac=0000000000000000")
+    assert res.status_code == 400
+    assert res.headers[SHARD_HEADER] == "http://127.0.0.1:1"
+
+
+def test_static_pages_precompressed(client):
+    res = client.get("/validate", headers={"Accept-Encoding": "gzip"})
+    assert res.headers["Content-Encoding"] == "gzip"
+    assert "ACCESS DENIED" in gzip.decompress(res.get_data()).decode('utf-8')
+
+    res = client.get("/", headers={"If-None-Match": res.headers["ETag"]})
+    assert res.status_code == 200
+
+    res = client.get("/", headers={"If-None-Match": client.get("/").headers["ETag"]})
+    assert res.status_code == 304
+
+
+def test_error_page_cached(client):
+    res = client.get("/tag")
+    assert res.status_code == 400
+    assert "Parameter picc_data is required" in res.get_data(as_text=True)
+    assert client.get("/tag", headers={"If-None-Match": res.headers["ETag"]}).status_code == 400
+
+
+def test_batch_ndjson(client):
+    body = "\n".join([
+        json.dumps({sdm_app.ENC_PICC_DATA_PARAM: PICC_DATA, sdm_app.ENC_FILE_DATA_PARAM: ENC, sdm_app.SDMMAC_PARAM: CMAC}),
+        json.dumps({"e": "EF963FF7828658A599F3041510671E8894EED9EE65337086"}),
+        "",
+        json.dumps({sdm_app.ENC_PICC_DATA_PARAM: PICC_DATA, sdm_app.SDMMAC_PARAM: "0000000000000000"}),
+        "not json",
+    ])
+    res = client.post("/api/tag/batch", data=body, content_type="application/x-ndjson")
+    assert res.mimetype == "application/x-ndjson"
+
+    lines = [json.loads(line) for line in res.get_data(as_text=True).splitlines()]
+    assert [line["index"] for line in lines] == [0, 1, 2, 3]
+    assert lines[0]["uid"] == "04958CAA5C5E80"
+    assert lines[0]["file_data"] == b"xxxxxxxxxxxxxxxx".hex()
+    assert lines[1]["read_ctr"] == 61
+    assert "Invalid message" in lines[2]["error"]
+    assert "Expected JSON object" in lines[3]["error"]
+
+
+def test_batch_json_array(client):
+    items = [{sdm_app.ENC_PICC_DATA_PARAM: PICC_DATA, sdm_app.ENC_FILE_DATA_PARAM: ENC, sdm_app.SDMMAC_PARAM: CMAC}] * 3
+    res = client.post("/api/tag/batch", json=items)
+    lines = [json.loads(line) for line in res.get_data(as_text=True).splitlines()]
+
+    assert [line["read_ctr"] for line in lines] == [8, 8, 8]
+    assert client.post("/api/tag/batch", json={"e": "00"}).status_code == 400
+    assert client.post("/api/tag/batch", json=[]).get_data() == b""
+
+
+def test_batch_malformed_items(client):
+    valid = {sdm_app.ENC_PICC_DATA_PARAM: PICC_DATA, sdm_app.ENC_FILE_DATA_PARAM: ENC, sdm_app.SDMMAC_PARAM: CMAC}
+    items = [
+        {"e": 5},
+        {sdm_app.ENC_PICC_DATA_PARAM: "00", sdm_app.SDMMAC_PARAM: 5},
+        {"e": "\u00e9\u00e9"},
+        {sdm_app.ENC_PICC_DATA_PARAM: "\u00e9", sdm_app.SDMMAC_PARAM: "00"},
+        dict(valid, **{sdm_app.KEY_VERSION_PARAM: ["default"]}),
+        valid,
+    ]
+
+    for kwargs in [{"json": items},
+                   {"data": "\n".join(json.dumps(item) for item in items), "content_type": "application/x-ndjson"}]:
+        res = client.post("/api/tag/batch", **kwargs)
+        lines = [json.loads(line) for line in res.get_data(as_text=True).splitlines()]
+
+        assert [line["index"] for line in lines] == [0, 1, 2, 3, 4, 5]
+        assert all("error" in line for line in lines[:5])
+        assert lines[5]["uid"] == "04958CAA5C5E80"
+
+
+def test_non_ascii_get_parameters(client):
+    query = "uid=%C3%A9&ctr=000001&cmac=0000000000000000"
+    assert client.get(f"/tagpt?{query}").status_code == 400
+    assert "Failed to decode parameters" in client.get(f"/api/tagpt?{query}").get_data(as_text=True)
+
+    assert client.get("/tag?e=%C3%A9").status_code == 400
+    assert client.get("/tag?picc_data=%C3%A9&cmac=00").status_code == 400
+
+
+def test_batch_limits(client, monkeypatch):
+    monkeypatch.setattr(sdm_app, "BATCH_MAX_ITEMS", 2)
+    res = client.post("/api/tag/batch", json=[{}] * 3)
+    assert res.status_code == 413
+
+    res = client.post("/api/tag/batch", data="{}\n{}\n{}\n", content_type="application/x-ndjson")
+    lines = [json.loads(line) for line in res.get_data(as_text=True).splitlines()]
+    assert len(lines) == 3
+    assert "limited to 2 items" in lines[2]["error"]
+
+    monkeypatch.setattr(sdm_app, "BATCH_MAX_BODY_SIZE", 10)
+    assert client.post("/api/tag/batch", json=[{}] * 5).status_code == 413
@@ -0,0 +1,199 @@
+import asyncio
+import threading
+
+import pytest
+
+from sdmserver.asgi_bridge import AsgiBridge, build_environ
+
+
+def _scope(path, query=b"", headers=None, method="GET"):
+    return {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": query,
+        "headers": headers or [],
+        "http_version": "1.1",
+        "scheme": "http",
+        "server": ("127.0.0.1", 5000),
+        "client": ("127.0.0.1", 12345),
+    }
+
+
+def _run(application, scope, messages, on_send=None):
+    sent = []
+    messages = list(messages)
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+
+        # the client stays connected
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+        if on_send:
+            on_send(message)
+
+    asyncio.run(application(scope, receive, send))
+    return sent
+
+
+def _request(application, scope, body=b""):
+    sent = _run(application, scope, [{"type": "http.request", "body": body, "more_body": False}])
+    status = sent[0]["status"]
+    headers = dict(sent[0]["headers"])
+    return status, headers, b"".join(m.get("body", b"") for m in sent[1:])
+
+
+def _echo_app(environ, start_response):
+    body = environ["wsgi.input"].read()
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [environ["PATH_INFO"].encode(), b"?", environ["QUERY_STRING"].encode(), b" ", body]
+
+
+def test_build_environ():
+    environ = build_environ(_scope("/tag", b"e=00", [(b"content-type", b"text/plain"), (b"x-a", b"1"), (b"x-a", b"2")]), b"abc")
+
+    assert environ["PATH_INFO"] == "/tag"
+    assert environ["QUERY_STRING"] == "e=00"
+    assert environ["CONTENT_TYPE"] == "text/plain"
+    assert environ["CONTENT_LENGTH"] == "3"
+    assert environ["HTTP_X_A"] == "1,2"
+
+
+def test_bridge_thread_pool():
+    application = AsgiBridge(_echo_app, workers=2)
+    assert _request(application, _scope("/x", b"a=1", method="POST"), b"body") == \
+        (200, {b"content-type": b"text/plain"}, b"/x?a=1 body")
+
+
+def test_bridge_streams_chunks():
+    def streaming_app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "application/x-ndjson")])
+
+        for i in range(3):
+            yield f"{i}\n".encode()
+
+    sent = _run(AsgiBridge(streaming_app, workers=1), _scope("/api/tag/batch"),
+                [{"type": "http.request", "body": b"", "more_body": False}])
+
+    assert sent[0]["headers"] == [(b"content-type", b"application/x-ndjson")]
+    # every chunk is sent on its own, not joined into a single body
+    assert [(m["body"], m["more_body"]) for m in sent[1:]] == [(b"0\n", True), (b"1\n", True), (b"2\n", True), (b"", False)]
+
+
+def test_bridge_disconnect_before_body():
+    called = []
+
+    def app(environ, start_response):
+        called.append(1)
+        return _echo_app(environ, start_response)
+
+    sent = _run(AsgiBridge(app, workers=1), _scope("/x", method="POST"),
+                [{"type": "http.request", "body": b"part", "more_body": True}, {"type": "http.disconnect"}])
+
+    assert sent == []
+    assert called == []
+
+
+def test_bridge_disconnect_stops_stream():
+    closed = threading.Event()
+    release = threading.Event()
+
+    class Stream:
+        def __init__(self):
+            self.produced = 0
+
+        def __iter__(self):
+            return self
+
+        def __next__(self):
+            if self.produced == 1:
+                # wait until the client is gone
+                release.wait(5)
+
+            self.produced += 1
+
+            if self.produced > 1000:
+                raise StopIteration
+
+            return b"x"
+
+        def close(self):
+            closed.set()
+
+    stream = Stream()
+
+    def app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return stream
+
+    async def scenario():
+        sent = []
+        disconnected = asyncio.Event()
+        messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+            if message["type"] == "http.response.body":
+                disconnected.set()
+                await asyncio.sleep(0.05)
+                release.set()
+
+        await AsgiBridge(app, workers=1)(_scope("/x"), receive, send)
+        return sent
+
+    sent = asyncio.run(scenario())
+
+    assert closed.is_set()
+    assert stream.produced < 1000
+    assert not any(m["type"] == "http.response.body" and not m.get("more_body") for m in sent)
+
+
+def test_bridge_limits():
+    application = AsgiBridge(_echo_app, workers=1, max_body_size=4)
+    assert _request(application, _scope("/x"), b"12345")[0] == 413
+
+    application = AsgiBridge(_echo_app, workers=1, max_in_flight=0)
+    status, headers, _ = _request(application, _scope("/x"))
+    assert status == 503
+    assert headers[b"retry-after"] == b"1"
+
+
+def test_bridge_flask_app():
+    from app import app  # pylint: disable=import-outside-toplevel
+
+    application = AsgiBridge(app)
+    status, headers, body = _request(application, _scope("/api/tagpt", b"uid=041E3C8A2D6B80&ctr=000006&cmac=0000000000000000"))
+
+    assert status == 400
+    assert headers[b"content-type"] == b"application/json"
+    assert b"Invalid message" in body
+
+
+def test_bridge_process_pool():
+    application = AsgiBridge(executor="process", workers=1, app_path="app:app")
+
+    try:
+        status, _, body = _request(application, _scope("/validate"))
+    finally:
+        application.pool.shutdown()
+
+    assert status == 200
+    assert "ACCESS DENIED" in body.decode('utf-8')
+
+
+def test_bridge_invalid_executor():
+    with pytest.raises(RuntimeError):
+        AsgiBridge(_echo_app, executor="fibers")
@@ -0,0 +1,148 @@
+import binascii
+import os
+import time
+
+import pytest
+
+import app as sdm_app
+from sdmserver.audit_log import (
+    HEADER,
+    OUTCOME_INVALID_MAC,
+    OUTCOME_OK,
+    PARAM_MODE_SEPARATED,
+    RECORD,
+    UNKNOWN_CTR,
+    UNKNOWN_MODE,
+    UNKNOWN_UID,
+    AuditLog,
+    audit_files,
+    read_records,
+)
+
+# AN12196 page 18, all-zeros keys
+PICC_DATA = "FD91EC264309878BE6345CBE53BADF40"
+ENC = "CEE9A53E3E463EF1F459635736738962"
+CMAC = "ECC1E7F6C6C73BF6"
+
+
+def read_all(directory):
+    return [rec for path in audit_files(str(directory)) for rec in read_records(path)]
+
+
+def test_record_layout():
+    assert HEADER.size == 16
+    assert RECORD.size == 32
+
+
+def test_write_and_read(tmp_path):
+    log = AuditLog(str(tmp_path), flush_interval=60)
+    assert log.record(b"\x04" * 7, 8, 0, PARAM_MODE_SEPARATED, OUTCOME_OK, 0.0015, timestamp=1700000000.25)
+    assert log.record(None, None, UNKNOWN_MODE, PARAM_MODE_SEPARATED, OUTCOME_INVALID_MAC, 0.002)
+    log.close()
+
+    records = read_all(tmp_path)
+    assert len(records) == 2
+    assert records[0].timestamp_us == 1700000000250000
+    assert records[0].uid == b"\x04" * 7
+    assert records[0].read_ctr == 8
+    assert records[0].outcome == OUTCOME_OK
+    assert records[0].latency_us == 1500
+    assert records[1].uid == UNKNOWN_UID
+    assert records[1].read_ctr == UNKNOWN_CTR
+    assert records[1].enc_mode == UNKNOWN_MODE
+
+
+def test_background_writer(tmp_path):
+    log = AuditLog(str(tmp_path), flush_interval=0.01)
+
+    try:
+        log.record(b"\x04" * 7, 1, 0, PARAM_MODE_SEPARATED, OUTCOME_OK, 0.001)
+        deadline = time.monotonic() + 5
+
+        while log.written < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        assert len(read_all(tmp_path)) == 1
+    finally:
+        log.close()
+
+
+def test_full_buffer_drops(tmp_path):
+    log = AuditLog(str(tmp_path), capacity=4, flush_interval=60)
+    # keep the writer thread from draining the buffer
+    log._pid = os.getpid()
+
+    results = [log.record(b"\x04" * 7, i, 0, PARAM_MODE_SEPARATED, OUTCOME_OK, 0.001) for i in range(6)]
+    assert results == [True] * 4 + [False] * 2
+    assert log.dropped == 2
+
+    # wrap around the end of the ring
+    log.flush()
+    for i in range(6, 9):
+        log.record(b"\x04" * 7, i, 0, PARAM_MODE_SEPARATED, OUTCOME_OK, 0.001)
+
+    log.close()
+    assert [rec.read_ctr for rec in read_all(tmp_path)] == [0, 1, 2, 3, 6, 7, 8]
+
+
+def test_rotation_and_truncated_record(tmp_path):
+    log = AuditLog(str(tmp_path), flush_interval=60, max_bytes=HEADER.size + 2 * RECORD.size)
+    log._pid = os.getpid()
+
+    for i in range(5):
+        log.record(b"\x04" * 7, i, 0, PARAM_MODE_SEPARATED, OUTCOME_OK, 0.001)
+        log.flush()
+
+    log.close()
+    files = audit_files(str(tmp_path))
+    assert len(files) == 3
+
+    # record partially written before a crash
+    with open(files[-1], "ab") as f:
+        f.write(b"\x01" * 10)
+
+    assert [rec.read_ctr for rec in read_all(tmp_path)] == [0, 1, 2, 3, 4]
+
+
+def test_not_an_audit_log(tmp_path):
+    path = tmp_path / "audit-0-0-0.bin"
+    path.write_bytes(b"\x00" * 64)
+
+    with pytest.raises(RuntimeError):
+        list(read_records(str(path)))
+
+
+def test_scan_speed(tmp_path):
+    log = AuditLog(str(tmp_path), capacity=200000, flush_interval=60)
+    log._pid = os.getpid()
+
+    for i in range(200000):
+        log.record(b"\x04" * 7, i, 0, PARAM_MODE_SEPARATED, OUTCOME_OK, 0.001)
+
+    log.close()
+
+    started = time.perf_counter()
+    assert sum(1 for _ in read_all(tmp_path)) == 200000
+    # generous bound, millions of records are expected to scan in seconds
+    assert time.perf_counter() - started < 5
+
+
+def test_app_audit_log(tmp_path, monkeypatch):
+    log = AuditLog(str(tmp_path), flush_interval=60)
+    monkeypatch.setattr(sdm_app, "audit_log", log)
+    monkeypatch.setattr(sdm_app, "key_registry", sdm_app.KeyRegistry([sdm_app.KeyVersion("default", b"\x00" * 16)]))
+    monkeypatch.setattr(sdm_app, "verification_results", sdm_app.SingleFlight(ttl=60))
+    client = sdm_app.app.test_client()
+
+    url = f"/api/tag?picc_data={PICC_DATA}&enc_file_data={ENC}&cmac="
+    client.get(url + CMAC)
+    client.get(url + "0000000000000000")
+    log.close()
+
+    ok, invalid = read_all(tmp_path)
+    assert ok.uid == binascii.unhexlify("04958CAA5C5E80")
+    assert ok.read_ctr == 8
+    assert ok.enc_mode == 0
+    assert ok.outcome == OUTCOME_OK
+    assert invalid.uid == UNKNOWN_UID
+    assert invalid.outcome == OUTCOME_INVALID_MAC
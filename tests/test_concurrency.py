@@ -0,0 +1,117 @@
+import binascii
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import app as sdm_app
+from libsdm.key_registry import KeyRegistry, KeyVersion
+from libsdm.sdm import EncMode, InvalidMessage, ParamMode
+from sdmserver.session_store import create_session_store, session_key
+
+THREADS = 8
+ROUNDS = 50
+
+# (message, expected UID, expected read counter), all-zeros keys
+MESSAGES = [
+    (dict(param_mode=ParamMode.SEPARATED,
+          picc_enc_data=binascii.unhexlify("FD91EC264309878BE6345CBE53BADF40"),
+          enc_file_data=binascii.unhexlify("CEE9A53E3E463EF1F459635736738962"),
+          sdmmac=binascii.unhexlify("ECC1E7F6C6C73BF6")), "04958CAA5C5E80", 8),
+    (dict(param_mode=ParamMode.BULK,
+          picc_enc_data=binascii.unhexlify("EF963FF7828658A599F3041510671E88"),
+          sdmmac=binascii.unhexlify("94EED9EE65337086")), "04DE5F1EACC040", 61),
+    (dict(param_mode=ParamMode.SEPARATED,
+          picc_enc_data=binascii.unhexlify("07D9CA2545881D4BFDD920BE1603268C0714420DD893A497"),
+          enc_file_data=binascii.unhexlify("D6E921C47DB4C17C56F979F81559BB83"),
+          sdmmac=binascii.unhexlify("F9481AC7D855BDB6")), "049B112A2F7080", 4),
+    (dict(param_mode=ParamMode.SEPARATED,
+          picc_enc_data=binascii.unhexlify("1FCBE61B3E4CAD980CBFDD333E7A4AC4A579569BAFD22C5F"),
+          sdmmac=binascii.unhexlify("4231608BA7B02BA9")), "04940E2A2F7080", 3),
+]
+
+
+def _run_concurrently(fn, count=THREADS):
+    barrier = threading.Barrier(count)
+
+    def worker(index):
+        barrier.wait()
+        return fn(index)
+
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        return list(pool.map(worker, range(count)))
+
+
+def test_key_registry_concurrent_verification():
+    registry = KeyRegistry([KeyVersion("default", b"\x00" * 16), KeyVersion("other", b"\x01" * 16)],
+                           learned_size=64, sdmmac_param="cmac")
+
+    def worker(index):
+        errors = 0
+
+        for i in range(ROUNDS):
+            message, uid, read_ctr = MESSAGES[(index + i) % len(MESSAGES)]
+            res = registry.decrypt_sun_message(**message)
+            assert res['uid'].hex().upper() == uid
+            assert res['read_ctr'] == read_ctr
+            assert res['key_version'] == "default"
+
+            try:
+                registry.decrypt_sun_message(**dict(message, sdmmac=b"\x00" * 8))
+            except InvalidMessage:
+                errors += 1
+
+        return errors
+
+    assert _run_concurrently(worker) == [ROUNDS] * THREADS
+
+
+def test_session_store_single_first_access():
+    store = create_session_store("memory", ttl=3600, max_entries=100000)
+    keys = [session_key(i.to_bytes(7, 'big'), i) for i in range(500)]
+
+    def worker(_):
+        return sum(store.claim(key, 1000.0)[1] for key in keys)
+
+    # every key is created exactly once, no matter how many threads claim it
+    assert sum(_run_concurrently(worker)) == len(keys)
+    assert len(store) == len(keys)
+
+
+def test_validate_concurrent_taps(monkeypatch):
+    monkeypatch.setattr(sdm_app, "key_registry", KeyRegistry([KeyVersion("default", b"\x00" * 16)], sdmmac_param="cmac"))
+    monkeypatch.setattr(sdm_app, "session_store", create_session_store("memory", ttl=3600, max_entries=1000))
+    monkeypatch.setattr(sdm_app, "verification_results", sdm_app.SingleFlight(ttl=60))
+    url = "/validate?picc_data=FD91EC264309878BE6345CBE53BADF40&enc=CEE9A53E3E463EF1F459635736738962&cmac=ECC1E7F6C6C73BF6"
+
+    def worker(_):
+        client = sdm_app.app.test_client()
+        return [client.get(url).get_data(as_text=True) for _ in range(5)]
+
+    pages = [page for pages in _run_concurrently(worker) for page in pages]
+    assert sum("Access expires in" in page for page in pages) == 1
+    assert sum("Expires in" in page for page in pages) == len(pages) - 1
+
+
+def test_api_concurrent_requests(monkeypatch):
+    monkeypatch.setattr(sdm_app, "key_registry", KeyRegistry([KeyVersion("default", b"\x00" * 16)], sdmmac_param="cmac"))
+    monkeypatch.setattr(sdm_app, "verification_results", sdm_app.SingleFlight(ttl=0))
+
+    def worker(index):
+        client = sdm_app.app.test_client()
+
+        for i in range(10):
+            message, uid, read_ctr = MESSAGES[(index + i) % len(MESSAGES)]
+            query = f"{sdm_app.ENC_PICC_DATA_PARAM}={message['picc_enc_data'].hex()}&{sdm_app.SDMMAC_PARAM}={message['sdmmac'].hex()}"
+
+            if message['param_mode'] == ParamMode.BULK:
+                query = f"e={(message['picc_enc_data'] + message['sdmmac']).hex()}"
+            elif message.get('enc_file_data'):
+                query += f"&{sdm_app.ENC_FILE_DATA_PARAM}={message['enc_file_data'].hex()}"
+
+            res = client.get(f"/api/tag?{query}").get_json()
+            assert res["uid"] == uid
+            assert res["read_ctr"] == read_ctr
+            assert res["enc_mode"] in (EncMode.AES.name, EncMode.LRP.name)
+
+        return True
+
+    assert all(_run_concurrently(worker))
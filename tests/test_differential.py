@@ -0,0 +1,59 @@
+from libsdm import reference
+from libsdm.differential import VECTORS, check_case, check_vectors, current_implementation, generate_case, run
+from libsdm.lrp import LRP
+from libsdm.sdm import calculate_sdmmac, decrypt_file_data
+
+
+class CounterNotCarriedLRP(LRP):
+    def encrypt(self, data: bytes) -> bytes:
+        r = self.r
+        ct = super().encrypt(data)
+        self.r = r
+        return ct
+
+
+def test_vectors():
+    assert check_vectors() == []
+
+
+def test_vectors_catch_broken_candidate():
+    def wrong_sdmmac(*args, **kwargs):
+        return calculate_sdmmac(*args, **kwargs)[::-1]
+
+    mismatches = check_vectors(current_implementation(calculate_sdmmac=wrong_sdmmac))
+    assert {m["implementation"] for m in mismatches} == {"candidate"}
+    assert {m["operation"] for m in mismatches} == {"calculate_sdmmac"}
+    assert len(mismatches) == sum(1 for _, op, _, _ in VECTORS if op == "calculate_sdmmac")
+
+
+def test_random_cases():
+    report = run(200, seed=1)
+    assert report["cases"] == 200
+    assert report["mismatch_count"] == 0, report["mismatches"]
+
+
+def test_cases_are_reproducible():
+    assert generate_case(42) == generate_case(42)
+    assert generate_case(42) != generate_case(43)
+
+
+def test_detects_broken_candidates():
+    def truncated_file_data(key, picc_data, read_ctr, enc_file_data, mode=None):
+        return decrypt_file_data(key, picc_data, read_ctr, enc_file_data[:32], mode=mode)
+
+    def bulk_as_separated(_param_mode, *args, **kwargs):
+        return reference.calculate_sdmmac(reference.ParamMode.SEPARATED, *args, **kwargs)
+
+    for candidate, operation in [(current_implementation(LRP=CounterNotCarriedLRP), "lrp_encrypt"),
+                                 (current_implementation(decrypt_file_data=truncated_file_data), "decrypt_file_data"),
+                                 (current_implementation(calculate_sdmmac=bulk_as_separated), "calculate_sdmmac")]:
+        mismatches = [m for seed in range(100) for m in check_case(seed, candidate)]
+        assert mismatches
+        assert {m["operation"] for m in mismatches} == {operation}
+        assert check_case(mismatches[0]["seed"], candidate)
+
+
+def test_run_in_parallel():
+    report = run(20, seed=2, workers=2, batch=5)
+    assert report["cases"] == 20
+    assert report["mismatch_count"] == 0
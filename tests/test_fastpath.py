@@ -0,0 +1,66 @@
+import json
+
+import app as sdm_app
+from sdmserver.fastpath import ApiFastPath, parse_query
+
+
+def test_parse_query():
+    assert parse_query("") == {}
+    assert parse_query("e=00AA&x=1&x=2&&flag") == {"e": "00AA", "x": "1", "flag": ""}
+    assert parse_query("a%20b=c+d%21") == {"a b": "c d!"}
+
+
+def _call(app, path, query, method="GET"):
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured['status'] = status
+        captured['headers'] = dict(headers)
+
+    body = b"".join(app({"PATH_INFO": path, "QUERY_STRING": query, "REQUEST_METHOD": method}, start_response))
+    return captured['status'], captured['headers'], body
+
+
+def test_fast_path_dispatch():
+    def fallback(environ, start_response):
+        start_response("200 OK", [])
+        return [b"flask"]
+
+    app = ApiFastPath(fallback, {"/api/x": lambda args: (400, {"b": args.get("q"), "a": 1})})
+
+    status, headers, body = _call(app, "/api/x", "q=%41")
+    assert status == "400 Bad Request"
+    assert headers["Content-Type"] == "application/json"
+    assert body == b'{"a":1,"b":"A"}\n'
+
+    assert _call(app, "/other", "")[2] == b"flask"
+    assert _call(app, "/api/x", "", method="POST")[2] == b"flask"
+
+
+def test_fast_path_same_as_flask(monkeypatch):
+    monkeypatch.setattr(sdm_app, "key_registry", sdm_app.KeyRegistry([sdm_app.KeyVersion("default", b"\x00" * 16)]))
+    monkeypatch.setattr(sdm_app, "verification_results", sdm_app.SingleFlight(ttl=0))
+    client = sdm_app.app.test_client()
+    fast = ApiFastPath(None, {
+        '/api/tag': sdm_app.fast_api_sdm,
+        '/api/tagtt': lambda args: sdm_app.fast_api_sdm(args, with_tt=True),
+        '/api/tagpt': sdm_app.fast_api_tagpt,
+    })
+
+    requests = [
+        ("/api/tag", "e=EF963FF7828658A599F3041510671E8894EED9EE65337086"),
+        ("/api/tag", f"{sdm_app.ENC_PICC_DATA_PARAM}=FD91EC264309878BE6345CBE53BADF40&{sdm_app.ENC_FILE_DATA_PARAM}=CEE9A53E3E463EF1F459635736738962&{sdm_app.SDMMAC_PARAM}=ECC1E7F6C6C73BF6"),
+        ("/api/tag", "e=EF963FF7828658A599F3041510671E8894EED9EE65337087"),
+        ("/api/tag", "e=XYZ"),
+        ("/api/tagtt", "e=EF963FF7828658A599F3041510671E8894EED9EE65337086"),
+        ("/api/tagpt", "uid=041E3C8A2D6B80&ctr=000006&cmac=4B00064004B0B3D3"),
+        ("/api/tagpt", "uid=041E3C8A2D6B80&ctr=000006&cmac=4B00064004B0B3D4"),
+        ("/api/tagpt", "uid=041E3C8A2D6B80"),
+    ]
+
+    for path, query in requests:
+        res = client.get(f"{path}?{query}")
+        status, _, body = _call(fast, path, query)
+
+        assert int(status.split(" ")[0]) == res.status_code
+        assert json.loads(body) == res.get_json()
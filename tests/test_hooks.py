@@ -0,0 +1,112 @@
+import binascii
+
+import pytest
+
+from libsdm import derive, hooks
+from libsdm.sdm import InvalidMessage, ParamMode, decrypt_sun_message
+from sdmserver.metrics import MetricsRegistry
+from sdmserver.timing import StageRecorder
+
+
+@pytest.fixture
+def events(monkeypatch):
+    # the application registers its own handler on import, start from a clean state
+    monkeypatch.setattr(hooks, "_handlers", ())
+    recorded = []
+
+    def handler(event, stage, size):
+        recorded.append((event, stage, size))
+
+    hooks.register(handler)
+    yield recorded
+    hooks.unregister(handler)
+
+
+def test_disabled_is_noop(monkeypatch):
+    monkeypatch.setattr(hooks, "_handlers", ())
+
+    assert not hooks.enabled()
+    assert hooks.span(hooks.STAGE_SUN, 16) is hooks.span(hooks.STAGE_SDMMAC, 32)
+
+
+def test_aes_stages(events):
+    decrypt_sun_message(param_mode=ParamMode.SEPARATED,
+                        sdm_meta_read_key=b"\x00" * 16,
+                        sdm_file_read_key=lambda _: b"\x00" * 16,
+                        picc_enc_data=binascii.unhexlify("FD91EC264309878BE6345CBE53BADF40"),
+                        sdmmac=binascii.unhexlify("ECC1E7F6C6C73BF6"),
+                        enc_file_data=binascii.unhexlify("CEE9A53E3E463EF1F459635736738962"))
+
+    assert events == [
+        ("start", "sun", 32),
+        ("start", "picc", 16),
+        ("stop", "picc", 16),
+        # UID + SDMReadCtr, hex encoded file data followed by "&cmac="
+        ("start", "sdmmac", 10 + 32 + 6),
+        ("stop", "sdmmac", 10 + 32 + 6),
+        ("start", "file", 16),
+        ("stop", "file", 16),
+        ("stop", "sun", 32),
+    ]
+
+
+def test_lrp_stages(events):
+    decrypt_sun_message(param_mode=ParamMode.SEPARATED,
+                        sdm_meta_read_key=b"\x00" * 16,
+                        sdm_file_read_key=lambda _: b"\x00" * 16,
+                        picc_enc_data=binascii.unhexlify("07D9CA2545881D4BFDD920BE1603268C0714420DD893A497"),
+                        enc_file_data=binascii.unhexlify("D6E921C47DB4C17C56F979F81559BB83"),
+                        sdmmac=binascii.unhexlify("F9481AC7D855BDB6"),
+                        sdmmac_param="cmac")
+
+    stages = [stage for event, stage, _ in events if event == "start"]
+    assert stages == ["sun", "picc", "lrp", "sdmmac", "lrp", "lrp", "file", "lrp", "lrp"]
+
+    # properly nested
+    stack = []
+
+    for event, stage, _ in events:
+        if event == "start":
+            stack.append(stage)
+        else:
+            assert stack.pop() == stage
+
+    assert not stack
+
+
+def test_derive_stage(events):
+    derive.derive_tag_key(b"\x01" * 16, b"\x04" * 7, 2)
+    derive.derive_tag_key(b"\x00" * 16, b"\x04" * 7, 2)
+
+    # all-zeros master key isn't diversified
+    assert events == [("start", "derive", 7), ("stop", "derive", 7)]
+
+
+def test_stop_emitted_on_error(events):
+    with pytest.raises(InvalidMessage):
+        decrypt_sun_message(param_mode=ParamMode.SEPARATED,
+                            sdm_meta_read_key=b"\x00" * 16,
+                            sdm_file_read_key=lambda _: b"\x00" * 16,
+                            picc_enc_data=binascii.unhexlify("FD91EC264309878BE6345CBE53BADF40"),
+                            sdmmac=b"\x00" * 8,
+                            enc_file_data=binascii.unhexlify("CEE9A53E3E463EF1F459635736738962"))
+
+    assert events[-1] == ("stop", "sun", 32)
+    assert "file" not in [stage for _, stage, _ in events]
+
+
+def test_stage_recorder(monkeypatch):
+    monkeypatch.setattr(hooks, "_handlers", ())
+    registry = MetricsRegistry()
+    histogram = registry.histogram("stage_seconds", "Stages", ["stage"])
+    recorder = StageRecorder(observe=lambda stage, seconds: histogram.labels(stage).observe(seconds))
+    hooks.register(recorder)
+
+    try:
+        derive.derive_tag_key(b"\x01" * 16, b"\x04" * 7, 2)
+        derive.derive_tag_key(b"\x01" * 16, b"\x04" * 7, 2)
+    finally:
+        hooks.unregister(recorder)
+
+    assert not hooks.enabled()
+    assert 'stage_seconds_count{stage="derive"} 2' in registry.render()
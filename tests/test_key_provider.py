@@ -0,0 +1,162 @@
+import asyncio
+import binascii
+import os
+import subprocess
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from libsdm import key_provider
+from libsdm.derive import derive_tag_key
+from libsdm.key_provider import BatchingKeyClient, DerivedKeyProvider, KeyProviderError, async_decrypt_sun_message
+from libsdm.sdm import InvalidMessage, ParamMode
+from sdmserver.key_service import RemoteKeyProvider
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# AN12196 page 18, all-zeros keys
+PICC_DATA = binascii.unhexlify("FD91EC264309878BE6345CBE53BADF40")
+ENC = binascii.unhexlify("CEE9A53E3E463EF1F459635736738962")
+CMAC = binascii.unhexlify("ECC1E7F6C6C73BF6")
+
+
+class CountingProvider:
+    def __init__(self, known=None):
+        self.calls = []
+        self.known = known
+
+    async def get_keys(self, uids):
+        self.calls.append(list(uids))
+        await asyncio.sleep(0.001)
+        return {uid: uid.ljust(16, b"\x00") for uid in uids if self.known is None or uid in self.known}
+
+
+def test_lookups_coalesced_and_cached():
+    provider = CountingProvider()
+    client = BatchingKeyClient(provider, max_batch=8, max_delay=0.01)
+    uids = [bytes([4, i, 0, 0, 0, 0, 0]) for i in range(20)]
+
+    async def run():
+        keys = await asyncio.gather(*[client.get_key(uid) for uid in uids + uids])
+        assert keys == [uid.ljust(16, b"\x00") for uid in uids + uids]
+        assert await client.get_key(uids[0]) == keys[0]
+
+    asyncio.run(run())
+    # 20 distinct UIDs in batches of at most 8, duplicates and the cached lookup don't cost anything
+    assert [len(batch) for batch in provider.calls] == [8, 8, 4]
+    assert client.provider_calls == 3
+
+
+def test_cache_expiry(monkeypatch):
+    provider = CountingProvider()
+    client = BatchingKeyClient(provider, ttl=10)
+    now = [1000.0]
+    # only the clock of the cache is faked, the event loop needs the real one
+    monkeypatch.setattr(key_provider, "time", SimpleNamespace(monotonic=lambda: now[0]))
+
+    async def run():
+        await client.get_key(b"\x04" * 7)
+        await client.get_key(b"\x04" * 7)
+        now[0] += 11
+        await client.get_key(b"\x04" * 7)
+
+    asyncio.run(run())
+    assert len(provider.calls) == 2
+
+
+def test_missing_key_and_provider_failure():
+    class FailingProvider:
+        async def get_keys(self, uids):
+            raise ConnectionError("down")
+
+    async def run():
+        client = BatchingKeyClient(CountingProvider(known={b"\x04" * 7}))
+
+        with pytest.raises(KeyProviderError):
+            await client.get_key(b"\x05" * 7)
+
+        with pytest.raises(KeyProviderError):
+            await BatchingKeyClient(FailingProvider()).get_key(b"\x04" * 7)
+
+    asyncio.run(run())
+
+
+def test_async_decrypt_sun_message():
+    async def run():
+        client = BatchingKeyClient(DerivedKeyProvider(b"\x00" * 16))
+        results = await asyncio.gather(*[async_decrypt_sun_message(param_mode=ParamMode.SEPARATED,
+                                                                   sdm_meta_read_key=b"\x00" * 16,
+                                                                   key_client=client,
+                                                                   picc_enc_data=PICC_DATA,
+                                                                   sdmmac=CMAC,
+                                                                   enc_file_data=ENC,
+                                                                   sdmmac_param="cmac") for _ in range(5)])
+        assert [res['read_ctr'] for res in results] == [8] * 5
+        assert results[0]['file_data'] == b"x" * 16
+        assert client.provider_calls == 1
+
+        with pytest.raises(InvalidMessage):
+            await async_decrypt_sun_message(param_mode=ParamMode.SEPARATED,
+                                            sdm_meta_read_key=b"\x00" * 16,
+                                            key_client=client,
+                                            picc_enc_data=PICC_DATA,
+                                            sdmmac=b"\x00" * 8,
+                                            enc_file_data=ENC,
+                                            sdmmac_param="cmac")
+
+        # rejected UIDs are not looked up at all
+        with pytest.raises(InvalidMessage):
+            await async_decrypt_sun_message(param_mode=ParamMode.SEPARATED,
+                                            sdm_meta_read_key=b"\x00" * 16,
+                                            key_client=BatchingKeyClient(CountingProvider(known=set())),
+                                            picc_enc_data=PICC_DATA,
+                                            sdmmac=CMAC,
+                                            enc_file_data=ENC,
+                                            uid_filter=lambda uid: False,
+                                            sdmmac_param="cmac")
+
+    asyncio.run(run())
+
+
+@pytest.fixture
+def key_service(tmp_path):
+    address = str(tmp_path / "keys.sock")
+    master_key = "47BBB68AFA73F31310BEEFCE5DDA692DBAD671A03FEAD5A9BBDBCF3CD6D4C521"
+    proc = subprocess.Popen([sys.executable, "-m", "sdmserver.key_service", "--address", address,
+                             "--master-key", master_key, "--latency", "0.01"],
+                            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    try:
+        deadline = time.time() + 10
+
+        while not os.path.exists(address):
+            if time.time() > deadline or proc.poll() is not None:
+                raise RuntimeError("Key service didn't start.")
+
+            time.sleep(0.05)
+
+        yield address, binascii.unhexlify(master_key)
+    finally:
+        proc.terminate()
+        proc.wait(5)
+
+
+def test_remote_key_service(key_service):
+    address, master_key = key_service
+    uids = [bytes([4, i, 0x2A, 0x2F, 0x70, 0x80, 0x00]) for i in range(50)]
+
+    async def run():
+        provider = RemoteKeyProvider(address, pool_size=2)
+        client = BatchingKeyClient(provider, max_batch=32, max_delay=0.005)
+
+        try:
+            keys = await asyncio.gather(*[client.get_key(uid) for uid in uids])
+        finally:
+            await provider.close()
+
+        assert keys == [derive_tag_key(master_key, uid, 2) for uid in uids]
+        assert client.provider_calls == 2
+
+    asyncio.run(run())
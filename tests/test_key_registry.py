@@ -0,0 +1,118 @@
+# pylint: disable=line-too-long, invalid-name
+
+import binascii
+
+import pytest
+
+from libsdm.key_registry import KeyRegistry, KeyVersion
+from libsdm.sdm import InvalidMessage, ParamMode
+
+# same message as in test_libsdm.test_decrypt_with_kdf1
+KDF_MASTER_KEY = binascii.unhexlify('47BBB68AFA73F31310BEEFCE5DDA692DBAD671A03FEAD5A9BBDBCF3CD6D4C521')
+KDF_MESSAGE = {
+    "param_mode": ParamMode.BULK,
+    "picc_enc_data": binascii.unhexlify('8DE9030262807261850FCCF5FE007E21'),
+    "enc_file_data": binascii.unhexlify('382B4C3D68552C3A5F417F0695A3D857923764E1737AD1F80E834E46387F45DC77FE7468BBCF9DBF43B29CA58E8D6435F908C9C0CD56E9B4B9960FE1279C5DF1'),
+    "sdmmac": binascii.unhexlify('DF3EF20BE7D91C8E'),
+}
+KDF_UID = binascii.unhexlify("04c24eda926980")
+
+
+class CountingKeyVersion(KeyVersion):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.derivations = 0
+
+    def sdm_file_read_key(self, uid):
+        self.derivations += 1
+        return super().sdm_file_read_key(uid)
+
+
+def _registry(**kwargs):
+    return KeyRegistry([CountingKeyVersion("old", b"\x11" * 16),
+                        CountingKeyVersion("legacy", b"\x22" * 16, "legacy"),
+                        CountingKeyVersion("new", KDF_MASTER_KEY)], **kwargs)
+
+
+def test_registry_trial_and_learning():
+    registry = _registry()
+    res = registry.decrypt_sun_message(**KDF_MESSAGE)
+
+    assert res['uid'] == KDF_UID
+    assert res['read_ctr'] == 1
+    assert res['key_version'] == "new"
+    assert registry.route_uid(KDF_UID) == "new"
+
+    # subsequent message is routed directly using the learned map
+    for v in registry.versions.values():
+        v.derivations = 0
+
+    registry.decrypt_sun_message(**KDF_MESSAGE)
+    assert [v.derivations for v in registry.versions.values()] == [0, 0, 1]
+
+
+def test_registry_explicit_version():
+    registry = _registry()
+    assert registry.decrypt_sun_message(**KDF_MESSAGE, version_hint="new")['key_version'] == "new"
+
+    with pytest.raises(InvalidMessage):
+        registry.decrypt_sun_message(**KDF_MESSAGE, version_hint="old")
+
+    with pytest.raises(InvalidMessage):
+        registry.decrypt_sun_message(**KDF_MESSAGE, version_hint="nonexistent")
+
+
+def test_registry_uid_prefix():
+    registry = _registry(uid_prefixes={b"\x04\xc2": "new"})
+    assert registry.route_uid(KDF_UID) == "new"
+    assert registry.route_uid(b"\x04\xc3\x00\x00\x00\x00\x00") is None
+    assert registry.decrypt_sun_message(**KDF_MESSAGE)['key_version'] == "new"
+
+
+def test_registry_skips_implausible_versions():
+    registry = _registry(max_trials=1)
+
+    # PICCData decrypted with the wrong meta keys doesn't look valid, so the SDMMAC is checked only once
+    assert registry.decrypt_sun_message(**KDF_MESSAGE)['key_version'] == "new"
+    assert [v.derivations for v in registry.versions.values()] == [0, 0, 1]
+
+
+def test_registry_plain_sun():
+    registry = KeyRegistry([KeyVersion("a", b"\x11" * 16), KeyVersion("zeros", b"\x00" * 16)])
+    res = registry.validate_plain_sun(uid=binascii.unhexlify('041E3C8A2D6B80'),
+                                      read_ctr=binascii.unhexlify('000006'),
+                                      sdmmac=binascii.unhexlify('4B00064004B0B3D3'))
+
+    assert res['read_ctr'] == 6
+    assert res['key_version'] == "zeros"
+
+
+def test_registry_no_candidates():
+    registry = KeyRegistry([KeyVersion("zeros", b"\x00" * 16)], max_trials=0)
+
+    with pytest.raises(InvalidMessage):
+        registry.validate_plain_sun(uid=binascii.unhexlify('041E3C8A2D6B80'),
+                                    read_ctr=binascii.unhexlify('000006'),
+                                    sdmmac=binascii.unhexlify('4B00064004B0B3D3'))
+
+    with pytest.raises(InvalidMessage):
+        registry.decrypt_sun_message(**KDF_MESSAGE)
+
+
+def test_registry_invalid_derive_mode():
+    with pytest.raises(RuntimeError):
+        KeyVersion("x", b"\x00" * 16, "unknown")
+
+
+def test_registry_batch():
+    registry = _registry()
+    file_key_cache = {}
+
+    assert registry.decrypt_sun_message(**KDF_MESSAGE, file_key_cache=file_key_cache)['uid'] == KDF_UID
+
+    with pytest.raises(InvalidMessage):
+        registry.decrypt_sun_message(**dict(KDF_MESSAGE, sdmmac=b"\x00" * 8), file_key_cache=file_key_cache)
+
+    assert registry.decrypt_sun_message(**KDF_MESSAGE, file_key_cache=file_key_cache)['read_ctr'] == 1
+    # tag key is derived only once within the batch
+    assert registry.versions["new"].derivations == 1
@@ -7,12 +7,15 @@ This code was implemented based on the examples provided in:
 
 import binascii
 
+import pytest
+
 import config
 from libsdm.derive import derive_tag_key, derive_undiversified_key
 from libsdm.sdm import (
     EncMode,
     InvalidMessage,
     ParamMode,
+    decrypt_picc_data,
     decrypt_sun_message,
     validate_plain_sun,
 )
@@ -35,6 +38,18 @@ def test_sun1():
     assert res['encryption_mode'] == EncMode.AES
 
 
+def test_decrypt_picc_data():
+    res = decrypt_picc_data(
+        sdm_meta_read_key=binascii.unhexlify('00000000000000000000000000000000'),
+        picc_enc_data=binascii.unhexlify("FD91EC264309878BE6345CBE53BADF40"))
+
+    assert res['picc_data_tag'] == b'\xc7'
+    assert res['uid'] == b'\x04\x95\x8C\xAA\x5C\x5E\x80'
+    assert res['read_ctr'] == b'\x08\x00\x00'
+    assert res['read_ctr_num'] == 8
+    assert res['encryption_mode'] == EncMode.AES
+
+
 def test_sun2():
     # FROM AN12196 page 18
     # https://www.my424dna.com/?picc_data=FD91EC264309878BE6345CBE53BADF40&enc=CEE9A53E3E463EF1F459635736738962&cmac=ECC1E7F6C6C73BF6
@@ -56,6 +71,31 @@ def test_sun2():
     assert res['encryption_mode'] == EncMode.AES
 
 
+def test_sun2_explicit_sdmmac_param():
+    # the parameter name is passed explicitly, without touching the global config
+    res = decrypt_sun_message(
+        param_mode=ParamMode.SEPARATED,
+        sdm_meta_read_key=binascii.unhexlify('00000000000000000000000000000000'),
+        sdm_file_read_key=lambda _: binascii.unhexlify('00000000000000000000000000000000'),
+        picc_enc_data=binascii.unhexlify("FD91EC264309878BE6345CBE53BADF40"),
+        sdmmac=binascii.unhexlify("ECC1E7F6C6C73BF6"),
+        enc_file_data=binascii.unhexlify("CEE9A53E3E463EF1F459635736738962"),
+        sdmmac_param="cmac")
+
+    assert res['read_ctr'] == 8
+    assert res['file_data'] == b'xxxxxxxxxxxxxxxx'
+
+    with pytest.raises(InvalidMessage):
+        decrypt_sun_message(
+            param_mode=ParamMode.SEPARATED,
+            sdm_meta_read_key=binascii.unhexlify('00000000000000000000000000000000'),
+            sdm_file_read_key=lambda _: binascii.unhexlify('00000000000000000000000000000000'),
+            picc_enc_data=binascii.unhexlify("FD91EC264309878BE6345CBE53BADF40"),
+            sdmmac=binascii.unhexlify("ECC1E7F6C6C73BF6"),
+            enc_file_data=binascii.unhexlify("CEE9A53E3E463EF1F459635736738962"),
+            sdmmac_param="")
+
+
 def test_sun3_custom():
     original_sdmmac_param = config.SDMMAC_PARAM
     config.SDMMAC_PARAM = ""
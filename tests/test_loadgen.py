@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+import app as sdm_app
+from sdmserver.loadgen import DEFAULT_MIX, KINDS, HttpTarget, LoadGenerator, WsgiTarget, build_requests, parse_mix, percentile
+
+ZERO_KEY = b"\x00" * 16
+
+
+@pytest.fixture
+def sdm(monkeypatch):
+    monkeypatch.setattr(sdm_app, "key_registry", sdm_app.KeyRegistry([sdm_app.KeyVersion("default", ZERO_KEY)]))
+    monkeypatch.setattr(sdm_app, "verification_results", sdm_app.SingleFlight(ttl=60))
+    return sdm_app.app
+
+
+def test_percentile():
+    values = [float(i) for i in range(1, 1001)]
+    assert percentile(values, 50) == 500
+    assert percentile(values, 99.9) == 999
+    assert percentile(values, 100) == 1000
+    assert percentile([], 50) == 0.0
+
+
+def test_parse_mix():
+    assert parse_mix("api_tag=3,invalid_mac") == {"api_tag": 3.0, "invalid_mac": 1.0}
+
+    with pytest.raises(ValueError):
+        parse_mix("unknown=1")
+
+
+def test_every_kind_gets_expected_status(sdm):
+    requests = build_requests(dict.fromkeys(KINDS, 1), ZERO_KEY, pool_size=3)
+    target = WsgiTarget(sdm)
+    expected = {"invalid_mac": "200 error", "malformed": "200 error"}
+
+    for kind, pool in requests.items():
+        assert len(pool) == 3
+        assert {target.request(path_qs) for path_qs in pool} == {expected.get(kind, "200")}, kind
+
+    assert b"denied" not in sdm.test_client().get(requests["validate"][0]).data.lower()
+
+
+def test_closed_loop(sdm):
+    requests = build_requests(DEFAULT_MIX, ZERO_KEY, pool_size=20)
+    report = LoadGenerator(WsgiTarget(sdm), requests, DEFAULT_MIX, concurrency=4, total=200).run()
+
+    assert report["mode"] == "closed"
+    assert report["requests"] == 200
+    assert sum(kind["requests"] for kind in report["kinds"].values()) == 200
+    assert set(report["latency_ms"]) == {"p50", "p90", "p99", "p99.9", "mean", "max"}
+    assert report["latency_ms"]["p50"] <= report["latency_ms"]["p99"] <= report["latency_ms"]["max"]
+    assert report["kinds"]["malformed"]["status"] == {"200 error": report["kinds"]["malformed"]["requests"]}
+    assert report["throughput_rps"] > 0
+
+
+def test_open_loop_over_http(sdm):
+    server = make_server("127.0.0.1", 0, sdm, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        mix = {"api_tag": 1}
+        requests = build_requests(mix, ZERO_KEY, pool_size=5)
+        report = LoadGenerator(HttpTarget(f"http://127.0.0.1:{server.port}"), requests, mix, concurrency=2, rate=200, total=40).run()
+    finally:
+        server.shutdown()
+
+    assert report["mode"] == "open"
+    assert report["status"] == {"200": 40}
+    assert report["errors"] == {}
+
+
+def test_connection_errors_are_counted():
+    mix = {"api_tag": 1}
+    requests = build_requests(mix, ZERO_KEY, pool_size=1)
+    report = LoadGenerator(HttpTarget("http://127.0.0.1:1"), requests, mix, total=3).run()
+    assert report["errors"] == {"ConnectionRefusedError": 3}
+    assert report["status"] == {}
+
+
+def test_invalid_settings():
+    with pytest.raises(ValueError):
+        LoadGenerator(None, {}, {"api_tag": 1})
+
+    with pytest.raises(ValueError):
+        HttpTarget("ftp://127.0.0.1")
@@ -0,0 +1,148 @@
+import pytest
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+import app as sdm_app
+from sdmserver import memory
+from sdmserver.memory import AllocationTracer, MemoryBudgetMiddleware, MemoryMonitor, heap_stats, rss_bytes
+from sdmserver.response_cache import ResponseCache
+
+# AN12196 page 18, all-zeros keys
+PICC_DATA = "FD91EC264309878BE6345CBE53BADF40"
+ENC = "CEE9A53E3E463EF1F459635736738962"
+CMAC = "ECC1E7F6C6C73BF6"
+
+
+def test_process_stats():
+    rss = rss_bytes()
+    assert rss is None or rss > 1024 * 1024
+
+    stats = heap_stats()
+    assert stats["allocated_blocks"] > 0
+    assert stats["gc_objects"] > 0
+    assert len(stats["gc_collections"]) == 3
+
+
+def test_response_cache_shrink():
+    cache = ResponseCache()
+    cache.put("main", "main page")
+    cache.get_or_render(("error", 400), lambda: "error page")
+    assert len(cache) == 2
+
+    assert cache.shrink() == 1
+    assert cache.get("main") is not None
+    assert cache.get(("error", 400)) is None
+
+
+def test_shrink_over_soft_limit(monkeypatch):
+    monkeypatch.setattr(memory, "rss_bytes", lambda: 200)
+    store = {"a": 1, "b": 2}
+    monitor = MemoryMonitor(soft_limit=100, check_interval=60)
+    monitor.register("store", lambda: len(store), store.clear)
+    monitor.register("fixed", lambda: 42)
+
+    assert monitor.sizes() == {"store": 2, "fixed": 42}
+    assert monitor.maybe_check() == "shrink"
+    assert not store
+    assert monitor.shrinks == 1
+
+    # rate limited by check_interval
+    store["c"] = 3
+    assert monitor.maybe_check() is None
+    assert store
+
+
+def test_recycle_once_after_response(monkeypatch):
+    monkeypatch.setattr(memory, "rss_bytes", lambda: 500)
+    recycled = []
+    monitor = MemoryMonitor(soft_limit=100, recycle_limit=400, check_interval=0, recycle=lambda: recycled.append(True))
+    client = Client(MemoryBudgetMiddleware(Response("x"), monitor))
+
+    res = client.get("/")
+    assert res.get_data() == b"x"
+    assert recycled == []
+    res.close()
+    assert recycled == [True]
+
+    client.get("/").close()
+    assert recycled == [True]
+    assert monitor.recycling
+
+
+def test_within_budget(monkeypatch):
+    monkeypatch.setattr(memory, "rss_bytes", lambda: 50)
+    monitor = MemoryMonitor(soft_limit=100, recycle_limit=400, check_interval=0, recycle=pytest.fail)
+    monitor.register("store", lambda: 1, pytest.fail)
+    assert monitor.maybe_check() is None
+
+    assert not MemoryMonitor().enabled
+
+    with pytest.raises(ValueError):
+        MemoryMonitor(soft_limit=400, recycle_limit=100)
+
+
+def test_allocation_tracer():
+    tracer = AllocationTracer()
+
+    with pytest.raises(RuntimeError):
+        tracer.top()
+
+    tracer.start()
+
+    try:
+        first = tracer.top(limit=5)
+        assert len(first) <= 5
+        blobs = [bytearray(100000) for _ in range(10)]
+        sites = tracer.top(limit=5)
+        assert any(__file__ in site["site"][0] and site["size_diff"] >= 1000000 for site in sites)
+        del blobs
+
+        with pytest.raises(ValueError):
+            tracer.top(key_type="module")
+    finally:
+        tracer.stop()
+
+    assert not tracer.active
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(sdm_app, "key_registry", sdm_app.KeyRegistry([sdm_app.KeyVersion("default", b"\x00" * 16)]))
+    monkeypatch.setattr(sdm_app, "verification_results", sdm_app.SingleFlight(ttl=60))
+    monkeypatch.setattr(sdm_app, "allocation_tracer", AllocationTracer())
+    monkeypatch.setattr(sdm_app, "ADMIN_TOKEN", "secret")
+    yield sdm_app.app.test_client()
+    sdm_app.allocation_tracer.stop()
+
+
+def test_admin_memory(client):
+    auth = {"Authorization": "Bearer secret"}
+    assert client.get("/admin/memory").status_code == 401
+
+    client.get(f"/api/tag?picc_data={PICC_DATA}&enc_file_data={ENC}&cmac={CMAC}")
+
+    res = client.get("/admin/memory", headers=auth)
+    assert res.status_code == 200
+    stores = res.json["stores"]
+    assert stores["verification_results"] == 1
+    assert stores["key_registry_learned"] == 1
+    assert {"response_cache", "session_store", "profiler_stacks", "audit_log_pending"} <= set(stores)
+    assert "gc_objects" in res.json["heap"]
+
+    res = client.post("/admin/memory/shrink", headers=auth)
+    assert res.json["shrunk"]["verification_results"] == 1
+    assert res.json["stores"]["verification_results"] == 0
+    assert res.json["stores"]["key_registry_learned"] == 0
+
+
+def test_admin_memory_trace(client):
+    auth = {"Authorization": "Bearer secret"}
+    assert client.get("/admin/memory/trace", headers=auth).status_code == 400
+    assert client.post("/admin/memory/trace/start?frames=0", headers=auth).status_code == 400
+
+    assert client.post("/admin/memory/trace/start", headers=auth).json["active"] is True
+    res = client.get("/admin/memory/trace?limit=3", headers=auth)
+    assert res.status_code == 200
+    assert len(res.json["sites"]) <= 3
+
+    assert client.post("/admin/memory/trace/stop", headers=auth).json["active"] is False
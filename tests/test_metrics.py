@@ -0,0 +1,128 @@
+import json
+import os
+
+import pytest
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+import app as sdm_app
+from sdmserver.metrics import MetricsMiddleware, MetricsRegistry
+
+# AN12196 page 18, all-zeros keys
+PICC_DATA = "FD91EC264309878BE6345CBE53BADF40"
+ENC = "CEE9A53E3E463EF1F459635736738962"
+CMAC = "ECC1E7F6C6C73BF6"
+
+
+def test_counter_and_histogram_rendering():
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "Test counter", ["result"])
+    histogram = registry.histogram("test_seconds", "Test histogram", ["stage"], buckets=(0.1, 1.0))
+
+    counter.labels("ok").inc()
+    counter.labels("ok").inc(2)
+    counter.labels('bad "one"').inc()
+    histogram.labels("parse").observe(0.05)
+    histogram.labels("parse").observe(0.5)
+    histogram.labels("parse").observe(5)
+
+    text = registry.render()
+    assert "# TYPE test_total counter" in text
+    assert 'test_total{result="ok"} 3' in text
+    assert 'test_total{result="bad \\"one\\""} 1' in text
+    assert "# TYPE test_seconds histogram" in text
+    assert 'test_seconds_bucket{stage="parse",le="0.1"} 1' in text
+    assert 'test_seconds_bucket{stage="parse",le="1"} 2' in text
+    assert 'test_seconds_bucket{stage="parse",le="+Inf"} 3' in text
+    assert 'test_seconds_count{stage="parse"} 3' in text
+    assert 'test_seconds_sum{stage="parse"} 5.55' in text
+
+
+def test_wrong_labels():
+    registry = MetricsRegistry()
+    counter = registry.counter("test_total", "Test counter", ["result"])
+
+    with pytest.raises(ValueError):
+        counter.labels("ok", "extra")
+
+    with pytest.raises(RuntimeError):
+        registry.counter("test_total", "Duplicate")
+
+
+def test_aggregation_across_processes(tmp_path):
+    registry = MetricsRegistry(directory=str(tmp_path))
+    counter = registry.counter("test_total", "Test counter", ["result"])
+    histogram = registry.histogram("test_seconds", "Test histogram", buckets=(1.0,))
+    counter.labels("ok").inc(2)
+    histogram.observe(0.5)
+    registry.flush()
+    assert os.path.exists(tmp_path / f"metrics-{os.getpid()}.json")
+
+    # snapshot of another live worker (the parent process stands for it) and of an exited one
+    other = {"test_total": [[["ok"], 3], [["bad"], 1]], "test_seconds": [[[], [0, 1], 2.0]]}
+    (tmp_path / f"metrics-{os.getppid()}.json").write_text(json.dumps(other))
+    (tmp_path / "metrics-999999999.json").write_text(json.dumps(other))
+
+    merged = registry.aggregate()
+    assert merged["test_total"] == {("ok",): 5, ("bad",): 1}
+    assert merged["test_seconds"] == {(): ([1, 1], 2.5)}
+
+
+def test_middleware_counts_requests():
+    registry = MetricsRegistry()
+
+    def wsgi_app(environ, start_response):
+        status = 200 if environ["PATH_INFO"] == "/tag" else 404
+        return Response("x", status=status)(environ, start_response)
+
+    client = Client(MetricsMiddleware(wsgi_app, registry, paths=["/tag"]))
+    for path in ["/tag", "/tag", "/random/path"]:
+        client.get(path).close()
+
+    text = registry.render()
+    assert 'sdm_http_requests_total{path="/tag",status="200"} 2' in text
+    assert 'sdm_http_requests_total{path="other",status="404"} 1' in text
+    assert 'sdm_http_request_seconds_count{path="/tag"} 2' in text
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(sdm_app, "key_registry", sdm_app.KeyRegistry([sdm_app.KeyVersion("default", b"\x00" * 16)]))
+    monkeypatch.setattr(sdm_app, "verification_results", sdm_app.SingleFlight(ttl=60))
+    monkeypatch.setattr(sdm_app, "METRICS_TOKEN", "secret")
+    return sdm_app.app.test_client()
+
+
+def test_metrics_endpoint(client):
+    def verifications(result):
+        return sdm_app.verifications_total.labels("tag", "SEPARATED", "AES", result).value
+
+    ok_before = verifications("ok")
+    bad_before = verifications("Message is not properly signed - invalid MAC")
+
+    url = f"/tag?picc_data={PICC_DATA}&enc_file_data={ENC}&cmac="
+
+    for cmac, status in [(CMAC, 200), (CMAC, 200), ("0000000000000000", 400)]:
+        with client.get(url + cmac) as res:
+            assert res.status_code == status
+
+    assert verifications("ok") == ok_before + 2
+    assert verifications("Message is not properly signed - invalid MAC") == bad_before + 1
+
+    res = client.get("/metrics", headers={"Authorization": "Bearer secret"})
+    assert res.status_code == 200
+    assert res.content_type.startswith("text/plain")
+
+    text = res.get_data(as_text=True)
+    assert 'sdm_stage_seconds_count{stage="verify"}' in text
+    assert 'sdm_stage_seconds_count{stage="render"}' in text
+    assert 'sdm_cache_requests_total{cache="verification",result="hits"} 1' in text
+    assert 'sdm_http_requests_total{path="/tag",status="200"}' in text
+
+
+def test_metrics_endpoint_requires_token(client, monkeypatch):
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+
+    monkeypatch.setattr(sdm_app, "METRICS_TOKEN", None)
+    assert client.get("/metrics", headers={"Authorization": "Bearer secret"}).status_code == 404
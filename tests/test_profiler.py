@@ -0,0 +1,136 @@
+import time
+
+import pytest
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+import app as sdm_app
+from sdmserver.profiler import ProfilerMiddleware, SamplingProfiler, redact_query
+
+# AN12196 page 18, all-zeros keys
+PICC_DATA = "FD91EC264309878BE6345CBE53BADF40"
+ENC = "CEE9A53E3E463EF1F459635736738962"
+CMAC = "ECC1E7F6C6C73BF6"
+
+
+def test_redact_query():
+    assert redact_query(f"picc_data={PICC_DATA}&cmac={CMAC}&output=json&kv=v2") == "picc_data=<32>&cmac=<16>&output=json&kv=v2"
+    assert redact_query("uid=041E3C8A2D6B80&ctr=000006") == "uid=<14>&ctr=<6>"
+
+
+def busy_view(seconds):
+    deadline = time.perf_counter() + seconds
+
+    while time.perf_counter() < deadline:
+        pass
+
+
+def make_client(profiler):
+    def wsgi_app(environ, start_response):
+        busy_view(0.05 if environ["PATH_INFO"] == "/slow" else 0.0)
+        return Response("x")(environ, start_response)
+
+    return Client(ProfilerMiddleware(wsgi_app, profiler, paths=["/tag", "/slow"]))
+
+
+def test_sampled_requests():
+    profiler = SamplingProfiler()
+    client = make_client(profiler)
+    client.get("/tag")
+    assert not profiler.stacks
+
+    profiler.start(rate=1.0, interval=0.001)
+
+    try:
+        client.get("/slow?picc_data=" + PICC_DATA).close()
+        client.get("/admin/profiler").close()
+    finally:
+        profiler.stop()
+
+    collapsed = profiler.collapsed()
+    assert collapsed
+    assert all(line.startswith("/slow;") for line in collapsed.splitlines())
+    assert "test_profiler:busy_view" in collapsed
+    assert profiler.requests == {"/slow": 1}
+    assert profiler.collapsed("/tag") == ""
+
+
+def test_slow_requests():
+    profiler = SamplingProfiler()
+    client = make_client(profiler)
+    profiler.start(slow_threshold=0.03, interval=0.001)
+
+    try:
+        client.get(f"/tag?picc_data={PICC_DATA}").close()
+        client.get(f"/slow?picc_data={PICC_DATA}&cmac={CMAC}").close()
+    finally:
+        profiler.stop()
+
+    assert list(profiler.stacks) == ["/slow"]
+    slow, = profiler.status()["slow_requests"]
+    assert slow["endpoint"] == "/slow"
+    assert slow["query"] == "picc_data=<32>&cmac=<16>"
+    assert PICC_DATA not in profiler.collapsed()
+
+    profiler.reset()
+    assert profiler.collapsed() == ""
+
+
+def test_invalid_settings():
+    profiler = SamplingProfiler()
+
+    with pytest.raises(ValueError):
+        profiler.start()
+
+    with pytest.raises(ValueError):
+        profiler.start(rate=2)
+
+    assert not profiler.active
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(sdm_app, "key_registry", sdm_app.KeyRegistry([sdm_app.KeyVersion("default", b"\x00" * 16)]))
+    monkeypatch.setattr(sdm_app, "profiler", SamplingProfiler())
+    monkeypatch.setattr(sdm_app, "ADMIN_TOKEN", "secret")
+    wsgi_app = ProfilerMiddleware(sdm_app.app.wsgi_app, sdm_app.profiler, paths=["/tag"])
+    monkeypatch.setattr(sdm_app.app, "wsgi_app", wsgi_app)
+    yield sdm_app.app.test_client()
+    sdm_app.profiler.stop()
+
+
+def test_admin_auth(client, monkeypatch):
+    assert client.get("/admin/profiler").status_code == 401
+    assert client.get("/admin/profiler", headers={"Authorization": "Bearer wrong"}).status_code == 401
+
+    monkeypatch.setattr(sdm_app, "ADMIN_TOKEN", None)
+    assert client.get("/admin/profiler", headers={"Authorization": "Bearer secret"}).status_code == 404
+
+
+def test_admin_profiler(client):
+    auth = {"Authorization": "Bearer secret"}
+
+    res = client.post("/admin/profiler/start?rate=1&interval_ms=0.5", headers=auth)
+    assert res.status_code == 200
+    assert res.json["active"] is True
+    assert client.post("/admin/profiler/start?rate=abc", headers=auth).status_code == 400
+
+    client.post("/admin/profiler/start?rate=1&interval_ms=0.5", headers=auth)
+
+    for _ in range(20):
+        client.get(f"/tag?picc_data={PICC_DATA}&enc_file_data={ENC}&cmac={CMAC}").close()
+
+    res = client.post("/admin/profiler/stop", headers=auth)
+    assert res.json["active"] is False
+    assert res.json["requests"] == {"/tag": 20}
+
+    res = client.get("/admin/profiler/stacks", headers=auth)
+    assert res.status_code == 200
+    assert "attachment" in res.headers["Content-Disposition"]
+    body = res.get_data(as_text=True)
+    assert PICC_DATA not in body and CMAC not in body
+
+    for line in body.splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert stack.startswith("/tag;")
+        assert int(count) > 0
@@ -0,0 +1,134 @@
+import json
+
+import pytest
+from werkzeug.test import Client
+
+import app as sdm_app
+from libsdm.sdm import EncMode, ParamMode
+from libsdm.simulator import generate_sun_message, pad_file_data, plain_sun_query, sun_query
+from sdmserver.loadgen import WsgiTarget
+from sdmserver.recorder import (
+    Replayer,
+    RequestRecorder,
+    RequestRecorderMiddleware,
+    TapSynthesizer,
+    compare,
+    prepare_requests,
+    read_recording,
+    redact_params,
+)
+
+ZERO_KEY = b"\x00" * 16
+UID = bytes.fromhex("04958CAA5C5E80")
+PATHS = ['/tag', '/tagtt', '/tagpt', '/api/tag', '/api/tagtt', '/api/tagpt', '/validate']
+
+
+@pytest.fixture
+def sdm(monkeypatch):
+    monkeypatch.setattr(sdm_app, "key_registry", sdm_app.KeyRegistry([sdm_app.KeyVersion("default", ZERO_KEY)]))
+    monkeypatch.setattr(sdm_app, "verification_results", sdm_app.SingleFlight(ttl=60))
+    monkeypatch.setattr(sdm_app, "session_store", sdm_app.create_session_store("memory", ttl=3600, max_entries=1000))
+    return sdm_app.app
+
+
+def taps():
+    tag = sun_query(generate_sun_message(ZERO_KEY, UID, 1, file_data=pad_file_data(b"abc")))
+    bulk_lrp = sun_query(generate_sun_message(ZERO_KEY, UID, 2, EncMode.LRP, ParamMode.BULK))
+    validate = sun_query(generate_sun_message(ZERO_KEY, UID, 3, file_data=pad_file_data(b"v")), file_param="enc")
+    invalid = sun_query(generate_sun_message(ZERO_KEY, UID, 4)._replace(sdmmac=bytes(8)))
+    return [
+        f"/tag?{tag}",
+        f"/tag?{tag}",
+        f"/api/tag?{bulk_lrp}&output=json",
+        f"/api/tag?{invalid}",
+        f"/tag?{invalid}",
+        f"/api/tagpt?{plain_sun_query(ZERO_KEY, UID, 5)}",
+        f"/validate?{validate}",
+        f"/validate?{validate}",
+        "/",
+    ]
+
+
+def record(sdm, path, **kwargs):
+    recorder = RequestRecorder(str(path), **kwargs)
+    client = Client(RequestRecorderMiddleware(sdm.wsgi_app, recorder, PATHS))
+
+    for url in taps():
+        client.get(url).close()
+
+    recorder.flush()
+    return list(read_recording(str(path)))
+
+
+def test_redact_params():
+    params = redact_params("picc_data=ab12&cmac=CD34&output=json", b"k")
+    assert params["output"] == "json"
+    assert params["picc_data"]["len"] == 4
+    assert params["picc_data"] == redact_params("picc_data=AB12", b"k")["picc_data"]
+    assert params["picc_data"] != redact_params("picc_data=AB12", b"other")["picc_data"]
+
+
+def test_record_redacted(sdm, tmp_path):
+    entries = record(sdm, tmp_path / "recording.jsonl")
+    text = (tmp_path / "recording.jsonl").read_text()
+
+    assert [entry["path"] for entry in entries] == ["/tag", "/tag", "/api/tag", "/api/tag", "/tag", "/api/tagpt", "/validate", "/validate"]
+    assert [entry["status"] for entry in entries] == ["200", "200", "200", "200 error", "400", "200", "200", "200"]
+    assert entries[0]["params"] == entries[1]["params"]
+    assert entries[2]["params"]["output"] == "json"
+    assert UID.hex().upper() not in text
+    assert taps()[0].split("=")[1].split("&")[0] not in text
+
+
+def test_sampling(sdm, tmp_path):
+    recorder = RequestRecorder(str(tmp_path / "none.jsonl"), sample_rate=0.0)
+    client = Client(RequestRecorderMiddleware(sdm.wsgi_app, recorder, PATHS))
+    client.get(taps()[0]).close()
+    recorder.flush()
+    assert recorder.recorded == 0
+    assert not (tmp_path / "none.jsonl").exists()
+
+    with pytest.raises(ValueError):
+        RequestRecorder(str(tmp_path / "x.jsonl"), sample_rate=1.5)
+
+
+@pytest.mark.parametrize("redact", [True, False])
+def test_replay_matches_recording(sdm, tmp_path, redact):
+    entries = record(sdm, tmp_path / "recording.jsonl", redact=redact)
+    requests = prepare_requests(entries, TapSynthesizer(ZERO_KEY))
+    assert len(requests) == len(entries)
+
+    # duplicate taps stay duplicates
+    assert requests[0]["path_qs"] == requests[1]["path_qs"]
+    assert requests[6]["path_qs"] == requests[7]["path_qs"]
+    assert requests[2]["path_qs"].endswith("&output=json")
+
+    replayer = Replayer(WsgiTarget(sdm), requests, speed=0, concurrency=1)
+    elapsed = replayer.run()
+    result = compare(replayer.outcomes, replayer.latencies, [req["status"] for req in requests], [req["latency"] for req in requests], elapsed)
+    assert result["status_mismatches"] == 0, result["mismatch_breakdown"]
+    assert set(result["latency_ms"]["p99"]) == {"baseline", "replay", "ratio"}
+
+
+def test_replay_speed(sdm):
+    url = "/api/tagpt?" + plain_sun_query(ZERO_KEY, UID, 1)
+    requests = [{"path_qs": url, "offset": offset, "status": "200", "latency": 0.0} for offset in (0.0, 0.1, 0.2)]
+
+    elapsed = Replayer(WsgiTarget(sdm), requests, speed=2.0).run()
+    assert 0.09 <= elapsed < 0.2
+
+    replayer = Replayer(WsgiTarget(sdm), requests, speed=0)
+    assert replayer.run() < 0.09
+    assert replayer.outcomes == ["200"] * 3
+
+
+def test_app_recorder_disabled_by_default():
+    assert sdm_app.REQUEST_RECORD_PATH is None
+    assert not hasattr(sdm_app, "request_recorder")
+
+
+def test_recording_lines_are_json(sdm, tmp_path):
+    record(sdm, tmp_path / "recording.jsonl")
+
+    for line in (tmp_path / "recording.jsonl").read_text().splitlines():
+        assert set(json.loads(line)) == {"ts", "method", "path", "status", "latency_ms", "params"}
@@ -0,0 +1,52 @@
+import gzip
+
+from sdmserver.response_cache import CachedResponse, ResponseCache
+
+BODY = ("<html>" + "x" * 1000 + "</html>").encode('utf-8')
+
+
+def test_negotiate_encoding():
+    entry = CachedResponse(BODY)
+
+    status, headers, body = entry.negotiate("gzip, deflate")
+    assert status == 0
+    assert ("Content-Encoding", "gzip") in headers
+    assert gzip.decompress(body) == BODY
+
+    status, headers, body = entry.negotiate("gzip;q=0, identity")
+    assert body == BODY
+    assert "Content-Encoding" not in dict(headers)
+
+    assert entry.negotiate(None)[2] == BODY
+
+
+def test_negotiate_etag():
+    entry = CachedResponse(BODY)
+
+    assert entry.negotiate("gzip", entry.etag) == (304, entry.negotiate("gzip", entry.etag)[1], b"")
+    assert entry.negotiate(None, f'"other", W/{entry.etag}')[0] == 304
+    assert entry.negotiate(None, '"other"')[0] == 0
+    # error pages are never "not modified"
+    assert entry.negotiate(None, entry.etag, conditional=False)[2] == BODY
+
+
+def test_small_body_not_compressed():
+    entry = CachedResponse(b"short")
+    assert not entry.encoded
+    assert entry.negotiate("gzip")[2] == b"short"
+
+
+def test_response_cache_bounded():
+    cache = ResponseCache(max_entries=2)
+    renders = []
+
+    def render(i):
+        renders.append(i)
+        return f"page {i}"
+
+    for _ in range(2):
+        for i in range(4):
+            assert cache.get_or_render(i, lambda i=i: render(i)).body == f"page {i}".encode('utf-8')
+
+    assert len(cache) == 2
+    assert renders == [0, 1, 2, 3, 2, 3]
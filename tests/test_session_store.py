@@ -0,0 +1,90 @@
+import binascii
+import threading
+
+from sdmserver.session_store import MemorySessionStore, SqliteSessionStore, session_key
+
+
+def test_session_key():
+    uid = binascii.unhexlify("04958caa5c5e80")
+    assert session_key(uid, 8) == uid + b"\x00\x00\x08"
+    assert session_key(uid, None) == uid
+    assert session_key(uid, 8) != session_key(uid, 9)
+
+
+def test_memory_store_claim():
+    store = MemorySessionStore(ttl=10, max_entries=100)
+
+    assert store.claim(b"a", now=100.0) == (100.0, True)
+    assert store.claim(b"a", now=105.0) == (100.0, False)
+    assert store.claim(b"b", now=106.0) == (106.0, True)
+    assert len(store) == 2
+
+    # first entry expired, it's treated as a new one
+    assert store.claim(b"a", now=111.0) == (111.0, True)
+
+
+def test_memory_store_expiry():
+    store = MemorySessionStore(ttl=10, max_entries=1000, purge_batch=2)
+
+    for i in range(10):
+        store.claim(bytes([i]), now=100.0 + i)
+
+    # incremental eviction only removes a limited number of entries
+    store.claim(b"x", now=200.0)
+    assert len(store) == 9
+
+    assert store.purge(now=200.0) == 8
+    assert len(store) == 1
+
+
+def test_memory_store_cap():
+    store = MemorySessionStore(ttl=1000, max_entries=3)
+
+    for i in range(5):
+        store.claim(bytes([i]), now=100.0 + i)
+
+    assert len(store) == 3
+    assert store.claim(b"\x00", now=110.0) == (110.0, True)
+    assert store.claim(b"\x04", now=110.0) == (104.0, False)
+
+
+def test_memory_store_concurrent():
+    store = MemorySessionStore(ttl=1000, max_entries=100000)
+    created = []
+
+    def worker():
+        for i in range(2000):
+            _, was_created = store.claim(i.to_bytes(4, 'big'), now=100.0)
+
+            if was_created:
+                created.append(i)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+
+    for t in threads:
+        t.start()
+
+    for t in threads:
+        t.join()
+
+    # each key must be created exactly once
+    assert sorted(created) == list(range(2000))
+
+
+def test_sqlite_store(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = SqliteSessionStore(path, ttl=10, max_entries=3)
+
+    assert store.claim(b"a", now=100.0) == (100.0, True)
+    assert store.claim(b"a", now=105.0) == (100.0, False)
+
+    # another instance (e.g. in other worker process) sees the same state
+    other = SqliteSessionStore(path, ttl=10, max_entries=3)
+    assert other.claim(b"a", now=106.0) == (100.0, False)
+
+    for key in [b"b", b"c", b"d"]:
+        other.claim(key, now=107.0)
+
+    assert len(store) == 3
+    assert store.purge(now=200.0) == 3
+    assert len(store) == 0
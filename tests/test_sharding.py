@@ -0,0 +1,149 @@
+import binascii
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+
+import pytest
+
+from sdmserver.sharding import FORWARDED_HEADER, SHARD_HEADER, HashRing, ShardRouter, sign_forwarded, verify_forwarded
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SECRET = b"cluster secret"
+FORWARDED_ENV = "HTTP_" + FORWARDED_HEADER.upper().replace("-", "_")
+
+
+def test_hash_ring_distribution():
+    ring = HashRing(["a", "b", "c"])
+    owners = Counter(ring.node_for(i.to_bytes(7, 'big')) for i in range(3000))
+
+    assert set(owners) == {"a", "b", "c"}
+    assert min(owners.values()) > 600
+
+
+def test_hash_ring_stability():
+    keys = [i.to_bytes(7, 'big') for i in range(2000)]
+    before = HashRing(["a", "b", "c"])
+    after = HashRing(["a", "b", "c", "d"])
+
+    moved = [k for k in keys if before.node_for(k) != after.node_for(k)]
+
+    # only keys taken over by the new node are moved
+    assert all(after.node_for(k) == "d" for k in moved)
+    assert len(moved) < len(keys) / 2
+
+
+def _app(environ, start_response):
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [b"local"]
+
+
+def _call(router, path, query, **extra):
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured['status'] = status
+        captured['headers'] = dict(headers)
+
+    body = b"".join(router({"PATH_INFO": path, "QUERY_STRING": query, **extra}, start_response))
+    return captured['status'], captured['headers'], body
+
+
+def _router(ring, forwarded):
+    def forward(node, environ, signature):
+        forwarded.append((node, signature))
+        return "200 OK", [(SHARD_HEADER, node)], b"remote"
+
+    return ShardRouter(_app, ring, "a",
+                       extract_uid=lambda environ: binascii.unhexlify(environ["QUERY_STRING"]) if environ["QUERY_STRING"] else None,
+                       paths=["/tag"],
+                       secret=SECRET,
+                       forward=forward)
+
+
+def test_shard_router():
+    ring = HashRing(["a", "b"])
+    forwarded = []
+    router = _router(ring, forwarded)
+
+    uid_a = next(u for u in (i.to_bytes(7, 'big') for i in range(100)) if ring.node_for(u) == "a")
+    uid_b = next(u for u in (i.to_bytes(7, 'big') for i in range(100)) if ring.node_for(u) == "b")
+
+    assert _call(router, "/tag", uid_a.hex())[2] == b"local"
+    assert _call(router, "/tag", uid_b.hex()) == ("200 OK", {SHARD_HEADER: "b", "Content-Length": "6"}, b"remote")
+    # unknown UID and non-routed paths are served locally
+    assert _call(router, "/tag", "")[2] == b"local"
+    assert _call(router, "/", uid_b.hex())[2] == b"local"
+    assert [node for node, _ in forwarded] == ["b"]
+    assert verify_forwarded(SECRET, {"PATH_INFO": "/tag", "QUERY_STRING": uid_b.hex(), FORWARDED_ENV: forwarded[0][1]})
+
+
+def test_forwarded_header_must_be_signed():
+    ring = HashRing(["a", "b"])
+    forwarded = []
+    router = _router(ring, forwarded)
+    uid_b = next(u for u in (i.to_bytes(7, 'big') for i in range(100)) if ring.node_for(u) == "b")
+    environ = {"PATH_INFO": "/tag", "QUERY_STRING": uid_b.hex()}
+
+    # spoofed by the client, the request is still routed to the owner
+    for value in ["1", sign_forwarded(b"other secret", environ), sign_forwarded(SECRET, environ, now=time.time() - 3600),
+                  sign_forwarded(SECRET, {"PATH_INFO": "/tag", "QUERY_STRING": ""})]:
+        assert _call(router, "/tag", uid_b.hex(), **{FORWARDED_ENV: value})[2] == b"remote"
+
+    assert len(forwarded) == 4
+
+    # forwarded by another node
+    assert _call(router, "/tag", uid_b.hex(), **{FORWARDED_ENV: sign_forwarded(SECRET, environ)})[2] == b"local"
+    assert len(forwarded) == 4
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for(url):
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.1)
+
+    raise RuntimeError("Node didn't start.")
+
+
+def test_local_shards():
+    """
+    Run several app processes on one machine, each of them standing in for a node.
+    """
+    nodes = [f"http://127.0.0.1:{_free_port()}" for _ in range(3)]
+    procs = [subprocess.Popen([sys.executable, "app.py", "--host", "127.0.0.1", "--port", node.rsplit(":", 1)[1],
+                               "--shard-nodes", ",".join(nodes), "--shard-self", node],
+                              cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+             for node in nodes]
+
+    try:
+        for node in nodes:
+            _wait_for(node + "/webnfc")
+
+        ring = HashRing(nodes)
+
+        for i in range(12):
+            uid = bytes([4, 0, 0, 0, 0, 0, i])
+
+            with pytest.raises(urllib.error.HTTPError) as exc:
+                # all requests enter through the first node, MAC is invalid
+                urllib.request.urlopen(f"{nodes[0]}/api/tagpt?uid={uid.hex()}&ctr=000001&cmac=0000000000000000")
+
+            assert exc.value.code == 400
+            assert exc.value.headers[SHARD_HEADER] == ring.node_for(uid)
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
@@ -0,0 +1,126 @@
+import binascii
+import urllib.parse
+
+import pytest
+from Crypto.Cipher import AES
+
+import app as sdm_app
+from libsdm import derive
+from libsdm.lrp import LRP
+from libsdm.sdm import EncMode, ParamMode, calculate_sdmmac, decrypt_picc_data, decrypt_sun_message, validate_plain_sun
+from libsdm.simulator import (
+    bulk_sun_messages,
+    encrypt_file_data,
+    encrypt_picc_data,
+    generate_sun_message,
+    pad_file_data,
+    plain_sun_query,
+    simulated_uid,
+    sun_query,
+)
+
+ZERO_KEY = b"\x00" * 16
+MASTER_KEY = binascii.unhexlify("757bf1693bca463bb529ee1771c1ea09")
+UID = binascii.unhexlify("04958CAA5C5E80")
+
+
+def verify(master_key, msg):
+    return decrypt_sun_message(msg.param_mode,
+                               derive.derive_undiversified_key(master_key, 1),
+                               lambda uid: derive.derive_tag_key(master_key, uid, 2),
+                               msg.picc_enc_data,
+                               msg.sdmmac,
+                               enc_file_data=msg.enc_file_data,
+                               sdmmac_param="cmac")
+
+
+def test_reproduce_an12196_vector():
+    # AN12196 page 18, all-zeros keys
+    picc_enc_data = binascii.unhexlify("FD91EC264309878BE6345CBE53BADF40")
+    enc_file_data = binascii.unhexlify("CEE9A53E3E463EF1F459635736738962")
+    # random padding chosen by the tag
+    padding = AES.new(ZERO_KEY, AES.MODE_CBC, IV=b"\x00" * 16).decrypt(picc_enc_data)[11:]
+    assert encrypt_picc_data(ZERO_KEY, UID, 8, padding=padding) == picc_enc_data
+
+    file_data = b"xxxxxxxxxxxxxxxx"
+    assert encrypt_file_data(ZERO_KEY, UID, 8, file_data) == enc_file_data
+
+    msg = generate_sun_message(ZERO_KEY, UID, 8, file_data=file_data, padding=padding)
+    assert msg.sdmmac == binascii.unhexlify("ECC1E7F6C6C73BF6")
+
+
+def test_reproduce_lrp_vector():
+    picc_enc_data = binascii.unhexlify("07D9CA2545881D4BFDD920BE1603268C0714420DD893A497")
+    picc_data = decrypt_picc_data(ZERO_KEY, picc_enc_data)
+    assert picc_data["encryption_mode"] == EncMode.LRP
+    padding = LRP(ZERO_KEY, 0, picc_enc_data[:8], pad=False).decrypt(picc_enc_data[8:])[11:]
+    assert encrypt_picc_data(ZERO_KEY, picc_data["uid"], picc_data["read_ctr_num"], EncMode.LRP,
+                             padding=padding, picc_rand=picc_enc_data[:8]) == picc_enc_data
+
+
+@pytest.mark.parametrize("mode", [EncMode.AES, EncMode.LRP])
+@pytest.mark.parametrize("param_mode", [ParamMode.SEPARATED, ParamMode.BULK])
+@pytest.mark.parametrize("with_file", [False, True])
+def test_roundtrip(mode, param_mode, with_file):
+    file_data = pad_file_data(b"hello", tt_status=b"CC", param_mode=param_mode) if with_file else None
+    msg = generate_sun_message(MASTER_KEY, UID, 123456, mode, param_mode, file_data=file_data)
+    res = verify(MASTER_KEY, msg)
+
+    assert res["uid"] == UID
+    assert res["read_ctr"] == 123456
+    assert res["encryption_mode"] == mode
+    assert res["file_data"] == file_data
+
+
+def test_pad_file_data():
+    assert pad_file_data(b"abc") == b"abc" + b"\x00" * 13
+    assert pad_file_data(b"abc", b"OC", ParamMode.BULK)[:6] == b"OC\x03abc"
+    assert len(pad_file_data(b"x" * 16)) == 16
+
+    with pytest.raises(ValueError):
+        pad_file_data(b"")
+
+
+def test_plain_query():
+    query = dict(urllib.parse.parse_qsl(plain_sun_query(MASTER_KEY, UID, 0x10203)))
+    assert query["ctr"] == "010203"
+    res = validate_plain_sun(UID, binascii.unhexlify(query["ctr"]), binascii.unhexlify(query["cmac"]),
+                             derive.derive_tag_key(MASTER_KEY, UID, 2))
+    assert res["read_ctr"] == 0x10203
+
+
+@pytest.mark.parametrize("mode", [EncMode.AES, EncMode.LRP])
+@pytest.mark.parametrize("param_mode", [ParamMode.SEPARATED, ParamMode.BULK])
+def test_bulk_matches_single(mode, param_mode):
+    file_data = pad_file_data(b"bulk", param_mode=param_mode)
+    messages = list(bulk_sun_messages(MASTER_KEY, 25, mode, param_mode, tags=10, file_data=file_data, chunk_size=7))
+
+    assert len({(m.uid, m.read_ctr) for m in messages}) == 25
+    assert messages[12].uid == simulated_uid(2)
+    assert messages[12].read_ctr == 2
+
+    for msg in messages:
+        res = verify(MASTER_KEY, msg)
+        assert (res["uid"], res["read_ctr"], res["file_data"]) == (msg.uid, msg.read_ctr, file_data)
+        assert msg.sdmmac == calculate_sdmmac(param_mode, derive.derive_tag_key(MASTER_KEY, msg.uid, 2),
+                                              msg.uid + msg.read_ctr.to_bytes(3, "little"), msg.enc_file_data,
+                                              mode=mode, sdmmac_param="cmac")
+
+    # split between workers
+    assert list(bulk_sun_messages(MASTER_KEY, 5, mode, param_mode, tags=10, start=20))[0].uid == messages[20].uid
+
+
+def test_app_accepts_simulated_taps(monkeypatch):
+    monkeypatch.setattr(sdm_app, "key_registry", sdm_app.KeyRegistry([sdm_app.KeyVersion("default", MASTER_KEY)]))
+    monkeypatch.setattr(sdm_app, "verification_results", sdm_app.SingleFlight(ttl=60))
+    client = sdm_app.app.test_client()
+
+    msg = generate_sun_message(MASTER_KEY, UID, 5, EncMode.LRP, ParamMode.BULK,
+                               file_data=pad_file_data(b"data", b"OC", ParamMode.BULK))
+    res = client.get("/api/tagtt?" + sun_query(msg))
+    assert res.status_code == 200
+    assert res.json["uid"] == UID.hex().upper()
+    assert res.json["tt_status"] == "tampered_closed"
+
+    res = client.get("/api/tagpt?" + plain_sun_query(MASTER_KEY, UID, 6))
+    assert res.json["read_ctr"] == 6
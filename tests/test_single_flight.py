@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+from sdmserver.single_flight import SingleFlight
+
+
+def test_concurrent_calls_coalesced():
+    flight = SingleFlight(ttl=0)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"uid": b"\x04"}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("k", compute)))
+    leader.start()
+    started.wait(5)
+
+    followers = [threading.Thread(target=lambda: results.append(flight.do("k", compute))) for _ in range(4)]
+
+    for t in followers:
+        t.start()
+
+    time.sleep(0.05)
+    release.set()
+
+    for t in [leader] + followers:
+        t.join(5)
+
+    assert len(calls) == 1
+    assert len(results) == 5
+    assert all(r is results[0] for r in results)
+    # ttl=0 only coalesces
+    assert len(flight) == 0
+
+
+def test_result_cached_until_ttl(monkeypatch):
+    flight = SingleFlight(ttl=3, max_entries=2)
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    calls = []
+
+    def compute(value):
+        calls.append(value)
+        return value
+
+    assert flight.do("a", lambda: compute(1)) == 1
+    assert flight.do("a", lambda: compute(2)) == 1
+
+    now[0] += 4
+    assert flight.do("a", lambda: compute(3)) == 3
+    assert calls == [1, 3]
+
+    # least recently used is evicted
+    flight.do("b", lambda: compute(4))
+    flight.do("a", lambda: 0)
+    flight.do("c", lambda: compute(5))
+    assert len(flight) == 2
+    assert flight.do("b", lambda: compute(6)) == 6
+
+
+def test_errors_not_cached():
+    flight = SingleFlight(ttl=60)
+
+    def fail():
+        raise ValueError("bad")
+
+    with pytest.raises(ValueError):
+        flight.do("k", fail)
+
+    assert flight.do("k", lambda: 1) == 1
@@ -0,0 +1,34 @@
+import os
+
+from sdmserver.startup_profile import format_report, measure_imports, parse_importtime
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+OUTPUT = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |     _io
+import time:       300 |        500 |   flask.app
+import time:       200 |        700 | flask
+import time:      1000 |       1800 | app
+"""
+
+
+def test_parse_importtime():
+    entries = parse_importtime(OUTPUT)
+    assert [e.module for e in entries] == ["_io", "flask.app", "flask", "app"]
+    assert entries[0].depth == 2
+    assert entries[3].cumulative_us == 1800
+
+    report = format_report("app", entries)
+    assert "1.6 ms total" in report
+    assert "module body of app (initialization): 1.0 ms" in report
+    assert "0.5 ms   30.9%  flask" in report
+
+
+def test_app_startup_is_lean():
+    modules = {e.module for e in measure_imports("app", cwd=ROOT)}
+
+    assert "app" in modules
+    # not needed by the worker unless the feature is used
+    assert "requests" not in modules
+    assert "sqlite3" not in modules
+    assert "sdmserver.verify_daemon" not in modules
@@ -0,0 +1,67 @@
+import pytest
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+import app as sdm_app
+from sdmserver.timing import RequestTimer, ServerTimingMiddleware, StageRecorder, current_timer
+
+# AN12196 page 18, all-zeros keys
+PICC_DATA = "FD91EC264309878BE6345CBE53BADF40"
+ENC = "CEE9A53E3E463EF1F459635736738962"
+CMAC = "ECC1E7F6C6C73BF6"
+
+
+def test_request_timer_header():
+    timer = RequestTimer()
+    timer.add("parse", 0.0001)
+    timer.add("picc", 0.002)
+    timer.add("lrp", 0.001)
+    timer.add("sdmmac", 0.003)
+    timer.add("file", 0.0005)
+
+    assert timer.server_timing() == "parse;dur=0.100, decrypt;dur=2.500, mac;dur=3.000"
+    assert RequestTimer().server_timing() == ""
+
+
+def test_recorder_feeds_observer_and_current_request():
+    observed = []
+    recorder = StageRecorder(observe=lambda stage, seconds: observed.append(stage))
+
+    def wsgi_app(environ, start_response):
+        with recorder.stage("parse"):
+            pass
+
+        recorder("start", "sdmmac", 10)
+        recorder("stop", "sdmmac", 10)
+        return Response("x")(environ, start_response)
+
+    client = Client(ServerTimingMiddleware(wsgi_app, paths=["/tag"]))
+
+    res = client.get("/tag")
+    assert observed == ["parse", "sdmmac"]
+    assert [part.split(";")[0] for part in res.headers["Server-Timing"].split(", ")] == ["parse", "mac"]
+
+    # only the configured paths are timed
+    res = client.get("/other")
+    assert "Server-Timing" not in res.headers
+    assert observed == ["parse", "sdmmac", "parse", "sdmmac"]
+    assert current_timer() is None
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(sdm_app, "key_registry", sdm_app.KeyRegistry([sdm_app.KeyVersion("default", b"\x00" * 16)]))
+    monkeypatch.setattr(sdm_app, "verification_results", sdm_app.SingleFlight(ttl=60))
+    monkeypatch.setattr(sdm_app.hooks, "_handlers", (sdm_app.stages,))
+    return Client(ServerTimingMiddleware(sdm_app.app, paths=["/tag", "/api/tag"]))
+
+
+def test_server_timing_header(client):
+    res = client.get(f"/tag?picc_data={PICC_DATA}&enc_file_data={ENC}&cmac={CMAC}")
+    assert res.status_code == 200
+
+    stages = [part.split(";")[0] for part in res.headers["Server-Timing"].split(", ")]
+    assert stages == ["parse", "decrypt", "mac", "render"]
+
+    res = client.get(f"/api/tag?picc_data={PICC_DATA}&enc_file_data={ENC}&cmac=0000000000000000")
+    assert "mac;dur=" in res.headers["Server-Timing"]
@@ -0,0 +1,131 @@
+# pylint: disable=line-too-long, invalid-name
+
+import binascii
+import os
+
+import pytest
+
+from libsdm.key_registry import KeyRegistry, KeyVersion
+from libsdm.sdm import InvalidMessage, ParamMode, decrypt_sun_message
+from libsdm.uid_filter import BloomFilter, UidAdmission
+
+UIDS = [i.to_bytes(7, 'big') for i in range(0x04000000000000, 0x04000000000000 + 5000)]
+
+
+def test_bloom_filter():
+    bloom = BloomFilter.build(UIDS, capacity=len(UIDS), fp_rate=0.001)
+
+    assert all(uid in bloom for uid in UIDS)
+
+    others = [i.to_bytes(7, 'big') for i in range(0x05000000000000, 0x05000000000000 + 5000)]
+    false_positives = sum(uid in bloom for uid in others)
+    assert false_positives < 25
+
+
+def test_bloom_filter_file(tmp_path):
+    path = str(tmp_path / "uids.bloom")
+    BloomFilter.build(UIDS, capacity=len(UIDS)).save(path)
+    bloom = BloomFilter.load(path)
+
+    assert all(uid in bloom for uid in UIDS)
+    assert b"\x00" * 7 not in bloom
+
+
+def test_admission_reload(tmp_path):
+    bloom_path = str(tmp_path / "uids.bloom")
+    revoked_path = str(tmp_path / "revoked.txt")
+
+    BloomFilter.build(UIDS[:10], capacity=10).save(bloom_path)
+
+    with open(revoked_path, "w", encoding="ascii") as f:
+        f.write("# revoked tags\n" + UIDS[0].hex() + "\n")
+
+    admission = UidAdmission(bloom_path, revoked_path, check_interval=0)
+
+    assert not admission.admit(UIDS[0])
+    assert admission.admit(UIDS[1])
+    assert not admission.admit(UIDS[20])
+
+    BloomFilter.build(UIDS[:30], capacity=30).save(bloom_path)
+    tmp_revoked = revoked_path + ".new"
+
+    with open(tmp_revoked, "w", encoding="ascii") as f:
+        f.write(UIDS[1].hex() + "\n")
+
+    os.replace(tmp_revoked, revoked_path)
+
+    assert admission.admit(UIDS[0])
+    assert not admission.admit(UIDS[1])
+    assert admission.admit(UIDS[20])
+
+
+@pytest.mark.parametrize("bloom_data,revoked_data", [
+    (None, "not a hex uid\n"),
+    (None, "\u00e9\n"),
+    (b"", None),
+    (b"SDMBLOOM", None),
+    (b"x" * 64, None),
+])
+def test_admission_keeps_state_on_broken_file(tmp_path, bloom_data, revoked_data):
+    bloom_path = str(tmp_path / "uids.bloom")
+    revoked_path = str(tmp_path / "revoked.txt")
+
+    BloomFilter.build(UIDS[:10], capacity=10).save(bloom_path)
+
+    with open(revoked_path, "w", encoding="ascii") as f:
+        f.write(UIDS[0].hex() + "\n")
+
+    admission = UidAdmission(bloom_path, revoked_path, check_interval=0)
+
+    if bloom_data is not None:
+        with open(bloom_path + ".new", "wb") as f:
+            f.write(bloom_data)
+
+        os.replace(bloom_path + ".new", bloom_path)
+
+    if revoked_data is not None:
+        with open(revoked_path + ".new", "w", encoding="utf-8") as f:
+            f.write(revoked_data)
+
+        os.replace(revoked_path + ".new", revoked_path)
+
+    for _ in range(2):
+        assert not admission.admit(UIDS[0])
+        assert admission.admit(UIDS[1])
+        assert not admission.admit(UIDS[20])
+
+    # fixed file is picked up again
+    BloomFilter.build(UIDS[:30], capacity=30).save(bloom_path)
+
+    with open(revoked_path, "w", encoding="ascii") as f:
+        f.write("")
+
+    assert admission.admit(UIDS[0])
+    assert admission.admit(UIDS[20])
+
+
+def test_decrypt_rejects_before_derivation():
+    derived = []
+
+    def file_read_key(uid):
+        derived.append(uid)
+        return b"\x00" * 16
+
+    with pytest.raises(InvalidMessage):
+        decrypt_sun_message(param_mode=ParamMode.SEPARATED,
+                            sdm_meta_read_key=b"\x00" * 16,
+                            sdm_file_read_key=file_read_key,
+                            picc_enc_data=binascii.unhexlify("EF963FF7828658A599F3041510671E88"),
+                            sdmmac=binascii.unhexlify("94EED9EE65337086"),
+                            uid_filter=lambda uid: False)
+
+    assert not derived
+
+
+def test_registry_plain_sun_admission():
+    registry = KeyRegistry([KeyVersion("zeros", b"\x00" * 16)], uid_filter=lambda uid: False)
+
+    with pytest.raises(InvalidMessage):
+        registry.validate_plain_sun(uid=binascii.unhexlify('041E3C8A2D6B80'),
+                                    read_ctr=binascii.unhexlify('000006'),
+                                    sdmmac=binascii.unhexlify('4B00064004B0B3D3'))
@@ -0,0 +1,178 @@
+import binascii
+import os
+import socket
+import subprocess
+import sys
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from libsdm.key_registry import KeyRegistry, KeyVersion
+from libsdm.sdm import EncMode, InvalidMessage, ParamMode
+from sdmserver.key_setup import key_registry_from_config
+from sdmserver.verify_daemon import (
+    REQUEST_HEADER,
+    Verifier,
+    VerifyClient,
+    create_server,
+    pack_fields,
+    parse_address,
+)
+
+# AN12196 page 18, all-zeros keys
+PICC_DATA = binascii.unhexlify("FD91EC264309878BE6345CBE53BADF40")
+ENC = binascii.unhexlify("CEE9A53E3E463EF1F459635736738962")
+CMAC = binascii.unhexlify("ECC1E7F6C6C73BF6")
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+@pytest.fixture(params=["unix", "tcp"])
+def daemon(request, tmp_path):
+    verifier = Verifier(KeyRegistry([KeyVersion("default", b"\x00" * 16)]))
+    address = str(tmp_path / "verify.sock") if request.param == "unix" else ("127.0.0.1", 0)
+    server = create_server(address, verifier)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, verifier
+    server.shutdown()
+    server.server_close()
+
+
+def test_parse_address():
+    assert parse_address("/tmp/a.sock") == "/tmp/a.sock"
+    assert parse_address("127.0.0.1:7000") == ("127.0.0.1", 7000)
+
+
+def test_decrypt_sun_message(daemon):
+    server, verifier = daemon
+    client = VerifyClient(server.server_address)
+
+    res = client.decrypt_sun_message(ParamMode.SEPARATED, PICC_DATA, CMAC, ENC)
+    assert res == {
+        "uid": binascii.unhexlify("04958CAA5C5E80"),
+        "read_ctr": 8,
+        "encryption_mode": EncMode.AES,
+        "file_data": b"xxxxxxxxxxxxxxxx",
+        "key_version": "default",
+    }
+    # the tag key stays cached for the next connections
+    assert len(verifier.key_cache) == 1
+
+    with pytest.raises(InvalidMessage):
+        client.decrypt_sun_message(ParamMode.SEPARATED, PICC_DATA, b"\x00" * 8, ENC)
+
+    # the connection is reused after an invalid message
+    assert client.decrypt_sun_message(ParamMode.SEPARATED, PICC_DATA, CMAC, ENC)["read_ctr"] == 8
+    client.close()
+
+
+def test_pipeline(daemon):
+    server, _ = daemon
+    client = VerifyClient(server.server_address)
+
+    results = client.pipeline([
+        client.sun_request(ParamMode.BULK, binascii.unhexlify("EF963FF7828658A599F3041510671E88"), binascii.unhexlify("94EED9EE65337086")),
+        client.plain_request(binascii.unhexlify("041E3C8A2D6B80"), binascii.unhexlify("000006"), binascii.unhexlify("4B00064004B0B3D3")),
+        client.plain_request(binascii.unhexlify("041E3C8A2D6B80"), binascii.unhexlify("000006"), b"\x00" * 8),
+        client.sun_request(ParamMode.SEPARATED, PICC_DATA, b""),
+    ])
+
+    assert results[0]["read_ctr"] == 61
+    assert results[1]["read_ctr"] == 6
+    assert isinstance(results[2], InvalidMessage)
+    assert isinstance(results[3], RuntimeError)
+    client.close()
+
+
+def test_malformed_request():
+    verifier = Verifier(KeyRegistry([KeyVersion("default", b"\x00" * 16)]))
+    response = verifier.process(REQUEST_HEADER.pack(7, 9, 0) + pack_fields(b"a", None, None, None))
+    request_id, result = VerifyClient._parse_response(response)  # pylint: disable=protected-access
+    assert request_id == 7
+    assert isinstance(result, RuntimeError)
+
+    request_id, result = VerifyClient._parse_response(verifier.process(REQUEST_HEADER.pack(8, 1, 0) + b"\x00"))  # pylint: disable=protected-access
+    assert request_id == 8
+    assert isinstance(result, RuntimeError)
+
+
+def test_key_registry_from_config(tmp_path):
+    revoked = tmp_path / "revoked.txt"
+    revoked.write_text("04958CAA5C5E80\n")
+    cfg = SimpleNamespace(MASTER_KEY=b"\x00" * 16, DERIVE_MODE="standard", MASTER_KEYS={"v2": ("11" * 16, "legacy")},
+                          KEY_VERSION_UID_PREFIXES={"04AB": "v2"}, KEY_TRIAL_LIMIT=2, SDMMAC_PARAM="cmac",
+                          UID_FILTER_PROVISIONED=None, UID_FILTER_REVOKED=str(revoked), UID_FILTER_CHECK_INTERVAL=5)
+    registry = key_registry_from_config(cfg)
+
+    assert list(registry.versions) == ["default", "v2"]
+    assert registry.route_uid(binascii.unhexlify("04AB0000000000")) == "v2"
+
+    with pytest.raises(InvalidMessage):
+        # revoked UID
+        registry.decrypt_sun_message(ParamMode.SEPARATED, PICC_DATA, CMAC, ENC)
+
+
+def test_daemon_does_not_import_web_app():
+    out = subprocess.run([sys.executable, "-c", "import sys, verify_daemon; print(sorted({'app', 'flask'} & set(sys.modules)))"],
+                         cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    assert out.strip() == "[]"
+
+
+def test_pipeline_larger_than_socket_buffers(daemon):
+    server, _ = daemon
+    client = VerifyClient(server.server_address, timeout=10.0, window=16)
+
+    # a few MB of requests and responses, sending them all before reading would deadlock on full socket buffers
+    results = client.pipeline([(9, 0, [b"a" * 64, None, None, None])] * 30000)
+
+    assert len(results) == 30000
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert client.decrypt_sun_message(ParamMode.SEPARATED, PICC_DATA, CMAC, ENC)["read_ctr"] == 8
+    client.close()
+
+
+def test_create_server_keeps_other_files(tmp_path):
+    verifier = Verifier(KeyRegistry([KeyVersion("default", b"\x00" * 16)]))
+    path = tmp_path / "verify.sock"
+    path.write_text("not a socket")
+
+    with pytest.raises(RuntimeError):
+        create_server(str(path), verifier)
+
+    assert path.read_text() == "not a socket"
+
+
+def test_create_server_refuses_live_socket(tmp_path):
+    verifier = Verifier(KeyRegistry([KeyVersion("default", b"\x00" * 16)]))
+    path = str(tmp_path / "verify.sock")
+    server = create_server(path, verifier)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        with pytest.raises(RuntimeError):
+            create_server(path, verifier)
+
+        assert VerifyClient(path).decrypt_sun_message(ParamMode.SEPARATED, PICC_DATA, CMAC, ENC)["read_ctr"] == 8
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_create_server_replaces_stale_socket(tmp_path):
+    verifier = Verifier(KeyRegistry([KeyVersion("default", b"\x00" * 16)]))
+    path = str(tmp_path / "verify.sock")
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+        stale.bind(path)
+
+    server = create_server(path, verifier)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        assert VerifyClient(path).decrypt_sun_message(ParamMode.SEPARATED, PICC_DATA, CMAC, ENC)["read_ctr"] == 8
+    finally:
+        server.shutdown()
+        server.server_close()
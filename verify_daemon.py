@@ -0,0 +1,33 @@
+"""
+Verification daemon for internal services, run with:
+    python3 verify_daemon.py [--address /run/sdm/verify.sock]
+
+Speaks the binary protocol described in sdmserver/verify_daemon.py, use sdmserver.verify_daemon.VerifyClient
+to talk to it. The keys and the UID filter are configured the same way as for the web application.
+"""
+
+import argparse
+
+import config
+from config import REQUIRE_LRP, VERIFY_DAEMON_ADDRESS, VERIFY_DAEMON_KEY_CACHE_SIZE
+from sdmserver.key_setup import key_registry_from_config
+from sdmserver.verify_daemon import Verifier, create_server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SUN verification daemon')
+    parser.add_argument('--address', type=str, default=VERIFY_DAEMON_ADDRESS,
+                        help='path of the Unix domain socket or host:port to listen on')
+
+    args = parser.parse_args()
+    verifier = Verifier(key_registry_from_config(config), require_lrp=REQUIRE_LRP, key_cache_size=VERIFY_DAEMON_KEY_CACHE_SIZE)
+    server = create_server(args.address, verifier)
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()